@@ -1,33 +1,22 @@
-import base64
+import logging
+import sys
 
+from cfdi.firma import convertir_a_base64
+from cfdi.instrumentacion import configurar_logs
 
-def convertir_a_base64(ruta_archivo):
-    """
-    Convierte un archivo en Base64.
+logger = logging.getLogger("b64")
 
-    Parámetros:
-        ruta_archivo (str): Ruta del archivo a convertir.
+if __name__ == "__main__":
+    configurar_logs()
 
-    Retorna:
-        str: Contenido del archivo en formato Base64.
-    """
+    # Convertir archivos CER y KEY a Base64
     try:
-        with open(ruta_archivo, "rb") as file:
-            return base64.b64encode(file.read()).decode()
-    except FileNotFoundError:
-        print(f"❌ ERROR: No se encontró el archivo: {ruta_archivo}")
-        return None
-    except Exception as e:
-        print(f"❌ ERROR al convertir el archivo a Base64: {e}")
-        return None
+        cer_base64 = convertir_a_base64("mi_certificado.cer")
+        key_base64 = convertir_a_base64("mi_llave.key")
+    except OSError as e:
+        logger.error("❌ ERROR al convertir el archivo a Base64: %s", e, extra={"categoria": type(e).__name__})
+        sys.exit(1)
 
-
-# Convertir archivos CER y KEY a Base64
-cer_base64 = convertir_a_base64("mi_certificado.cer")
-key_base64 = convertir_a_base64("mi_llave.key")
-
-# Imprimir resultados si la conversión fue exitosa
-if cer_base64:
+    # Imprimir resultados (salida del programa, no diagnóstico)
     print("CER Base64:\n", cer_base64)
-if key_base64:
     print("KEY Base64:\n", key_base64)
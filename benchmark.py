@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from lxml import etree
+
+try:
+    import resource
+except ImportError:  # Windows: no se reporta memoria
+    resource = None
+
+from cfdi import cadena, firma, generacion_streaming, verificacion_lote
+
+CFDI = "http://www.sat.gob.mx/cfd/4"
+PAGO20 = "http://www.sat.gob.mx/Pagos20"
+
+# Conceptos por documento y repeticiones de cada tamaño del corpus sintético
+TAMANOS = {"chico": 1, "1k": 1000, "50k": 50000}
+REPETICIONES = {"chico": 200, "1k": 20, "50k": 3}
+
+# Etapas medidas; "completo" va de generar a timbrar sin contar la etapa "cadena"
+ETAPAS = ("generar", "cadena", "firmar", "verificar", "timbrar", "completo")
+
+COMPROBANTE = {
+    "Serie": "B", "Folio": "1", "Fecha": "2024-03-09T12:00:00", "FormaPago": "01",
+    "CondicionesDePago": "Contado", "Moneda": "MXN", "TipoDeComprobante": "I",
+    "Exportacion": "01", "MetodoPago": "PUE", "LugarExpedicion": "64000",
+}
+EMISOR = {"Rfc": "AAA010101AX5", "Nombre": "EMPRESA EMISORA S.A. DE C.V.", "RegimenFiscal": "601"}
+RECEPTOR = {"Rfc": "BBB020202BX6", "Nombre": "CLIENTE EJEMPLO", "DomicilioFiscalReceptor": "64000",
+            "RegimenFiscalReceptor": "601", "UsoCFDI": "G03"}
+
+
+def _agregar_pagos(raiz, documentos):
+    """Agrega un complemento de Pagos 2.0 con `documentos` DoctoRelacionado."""
+    complemento = etree.SubElement(raiz, f"{{{CFDI}}}Complemento")
+    pagos = etree.SubElement(complemento, f"{{{PAGO20}}}Pagos", nsmap={"pago20": PAGO20}, Version="2.0")
+    monto = f"{116 * documentos}.00"
+    etree.SubElement(pagos, f"{{{PAGO20}}}Totales", TotalTrasladosBaseIVA16=f"{100 * documentos}.00",
+                     TotalTrasladosImpuestoIVA16=f"{16 * documentos}.00", MontoTotalPagos=monto)
+    pago = etree.SubElement(pagos, f"{{{PAGO20}}}Pago", FechaPago="2024-03-09T12:00:00",
+                            FormaDePagoP="03", MonedaP="MXN", TipoCambioP="1", Monto=monto)
+    for numero in range(documentos):
+        relacionado = etree.SubElement(
+            pago, f"{{{PAGO20}}}DoctoRelacionado", IdDocumento=f"00000000-0000-0000-0000-{numero:012d}",
+            Serie="A", Folio=str(numero + 1), MonedaDR="MXN", EquivalenciaDR="1", NumParcialidad="1",
+            ImpSaldoAnt="116.00", ImpPagado="116.00", ImpSaldoInsoluto="0.00", ObjetoImpDR="02")
+        traslados = etree.SubElement(etree.SubElement(relacionado, f"{{{PAGO20}}}ImpuestosDR"),
+                                     f"{{{PAGO20}}}TrasladosDR")
+        etree.SubElement(traslados, f"{{{PAGO20}}}TrasladoDR", BaseDR="100.00", ImpuestoDR="002",
+                         TipoFactorDR="Tasa", TasaOCuotaDR="0.160000", ImporteDR="16.00")
+    traslados = etree.SubElement(etree.SubElement(pago, f"{{{PAGO20}}}ImpuestosP"), f"{{{PAGO20}}}TrasladosP")
+    etree.SubElement(traslados, f"{{{PAGO20}}}TrasladoP", BaseP=f"{100 * documentos}.00", ImpuestoP="002",
+                     TipoFactorP="Tasa", TasaOCuotaP="0.160000", ImporteP=f"{16 * documentos}.00")
+
+
+def generar_documento(conceptos, complemento=False):
+    """
+    Genera un CFDI sintético sin sellar.
+
+    Parámetros:
+        conceptos (int): Número de conceptos con IVA 16%.
+        complemento (bool): Agregar un complemento de Pagos 2.0 (un DoctoRelacionado
+            por cada 10 conceptos).
+
+    Retorna:
+        bytes: XML del comprobante.
+    """
+    salida = io.BytesIO()
+    generacion_streaming.generar_cfdi_streaming(COMPROBANTE, EMISOR, RECEPTOR,
+                                                generacion_streaming.conceptos_de_ejemplo(conceptos), salida)
+    if not complemento:
+        return salida.getvalue()
+    raiz = etree.fromstring(salida.getvalue())
+    _agregar_pagos(raiz, max(1, conceptos // 10))
+    return etree.tostring(raiz, xml_declaration=True, encoding="UTF-8")
+
+
+def percentiles(muestras):
+    """p50/p95/p99, media y rendimiento (documentos por segundo) de tiempos en segundos."""
+    ordenadas = sorted(muestras)
+
+    def rango(p):
+        # Percentil por rango más cercano: siempre es una muestra observada
+        return ordenadas[max(0, -(-len(ordenadas) * p // 100) - 1)]
+
+    total = sum(ordenadas)
+    return {
+        "muestras": len(ordenadas),
+        "p50_ms": rango(50) * 1000,
+        "p95_ms": rango(95) * 1000,
+        "p99_ms": rango(99) * 1000,
+        "media_ms": total / len(ordenadas) * 1000,
+        "por_segundo": len(ordenadas) / total if total else None,
+    }
+
+
+def _rss_maximo_mb():
+    if resource is None:
+        return None
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo reporta en KiB y macOS en bytes
+    return maximo / (1024 * 1024) if sys.platform == "darwin" else maximo / 1024
+
+
+def medir_caso(tamano, complemento, repeticiones, metodo="xslt", ruta_key="mi_llave.key",
+               password=b"12345678a", ruta_cer="mi_certificado.cer"):
+    """
+    Mide cada etapa de un caso del corpus, timbrando contra un PACSimulado local.
+
+    Retorna:
+        dict: Conceptos, tamaño del XML, métricas por etapa y RSS máximo del proceso.
+    """
+    from cfdi.cliente_pac import ClienteSW
+    from cfdi.pac_simulado import PACSimulado
+
+    llave = firma.cargar_llave_privada(ruta_key, password=password)
+    no_certificado, certificado_b64 = firma.cargar_certificado(ruta_cer)
+    conceptos = TAMANOS[tamano]
+    rss_inicial = _rss_maximo_mb()
+    muestras = {etapa: [] for etapa in ETAPAS}
+    tamano_xml = None
+
+    # El documento sintético es el mismo en cada repetición
+    with PACSimulado(rechazar_duplicados=False) as pac:
+        loop = asyncio.new_event_loop()
+        cliente = ClienteSW(pac.user, pac.password, url_base=pac.url, max_concurrencia=1)
+        try:
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                xml = generar_documento(conceptos, complemento)
+                generado = time.perf_counter()
+                firmado = firma.sellar_cfdi(xml, llave, no_certificado, certificado_b64, metodo=metodo)
+                sellado = time.perf_counter()
+                resultado = verificacion_lote.verificar_cfdi(firmado, metodo=metodo)
+                verificado = time.perf_counter()
+                loop.run_until_complete(cliente.timbrar(firmado))
+                timbrado = time.perf_counter()
+                if resultado.estado != verificacion_lote.VALIDO:
+                    raise RuntimeError(f"Verificación fallida en {tamano}: {resultado}")
+
+                cadena.generar_cadena_original(etree.fromstring(xml), metodo=metodo)
+                muestras["cadena"].append(time.perf_counter() - timbrado)
+                muestras["generar"].append(generado - inicio)
+                muestras["firmar"].append(sellado - generado)
+                muestras["verificar"].append(verificado - sellado)
+                muestras["timbrar"].append(timbrado - verificado)
+                muestras["completo"].append(timbrado - inicio)
+                tamano_xml = len(xml)
+        finally:
+            loop.run_until_complete(cliente.cerrar())
+            loop.close()
+
+    return {
+        "conceptos": conceptos,
+        "complemento": "pagos20" if complemento else None,
+        "bytes_xml": tamano_xml,
+        "etapas": {etapa: percentiles(valores) for etapa, valores in muestras.items()},
+        "conceptos_por_segundo": conceptos * len(muestras["completo"]) / sum(muestras["completo"]),
+        "rss_inicial_mb": rss_inicial,
+        "rss_maximo_mb": _rss_maximo_mb(),
+    }
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar(casos, repeticiones=None, metodo="xslt", aislado=True):
+    """
+    Ejecuta los casos indicados, cada uno en un proceso nuevo para que el RSS máximo sea el suyo.
+
+    Parámetros:
+        casos (list): Pares (tamaño, complemento), por ejemplo ("1k", True).
+        repeticiones (int): Repeticiones por caso; por omisión, REPETICIONES del tamaño.
+        metodo (str): Generación de la cadena original ("xslt", "nativo" o "auto").
+        aislado (bool): Medir cada caso en su propio proceso.
+
+    Retorna:
+        dict: Informe listo para guardarse como JSON.
+    """
+    informe = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "metodo": metodo,
+        "casos": {},
+    }
+    for tamano, complemento in casos:
+        nombre = f"{tamano}/{'pagos20' if complemento else 'sin_complemento'}"
+        argumentos = (tamano, complemento, repeticiones or REPETICIONES[tamano], metodo)
+        if aislado:
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                informe["casos"][nombre] = executor.submit(medir_caso, *argumentos).result()
+        else:
+            informe["casos"][nombre] = medir_caso(*argumentos)
+        print(f"⏱️  {nombre}: p50 completo {informe['casos'][nombre]['etapas']['completo']['p50_ms']:.1f} ms",
+              file=sys.stderr)
+    return informe
+
+
+def comparar(actual, base, umbral=0.10):
+    """
+    Compara dos informes y devuelve las regresiones del p50 mayores al umbral.
+
+    Retorna:
+        list: Tuplas (caso, etapa, p50 base en ms, p50 actual en ms, cambio relativo).
+    """
+    regresiones = []
+    for caso, datos in actual["casos"].items():
+        previo = base.get("casos", {}).get(caso)
+        if previo is None:
+            continue
+        for etapa, metricas in datos["etapas"].items():
+            anterior = previo["etapas"].get(etapa, {}).get("p50_ms")
+            if not anterior:
+                continue
+            cambio = metricas["p50_ms"] / anterior - 1
+            if cambio > umbral:
+                regresiones.append((caso, etapa, anterior, metricas["p50_ms"], cambio))
+    return regresiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de generar → cadena → firmar → verificar → timbrar.")
+    parser.add_argument("--salida", default="benchmark.json", help="Archivo JSON del informe")
+    parser.add_argument("--tamanos", default=",".join(TAMANOS),
+                        help=f"Tamaños separados por coma ({', '.join(TAMANOS)})")
+    parser.add_argument("--complemento", choices=("sin", "con", "ambos"), default="ambos",
+                        help="Casos sin complemento, con Pagos 2.0 o ambos")
+    parser.add_argument("--repeticiones", type=int, default=None, help="Repeticiones por caso")
+    parser.add_argument("--metodo", default="xslt", choices=("xslt", "nativo", "auto"),
+                        help="Generación de la cadena original")
+    parser.add_argument("--comparar", default=None, help="Informe JSON anterior para detectar regresiones")
+    parser.add_argument("--umbral", type=float, default=0.10, help="Regresión tolerada del p50 (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    variantes = {"sin": (False,), "con": (True,), "ambos": (False, True)}[args.complemento]
+    casos = [(tamano, complemento) for tamano in args.tamanos.split(",") for complemento in variantes]
+    informe = ejecutar(casos, args.repeticiones, args.metodo)
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(f"✅ Informe guardado en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(informe, json.load(f), args.umbral)
+        for caso, etapa, anterior, actual, cambio in regresiones:
+            print(f"❌ {caso} {etapa}: p50 {anterior:.2f} ms → {actual:.2f} ms (+{cambio:.0%})")
+        if not regresiones:
+            print("✅ Sin regresiones respecto al informe anterior")
+        exit(1 if regresiones else 0)
@@ -0,0 +1,75 @@
+"""
+Generación, cadena original, firma, verificación y timbrado de CFDI 4.0.
+
+Importar el paquete no carga ningún submódulo: cada nombre público se importa
+en su primer uso (por ejemplo, cfdi.sellar_cfdi carga cfdi.firma). Las
+dependencias pesadas (cryptography, requests, fiscalapi, numpy, zstandard) se cargan
+dentro de las funciones que las usan.
+"""
+import importlib
+
+# Nombre público -> submódulo que lo define
+_EXPORTADOS = {
+    "construir_comprobante": "generacion",
+    "generar_xml_cfdi": "generacion",
+    "generar_cfdi_streaming": "generacion_streaming",
+    "calcular": "impuestos",
+    "ColumnaImpuesto": "impuestos",
+    "generar_cadena_original": "cadena",
+    "generar_cadena_nativa": "cadena_nativa",
+    "cargar_llave_privada": "firma",
+    "cargar_certificado": "firma",
+    "firmar_cadena": "firma",
+    "sellar_cfdi": "firma",
+    "ErrorFirma": "firma",
+    "FirmadorLote": "firma_lote",
+    "Firmante": "firmante",
+    "GestorCSD": "csd",
+    "LoteCancelacion": "cancelacion",
+    "LibroSaldos": "pagos",
+    "construir_pago": "pagos",
+    "validar_sello": "verificacion",
+    "SelloInvalido": "verificacion",
+    "validar": "validacion",
+    "ComprobanteInvalido": "validacion",
+    "verificar_cfdi": "verificacion_lote",
+    "verificar_lote": "verificacion_lote",
+    "ClienteSW": "cliente_pac",
+    "ClienteFiscalAPI": "cliente_pac",
+    "ErrorPAC": "cliente_pac",
+    "PACSimulado": "pac_simulado",
+    "ColaTimbrado": "cola_timbrado",
+    "CacheResultados": "cache_resultados",
+    "Almacen": "almacen",
+    "Catalogos": "catalogos",
+    "ServicioCFDI": "servicio",
+    "Plantilla": "plantillas",
+    "Ingesta": "ingesta",
+    "Extractor": "extraccion",
+    "AsignadorFolios": "folios",
+    "AlmacenFolios": "folios",
+}
+
+_SUBMODULOS = frozenset({
+    "almacen", "cache_resultados", "cadena", "cadena_nativa", "cancelacion", "catalogos", "cliente_pac",
+    "cola_timbrado", "csd", "extraccion", "firma", "firma_lote", "firmante", "folios", "generacion",
+    "generacion_streaming", "impuestos", "ingesta", "instrumentacion", "pac_simulado", "pagos", "plantillas",
+    "servicio", "timbrado", "validacion", "verificacion", "verificacion_lote",
+})
+
+__all__ = sorted(_EXPORTADOS)
+
+
+def __getattr__(nombre):
+    if nombre in _SUBMODULOS:
+        return importlib.import_module(f"{__name__}.{nombre}")
+    submodulo = _EXPORTADOS.get(nombre)
+    if submodulo is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+    valor = getattr(importlib.import_module(f"{__name__}.{submodulo}"), nombre)
+    globals()[nombre] = valor  # las siguientes búsquedas ya no pasan por aquí
+    return valor
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTADOS) | _SUBMODULOS)
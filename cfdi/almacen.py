@@ -0,0 +1,608 @@
+import argparse
+import base64
+import collections
+import csv
+import json
+import mmap
+import os
+import zlib
+from decimal import Decimal
+from lxml import etree
+
+# numpy (índices) y zstandard (compresión) se importan al abrir el almacén
+
+CFDI = "{http://www.sat.gob.mx/cfd/4}"
+TFD = "{http://www.sat.gob.mx/TimbreFiscalDigital}"
+
+# Un registro de ancho fijo por CFDI, en orden de llegada (registros.bin).
+# Fecha se guarda como AAAAMMDDhhmmss y Total en millonésimas, ambos enteros.
+CAMPOS = [
+    ("uuid", "S36"), ("fecha", "<i8"), ("total", "<i8"),
+    ("emisor", "S13"), ("receptor", "S13"), ("serie", "S25"), ("folio", "S40"),
+    ("segmento", "<u4"), ("desplazamiento", "<u8"), ("longitud", "<u4"), ("longitud_xml", "<u4"),
+]
+
+# Índices ordenados: nombre -> campos que forman la clave
+INDICES = {
+    "uuid": ("uuid",),
+    "emisor": ("emisor",),
+    "receptor": ("receptor",),
+    "fecha": ("fecha",),
+    "total": ("total",),
+    "folio": ("serie", "folio"),
+}
+
+_ESCALA_TOTAL = 10 ** 6
+_MINIMO, _MAXIMO = -2 ** 63, 2 ** 63 - 1
+
+Registro = collections.namedtuple("Registro", "numero uuid fecha total emisor receptor serie folio")
+
+
+def _fecha_a_entero(texto, fin=False):
+    """'2024-03-05T12:00:00' -> 20240305120000. Una fecha parcial se completa al inicio (o al final) del periodo."""
+    digitos = "".join(c for c in texto if c.isdigit())[:14]
+    return int(digitos.ljust(14, "9" if fin else "0"))
+
+
+def _entero_a_fecha(valor):
+    t = f"{valor:014d}"
+    return f"{t[0:4]}-{t[4:6]}-{t[6:8]}T{t[8:10]}:{t[10:12]}:{t[12:14]}"
+
+
+def _total_a_entero(valor):
+    return int((Decimal(str(valor)) * _ESCALA_TOTAL).to_integral_value())
+
+
+def _entero_a_total(valor):
+    total = Decimal(int(valor)).scaleb(-6)
+    centavos = total.quantize(Decimal("0.01"))
+    return centavos if centavos == total else total.normalize()
+
+
+def xml_de_respuesta(respuesta):
+    """
+    Extrae el XML timbrado de la respuesta de un PAC.
+
+    Parámetros:
+        respuesta: XML (bytes o str), los datos de SW (dict con "cfdi"), o la
+            respuesta de client.invoices.create de FiscalAPI (o su .data).
+
+    Retorna:
+        bytes: XML timbrado.
+    """
+    if isinstance(respuesta, bytes):
+        return respuesta
+    if isinstance(respuesta, str):
+        return respuesta.encode("utf-8")
+    if isinstance(respuesta, dict):
+        datos = respuesta.get("data", respuesta)
+        return datos["cfdi"].encode("utf-8")
+    datos = getattr(respuesta, "data", None) or respuesta
+    for respuesta_sat in getattr(datos, "responses", None) or []:
+        if getattr(respuesta_sat, "invoice_base64", None):
+            return base64.b64decode(respuesta_sat.invoice_base64)
+    xml = getattr(datos, "xml", None)
+    if xml:
+        return xml_de_respuesta(xml)
+    raise ValueError("La respuesta no contiene el XML timbrado.")
+
+
+class Almacen:
+    """
+    Almacén de solo anexado para CFDI timbrados.
+
+    Cada XML se comprime (zstd si está instalado, si no zlib) como un bloque
+    independiente dentro de segmentos de hasta `tamano_segmento` bytes. Con
+    zstd, al llegar a `muestras_diccionario` documentos se entrena un
+    diccionario con ellos: los CFDI comparten casi toda su estructura y cada
+    bloque se comprime varias veces mejor sin perder el acceso individual. Sus
+    datos de búsqueda (UUID, RFC de emisor y receptor, Fecha, Total,
+    Serie/Folio) se extraen una sola vez al agregarlo. Los índices son
+    arreglos ordenados en disco que se abren con mmap y se consultan por
+    búsqueda binaria; los registros agregados después del último indexar()
+    se revisan en forma vectorizada. Ninguna consulta parsea XML.
+
+    Un solo proceso escribe; cualquier número de procesos puede leer.
+
+    Uso:
+        with Almacen("almacen_cfdi") as almacen:
+            almacen.agregar(xml_timbrado)
+            for numero in almacen.buscar(emisor="AAA010101AX5", desde="2024-03", hasta="2024-03"):
+                xml = almacen.xml(numero)
+    """
+
+    def __init__(self, ruta, codec=None, nivel=3, tamano_segmento=256 * 1024 * 1024, umbral_indexar=100_000,
+                 muestras_diccionario=1000, tamano_diccionario=64 * 1024):
+        import numpy as np
+
+        self.np = np
+        self.ruta = ruta
+        self.nivel = nivel
+        self.tamano_segmento = tamano_segmento
+        self.umbral_indexar = umbral_indexar
+        self.muestras_diccionario = muestras_diccionario
+        self.tamano_diccionario = tamano_diccionario
+        self.dtype = np.dtype(CAMPOS)
+        os.makedirs(os.path.join(ruta, "segmentos"), exist_ok=True)
+        os.makedirs(os.path.join(ruta, "indices"), exist_ok=True)
+
+        self._ruta_manifiesto = os.path.join(ruta, "manifiesto.json")
+        if os.path.exists(self._ruta_manifiesto):
+            with open(self._ruta_manifiesto, encoding="utf-8") as f:
+                self.manifiesto = json.load(f)
+            if codec is not None and codec != self.manifiesto["codec"]:
+                raise ValueError(f"El almacén usa el codec {self.manifiesto['codec']}, no {codec}.")
+        else:
+            self.manifiesto = {"version": 1, "codec": codec or self._codec_disponible(), "indexados": 0,
+                               "diccionario": None}
+            self._guardar_manifiesto()
+        self.codec = self.manifiesto["codec"]
+        self._preparar_codec()
+
+        self._ruta_registros = os.path.join(ruta, "registros.bin")
+        self._recortar_registro_incompleto()
+        self._archivo_registros = open(self._ruta_registros, "ab")
+        self._archivo_segmento = None
+        self._segmento = None
+        self._registros = None
+        self._indices = {}
+        self._mapas = {}
+        # uuid -> número de los registros aún no indexados (hasta _revisados), para buscarlos
+        # por UUID y no duplicarlos al agregar
+        self._por_indexar = {}
+        self._revisados = self.manifiesto["indexados"]
+        self._revisar_nuevos()
+
+    @staticmethod
+    def _codec_disponible():
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            return "zlib"
+        return "zstd"
+
+    def _preparar_codec(self):
+        if self.codec == "zstd":
+            import zstandard
+
+            diccionario = None
+            if self.manifiesto.get("diccionario"):
+                with open(os.path.join(self.ruta, self.manifiesto["diccionario"]), "rb") as f:
+                    diccionario = zstandard.ZstdCompressionDict(f.read())
+            # Los bloques anteriores al diccionario se descomprimen con el mismo objeto
+            self._compresor = zstandard.ZstdCompressor(level=self.nivel, dict_data=diccionario).compress
+            self._descompresor = zstandard.ZstdDecompressor(dict_data=diccionario).decompress
+        elif self.codec == "zlib":
+            self._compresor = lambda datos: zlib.compress(datos, self.nivel)
+            self._descompresor = zlib.decompress
+        elif self.codec == "ninguno":
+            self._compresor, self._descompresor = bytes, None
+        else:
+            raise ValueError(f"Codec desconocido: {self.codec}")
+
+    def _entrenar_diccionario(self):
+        """Entrena el diccionario zstd con los primeros documentos; los siguientes bloques lo usan."""
+        import zstandard
+
+        muestras = [bytes(self.xml(numero)) for numero in range(self.muestras_diccionario)]
+        try:
+            diccionario = zstandard.train_dictionary(self.tamano_diccionario, muestras)
+        except zstandard.ZstdError:
+            return  # muestras insuficientes o demasiado uniformes: se sigue sin diccionario
+        nombre = "diccionario.zstd"
+        with open(os.path.join(self.ruta, nombre + ".tmp"), "wb") as f:
+            f.write(diccionario.as_bytes())
+        os.replace(os.path.join(self.ruta, nombre + ".tmp"), os.path.join(self.ruta, nombre))
+        self.manifiesto["diccionario"] = nombre
+        self._guardar_manifiesto()
+        self._preparar_codec()
+
+    def _guardar_manifiesto(self):
+        temporal = self._ruta_manifiesto + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(self.manifiesto, f)
+        os.replace(temporal, self._ruta_manifiesto)
+
+    def _recortar_registro_incompleto(self):
+        """Descarta un registro escrito a medias por una caída (el XML huérfano queda sin referencia)."""
+        if os.path.exists(self._ruta_registros):
+            tamano = os.path.getsize(self._ruta_registros)
+            if tamano % self.dtype.itemsize:
+                with open(self._ruta_registros, "r+b") as f:
+                    f.truncate(tamano - tamano % self.dtype.itemsize)
+
+    def _revisar_nuevos(self):
+        """Incorpora a _por_indexar los registros que otro proceso agregó desde la última revisión."""
+        registros = self._cargar_registros()
+        if len(registros) > self._revisados:
+            nuevos = registros[self._revisados:]["uuid"].tolist()
+            self._por_indexar.update(zip(nuevos, range(self._revisados, len(registros))))
+            self._revisados = len(registros)
+
+    def _contar_registros(self):
+        self._archivo_registros.flush()
+        return os.path.getsize(self._ruta_registros) // self.dtype.itemsize
+
+    def _cargar_registros(self):
+        """Registros como arreglo de numpy mapeado a memoria (se remapea si creció)."""
+        total = self._contar_registros()
+        if self._registros is None or len(self._registros) != total:
+            if total == 0:
+                self._registros = self.np.empty(0, self.dtype)
+            else:
+                self._registros = self.np.memmap(self._ruta_registros, self.dtype, "r", shape=(total,))
+        return self._registros
+
+    def cerrar(self):
+        if len(self._por_indexar) >= self.umbral_indexar:
+            self.indexar()
+        self._archivo_registros.close()
+        if self._archivo_segmento is not None:
+            self._archivo_segmento.close()
+        for mapa in self._mapas.values():
+            mapa.close()
+        self._mapas.clear()
+        self._registros = None
+        self._indices.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+    def __len__(self):
+        return self._contar_registros()
+
+    def __contains__(self, uuid):
+        return self._buscar_uuid(uuid) is not None
+
+    # Escritura
+
+    def _ruta_segmento(self, segmento):
+        return os.path.join(self.ruta, "segmentos", f"{segmento:06d}.seg")
+
+    def _abrir_segmento(self, tamano):
+        """Segmento donde cabe un bloque de `tamano` bytes; rota al siguiente si el actual está lleno."""
+        if self._segmento is None:
+            existentes = sorted(os.listdir(os.path.join(self.ruta, "segmentos")))
+            self._segmento = int(existentes[-1].split(".")[0]) if existentes else 1
+            self._archivo_segmento = open(self._ruta_segmento(self._segmento), "ab")
+        if self._archivo_segmento.tell() and self._archivo_segmento.tell() + tamano > self.tamano_segmento:
+            self._archivo_segmento.close()
+            self._segmento += 1
+            self._archivo_segmento = open(self._ruta_segmento(self._segmento), "ab")
+        return self._segmento, self._archivo_segmento
+
+    def agregar(self, documento):
+        """
+        Agrega un CFDI timbrado; si su UUID ya está en el almacén no se duplica.
+
+        Parámetros:
+            documento: XML timbrado (bytes o str), su ruta, o la respuesta de un
+                PAC (ver xml_de_respuesta).
+
+        Retorna:
+            int: Número de registro del CFDI.
+        """
+        if isinstance(documento, str) and not documento.lstrip().startswith("<"):
+            with open(documento, "rb") as xml_file:
+                xml = xml_file.read()
+        else:
+            xml = xml_de_respuesta(documento)
+        raiz = etree.fromstring(xml)
+        timbre = raiz.find(f"{CFDI}Complemento/{TFD}TimbreFiscalDigital")
+        if timbre is None or not timbre.get("UUID"):
+            raise ValueError("El CFDI no tiene Timbre Fiscal Digital.")
+        uuid = timbre.get("UUID").upper().encode("ascii")
+        existente = self._buscar_uuid(uuid)
+        if existente is not None:
+            return existente
+        emisor = raiz.find(f"{CFDI}Emisor")
+        receptor = raiz.find(f"{CFDI}Receptor")
+
+        bloque = self._compresor(xml)
+        segmento, archivo = self._abrir_segmento(len(bloque))
+        desplazamiento = archivo.tell()
+        archivo.write(bloque)
+        archivo.flush()  # el XML llega al archivo antes que el registro que lo referencia
+        registro = self.np.array([(
+            uuid, _fecha_a_entero(raiz.get("Fecha", "")), _total_a_entero(raiz.get("Total", "0")),
+            (emisor.get("Rfc", "") if emisor is not None else "").encode("utf-8"),
+            (receptor.get("Rfc", "") if receptor is not None else "").encode("utf-8"),
+            raiz.get("Serie", "").encode("utf-8"), raiz.get("Folio", "").encode("utf-8"),
+            segmento, desplazamiento, len(bloque), len(xml),
+        )], self.dtype)
+        numero = self._contar_registros()
+        self._archivo_registros.write(registro.tobytes())
+        self._archivo_registros.flush()
+        self._por_indexar[uuid] = numero
+        self._revisados = numero + 1
+        if (self.codec == "zstd" and numero + 1 == self.muestras_diccionario
+                and not self.manifiesto.get("diccionario")):
+            self._entrenar_diccionario()
+        return numero
+
+    def sincronizar(self):
+        """Fuerza a disco los segmentos y registros escritos (fsync)."""
+        for archivo in (self._archivo_segmento, self._archivo_registros):
+            if archivo is not None:
+                archivo.flush()
+                os.fsync(archivo.fileno())
+
+    def indexar(self):
+        """Reconstruye los índices ordenados con todos los registros."""
+        np = self.np
+        registros = self._cargar_registros()
+        total = len(registros)
+        for nombre in INDICES:
+            claves = self._claves(nombre, registros)
+            orden = np.argsort(claves, kind="stable").astype("<u4")
+            for extension, arreglo in (("claves", claves[orden]), ("registros", orden)):
+                ruta = os.path.join(self.ruta, "indices", f"{nombre}.{extension}")
+                arreglo.tofile(ruta + ".tmp")
+                os.replace(ruta + ".tmp", ruta)
+        self._indices.clear()
+        self.manifiesto["indexados"] = total
+        self._guardar_manifiesto()
+        self._por_indexar.clear()
+        self._revisados = total
+
+    # Lectura
+
+    def _claves(self, nombre, registros):
+        """Clave de un índice para un conjunto de registros (Serie+Folio se concatenan a ancho fijo)."""
+        # Los campos de un arreglo estructurado son vistas con salto; se copian a memoria contigua
+        campos = INDICES[nombre]
+        if len(campos) == 1:
+            return self.np.ascontiguousarray(registros[campos[0]])
+        anchos = [self.dtype[c].itemsize for c in campos]
+        claves = self.np.zeros((len(registros), sum(anchos)), "u1")
+        inicio = 0
+        for campo, ancho in zip(campos, anchos):
+            claves[:, inicio:inicio + ancho] = self.np.ascontiguousarray(registros[campo]).view("u1").reshape(-1, ancho)
+            inicio += ancho
+        return claves.view(f"S{sum(anchos)}").ravel()
+
+    def _clave_folio(self, serie, folio):
+        ancho_serie = self.dtype["serie"].itemsize
+        return serie.encode("utf-8").ljust(ancho_serie, b"\0") + folio.encode("utf-8")
+
+    def _indice(self, nombre):
+        if nombre not in self._indices:
+            indexados = self.manifiesto["indexados"]
+            registros = self._cargar_registros()
+            tipo = self._claves(nombre, registros[:0]).dtype
+            if indexados == 0:
+                self._indices[nombre] = (self.np.empty(0, tipo), self.np.empty(0, "<u4"))
+            else:
+                base = os.path.join(self.ruta, "indices", nombre)
+                self._indices[nombre] = (self.np.memmap(base + ".claves", tipo, "r", shape=(indexados,)),
+                                         self.np.memmap(base + ".registros", "<u4", "r", shape=(indexados,)))
+        return self._indices[nombre]
+
+    def _rango(self, nombre, bajo, alto):
+        """Números de registro con bajo <= clave <= alto: búsqueda binaria más los aún no indexados."""
+        np = self.np
+        claves, numeros = self._indice(nombre)
+        inicio = np.searchsorted(claves, bajo, "left")
+        fin = np.searchsorted(claves, alto, "right")
+        indexados = self.manifiesto["indexados"]
+        cola = self._cargar_registros()[indexados:]
+        if not len(cola):
+            return np.asarray(numeros[inicio:fin], "<i8")
+        claves_cola = self._claves(nombre, cola)
+        en_cola = np.nonzero((claves_cola >= bajo) & (claves_cola <= alto))[0] + indexados
+        return np.concatenate([np.asarray(numeros[inicio:fin], "<i8"), en_cola])
+
+    def _buscar_uuid(self, uuid):
+        if isinstance(uuid, str):
+            uuid = uuid.upper().encode("ascii")
+        if uuid not in self._por_indexar:
+            self._revisar_nuevos()
+        if uuid in self._por_indexar:
+            return self._por_indexar[uuid]
+        claves, numeros = self._indice("uuid")
+        posicion = self.np.searchsorted(claves, uuid)
+        if posicion < len(claves) and claves[posicion] == uuid:
+            return int(numeros[posicion])
+        return None
+
+    def buscar(self, uuid=None, emisor=None, receptor=None, serie=None, folio=None,
+               desde=None, hasta=None, total_min=None, total_max=None):
+        """
+        Busca CFDI por cualquier combinación de filtros, sin parsear XML.
+
+        Parámetros:
+            uuid, emisor, receptor (str): Coincidencia exacta.
+            serie, folio (str): Coincidencia exacta de Serie+Folio (serie "" por omisión).
+            desde, hasta (str): Rango de Fecha inclusivo; admite fechas parciales
+                ("2024-03" abarca todo marzo).
+            total_min, total_max: Rango de Total inclusivo.
+
+        Retorna:
+            numpy.ndarray: Números de registro en orden de llegada (ver registro y xml).
+        """
+        np = self.np
+        filtros = {}
+        if uuid is not None:
+            filtros["uuid"] = (uuid.upper().encode("ascii"),) * 2
+        if folio is not None:
+            filtros["folio"] = (self._clave_folio(serie or "", folio),) * 2
+        if emisor is not None:
+            filtros["emisor"] = (emisor.encode("utf-8"),) * 2
+        if receptor is not None:
+            filtros["receptor"] = (receptor.encode("utf-8"),) * 2
+        if desde is not None or hasta is not None:
+            filtros["fecha"] = (_fecha_a_entero(desde) if desde else _MINIMO,
+                                _fecha_a_entero(hasta, fin=True) if hasta else _MAXIMO)
+        if total_min is not None or total_max is not None:
+            filtros["total"] = (_total_a_entero(total_min) if total_min is not None else _MINIMO,
+                                _total_a_entero(total_max) if total_max is not None else _MAXIMO)
+        if not filtros:
+            return np.arange(self._contar_registros())
+
+        # El primer filtro (el más selectivo) usa su índice; los demás se aplican sobre sus resultados
+        principal = next(nombre for nombre in INDICES if nombre in filtros)
+        numeros = self._rango(principal, *filtros.pop(principal))
+        registros = self._cargar_registros()
+        for nombre, (bajo, alto) in filtros.items():
+            if not len(numeros):
+                break
+            claves = self._claves(nombre, registros[numeros])
+            numeros = numeros[(claves >= bajo) & (claves <= alto)]
+        return np.sort(numeros)
+
+    def registro(self, numero):
+        """Datos indexados de un CFDI como Registro."""
+        fila = self._cargar_registros()[numero]
+        return Registro(int(numero), fila["uuid"].decode("ascii"), _entero_a_fecha(int(fila["fecha"])),
+                        _entero_a_total(fila["total"]), fila["emisor"].decode("utf-8"),
+                        fila["receptor"].decode("utf-8"), fila["serie"].decode("utf-8"),
+                        fila["folio"].decode("utf-8"))
+
+    def _mapa(self, segmento, fin):
+        mapa = self._mapas.get(segmento)
+        if mapa is None or len(mapa) < fin:
+            # El segmento en escritura crece: se vuelve a mapear con su tamaño actual
+            if self._segmento == segmento:
+                self._archivo_segmento.flush()
+            if mapa is not None:
+                mapa.close()
+            with open(self._ruta_segmento(segmento), "rb") as f:
+                mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapas[segmento] = mapa
+        return mapa
+
+    def bloque(self, numero):
+        """
+        Bloque almacenado de un CFDI, sin copiarlo (memoryview sobre el segmento mapeado).
+
+        Con codec "ninguno" es el XML tal cual; con zstd/zlib es el bloque comprimido,
+        útil para copiarlo a otro almacén o servirlo comprimido.
+        """
+        fila = self._cargar_registros()[numero]
+        inicio = int(fila["desplazamiento"])
+        fin = inicio + int(fila["longitud"])
+        return memoryview(self._mapa(int(fila["segmento"]), fin))[inicio:fin]
+
+    def xml(self, numero_o_uuid):
+        """
+        XML timbrado de un CFDI por número de registro o UUID.
+
+        Retorna:
+            bytes | memoryview: El XML original (memoryview sin copia si el codec es "ninguno").
+        """
+        numero = numero_o_uuid
+        if isinstance(numero_o_uuid, (str, bytes)):
+            numero = self._buscar_uuid(numero_o_uuid)
+            if numero is None:
+                raise KeyError(numero_o_uuid)
+        bloque = self.bloque(numero)
+        if self._descompresor is None:
+            return bloque
+        try:
+            return self._descompresor(bloque)
+        except Exception:
+            # Un lector abierto antes de que el escritor entrenara el diccionario
+            with open(self._ruta_manifiesto, encoding="utf-8") as f:
+                manifiesto = json.load(f)
+            if manifiesto.get("diccionario") == self.manifiesto.get("diccionario"):
+                raise
+            self.manifiesto["diccionario"] = manifiesto["diccionario"]
+            self._preparar_codec()
+            return self._descompresor(bloque)
+
+    def exportar_csv(self, numeros, salida):
+        """Escribe los datos indexados (p. ej. para conciliar con la descarga masiva del SAT)."""
+        with open(salida, "w", newline="", encoding="utf-8") as f:
+            escritor = csv.writer(f)
+            escritor.writerow(Registro._fields[1:])
+            for numero in numeros:
+                escritor.writerow(self.registro(numero)[1:])
+
+    def exportar_xml(self, numeros, directorio):
+        """Escribe cada XML como <UUID>.xml en el directorio."""
+        os.makedirs(directorio, exist_ok=True)
+        registros = self._cargar_registros()
+        for numero in numeros:
+            uuid = registros[numero]["uuid"].decode("ascii")
+            with open(os.path.join(directorio, f"{uuid}.xml"), "wb") as f:
+                f.write(self.xml(numero))
+
+
+def archivar_respuesta(almacen, respuesta):
+    """
+    Agrega al almacén el CFDI de una respuesta exitosa del PAC.
+
+    Parámetros:
+        almacen (Almacen | str): Almacén abierto o su ruta.
+        respuesta: Datos de ClienteSW.timbrar / timbrar_xml, o la respuesta de
+            client.invoices.create de FiscalAPI.
+
+    Retorna:
+        int: Número de registro.
+    """
+    if isinstance(almacen, str):
+        with Almacen(almacen) as abierto:
+            return abierto.agregar(xml_de_respuesta(respuesta))
+    return almacen.agregar(xml_de_respuesta(respuesta))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Almacén de CFDI timbrados con índices mapeados a memoria.")
+    parser.add_argument("ruta", help="Directorio del almacén")
+    acciones = parser.add_subparsers(dest="accion", required=True)
+    agregar = acciones.add_parser("agregar", help="Agrega XML timbrados")
+    agregar.add_argument("origen", nargs="+", help="Archivos, directorios o patrones glob")
+    acciones.add_parser("indexar", help="Reconstruye los índices ordenados")
+    buscar = acciones.add_parser("buscar", help="Busca por índices y lista o exporta los resultados")
+    for filtro in ("uuid", "emisor", "receptor", "serie", "folio", "desde", "hasta"):
+        buscar.add_argument(f"--{filtro}")
+    buscar.add_argument("--total-min")
+    buscar.add_argument("--total-max")
+    buscar.add_argument("--csv", help="Exporta los datos indexados a este CSV")
+    buscar.add_argument("--xml", help="Exporta los XML a este directorio")
+    extraer = acciones.add_parser("xml", help="Escribe el XML de un UUID")
+    extraer.add_argument("uuid")
+    extraer.add_argument("salida", nargs="?", default="factura_timbrada.xml")
+    args = parser.parse_args()
+
+    with Almacen(args.ruta) as almacen:
+        if args.accion == "agregar":
+            from .firma_lote import expandir_documentos
+
+            agregados = errores = 0
+            for origen in args.origen:
+                for ruta in expandir_documentos(origen):
+                    try:
+                        almacen.agregar(ruta)
+                        agregados += 1
+                    except (OSError, ValueError, etree.XMLSyntaxError) as e:
+                        errores += 1
+                        print(f"❌ {ruta}: {e}")
+            almacen.indexar()
+            print(f"✅ {agregados} CFDI agregados ({errores} con error); {len(almacen)} en el almacén")
+        elif args.accion == "indexar":
+            almacen.indexar()
+            print(f"✅ {len(almacen)} registros indexados")
+        elif args.accion == "buscar":
+            numeros = almacen.buscar(args.uuid, args.emisor, args.receptor, args.serie, args.folio,
+                                     args.desde, args.hasta, args.total_min, args.total_max)
+            if args.csv:
+                almacen.exportar_csv(numeros, args.csv)
+            if args.xml:
+                almacen.exportar_xml(numeros, args.xml)
+            if not args.csv and not args.xml:
+                for numero in numeros:
+                    print(" ".join(str(valor) for valor in almacen.registro(numero)[1:]))
+            print(f"✅ {len(numeros)} CFDI encontrados")
+        else:
+            try:
+                contenido = almacen.xml(args.uuid)
+            except KeyError:
+                print(f"❌ No se encontró el UUID {args.uuid}")
+                exit(1)
+            with open(args.salida, "wb") as f:
+                f.write(contenido)
+            print(f"✅ {args.uuid} guardado en {args.salida}")
@@ -0,0 +1,247 @@
+import argparse
+import collections
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from lxml import etree
+
+# Claves (todas derivadas de contenido, nunca de nombres de archivo):
+#   documento:<sha256 del C14N sin Sello ni Certificado, o de los bytes recibidos>
+#                                                          -> sha256 de la cadena original
+#   sello:<sha256 cadena>:<NoCertificado>                  -> Sello
+#   veredicto:<sha256 cadena>:<NoCertificado>:<sha256 Certificado+Sello> -> estado
+#   archivo:<sha256 de los bytes del XML sellado>          -> estado y NoCertificado
+# La primera evita la transformación XSLT en un documento repetido; sello y
+# veredicto evitan la operación RSA, y archivo evita incluso parsear el XML.
+
+_ETIQUETA_RAIZ = re.compile(rb'^<[^\s>]+(?:\s+[^\s=]+="[^"]*")*\s*/?>')
+_SELLO_Y_CERTIFICADO = re.compile(rb'\s(?:Sello|Certificado)="[^"]*"')
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS entradas (
+    clave TEXT PRIMARY KEY,
+    valor TEXT NOT NULL,
+    tamano INTEGER NOT NULL,
+    usado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entradas_usado ON entradas (usado);
+"""
+
+
+def digesto_documento(raiz):
+    """
+    SHA-256 de la forma canónica (C14N) del comprobante sin Sello ni Certificado.
+
+    Dos documentos con el mismo digesto tienen la misma cadena original, aunque
+    uno esté sellado y el otro no. El árbol no se modifica.
+    """
+    canonico = etree.tostring(raiz, method="c14n")
+    etiqueta = _ETIQUETA_RAIZ.match(canonico)
+    if etiqueta is not None:
+        fin = etiqueta.end()
+        canonico = _SELLO_Y_CERTIFICADO.sub(b"", canonico[:fin]) + canonico[fin:]
+    return hashlib.sha256(canonico).hexdigest()
+
+
+def digesto_bytes(contenido, *extras):
+    """SHA-256 del XML tal como se recibió, más los parámetros que alteren su cadena original."""
+    digesto = hashlib.sha256(contenido)
+    for extra in extras:
+        digesto.update(b"\0" + str(extra).encode("utf-8"))
+    return digesto.hexdigest()
+
+
+def digesto_cadena(cadena_original):
+    return hashlib.sha256(cadena_original.encode("utf-8")).hexdigest()
+
+
+class CacheResultados:
+    """
+    Cache de sellos y veredictos con un nivel en memoria y otro en disco.
+
+    El nivel en memoria es un LRU por número de entradas; el de disco es una
+    base SQLite (modo WAL, compartible entre procesos) limitada en bytes que
+    desaloja las entradas usadas hace más tiempo. Un acierto en disco se
+    promueve a memoria. Sin ruta, solo se usa el nivel en memoria.
+
+    Cualquier objeto con obtener(clave) y guardar(clave, valor) puede usarse
+    en su lugar (por ejemplo, un cliente de Redis envuelto).
+    """
+
+    def __init__(self, ruta=None, capacidad=4096, max_bytes_disco=256 * 1024 * 1024, revisar_cada=256):
+        self.ruta = ruta
+        self.capacidad = capacidad
+        self.max_bytes_disco = max_bytes_disco
+        self.revisar_cada = revisar_cada
+        self._entradas = collections.OrderedDict()
+        self._candado = threading.Lock()
+        self._escrituras = 0
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        self.desalojos_memoria = 0
+        self.desalojos_disco = 0
+        self.conexion = None
+        if ruta is not None:
+            self.conexion = sqlite3.connect(ruta, timeout=30, isolation_level=None, check_same_thread=False)
+            self.conexion.execute("PRAGMA journal_mode=WAL")
+            # Es una cache: perder las últimas escrituras ante una caída solo cuesta recalcularlas
+            self.conexion.execute("PRAGMA synchronous=NORMAL")
+            self.conexion.executescript(_ESQUEMA)
+
+    def cerrar(self):
+        if self.conexion is not None:
+            self.conexion.close()
+            self.conexion = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+    def obtener(self, clave):
+        """Devuelve el valor guardado o None."""
+        with self._candado:
+            valor = self._entradas.get(clave)
+            if valor is not None:
+                self._entradas.move_to_end(clave)
+                self.aciertos_memoria += 1
+                return valor
+            if self.conexion is not None:
+                fila = self.conexion.execute("SELECT valor FROM entradas WHERE clave = ?", (clave,)).fetchone()
+                if fila is not None:
+                    self.conexion.execute("UPDATE entradas SET usado = ? WHERE clave = ?", (time.time(), clave))
+                    self.aciertos_disco += 1
+                    self._en_memoria(clave, fila[0])
+                    return fila[0]
+            self.fallos += 1
+            return None
+
+    def guardar(self, clave, valor):
+        with self._candado:
+            self._en_memoria(clave, valor)
+            if self.conexion is None:
+                return
+            self.conexion.execute(
+                "INSERT OR REPLACE INTO entradas (clave, valor, tamano, usado) VALUES (?, ?, ?, ?)",
+                (clave, valor, len(clave) + len(valor), time.time()))
+            self._escrituras += 1
+            if self._escrituras % self.revisar_cada == 0:
+                self._desalojar_disco()
+
+    def _en_memoria(self, clave, valor):
+        self._entradas[clave] = valor
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.capacidad:
+            self._entradas.popitem(last=False)
+            self.desalojos_memoria += 1
+
+    def _desalojar_disco(self):
+        """Si el disco excede su límite, borra las entradas menos usadas hasta quedar al 90%."""
+        total = self.conexion.execute("SELECT COALESCE(SUM(tamano), 0) FROM entradas").fetchone()[0]
+        if total <= self.max_bytes_disco:
+            return
+        objetivo = total - int(self.max_bytes_disco * 0.9)
+        liberado = 0
+        borrar = []
+        for clave, tamano in self.conexion.execute("SELECT clave, tamano FROM entradas ORDER BY usado"):
+            borrar.append((clave,))
+            liberado += tamano
+            if liberado >= objetivo:
+                break
+        self.conexion.execute("BEGIN IMMEDIATE")
+        self.conexion.executemany("DELETE FROM entradas WHERE clave = ?", borrar)
+        self.conexion.execute("COMMIT")
+        self.desalojos_disco += len(borrar)
+
+    def estadisticas(self):
+        """Aciertos por nivel, fallos, desalojos y tamaño actual de cada nivel."""
+        with self._candado:
+            datos = {
+                "aciertos_memoria": self.aciertos_memoria,
+                "aciertos_disco": self.aciertos_disco,
+                "fallos": self.fallos,
+                "desalojos_memoria": self.desalojos_memoria,
+                "desalojos_disco": self.desalojos_disco,
+                "entradas_memoria": len(self._entradas),
+            }
+            if self.conexion is not None:
+                datos["entradas_disco"], datos["bytes_disco"] = self.conexion.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM entradas").fetchone()
+        consultas = datos["aciertos_memoria"] + datos["aciertos_disco"] + datos["fallos"]
+        datos["tasa_aciertos"] = (datos["aciertos_memoria"] + datos["aciertos_disco"]) / consultas if consultas else 0.0
+        return datos
+
+
+def buscar_sello(cache, documento, no_certificado):
+    """
+    Sello guardado para un documento (ver digesto_documento) y un certificado.
+
+    Retorna:
+        str: El Sello, o None si no se ha firmado antes.
+    """
+    cadena_digesto = cache.obtener("documento:" + documento)
+    if cadena_digesto is None:
+        return None
+    return cache.obtener(f"sello:{cadena_digesto}:{no_certificado}")
+
+
+def guardar_sello(cache, documento, no_certificado, cadena_original, sello):
+    cadena_digesto = digesto_cadena(cadena_original)
+    cache.guardar("documento:" + documento, cadena_digesto)
+    cache.guardar(f"sello:{cadena_digesto}:{no_certificado}", sello)
+
+
+def _clave_veredicto(cadena_digesto, no_certificado, certificado_b64, sello):
+    firma = hashlib.sha256(f"{certificado_b64}|{sello}".encode("ascii", "replace")).hexdigest()
+    return f"veredicto:{cadena_digesto}:{no_certificado}:{firma}"
+
+
+def buscar_veredicto(cache, documento, no_certificado, certificado_b64, sello):
+    """
+    Resultado guardado de verificar ese Sello con ese Certificado.
+
+    Retorna:
+        str: Estado de la verificación (ver verificacion_lote), o None.
+    """
+    cadena_digesto = cache.obtener("documento:" + documento)
+    if cadena_digesto is None:
+        return None
+    return cache.obtener(_clave_veredicto(cadena_digesto, no_certificado, certificado_b64, sello))
+
+
+def guardar_veredicto(cache, documento, no_certificado, certificado_b64, sello, cadena_original, estado):
+    cadena_digesto = digesto_cadena(cadena_original)
+    cache.guardar("documento:" + documento, cadena_digesto)
+    cache.guardar(_clave_veredicto(cadena_digesto, no_certificado, certificado_b64, sello), estado)
+
+
+def buscar_veredicto_archivo(cache, digesto):
+    """
+    Resultado guardado de verificar exactamente esos bytes (ver digesto_bytes).
+
+    Retorna:
+        tuple: (estado, NoCertificado), o None.
+    """
+    valor = cache.obtener("archivo:" + digesto)
+    if valor is None:
+        return None
+    estado, _, no_certificado = valor.partition(" ")
+    return estado, no_certificado
+
+
+def guardar_veredicto_archivo(cache, digesto, estado, no_certificado):
+    cache.guardar("archivo:" + digesto, f"{estado} {no_certificado}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estadísticas de una cache de resultados en disco.")
+    parser.add_argument("ruta", help="Base de datos SQLite de la cache")
+    args = parser.parse_args()
+
+    with CacheResultados(args.ruta) as cache:
+        print(json.dumps(cache.estadisticas(), indent=2))
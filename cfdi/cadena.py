@@ -0,0 +1,248 @@
+import os
+import sys
+import threading
+import time
+from lxml import etree
+
+# Directorio del proyecto (padre del paquete cfdi) y paquete local con las hojas XSLT del SAT
+DIRECTORIO_BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAQUETE_SAT = os.path.join(DIRECTORIO_BASE, "xslt_sat")
+
+# Los xsl:include del SAT apuntan a esta ruta; se resuelven dentro del paquete local
+PREFIJOS_SAT = (
+    "http://www.sat.gob.mx/sitio_internet/cfd/",
+    "https://www.sat.gob.mx/sitio_internet/cfd/",
+)
+
+# Hoja principal de transformación por versión de cadena original
+HOJAS_CADENA = {
+    "4.0": os.path.join(DIRECTORIO_BASE, "cadenaoriginal_4_0.xslt"),
+}
+
+XSL = "http://www.w3.org/1999/XSL/Transform"
+
+# Hoja sustituta para complementos que no están en el paquete local. Si un
+# documento trae ese complemento la transformación se detiene con un mensaje
+# en lugar de producir una cadena original incompleta.
+HOJA_FALTANTE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform" xmlns:cfdi="http://www.sat.gob.mx/cfd/4">
+  <xsl:template match="cfdi:Complemento/*[namespace-uri() != 'http://www.sat.gob.mx/TimbreFiscalDigital'] | cfdi:ComplementoConcepto/*" priority="-10">
+    <xsl:message terminate="yes">Complemento sin hoja XSLT en el paquete local: <xsl:value-of select="name()"/></xsl:message>
+  </xsl:template>
+</xsl:stylesheet>
+"""
+
+
+def ruta_en_paquete(url, paquete=PAQUETE_SAT):
+    """Traduce la URL de un xsl:include del SAT a su ruta dentro del paquete local."""
+    for prefijo in PREFIJOS_SAT:
+        if url.startswith(prefijo):
+            relativa = url[len(prefijo):].split("?", 1)[0]
+            return os.path.join(paquete, *relativa.split("/"))
+    return None
+
+
+class ResolvedorPaqueteSAT(etree.Resolver):
+    """Resuelve los xsl:include del SAT contra el paquete local, sin acceso a red."""
+
+    def __init__(self, paquete=PAQUETE_SAT, estricto=False):
+        super().__init__()
+        self.paquete = paquete
+        self.estricto = estricto
+        self.faltantes = []
+
+    def resolve(self, url, pubid, context):
+        ruta = ruta_en_paquete(url, self.paquete)
+        if ruta is None:
+            return None
+        if os.path.exists(ruta):
+            return self.resolve_filename(ruta, context)
+        self.faltantes.append(url)
+        return self.resolve_string(HOJA_FALTANTE, context, base_url=url)
+
+
+class MotorCadenaOriginal:
+    """
+    Motor de cadena original compartido por el proceso.
+
+    Compila cada hoja XSLT una sola vez y guarda la transformación por versión
+    ("4.0" hoy; se pueden registrar más con registrar_hoja). Los xsl:include
+    del SAT se resuelven desde el paquete local y, si el paquete o la hoja
+    cambian en disco, la transformación se recompila en la siguiente llamada.
+    """
+
+    def __init__(self, paquete=PAQUETE_SAT, hojas=None, estricto=False, intervalo_revision=2.0):
+        self.paquete = paquete
+        self.hojas = dict(HOJAS_CADENA if hojas is None else hojas)
+        self.estricto = estricto
+        self.intervalo_revision = intervalo_revision
+        self._cache = {}  # version -> [firma, transformacion, faltantes, ultima_revision]
+        self._candado = threading.Lock()
+
+    def registrar_hoja(self, version, ruta_xslt):
+        """Registra (o reemplaza) la hoja principal de una versión de cadena original."""
+        with self._candado:
+            self.hojas[version] = os.path.abspath(ruta_xslt)
+            self._cache.pop(version, None)
+
+    def limpiar(self):
+        """Descarta todas las transformaciones compiladas."""
+        with self._candado:
+            self._cache.clear()
+
+    def firma_paquete(self, version):
+        """Huella (ruta, mtime, tamaño) de la hoja principal y del paquete local."""
+        archivos = [self.hojas[version]]
+        for raiz, _, nombres in os.walk(self.paquete):
+            archivos.extend(os.path.join(raiz, n) for n in nombres if n.endswith(".xslt"))
+        firma = []
+        for ruta in sorted(archivos):
+            try:
+                st = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            firma.append((ruta, st.st_mtime_ns, st.st_size))
+        return tuple(firma)
+
+    def _compilar(self, version):
+        resolvedor = ResolvedorPaqueteSAT(self.paquete, self.estricto)
+        parser = etree.XMLParser(no_network=True)
+        parser.resolvers.add(resolvedor)
+        xslt_doc = etree.parse(self.hojas[version], parser)
+        acceso = etree.XSLTAccessControl(read_network=False, write_network=False,
+                                         create_dir=False, write_file=False)
+        transformacion = etree.XSLT(xslt_doc, access_control=acceso)
+        if resolvedor.faltantes and self.estricto:
+            raise etree.XSLTParseError(
+                "Hojas XSLT faltantes en el paquete local: " + ", ".join(resolvedor.faltantes))
+        return transformacion, tuple(resolvedor.faltantes)
+
+    def transformacion(self, version="4.0"):
+        """Devuelve la transformación compilada de la versión, recompilando si el paquete cambió."""
+        if version not in self.hojas:
+            raise KeyError(f"Versión de cadena original no registrada: {version}")
+        entrada = self._cache.get(version)
+        ahora = time.monotonic()
+        if entrada is not None and ahora - entrada[3] < self.intervalo_revision:
+            return entrada[1]
+        with self._candado:
+            entrada = self._cache.get(version)
+            firma = self.firma_paquete(version)
+            if entrada is None or entrada[0] != firma:
+                transformacion, faltantes = self._compilar(version)
+                entrada = [firma, transformacion, faltantes, ahora]
+                self._cache[version] = entrada
+            else:
+                entrada[3] = ahora
+            return entrada[1]
+
+    def faltantes(self, version="4.0"):
+        """URLs de complementos que no se encontraron en el paquete local."""
+        self.transformacion(version)
+        return self._cache[version][2]
+
+    def generar(self, documento, version="4.0"):
+        """
+        Genera la cadena original de un documento.
+
+        Parámetros:
+            documento: Ruta del XML, bytes del XML, o un árbol/elemento de lxml.
+            version (str): Versión registrada de la hoja de transformación.
+
+        Retorna:
+            str: Cadena original.
+        """
+        transformacion = self.transformacion(version)
+        if isinstance(documento, (bytes, bytearray)):
+            documento = etree.fromstring(bytes(documento))
+        elif isinstance(documento, (str, os.PathLike)):
+            documento = etree.parse(os.fspath(documento))
+        if isinstance(documento, etree._Element):
+            documento = documento.getroottree()
+        return str(transformacion(documento))
+
+
+# Motor compartido del proceso
+motor = MotorCadenaOriginal()
+
+
+def generar_cadena_original(documento, xslt_path=None, version="4.0", metodo="xslt"):
+    """
+    Genera la cadena original con el motor compartido (una compilación por proceso).
+
+    Parámetros:
+        documento: Ruta del XML, bytes del XML, o un árbol/elemento de lxml.
+        xslt_path (str): Hoja principal alternativa; por omisión la de la versión.
+        version (str): Versión registrada de la hoja de transformación.
+        metodo (str): "xslt", "nativo" (sin XSLT, ver cadena_nativa) o "auto"
+            (nativo, y XSLT si el documento trae un complemento no soportado).
+
+    Retorna:
+        str: Cadena original.
+    """
+    if metodo != "xslt":
+        from . import cadena_nativa
+
+        if metodo not in ("nativo", "auto"):
+            raise ValueError(f"Método de cadena original desconocido: {metodo}")
+        documento = cadena_nativa.cargar_raiz(documento)
+        try:
+            return cadena_nativa.generar_cadena_nativa(documento)
+        except cadena_nativa.ComplementoNoSoportado:
+            if metodo == "nativo":
+                raise
+    if xslt_path is not None:
+        ruta = os.path.abspath(xslt_path)
+        if motor.hojas.get(version) != ruta:
+            version = ruta
+            if version not in motor.hojas:
+                motor.registrar_hoja(version, ruta)
+    return motor.generar(documento, version)
+
+
+def actualizar_paquete(paquete=PAQUETE_SAT, hojas=None, tiempo_espera=30):
+    """
+    Descarga al paquete local todas las hojas que incluyen las hojas principales.
+
+    Se ejecuta una vez en un equipo con acceso a red; el paquete resultante se
+    copia a los nodos de firma sin red.
+    """
+    import urllib.request
+
+    pendientes = list((HOJAS_CADENA if hojas is None else hojas).values())
+    vistos = set()
+    descargadas = []
+    while pendientes:
+        ruta = pendientes.pop()
+        for nodo in etree.parse(ruta).getroot():
+            if nodo.tag not in (f"{{{XSL}}}include", f"{{{XSL}}}import"):
+                continue
+            url = nodo.get("href")
+            destino = ruta_en_paquete(url, paquete)
+            if destino is None or url in vistos:
+                continue
+            vistos.add(url)
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            with urllib.request.urlopen(url, timeout=tiempo_espera) as respuesta:
+                contenido = respuesta.read()
+            with open(destino, "wb") as f:
+                f.write(contenido)
+            descargadas.append(destino)
+            pendientes.append(destino)
+    return descargadas
+
+
+if __name__ == "__main__":
+    if "--actualizar-paquete" in sys.argv:
+        for ruta in actualizar_paquete():
+            print(f"✅ Descargada: {ruta}")
+        exit(0)
+
+    for xml_path in sys.argv[1:] or ["cfdi.xml"]:
+        try:
+            print(generar_cadena_original(xml_path))
+        except Exception as e:
+            print(f"❌ Error al generar la cadena original de {xml_path}: {e}")
+    faltantes = motor.faltantes()
+    if faltantes:
+        print(f"⚠️ {len(faltantes)} complementos sin hoja en el paquete local ({PAQUETE_SAT}).")
@@ -0,0 +1,330 @@
+import os
+import re
+import sys
+from lxml import etree
+
+CFDI = "{http://www.sat.gob.mx/cfd/4}"
+PAGO20 = "{http://www.sat.gob.mx/Pagos20}"
+TFD = "{http://www.sat.gob.mx/TimbreFiscalDigital}"
+
+# Espacios que colapsa normalize-space() en utilerias.xslt (solo los de XML)
+_ESPACIOS = re.compile(r"[ \t\r\n]+")
+
+
+# Tipos de paso de una regla
+_REQUERIDO, _OPCIONAL, _HIJOS, _DESCENDIENTES, _COMPLEMENTO, _ATRIBUTOS = range(6)
+
+
+def R(atributo):
+    return (_REQUERIDO, atributo)
+
+
+def O(atributo):
+    return (_OPCIONAL, atributo)
+
+
+def hijos(ruta, regla):
+    """Procesa con `regla` cada nodo alcanzado por la ruta de hijos (./a/b/c)."""
+    return (_HIJOS, tuple(ruta.split("/")), regla)
+
+
+def descendientes(etiqueta, regla):
+    """Procesa con `regla` cada descendiente con la etiqueta (.//a)."""
+    return (_DESCENDIENTES, etiqueta, regla)
+
+
+def _q(nombre):
+    prefijo, local = nombre.split(":")
+    return {"cfdi": CFDI, "pago20": PAGO20}[prefijo] + local
+
+
+def _compilar(reglas):
+    # Agrupa los atributos consecutivos en un solo paso para recorrer menos tuplas
+    compiladas = {}
+    for nombre, pasos in reglas.items():
+        salida = []
+        for paso in pasos:
+            if paso[0] in (_REQUERIDO, _OPCIONAL):
+                if salida and salida[-1][0] == _ATRIBUTOS:
+                    salida[-1][1].append((paso[1], paso[0] == _REQUERIDO))
+                else:
+                    salida.append((_ATRIBUTOS, [(paso[1], paso[0] == _REQUERIDO)]))
+                continue
+            if paso[0] == _HIJOS:
+                paso = (_HIJOS, tuple(_q(p) for p in paso[1]), paso[2])
+            elif paso[0] == _DESCENDIENTES:
+                paso = (_DESCENDIENTES, _q(paso[1]), paso[2])
+            salida.append(paso)
+        compiladas[nombre] = tuple((p[0], tuple(p[1])) if p[0] == _ATRIBUTOS else p for p in salida)
+    return compiladas
+
+
+# Reglas en el orden de cadenaoriginal_4_0.xslt (Anexo 20) y Pagos20.xslt
+REGLAS = _compilar({
+    "Comprobante": [
+        R("Version"), O("Serie"), O("Folio"), R("Fecha"), O("FormaPago"), R("NoCertificado"),
+        O("CondicionesDePago"), R("SubTotal"), O("Descuento"), R("Moneda"), O("TipoCambio"),
+        R("Total"), R("TipoDeComprobante"), R("Exportacion"), O("MetodoPago"),
+        R("LugarExpedicion"), O("Confirmacion"),
+        hijos("cfdi:InformacionGlobal", "InformacionGlobal"),
+        hijos("cfdi:CfdiRelacionados", "CfdiRelacionados"),
+        hijos("cfdi:Emisor", "Emisor"),
+        hijos("cfdi:Receptor", "Receptor"),
+        hijos("cfdi:Conceptos/cfdi:Concepto", "Concepto"),
+        hijos("cfdi:Impuestos", "Impuestos"),
+        (_COMPLEMENTO, CFDI + "Complemento"),
+    ],
+    "InformacionGlobal": [R("Periodicidad"), R("Meses"), R("Año")],
+    "CfdiRelacionados": [R("TipoRelacion"), hijos("cfdi:CfdiRelacionado", "CfdiRelacionado")],
+    "CfdiRelacionado": [R("UUID")],
+    "Emisor": [R("Rfc"), R("Nombre"), R("RegimenFiscal"), O("FacAtrAdquirente")],
+    "Receptor": [
+        R("Rfc"), R("Nombre"), R("DomicilioFiscalReceptor"), O("ResidenciaFiscal"),
+        O("NumRegIdTrib"), R("RegimenFiscalReceptor"), R("UsoCFDI"),
+    ],
+    "Concepto": [
+        R("ClaveProdServ"), O("NoIdentificacion"), R("Cantidad"), R("ClaveUnidad"), O("Unidad"),
+        R("Descripcion"), R("ValorUnitario"), R("Importe"), O("Descuento"), R("ObjetoImp"),
+        hijos("cfdi:Impuestos/cfdi:Traslados/cfdi:Traslado", "TrasladoConcepto"),
+        hijos("cfdi:Impuestos/cfdi:Retenciones/cfdi:Retencion", "RetencionConcepto"),
+        hijos("cfdi:ACuentaTerceros", "ACuentaTerceros"),
+        hijos("cfdi:InformacionAduanera", "InformacionAduanera"),
+        hijos("cfdi:CuentaPredial", "CuentaPredial"),
+        (_COMPLEMENTO, CFDI + "ComplementoConcepto"),
+        descendientes("cfdi:Parte", "Parte"),
+    ],
+    "TrasladoConcepto": [R("Base"), R("Impuesto"), R("TipoFactor"), O("TasaOCuota"), O("Importe")],
+    "RetencionConcepto": [R("Base"), R("Impuesto"), R("TipoFactor"), R("TasaOCuota"), R("Importe")],
+    "ACuentaTerceros": [
+        R("RfcACuentaTerceros"), R("NombreACuentaTerceros"),
+        R("RegimenFiscalACuentaTerceros"), R("DomicilioFiscalACuentaTerceros"),
+    ],
+    "InformacionAduanera": [R("NumeroPedimento")],
+    "CuentaPredial": [R("Numero")],
+    "Parte": [
+        R("ClaveProdServ"), O("NoIdentificacion"), R("Cantidad"), O("Unidad"), R("Descripcion"),
+        O("ValorUnitario"), O("Importe"),
+        descendientes("cfdi:InformacionAduanera", "InformacionAduanera"),
+    ],
+    "Impuestos": [
+        hijos("cfdi:Retenciones/cfdi:Retencion", "Retencion"),
+        O("TotalImpuestosRetenidos"),
+        hijos("cfdi:Traslados/cfdi:Traslado", "Traslado"),
+        O("TotalImpuestosTrasladados"),
+    ],
+    "Retencion": [R("Impuesto"), R("Importe")],
+    "Traslado": [R("Base"), R("Impuesto"), R("TipoFactor"), O("TasaOCuota"), O("Importe")],
+
+    # Complemento para recepción de pagos 2.0
+    "pago20:Pagos": [
+        R("Version"), hijos("pago20:Totales", "pago20:Totales"), hijos("pago20:Pago", "pago20:Pago"),
+    ],
+    "pago20:Totales": [
+        O("TotalRetencionesIVA"), O("TotalRetencionesISR"), O("TotalRetencionesIEPS"),
+        O("TotalTrasladosBaseIVA16"), O("TotalTrasladosImpuestoIVA16"),
+        O("TotalTrasladosBaseIVA8"), O("TotalTrasladosImpuestoIVA8"),
+        O("TotalTrasladosBaseIVA0"), O("TotalTrasladosImpuestoIVA0"),
+        O("TotalTrasladosBaseIVAExento"), R("MontoTotalPagos"),
+    ],
+    "pago20:Pago": [
+        R("FechaPago"), R("FormaDePagoP"), R("MonedaP"), O("TipoCambioP"), R("Monto"),
+        O("NumOperacion"), O("RfcEmisorCtaOrd"), O("NomBancoOrdExt"), O("CtaOrdenante"),
+        O("RfcEmisorCtaBen"), O("CtaBeneficiario"), O("TipoCadPago"), O("CertPago"),
+        O("CadPago"), O("SelloPago"),
+        hijos("pago20:DoctoRelacionado", "pago20:DoctoRelacionado"),
+        hijos("pago20:ImpuestosP", "pago20:ImpuestosP"),
+    ],
+    "pago20:DoctoRelacionado": [
+        R("IdDocumento"), O("Serie"), O("Folio"), R("MonedaDR"), O("EquivalenciaDR"),
+        R("NumParcialidad"), R("ImpSaldoAnt"), R("ImpPagado"), R("ImpSaldoInsoluto"),
+        R("ObjetoImpDR"),
+        hijos("pago20:ImpuestosDR/pago20:RetencionesDR/pago20:RetencionDR", "pago20:RetencionDR"),
+        hijos("pago20:ImpuestosDR/pago20:TrasladosDR/pago20:TrasladoDR", "pago20:TrasladoDR"),
+    ],
+    "pago20:RetencionDR": [R("BaseDR"), R("ImpuestoDR"), R("TipoFactorDR"), R("TasaOCuotaDR"), R("ImporteDR")],
+    "pago20:TrasladoDR": [R("BaseDR"), R("ImpuestoDR"), R("TipoFactorDR"), O("TasaOCuotaDR"), O("ImporteDR")],
+    "pago20:ImpuestosP": [
+        hijos("pago20:RetencionesP/pago20:RetencionP", "pago20:RetencionP"),
+        hijos("pago20:TrasladosP/pago20:TrasladoP", "pago20:TrasladoP"),
+    ],
+    "pago20:RetencionP": [R("ImpuestoP"), R("ImporteP")],
+    "pago20:TrasladoP": [R("BaseP"), R("ImpuestoP"), R("TipoFactorP"), O("TasaOCuotaP"), O("ImporteP")],
+})
+
+_ETIQUETAS_DESCENDIENTES = frozenset(
+    paso[1] for pasos in REGLAS.values() for paso in pasos if paso[0] == _DESCENDIENTES)
+
+# Regla de entrada por etiqueta de complemento soportado
+COMPLEMENTOS = {
+    PAGO20 + "Pagos": "pago20:Pagos",
+}
+
+
+class ComplementoNoSoportado(Exception):
+    """El documento trae un complemento que el generador nativo no conoce."""
+
+
+def maneja_espacios(valor):
+    """Equivalente a normalize-space() de la plantilla ManejaEspacios del SAT."""
+    if " " in valor or "\t" in valor or "\n" in valor or "\r" in valor:
+        return _ESPACIOS.sub(" ", valor).strip(" ")
+    return valor
+
+
+def _requiere_normalizar(cuerpo):
+    # Si la cadena unida no tiene espacios dobles, tabuladores, saltos de línea
+    # ni espacios junto a un separador, ningún valor cambia con normalize-space()
+    return ("  " in cuerpo or " |" in cuerpo or "| " in cuerpo or "\n" in cuerpo
+            or "\t" in cuerpo or "\r" in cuerpo or cuerpo.startswith(" ") or cuerpo.endswith(" "))
+
+
+def _hijos_por_etiqueta(nodo):
+    # Un solo recorrido de los hijos; filtrar con iterchildren(tag) por cada
+    # paso de la regla cuesta varias veces más en documentos con miles de nodos
+    grupos = {}
+    for hijo in nodo:
+        etiqueta = hijo.tag
+        if etiqueta in grupos:
+            grupos[etiqueta].append(hijo)
+        else:
+            grupos[etiqueta] = [hijo]
+    return grupos
+
+
+def _recorrer(grupos, ruta):
+    nodos = grupos.get(ruta[0], ())
+    for etiqueta in ruta[1:]:
+        nodos = [hijo for padre in nodos for hijo in padre if hijo.tag == etiqueta]
+    return nodos
+
+
+def _aplicar(nodo, regla, valores, omitir):
+    grupos = None
+    for paso in REGLAS[regla]:
+        tipo = paso[0]
+        if tipo == _ATRIBUTOS:
+            atributos = dict(nodo.items())
+            for atributo, requerido in paso[1]:
+                valor = atributos.get(atributo)
+                if valor is not None:
+                    valores.append(valor)
+                elif requerido:
+                    valores.append("")
+            continue
+        if tipo == _DESCENDIENTES:
+            if paso[1] not in omitir:
+                for hijo in nodo.iterdescendants(paso[1]):
+                    _aplicar(hijo, paso[2], valores, omitir)
+            continue
+        if grupos is None:
+            grupos = _hijos_por_etiqueta(nodo)
+        if tipo == _HIJOS:
+            for hijo in _recorrer(grupos, paso[1]):
+                _aplicar(hijo, paso[2], valores, omitir)
+            continue
+        for contenedor in grupos.get(paso[1], ()):
+            for hijo in contenedor.iterchildren(tag=etree.Element):
+                regla_complemento = COMPLEMENTOS.get(hijo.tag)
+                if regla_complemento is not None:
+                    _aplicar(hijo, regla_complemento, valores, omitir)
+                elif hijo.tag.startswith(TFD):
+                    # Sin plantilla en la XSLT: la regla por omisión solo copia texto
+                    texto = "".join(hijo.itertext())
+                    if texto and valores:
+                        valores[-1] += texto
+                    elif texto:
+                        valores.append(texto)
+                else:
+                    raise ComplementoNoSoportado(f"Complemento no soportado: {hijo.tag}")
+
+
+def cargar_raiz(documento):
+    """Devuelve el elemento raíz de una ruta, bytes, árbol o elemento de lxml."""
+    if isinstance(documento, (bytes, bytearray)):
+        return etree.fromstring(bytes(documento))
+    if isinstance(documento, (str, os.PathLike)):
+        return etree.parse(os.fspath(documento)).getroot()
+    if isinstance(documento, etree._ElementTree):
+        return documento.getroot()
+    return documento
+
+
+def generar_cadena_nativa(documento):
+    """
+    Genera la cadena original sin XSLT, en un solo recorrido del árbol.
+
+    Parámetros:
+        documento: Ruta del XML, bytes del XML, o un árbol/elemento de lxml.
+
+    Retorna:
+        str: Cadena original, idéntica a la de cadenaoriginal_4_0.xslt.
+    """
+    raiz = cargar_raiz(documento)
+    if raiz.tag != CFDI + "Comprobante":
+        raise ValueError(f"La raíz no es cfdi:Comprobante: {raiz.tag}")
+    # Los pasos .//nodo recorren todo el subárbol; se omiten si el documento no los tiene
+    omitir = {etiqueta for etiqueta in _ETIQUETAS_DESCENDIENTES
+              if next(raiz.iter(etiqueta), None) is None}
+    valores = []
+    _aplicar(raiz, "Comprobante", valores, omitir)
+    cuerpo = "|".join(valores)
+    if _requiere_normalizar(cuerpo):
+        cuerpo = "|".join(maneja_espacios(valor) for valor in valores)
+    return "||" + cuerpo + "||"
+
+
+def comparar_con_xslt(documentos):
+    """
+    Modo diferencial: genera la cadena por ambos caminos y reporta diferencias.
+
+    Parámetros:
+        documentos: Iterable de rutas o bytes de XML.
+
+    Retorna:
+        list: Una tupla (documento, posición, detalle) por cada discrepancia o error.
+    """
+    from . import cadena
+
+    discrepancias = []
+    for documento in documentos:
+        nombre = documento if isinstance(documento, str) else f"<{len(documento)} bytes>"
+        try:
+            raiz = cargar_raiz(documento)
+            esperada = cadena.generar_cadena_original(raiz).encode("utf-8")
+            obtenida = generar_cadena_nativa(raiz).encode("utf-8")
+        except Exception as e:
+            discrepancias.append((nombre, None, f"{type(e).__name__}: {e}"))
+            continue
+        if esperada != obtenida:
+            posicion = next((i for i, (a, b) in enumerate(zip(esperada, obtenida)) if a != b),
+                            min(len(esperada), len(obtenida)))
+            detalle = (f"xslt={esperada[posicion:posicion + 40]!r} "
+                       f"nativa={obtenida[posicion:posicion + 40]!r}")
+            discrepancias.append((nombre, posicion, detalle))
+    return discrepancias
+
+
+def _rutas_corpus(argumentos):
+    for argumento in argumentos:
+        if os.path.isdir(argumento):
+            for raiz, _, nombres in os.walk(argumento):
+                for nombre in sorted(nombres):
+                    if nombre.endswith(".xml"):
+                        yield os.path.join(raiz, nombre)
+        else:
+            yield argumento
+
+
+if __name__ == "__main__":
+    # Uso: python -m cfdi.cadena_nativa --diferencial <archivos o directorios>
+    argumentos = [a for a in sys.argv[1:] if a != "--diferencial"]
+    if "--diferencial" in sys.argv:
+        rutas = list(_rutas_corpus(argumentos or ["."]))
+        discrepancias = comparar_con_xslt(rutas)
+        for nombre, posicion, detalle in discrepancias:
+            print(f"❌ {nombre} (byte {posicion}): {detalle}")
+        print(f"{len(rutas) - len(discrepancias)}/{len(rutas)} documentos idénticos entre XSLT y nativa.")
+        exit(1 if discrepancias else 0)
+
+    for xml_path in argumentos or ["cfdi.xml"]:
+        print(generar_cadena_nativa(xml_path))
@@ -0,0 +1,350 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import csv
+import json
+import sqlite3
+import time
+
+from .cliente_pac import ErrorPAC, es_reintentable
+
+CANCELAR = "cancelar"
+CONSULTAR = "consultar"
+OPERACIONES = (CANCELAR, CONSULTAR)
+
+# c_MotivoCancelacion
+MOTIVOS = {
+    "01": "Comprobante emitido con errores con relación",
+    "02": "Comprobante emitido con errores sin relación",
+    "03": "No se llevó a cabo la operación",
+    "04": "Operación nominativa relacionada en una factura global",
+}
+
+# Estatus de la solicitud ante el SAT que dan la cancelación por terminada
+# (201: solicitud aceptada; 202: el CFDI ya estaba cancelado)
+CANCELACION_ACEPTADA = frozenset({"201", "202"})
+
+# Estados de cada UUID en el lote: pendiente -> terminado | fallido
+PENDIENTE = "pendiente"
+TERMINADO = "terminado"
+FALLIDO = "fallido"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS solicitudes (
+    operacion TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    rfc_emisor TEXT NOT NULL,
+    motivo TEXT,
+    folio_sustitucion TEXT,
+    rfc_receptor TEXT,
+    total TEXT,
+    estado TEXT NOT NULL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    resultado TEXT,
+    error TEXT,
+    actualizado REAL NOT NULL,
+    PRIMARY KEY (operacion, uuid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS solicitudes_estado ON solicitudes (operacion, estado, uuid);
+"""
+
+# Una solicitud del lote; motivo y folio_sustitucion aplican a la cancelación,
+# rfc_receptor y total a la consulta de estado
+Solicitud = collections.namedtuple("Solicitud", "uuid rfc_emisor motivo folio_sustitucion rfc_receptor total",
+                                   defaults=(None, None, None, None))
+
+# Estado final de un UUID; `resultado` es la respuesta normalizada del PAC
+ResultadoSolicitud = collections.namedtuple("ResultadoSolicitud", "uuid estado intentos resultado error")
+
+
+def validar_solicitud(operacion, solicitud):
+    """Revisa una solicitud antes de encolarla; lanza ValueError si no puede enviarse."""
+    if operacion not in OPERACIONES:
+        raise ValueError(f"Operación desconocida: {operacion}")
+    if not solicitud.uuid or not solicitud.rfc_emisor:
+        raise ValueError("Cada solicitud requiere uuid y rfc_emisor")
+    if operacion == CANCELAR:
+        if solicitud.motivo not in MOTIVOS:
+            raise ValueError(f"{solicitud.uuid}: motivo {solicitud.motivo!r} fuera de c_MotivoCancelacion")
+        if solicitud.motivo == "01" and not solicitud.folio_sustitucion:
+            raise ValueError(f"{solicitud.uuid}: el motivo 01 requiere el UUID que lo sustituye")
+        if solicitud.motivo != "01" and solicitud.folio_sustitucion:
+            raise ValueError(f"{solicitud.uuid}: el folio de sustitución solo aplica con el motivo 01")
+    elif not solicitud.rfc_receptor or solicitud.total in (None, ""):
+        raise ValueError(f"{solicitud.uuid}: la consulta de estado requiere rfc_receptor y total")
+
+
+class LoteCancelacion:
+    """
+    Cancelaciones y consultas de estado en lote, con avance guardado en SQLite.
+
+    Las solicitudes se registran una vez por (operación, UUID); ejecutar()
+    las reparte entre N corrutinas sobre un solo cliente del PAC (conexiones
+    keep-alive y el límite de tasa del cliente, ver ProveedorPAC) y guarda
+    los resultados por grupos, cada `guardar_cada` respuestas o
+    `intervalo_guardado` segundos. Si el proceso se interrumpe, volver a
+    ejecutar continúa con los pendientes; lo que no alcanzó a guardarse se
+    reenvía, lo cual es seguro porque consultar es idempotente y el SAT
+    responde 202 (previamente cancelado) a una cancelación repetida.
+
+    Los errores de comunicación, 429 y 5xx (ya reintentados por el cliente)
+    dejan el UUID pendiente para la siguiente ronda, hasta `max_intentos`;
+    los rechazos del SAT lo marcan como fallido.
+
+    Uso:
+        with LoteCancelacion("cancelaciones.db") as lote:
+            lote.agregar(CANCELAR, solicitudes)
+            async with ClienteSW(usuario, password, solicitudes_por_segundo=10) as cliente:
+                await lote.ejecutar(cliente, CANCELAR, credenciales=gestor_csd)
+    """
+
+    def __init__(self, ruta="cancelaciones.db", max_intentos=3, guardar_cada=200, intervalo_guardado=1.0,
+                 espera_ronda=5.0):
+        self.ruta = ruta
+        self.max_intentos = max_intentos
+        self.guardar_cada = guardar_cada
+        self.intervalo_guardado = intervalo_guardado
+        self.espera_ronda = espera_ronda
+        # Las transacciones se abren explícitamente (BEGIN IMMEDIATE)
+        self.conexion = sqlite3.connect(ruta, timeout=30, isolation_level=None)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.executescript(_ESQUEMA)
+        self._por_guardar = []
+        self._guardado = time.monotonic()
+        self.procesadas = 0
+        self.segundos = 0.0
+
+    def cerrar(self):
+        self._guardar()
+        self.conexion.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+    @contextlib.contextmanager
+    def _transaccion(self):
+        self.conexion.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conexion
+        except BaseException:
+            self.conexion.execute("ROLLBACK")
+            raise
+        self.conexion.execute("COMMIT")
+
+    @property
+    def por_segundo(self):
+        """Solicitudes atendidas por segundo en la última ejecución."""
+        return self.procesadas / self.segundos if self.segundos else 0.0
+
+    def agregar(self, operacion, solicitudes):
+        """
+        Registra solicitudes; las que ya estaban en el lote se conservan con su estado.
+
+        Parámetros:
+            operacion (str): CANCELAR o CONSULTAR.
+            solicitudes: Iterable de Solicitud (o dicts con sus campos).
+
+        Retorna:
+            int: Solicitudes nuevas.
+        """
+        ahora = time.time()
+        filas = []
+        for solicitud in solicitudes:
+            if isinstance(solicitud, dict):
+                solicitud = Solicitud(**{campo: solicitud.get(campo) or None for campo in Solicitud._fields})
+            validar_solicitud(operacion, solicitud)
+            filas.append((operacion, solicitud.uuid.upper(), solicitud.rfc_emisor, solicitud.motivo,
+                          solicitud.folio_sustitucion, solicitud.rfc_receptor,
+                          None if solicitud.total is None else str(solicitud.total), PENDIENTE, ahora))
+        with self._transaccion() as conexion:
+            antes = conexion.total_changes
+            conexion.executemany(
+                "INSERT OR IGNORE INTO solicitudes (operacion, uuid, rfc_emisor, motivo, folio_sustitucion, "
+                "rfc_receptor, total, estado, actualizado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", filas)
+            return conexion.total_changes - antes
+
+    def _pagina(self, operacion, despues, tamano=1000):
+        return self.conexion.execute(
+            "SELECT uuid, rfc_emisor, motivo, folio_sustitucion, rfc_receptor, total, intentos FROM solicitudes "
+            "WHERE operacion = ? AND estado = ? AND uuid > ? ORDER BY uuid LIMIT ?",
+            (operacion, PENDIENTE, despues, tamano)).fetchall()
+
+    def _anotar(self, operacion, uuid, estado, intentos, resultado, error):
+        self._por_guardar.append((estado, intentos, resultado, error, time.time(), operacion, uuid))
+        if (len(self._por_guardar) >= self.guardar_cada
+                or time.monotonic() - self._guardado >= self.intervalo_guardado):
+            self._guardar()
+
+    def _guardar(self):
+        """Punto de control: escribe en una transacción los resultados acumulados."""
+        if self._por_guardar:
+            with self._transaccion() as conexion:
+                conexion.executemany(
+                    "UPDATE solicitudes SET estado = ?, intentos = ?, resultado = ?, error = ?, actualizado = ? "
+                    "WHERE operacion = ? AND uuid = ?", self._por_guardar)
+            self._por_guardar = []
+        self._guardado = time.monotonic()
+
+    async def _atender(self, cliente, operacion, fila, credenciales):
+        uuid, rfc_emisor, motivo, folio_sustitucion, rfc_receptor, total, intentos = fila
+        intentos += 1
+        try:
+            if operacion == CANCELAR:
+                respuesta = await cliente.cancelar(uuid, rfc_emisor, motivo, folio_sustitucion,
+                                                   credenciales(rfc_emisor) if credenciales else None)
+                if respuesta.get("codigo") in CANCELACION_ACEPTADA:
+                    estado, error = TERMINADO, None
+                else:
+                    estado, error = FALLIDO, f"Cancelación rechazada: {respuesta.get('codigo')}"
+            else:
+                respuesta = await cliente.consultar_estado(uuid, rfc_emisor, rfc_receptor, total)
+                estado, error = TERMINADO, None
+            resultado = json.dumps(respuesta, ensure_ascii=False)
+        except ErrorPAC as e:
+            transitorio = es_reintentable(e)
+            estado = PENDIENTE if transitorio and intentos < self.max_intentos else FALLIDO
+            resultado, error = None, f"{e} {e.cuerpo or ''}".strip()
+        except Exception as e:
+            # Falta el CSD del emisor u otro error local: reintentar no lo resuelve
+            estado, resultado, error = FALLIDO, None, f"{type(e).__name__}: {e}"
+        self._anotar(operacion, uuid, estado, intentos, resultado, error)
+        self.procesadas += 1
+
+    async def _ronda(self, cliente, operacion, trabajadores, credenciales):
+        cola = asyncio.Queue(maxsize=trabajadores * 4)
+
+        async def trabajador():
+            while True:
+                fila = await cola.get()
+                if fila is None:
+                    return
+                await self._atender(cliente, operacion, fila, credenciales)
+
+        tareas = [asyncio.create_task(trabajador()) for _ in range(trabajadores)]
+        try:
+            # Paginación por UUID: los resultados aún sin guardar no se vuelven a leer
+            despues = ""
+            while True:
+                filas = self._pagina(operacion, despues)
+                if not filas:
+                    break
+                for fila in filas:
+                    await cola.put(fila)
+                despues = filas[-1][0]
+            for _ in tareas:
+                await cola.put(None)
+            await asyncio.gather(*tareas)
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+            self._guardar()
+
+    async def ejecutar(self, cliente, operacion, trabajadores=None, credenciales=None):
+        """
+        Atiende los pendientes de una operación hasta terminarlos o agotar los intentos.
+
+        Parámetros:
+            cliente (ProveedorPAC): Cliente del PAC, con su límite de tasa.
+            trabajadores (int): Corrutinas concurrentes; por omisión, las del cliente.
+            credenciales: Para cancelar, función RFC -> (certificado_b64, key_b64,
+                password), o un GestorCSD (se usa el CSD vigente de cada emisor).
+
+        Retorna:
+            dict: Número de solicitudes por estado al terminar.
+        """
+        if hasattr(credenciales, "seleccionar"):
+            gestor = credenciales
+
+            def credenciales(rfc):
+                return gestor.seleccionar(rfc).credenciales()
+
+        trabajadores = trabajadores or cliente.max_concurrencia
+        self.procesadas = 0
+        inicio = time.perf_counter()
+        try:
+            for ronda in range(self.max_intentos):
+                if ronda:
+                    await asyncio.sleep(self.espera_ronda)
+                await self._ronda(cliente, operacion, trabajadores, credenciales)
+                if not self.resumen(operacion).get(PENDIENTE):
+                    break
+        finally:
+            self.segundos = time.perf_counter() - inicio
+        return self.resumen(operacion)
+
+    def resumen(self, operacion):
+        """Número de solicitudes por estado."""
+        return dict(self.conexion.execute(
+            "SELECT estado, COUNT(*) FROM solicitudes WHERE operacion = ? GROUP BY estado", (operacion,)))
+
+    def resultados(self, operacion, estado=None):
+        """Generador de ResultadoSolicitud, en orden de UUID."""
+        consulta = "SELECT uuid, estado, intentos, resultado, error FROM solicitudes WHERE operacion = ?"
+        parametros = [operacion]
+        if estado is not None:
+            consulta += " AND estado = ?"
+            parametros.append(estado)
+        for uuid, estado_fila, intentos, resultado, error in self.conexion.execute(consulta + " ORDER BY uuid",
+                                                                                  parametros):
+            yield ResultadoSolicitud(uuid, estado_fila, intentos, json.loads(resultado) if resultado else None,
+                                     error)
+
+
+def leer_solicitudes(ruta):
+    """Solicitudes de un CSV con encabezados uuid, rfc_emisor, motivo, folio_sustitucion, rfc_receptor, total."""
+    with open(ruta, newline="", encoding="utf-8") as f:
+        for fila in csv.DictReader(f):
+            yield Solicitud(**{campo: (fila.get(campo) or "").strip() or None for campo in Solicitud._fields})
+
+
+if __name__ == "__main__":
+    from .cliente_pac import ClienteSW, URL_SW_PRUEBAS
+    from .csd import GestorCSD
+
+    parser = argparse.ArgumentParser(description="Cancelación y consulta de estado de CFDI en lote.")
+    parser.add_argument("operacion", choices=OPERACIONES + ("resumen",))
+    parser.add_argument("solicitudes", nargs="?", help="CSV con las solicitudes (se omite para continuar)")
+    parser.add_argument("--lote", default="cancelaciones.db", help="Base de datos con el avance del lote")
+    parser.add_argument("--usuario", default="usuario@pruebas.com", help="Usuario del PAC")
+    parser.add_argument("--password-pac", default="contraseña1234", help="Contraseña del PAC")
+    parser.add_argument("--url", default=URL_SW_PRUEBAS, help="URL base del PAC")
+    parser.add_argument("--por-segundo", type=float, default=10.0,
+                        help="Solicitudes por segundo permitidas por el PAC")
+    parser.add_argument("--concurrencia", type=int, default=16, help="Solicitudes simultáneas")
+    parser.add_argument("--cer", default="mi_certificado.cer", help="Certificado del CSD para cancelar")
+    parser.add_argument("--key", default="mi_llave.key", help="Llave privada del CSD para cancelar")
+    parser.add_argument("--password", default="12345678a", help="Contraseña de la llave privada")
+    parser.add_argument("--csd", default=None, help="Directorio con los CSD de varios emisores (ver cfdi.csd)")
+    args = parser.parse_args()
+
+    async def principal(lote):
+        gestor = None
+        if args.operacion == CANCELAR:
+            gestor = GestorCSD()
+            if args.csd:
+                gestor.cargar_directorio(args.csd, password=args.password)
+            else:
+                gestor.agregar(args.cer, args.key, args.password)
+        async with ClienteSW(args.usuario, args.password_pac, url_base=args.url,
+                             max_concurrencia=args.concurrencia,
+                             solicitudes_por_segundo=args.por_segundo) as cliente:
+            return await lote.ejecutar(cliente, args.operacion, credenciales=gestor)
+
+    with LoteCancelacion(args.lote) as lote:
+        if args.operacion == "resumen":
+            for operacion in OPERACIONES:
+                print(f"{operacion}: {lote.resumen(operacion)}")
+            exit(0)
+        if args.solicitudes:
+            nuevas = lote.agregar(args.operacion, leer_solicitudes(args.solicitudes))
+            print(f"✅ {nuevas} solicitudes nuevas en {args.lote}")
+        resumen = asyncio.run(principal(lote))
+        for resultado in lote.resultados(args.operacion, FALLIDO):
+            print(f"❌ {resultado.uuid}: {resultado.error}")
+        print(f"✅ {resumen.get(TERMINADO, 0)} terminadas, {resumen.get(FALLIDO, 0)} fallidas, "
+              f"{resumen.get(PENDIENTE, 0)} pendientes ({lote.procesadas} solicitudes en {lote.segundos:.1f} s, "
+              f"{lote.por_segundo:.1f}/s)")
@@ -0,0 +1,515 @@
+import argparse
+import collections
+import csv
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+# Catálogos del SAT que se importan y el ancho de su clave: las hojas de
+# cálculo guardan las claves numéricas como números (1010101.0 en lugar de
+# "01010101"), así que se rellenan con ceros a la izquierda.
+ANCHOS = {
+    "c_ClaveProdServ": 8,
+    "c_ClaveUnidad": None,
+    "c_RegimenFiscal": 3,
+    "c_UsoCFDI": None,
+    "c_CodigoPostal": 5,
+    "c_FormaPago": 2,
+    "c_MetodoPago": None,
+    "c_Moneda": None,
+    "c_TipoDeComprobante": None,
+    "c_Exportacion": 2,
+    "c_ObjetoImp": 2,
+    "c_Impuesto": 3,
+    "c_TipoFactor": None,
+    "c_Pais": None,
+    "c_TipoRelacion": 2,
+}
+
+# Pseudocatálogo de las relaciones por tipo de persona (columnas Física/Moral)
+PERSONA = "persona"
+FISICA = "Fisica"
+MORAL = "Moral"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS claves (
+    catalogo TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    descripcion TEXT NOT NULL,
+    inicio TEXT,
+    fin TEXT,
+    datos TEXT,
+    PRIMARY KEY (catalogo, clave)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS relaciones (
+    catalogo TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    relacionado TEXT NOT NULL,
+    clave_relacionada TEXT NOT NULL,
+    PRIMARY KEY (catalogo, clave, relacionado, clave_relacionada)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS importaciones (
+    catalogo TEXT PRIMARY KEY,
+    origen TEXT NOT NULL,
+    registros INTEGER NOT NULL,
+    fecha TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS textos USING fts5(
+    catalogo UNINDEXED, clave UNINDEXED, texto,
+    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+"""
+
+Clave = collections.namedtuple("Clave", "catalogo clave descripcion inicio fin datos")
+
+# Excel cuenta los días desde el 30 de diciembre de 1899
+_EPOCA_EXCEL = datetime.date(1899, 12, 30)
+_PARTE = re.compile(r"_Parte_\d+$", re.IGNORECASE)
+
+
+def _normalizar(texto):
+    """Encabezado sin acentos, espacios ni mayúsculas ("Descripción" -> "descripcion")."""
+    texto = unicodedata.normalize("NFKD", str(texto or "")).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]", "", texto.lower())
+
+
+def _texto_clave(valor, ancho):
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    texto = str(valor).strip()
+    if ancho and texto.isdigit():
+        texto = texto.zfill(ancho)
+    return texto
+
+
+def _fecha(valor):
+    """Fecha de la hoja de cálculo (date, serial de Excel o texto) como AAAA-MM-DD; None si está vacía."""
+    if valor in (None, ""):
+        return None
+    if isinstance(valor, datetime.datetime):
+        return valor.date().isoformat()
+    if isinstance(valor, datetime.date):
+        return valor.isoformat()
+    if isinstance(valor, (int, float)):
+        return (_EPOCA_EXCEL + datetime.timedelta(days=int(valor))).isoformat()
+    texto = str(valor).strip()
+    for formato in ("%d/%m/%Y", "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%d-%m-%Y"):
+        try:
+            return datetime.datetime.strptime(texto, formato).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"Fecha no reconocida en el catálogo: {texto!r}")
+
+
+def _es_si(valor):
+    return _normalizar(valor) in ("si", "s", "x", "1")
+
+
+# Papel de cada columna de una hoja, según su encabezado normalizado
+_INICIO, _FIN, _REGIMENES, _FISICA, _MORAL, _NOMBRE, _DESCRIPCION, _SIMILARES, _DATO = range(9)
+
+
+def _columnas(encabezados):
+    """Índice, papel y encabezado de cada columna después de la clave."""
+    columnas = []
+    for indice, encabezado in enumerate(encabezados[1:], 1):
+        encabezado = str(encabezado or "").strip()
+        normal = _normalizar(encabezado)
+        if "inicio" in normal and "vigencia" in normal:
+            papel = _INICIO
+        elif "fin" in normal and "vigencia" in normal:
+            papel = _FIN
+        elif normal.startswith("regimenfiscalreceptor"):
+            papel = _REGIMENES
+        elif normal.endswith("fisica"):
+            papel = _FISICA
+        elif normal.endswith("moral"):
+            papel = _MORAL
+        elif normal == "nombre":
+            papel = _NOMBRE
+        elif normal == "descripcion":
+            papel = _DESCRIPCION
+        elif normal == "palabrassimilares":
+            papel = _SIMILARES
+        else:
+            papel = _DATO
+        columnas.append((indice, papel, encabezado))
+    return columnas
+
+
+def _agregar_fila(catalogo, columnas, fila, claves, relaciones, textos):
+    """Convierte una fila de la hoja en sus registros de claves, relaciones y textos."""
+    clave = _texto_clave(fila[0], ANCHOS.get(catalogo))
+    nombre = descripcion = inicio = fin = None
+    palabras, datos = [], {}
+    for indice, papel, encabezado in columnas:
+        valor = fila[indice] if indice < len(fila) else None
+        if valor in (None, ""):
+            continue
+        if papel == _INICIO:
+            inicio = _fecha(valor)
+        elif papel == _FIN:
+            fin = _fecha(valor)
+        elif papel == _REGIMENES:
+            for regimen in re.split(r"[,\s]+", _texto_clave(valor, None)):
+                if regimen:
+                    relaciones.append((catalogo, clave, "c_RegimenFiscal", _texto_clave(regimen, 3)))
+        elif papel in (_FISICA, _MORAL):
+            if _es_si(valor):
+                relaciones.append((catalogo, clave, PERSONA, FISICA if papel == _FISICA else MORAL))
+        elif papel == _NOMBRE:
+            # c_ClaveUnidad trae un Nombre corto y una Descripción larga
+            nombre = str(valor).strip()
+            palabras.append(nombre)
+        elif papel == _DESCRIPCION:
+            descripcion = str(valor).strip()
+            palabras.append(descripcion)
+        else:
+            if papel == _SIMILARES:
+                palabras.append(str(valor))
+            datos[encabezado] = valor if isinstance(valor, (int, float, str)) else str(valor)
+    claves.append((catalogo, clave, nombre or descripcion or "", inicio, fin,
+                   json.dumps(datos, ensure_ascii=False) if datos else None))
+    if palabras:
+        textos.append((catalogo, clave, " ".join(palabras)))
+
+
+class Catalogos:
+    """
+    Catálogos del SAT importados a una base SQLite con índices.
+
+    Las hojas de cálculo del SAT (catCFDI.xls) se importan una sola vez; cada
+    búsqueda por clave es una consulta por llave primaria, sin cargar el
+    catálogo en objetos de Python, y las claves consultadas se recuerdan en
+    un LRU por proceso. Incluye la vigencia de cada clave, las relaciones
+    entre catálogos (UsoCFDI permitidos por RegimenFiscalReceptor, régimen
+    por tipo de persona) y búsqueda de texto por prefijo para autocompletar
+    descripciones.
+
+    Uso:
+        with Catalogos("catalogos.db") as catalogos:
+            catalogos.importar("catCFDI_V_4.xls")
+            "01010101" in catalogos["c_ClaveProdServ"]
+            errores = validacion.validar(xml, catalogos=catalogos)
+    """
+
+    def __init__(self, ruta="catalogos.db", capacidad=8192):
+        self.ruta = ruta
+        self.capacidad = capacidad
+        self.conexion = sqlite3.connect(ruta, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.executescript(_ESQUEMA)
+        self._candado = threading.Lock()
+        self._memoria = collections.OrderedDict()
+        self._restringidos = {}
+        self._importados = None
+
+    def cerrar(self):
+        self.conexion.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+    # -- Importación --------------------------------------------------------
+
+    def importar(self, ruta, catalogos=None):
+        """
+        Importa las hojas de un archivo del SAT (.xls, .xlsx) o un CSV.
+
+        En las hojas de cálculo, cada hoja cuyo nombre es un catálogo (por
+        ejemplo c_CodigoPostal_Parte_1) se importa a partir de la fila de
+        encabezados que empieza con el nombre del catálogo. Un CSV se importa
+        como el catálogo de su primer encabezado.
+
+        Parámetros:
+            ruta (str): Archivo a importar.
+            catalogos (iterable): Solo estos catálogos; por omisión, todos los de ANCHOS.
+
+        Retorna:
+            dict: Registros importados por catálogo.
+        """
+        permitidos = set(catalogos or ANCHOS)
+        extension = os.path.splitext(ruta)[1].lower()
+        if extension == ".csv":
+            with open(ruta, newline="", encoding="utf-8-sig") as f:
+                hojas = [(None, csv.reader(f))]
+                return self._importar_hojas(ruta, hojas, permitidos)
+        if extension == ".xls":
+            import xlrd  # opcional: solo para importar el .xls del SAT
+
+            libro = xlrd.open_workbook(ruta, on_demand=True)
+            try:
+                hojas = ((hoja.name, (hoja.row_values(i) for i in range(hoja.nrows))) for hoja in libro.sheets())
+                return self._importar_hojas(ruta, hojas, permitidos)
+            finally:
+                libro.release_resources()
+        if extension in (".xlsx", ".xlsm"):
+            import openpyxl  # opcional: solo para importar hojas .xlsx
+
+            libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+            try:
+                hojas = ((hoja.title, hoja.iter_rows(values_only=True)) for hoja in libro.worksheets)
+                return self._importar_hojas(ruta, hojas, permitidos)
+            finally:
+                libro.close()
+        raise ValueError(f"Formato de catálogo no soportado: {ruta}")
+
+    def _importar_hojas(self, origen, hojas, permitidos, lote=5000):
+        importados = collections.Counter()
+        reemplazados = set()
+        self.conexion.execute("BEGIN IMMEDIATE")
+        try:
+            for nombre_hoja, filas in hojas:
+                catalogo = _PARTE.sub("", nombre_hoja) if nombre_hoja else None
+                if catalogo is not None and catalogo not in permitidos:
+                    continue
+                columnas = None
+                pendientes = ([], [], [])
+                for fila in filas:
+                    if columnas is None:
+                        # Las primeras filas de cada hoja son el título y la versión del catálogo
+                        primera = str(fila[0]).strip() if fila and fila[0] is not None else ""
+                        if (catalogo is None and primera in permitidos) or primera == catalogo:
+                            catalogo = primera
+                            columnas = _columnas(fila)
+                            if catalogo not in reemplazados:
+                                self._borrar(catalogo)
+                                reemplazados.add(catalogo)
+                        continue
+                    if not fila or fila[0] in (None, ""):
+                        continue
+                    _agregar_fila(catalogo, columnas, fila, *pendientes)
+                    importados[catalogo] += 1
+                    if len(pendientes[0]) >= lote:
+                        self._insertar(*pendientes)
+                        pendientes = ([], [], [])
+                self._insertar(*pendientes)
+            ahora = datetime.datetime.now().isoformat(timespec="seconds")
+            self.conexion.executemany(
+                "INSERT OR REPLACE INTO importaciones (catalogo, origen, registros, fecha) VALUES (?, ?, ?, ?)",
+                [(c, os.path.basename(origen), n, ahora) for c, n in importados.items()])
+            self.conexion.execute("COMMIT")
+        except BaseException:
+            self.conexion.execute("ROLLBACK")
+            raise
+        with self._candado:
+            self._memoria.clear()
+            self._restringidos.clear()
+            self._importados = None
+        return dict(importados)
+
+    def _borrar(self, catalogo):
+        self.conexion.execute("DELETE FROM claves WHERE catalogo = ?", (catalogo,))
+        self.conexion.execute("DELETE FROM relaciones WHERE catalogo = ?", (catalogo,))
+        self.conexion.execute("DELETE FROM textos WHERE catalogo = ?", (catalogo,))
+
+    def _insertar(self, claves, relaciones, textos):
+        self.conexion.executemany(
+            "INSERT OR REPLACE INTO claves (catalogo, clave, descripcion, inicio, fin, datos) VALUES (?, ?, ?, ?, ?, ?)",
+            claves)
+        self.conexion.executemany(
+            "INSERT OR IGNORE INTO relaciones (catalogo, clave, relacionado, clave_relacionada) VALUES (?, ?, ?, ?)",
+            relaciones)
+        self.conexion.executemany("INSERT INTO textos (catalogo, clave, texto) VALUES (?, ?, ?)", textos)
+
+    # -- Consultas ----------------------------------------------------------
+
+    def catalogos(self):
+        """Catálogos importados con su número de registros."""
+        return dict(self.conexion.execute("SELECT catalogo, registros FROM importaciones ORDER BY catalogo"))
+
+    def consultar(self, catalogo, clave):
+        """
+        Registro de una clave (con vigencia y columnas adicionales).
+
+        Retorna:
+            Clave: El registro, o None si la clave no existe en el catálogo.
+        """
+        llave = (catalogo, clave)
+        with self._candado:
+            if llave in self._memoria:
+                self._memoria.move_to_end(llave)
+                return self._memoria[llave]
+            fila = self.conexion.execute(
+                "SELECT catalogo, clave, descripcion, inicio, fin, datos FROM claves WHERE catalogo = ? AND clave = ?",
+                llave).fetchone()
+            registro = None
+            if fila is not None:
+                registro = Clave(*fila[:5], json.loads(fila[5]) if fila[5] else {})
+            self._memoria[llave] = registro
+            while len(self._memoria) > self.capacidad:
+                self._memoria.popitem(last=False)
+            return registro
+
+    def vigente(self, catalogo, clave, fecha=None):
+        """
+        Indica si la clave existe y está vigente en la fecha.
+
+        Parámetros:
+            fecha: date, datetime o texto AAAA-MM-DD[THH:MM:SS]; por omisión, hoy.
+        """
+        registro = self.consultar(catalogo, clave)
+        if registro is None:
+            return False
+        dia = _fecha(fecha)[:10] if fecha is not None else datetime.date.today().isoformat()
+        return (registro.inicio is None or registro.inicio <= dia) and (registro.fin is None or dia <= registro.fin)
+
+    def exigir(self, catalogo, clave, fecha=None):
+        """Como vigente(), pero lanza ValueError; para generadores que arman comprobantes."""
+        if not self.vigente(catalogo, clave, fecha):
+            motivo = "no está vigente" if self.consultar(catalogo, clave) else "no existe"
+            raise ValueError(f"La clave {clave!r} de {catalogo} {motivo}")
+        return clave
+
+    def relacionadas(self, catalogo, clave, relacionado):
+        """Claves de `relacionado` asociadas a la clave (por ejemplo los regímenes de un UsoCFDI)."""
+        return {fila[0] for fila in self.conexion.execute(
+            "SELECT clave_relacionada FROM relaciones WHERE catalogo = ? AND clave = ? AND relacionado = ?",
+            (catalogo, clave, relacionado))}
+
+    def compatibles(self, catalogo, clave, relacionado, clave_relacionada):
+        """
+        Indica si dos claves pueden usarse juntas según las relaciones importadas.
+
+        Si el catálogo no define esa relación (por ejemplo, no se importó
+        c_UsoCFDI), no se restringe nada.
+        """
+        restringido = self._restringidos.get((catalogo, relacionado))
+        if restringido is None:
+            restringido = self.conexion.execute(
+                "SELECT 1 FROM relaciones WHERE catalogo = ? AND relacionado = ? LIMIT 1",
+                (catalogo, relacionado)).fetchone() is not None
+            self._restringidos[(catalogo, relacionado)] = restringido
+        if not restringido:
+            return True
+        return self.conexion.execute(
+            "SELECT 1 FROM relaciones WHERE catalogo = ? AND clave = ? AND relacionado = ? AND clave_relacionada = ?",
+            (catalogo, clave, relacionado, clave_relacionada)).fetchone() is not None
+
+    def por_prefijo(self, catalogo, prefijo, limite=20):
+        """Claves que empiezan con el prefijo, en orden (por ejemplo "4321" en c_ClaveProdServ)."""
+        if not prefijo:
+            return []
+        tope = prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
+        return [Clave(*fila[:5], None) for fila in self.conexion.execute(
+            "SELECT catalogo, clave, descripcion, inicio, fin FROM claves "
+            "WHERE catalogo = ? AND clave >= ? AND clave < ? ORDER BY clave LIMIT ?",
+            (catalogo, prefijo, tope, limite))]
+
+    def buscar_texto(self, catalogo, texto, limite=20):
+        """
+        Autocompletado de descripciones: cada palabra se busca como prefijo, sin acentos.
+
+        Retorna:
+            list: Clave ordenadas por relevancia.
+        """
+        palabras = re.findall(r"\w+", texto)
+        if not palabras:
+            return []
+        consulta = " AND ".join(f'"{p}"*' for p in palabras)
+        return [Clave(*fila[:5], None) for fila in self.conexion.execute(
+            "SELECT c.catalogo, c.clave, c.descripcion, c.inicio, c.fin FROM textos t "
+            "JOIN claves c ON c.catalogo = t.catalogo AND c.clave = t.clave "
+            "WHERE textos MATCH ? AND t.catalogo = ? ORDER BY t.rank LIMIT ?",
+            (consulta, catalogo, limite))]
+
+    # -- Vistas para validacion ---------------------------------------------
+
+    def __getitem__(self, catalogo):
+        return VistaCatalogo(self, catalogo)
+
+    def get(self, catalogo, predeterminado=None):
+        """Vista del catálogo si fue importado; así se usa como el parámetro `catalogos` de validacion."""
+        if catalogo not in self.importados():
+            return predeterminado
+        return VistaCatalogo(self, catalogo)
+
+    def vigentes(self, fecha):
+        """Vista de todos los catálogos que además exige la vigencia de cada clave en la fecha."""
+        return VistaCatalogos(self, fecha)
+
+    def importados(self):
+        """Nombres de los catálogos con al menos una importación."""
+        if self._importados is None:
+            self._importados = frozenset(self.catalogos())
+        return self._importados
+
+
+class VistaCatalogo:
+    """Un catálogo como contenedor (`clave in vista`), opcionalmente a una fecha."""
+
+    def __init__(self, catalogos, catalogo, fecha=None):
+        self.catalogos = catalogos
+        self.catalogo = catalogo
+        self.fecha = fecha
+
+    def __contains__(self, clave):
+        if self.fecha is None:
+            return self.catalogos.consultar(self.catalogo, clave) is not None
+        return self.catalogos.vigente(self.catalogo, clave, self.fecha)
+
+    def __getitem__(self, clave):
+        registro = self.catalogos.consultar(self.catalogo, clave)
+        if registro is None:
+            raise KeyError(clave)
+        return registro
+
+
+class VistaCatalogos:
+    """Los catálogos importados a una fecha; ver Catalogos.vigentes."""
+
+    def __init__(self, catalogos, fecha):
+        self.catalogos = catalogos
+        self.fecha = fecha
+
+    def get(self, catalogo, predeterminado=None):
+        if catalogo not in self.catalogos.importados():
+            return predeterminado
+        return VistaCatalogo(self.catalogos, catalogo, self.fecha)
+
+    def compatibles(self, *args):
+        return self.catalogos.compatibles(*args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catálogos del SAT en SQLite.")
+    parser.add_argument("--db", default="catalogos.db", help="Base de datos de catálogos")
+    acciones = parser.add_subparsers(dest="accion", required=True)
+    importar = acciones.add_parser("importar", help="Importa catCFDI (.xls/.xlsx) o un CSV")
+    importar.add_argument("archivos", nargs="+")
+    consultar = acciones.add_parser("consultar", help="Muestra una clave")
+    consultar.add_argument("catalogo")
+    consultar.add_argument("clave")
+    consultar.add_argument("--fecha", default=None, help="Revisar vigencia en esta fecha (AAAA-MM-DD)")
+    buscar = acciones.add_parser("buscar", help="Autocompleta por clave o descripción")
+    buscar.add_argument("catalogo")
+    buscar.add_argument("texto")
+    buscar.add_argument("--limite", type=int, default=20)
+    args = parser.parse_args()
+
+    with Catalogos(args.db) as catalogos:
+        if args.accion == "importar":
+            for archivo in args.archivos:
+                for catalogo, registros in catalogos.importar(archivo).items():
+                    print(f"✅ {catalogo}: {registros} claves ({archivo})")
+        elif args.accion == "consultar":
+            registro = catalogos.consultar(args.catalogo, args.clave)
+            if registro is None:
+                print(f"❌ {args.clave} no existe en {args.catalogo}")
+                exit(1)
+            print(json.dumps(registro._asdict(), ensure_ascii=False, indent=2))
+            if not catalogos.vigente(args.catalogo, args.clave, args.fecha):
+                print(f"⚠️ {args.clave} no está vigente")
+                exit(1)
+        else:
+            resultados = catalogos.por_prefijo(args.catalogo, args.texto, args.limite)
+            resultados = resultados or catalogos.buscar_texto(args.catalogo, args.texto, args.limite)
+            for registro in resultados:
+                print(f"{registro.clave}\t{registro.descripcion}")
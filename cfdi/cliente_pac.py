@@ -0,0 +1,607 @@
+import asyncio
+import base64
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from . import instrumentacion
+
+URL_SW_PRUEBAS = "https://services.test.sw.com.mx"
+
+# Respuestas que se reintentan con espera exponencial
+ESTADOS_REINTENTABLES = frozenset({429, 500, 502, 503, 504})
+
+# Consulta del timbre de un comprobante ya enviado (la atiende PACSimulado;
+# con otro PAC se ajusta a su servicio de recuperación)
+RUTA_CONSULTA = "/cfdi33/consulta/v4"
+
+# Cancelación con el CSD del emisor y consulta del estado en el SAT (PACSimulado
+# atiende ambas; la de estado se ajusta al servicio de consulta de cada PAC)
+RUTA_CANCELACION = "/cfdi33/cancel/csd"
+RUTA_ESTADO = "/cfdi/status"
+
+# Etapa (ver cfdi.instrumentacion) con la que se mide cada solicitud al PAC
+ETAPAS_HTTP = {
+    "/cfdi33/issue/v4": "timbrado_http",
+    RUTA_CONSULTA: "consulta_http",
+    RUTA_CANCELACION: "cancelacion_http",
+    RUTA_ESTADO: "estado_http",
+}
+
+
+class ErrorPAC(Exception):
+    """
+    Error devuelto por el PAC (o falla de comunicación tras agotar los reintentos).
+
+    `status_code` es None cuando no hubo respuesta HTTP; `rechazado` indica que
+    el PAC respondió y rechazó la solicitud (datos inválidos, sello, folio...),
+    aunque su SDK no exponga el código HTTP: reintentarla no la resuelve.
+    """
+
+    def __init__(self, mensaje, status_code=None, cuerpo=None, rechazado=False):
+        super().__init__(mensaje)
+        self.status_code = status_code
+        self.cuerpo = cuerpo
+        self.rechazado = rechazado
+
+
+def es_reintentable(error):
+    """Indica si una falla es transitoria (red, 429 o 5xx) y vale la pena reintentar la solicitud."""
+    if not isinstance(error, ErrorPAC) or error.rechazado:
+        return False
+    return error.status_code is None or error.status_code in ESTADOS_REINTENTABLES
+
+
+def es_timbre_previo(error):
+    """Indica si el PAC rechazó el documento porque ya lo había timbrado (error 307 del SAT)."""
+    if not isinstance(error, ErrorPAC) or not error.cuerpo:
+        return False
+    try:
+        mensaje = json.loads(error.cuerpo).get("message") or ""
+    except (TypeError, ValueError, AttributeError):
+        mensaje = str(error.cuerpo)
+    return mensaje.startswith("307")
+
+
+class LimitadorTasa:
+    """
+    Cubeta de fichas compartida por todas las corrutinas de un cliente.
+
+    Permite a lo sumo `por_segundo` solicitudes por segundo, con ráfagas de
+    hasta `rafaga`; por omisión las solicitudes van espaciadas, porque los PAC
+    suelen contar el límite en una ventana deslizante y una ráfaga inicial lo
+    rebasaría. Un 429 del PAC pausa a todas las corrutinas, no solo a la que
+    lo recibió (ver pausar).
+    """
+
+    def __init__(self, por_segundo, rafaga=1):
+        self.por_segundo = float(por_segundo)
+        self.rafaga = float(rafaga)
+        self._fichas = self.rafaga
+        self._ultimo = time.monotonic()
+        self._pausa_hasta = 0.0
+        self._candado = asyncio.Lock()
+        self.esperas = 0
+
+    async def esperar(self):
+        """Espera una ficha; las corrutinas la obtienen en el orden en que llegan."""
+        async with self._candado:
+            while True:
+                ahora = time.monotonic()
+                if ahora < self._pausa_hasta:
+                    await asyncio.sleep(self._pausa_hasta - ahora)
+                    continue
+                self._fichas = min(self.rafaga, self._fichas + (ahora - self._ultimo) * self.por_segundo)
+                self._ultimo = ahora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                self.esperas += 1
+                await asyncio.sleep((1 - self._fichas) / self.por_segundo)
+
+    def pausar(self, segundos):
+        """Detiene todas las solicitudes durante `segundos` (por ejemplo, el Retry-After de un 429)."""
+        self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+        self._fichas = 0.0
+
+
+class ProveedorPAC:
+    """
+    Interfaz común de los PAC.
+
+    Cada implementación limita las solicitudes en vuelo con un semáforo y,
+    con `solicitudes_por_segundo` (el límite documentado del PAC), su tasa con
+    un LimitadorTasa; las fallas transitorias se reintentan hasta `reintentos`
+    veces con la misma espera exponencial (ver _esperar_reintento). Se usa
+    como contexto asíncrono para liberar sus conexiones al terminar.
+    """
+
+    def __init__(self, max_concurrencia=8, solicitudes_por_segundo=None, reintentos=4, espera_base=0.5):
+        self.max_concurrencia = max_concurrencia
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+        self._executor = ThreadPoolExecutor(max_concurrencia, thread_name_prefix="pac")
+        self._limitador = LimitadorTasa(solicitudes_por_segundo) if solicitudes_por_segundo else None
+
+    async def timbrar(self, documento):
+        """
+        Timbra un XML firmado (bytes, o la ruta del archivo).
+
+        Retorna:
+            dict: Al menos "uuid" y "cfdi" (el XML timbrado), como lo espera ColaTimbrado.
+        """
+        raise NotImplementedError
+
+    async def consultar_timbre(self, documento):
+        """Busca el timbre de un documento ya enviado; None si el PAC no lo timbró."""
+        raise NotImplementedError
+
+    async def timbrar_lote(self, documentos):
+        """Timbra varios documentos de forma concurrente; los errores se devuelven en su posición."""
+        return await asyncio.gather(*(self.timbrar(d) for d in documentos), return_exceptions=True)
+
+    async def cancelar(self, uuid, rfc_emisor, motivo, folio_sustitucion=None, credenciales=None):
+        """
+        Solicita la cancelación de un CFDI.
+
+        Parámetros:
+            motivo (str): Clave de c_MotivoCancelacion ("01" a "04").
+            folio_sustitucion (str): UUID que lo sustituye (solo con motivo "01").
+            credenciales (tuple): (certificado_b64, key_b64, password) del CSD del emisor.
+
+        Retorna:
+            dict: "uuid", "codigo" (estatus de la solicitud ante el SAT, por
+                ejemplo "201" aceptada o "202" previamente cancelado) y "acuse".
+        """
+        raise NotImplementedError
+
+    async def consultar_estado(self, uuid, rfc_emisor, rfc_receptor, total):
+        """
+        Consulta el estado de un CFDI en el SAT.
+
+        Retorna:
+            dict: "uuid", "estado" ("Vigente", "Cancelado" o "No Encontrado"),
+                "codigo_estatus", "es_cancelable" y "estatus_cancelacion".
+        """
+        raise NotImplementedError
+
+    async def _turno(self):
+        """Espera el turno del limitador de tasa, si el proveedor tiene uno."""
+        if self._limitador is not None:
+            await self._limitador.esperar()
+
+    async def _esperar_reintento(self, intento, retry_after=None, status_code=None):
+        """Espera antes del reintento `intento`; un 429 pausa a todo el limitador de tasa."""
+        espera = self._espera(intento, retry_after)
+        if status_code == 429 and self._limitador is not None:
+            self._limitador.pausar(espera)  # el límite del PAC es de toda la cuenta
+        else:
+            await asyncio.sleep(espera)
+
+    def _espera(self, intento, retry_after):
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.espera_base * (2 ** intento) * (0.5 + random.random())
+
+    async def _en_hilo(self, funcion, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: funcion(*args, **kwargs))
+
+    async def cerrar(self):
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *excepcion):
+        await self.cerrar()
+
+
+class ClienteSW(ProveedorPAC):
+    """
+    Cliente asíncrono para el timbrado de SW (endpoint /cfdi33/issue/v4).
+
+    Mantiene una sesión HTTP con conexiones keep-alive reutilizables, guarda el
+    token hasta su expiración y lo renueva una sola vez bajo un candado aunque
+    muchas solicitudes lo necesiten al mismo tiempo. Las respuestas 429 y 5xx
+    se reintentan con espera exponencial (respetando Retry-After).
+    """
+
+    def __init__(self, user, password, url_base=URL_SW_PRUEBAS, max_concurrencia=8,
+                 reintentos=4, espera_base=0.5, vigencia_token=3600, margen_token=60, timeout=60,
+                 solicitudes_por_segundo=None):
+        super().__init__(max_concurrencia, solicitudes_por_segundo, reintentos, espera_base)
+        self.user = user
+        self.password = password
+        self.url_base = url_base.rstrip("/")
+        self.vigencia_token = vigencia_token
+        self.margen_token = margen_token
+        self.timeout = timeout
+        # requests se importa al crear el cliente, no al importar el paquete
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._error_red = requests.RequestException
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrencia)
+        self.sesion.mount("https://", adaptador)
+        self.sesion.mount("http://", adaptador)
+        self._token = None
+        self._expira = 0.0
+        self._candado_token = asyncio.Lock()
+        self.autenticaciones = 0
+
+    async def obtener_token(self):
+        """Devuelve el token vigente, autenticando una sola vez si expiró."""
+        if self._token and time.time() < self._expira:
+            return self._token
+        async with self._candado_token:
+            # Otra corrutina pudo renovarlo mientras se esperaba el candado
+            if self._token and time.time() < self._expira:
+                return self._token
+            respuesta = await self._en_hilo(
+                self.sesion.post, f"{self.url_base}/security/authenticate",
+                json={"user": self.user, "password": self.password},
+                headers={"Content-Type": "application/json; charset=utf-8"}, timeout=self.timeout)
+            if respuesta.status_code != 200:
+                raise ErrorPAC(f"Error en autenticación: {respuesta.status_code}",
+                               respuesta.status_code, respuesta.text)
+            cuerpo = respuesta.json()
+            datos = cuerpo.get("data") or cuerpo
+            if not datos.get("token"):
+                raise ErrorPAC("No se encontró el token en la respuesta", 200, respuesta.text)
+            self.autenticaciones += 1
+            self._token = datos["token"]
+            self._expira = self._calcular_expiracion(datos.get("expires_in"))
+            return self._token
+
+    def _calcular_expiracion(self, expires_in):
+        ahora = time.time()
+        if expires_in is None:
+            expira = ahora + self.vigencia_token
+        elif float(expires_in) > 1e9:
+            expira = float(expires_in)  # SW lo envía como marca de tiempo Unix
+        else:
+            expira = ahora + float(expires_in)
+        return expira - self.margen_token
+
+    def invalidar_token(self):
+        self._token = None
+        self._expira = 0.0
+
+    async def timbrar(self, documento, nombre="cfdi.xml"):
+        """
+        Envía un XML firmado a timbrar.
+
+        Parámetros:
+            documento (bytes | str): XML firmado, o la ruta del archivo.
+            nombre (str): Nombre del archivo en el formulario multipart.
+
+        Retorna:
+            dict: Contenido de "data" en la respuesta (uuid, cfdi, ...).
+        """
+        if isinstance(documento, str):
+            nombre = documento
+            with open(documento, "rb") as xml_file:
+                documento = xml_file.read()
+        async with self._semaforo:
+            return await self._enviar("/cfdi33/issue/v4", nombre, documento)
+
+    async def consultar_timbre(self, documento, nombre="cfdi.xml"):
+        """
+        Busca en el PAC el timbre de un documento firmado.
+
+        Se usa antes de reenviar un documento cuyo resultado se desconoce (por
+        ejemplo si el proceso terminó entre la respuesta del PAC y el guardado
+        del TFD), para no timbrar dos veces el mismo folio.
+
+        Retorna:
+            dict: Datos del timbre previo (uuid, cfdi, ...), o None si no existe.
+        """
+        if isinstance(documento, str):
+            nombre = documento
+            with open(documento, "rb") as xml_file:
+                documento = xml_file.read()
+        async with self._semaforo:
+            try:
+                return await self._enviar(RUTA_CONSULTA, nombre, documento)
+            except ErrorPAC as e:
+                if e.status_code == 404:
+                    return None
+                raise
+
+    async def cancelar(self, uuid, rfc_emisor, motivo, folio_sustitucion=None, credenciales=None):
+        """Cancela un CFDI con el CSD del emisor (ver ProveedorPAC.cancelar)."""
+        certificado_b64, key_b64, password = credenciales or (None, None, None)
+        solicitud = {"uuid": uuid, "rfc": rfc_emisor, "motivo": motivo, "b64Cer": certificado_b64,
+                     "b64Key": key_b64, "password": password}
+        if folio_sustitucion:
+            solicitud["foliosustitucion"] = folio_sustitucion
+        async with self._semaforo:
+            datos = await self._solicitar(RUTA_CANCELACION, "cancelación", json=solicitud)
+        codigos = datos.get("uuid") or {}
+        codigo = codigos.get(uuid) or codigos.get(uuid.upper()) or next(iter(codigos.values()), None)
+        return {"uuid": uuid, "codigo": codigo, "acuse": datos.get("acuse")}
+
+    async def consultar_estado(self, uuid, rfc_emisor, rfc_receptor, total):
+        """Consulta el estado de un CFDI en el SAT (ver ProveedorPAC.consultar_estado)."""
+        solicitud = {"uuid": uuid, "rfcEmisor": rfc_emisor, "rfcReceptor": rfc_receptor, "total": str(total)}
+        async with self._semaforo:
+            datos = await self._solicitar(RUTA_ESTADO, "consulta de estado", json=solicitud)
+        return {"uuid": uuid, "estado": datos.get("estado"), "codigo_estatus": datos.get("codigoEstatus"),
+                "es_cancelable": datos.get("esCancelable"),
+                "estatus_cancelacion": datos.get("estatusCancelacion")}
+
+    async def _enviar(self, ruta, nombre, contenido):
+        return await self._solicitar(ruta, "timbrado", files={"xml": (nombre, contenido, "application/xml")})
+
+    async def _solicitar(self, ruta, descripcion, **argumentos):
+        renovado = False
+        intento = 0
+        nombre_etapa = ETAPAS_HTTP.get(ruta, "pac_http")
+        while True:
+            token = await self.obtener_token()
+            await self._turno()
+            try:
+                # Se mide cada intento por separado: los reintentos y las esperas no cuentan
+                with instrumentacion.etapa(nombre_etapa, intento=intento):
+                    respuesta = await self._en_hilo(
+                        self.sesion.post, self.url_base + ruta,
+                        headers={"Authorization": f"Bearer {token}"}, timeout=self.timeout, **argumentos)
+            except self._error_red as e:
+                if intento >= self.reintentos:
+                    raise ErrorPAC(f"Falla de comunicación con el PAC: {e}") from e
+                await self._esperar_reintento(intento)
+                intento += 1
+                continue
+            instrumentacion.contar(instrumentacion.RESPUESTAS_PAC, nombre_etapa, str(respuesta.status_code))
+
+            if respuesta.status_code == 200:
+                cuerpo = respuesta.json()
+                return cuerpo.get("data", cuerpo)
+            if respuesta.status_code == 401 and not renovado:
+                # Token revocado antes de tiempo: se renueva una vez y se reintenta
+                self.invalidar_token()
+                renovado = True
+                continue
+            if respuesta.status_code in ESTADOS_REINTENTABLES and intento < self.reintentos:
+                await self._esperar_reintento(intento, respuesta.headers.get("Retry-After"), respuesta.status_code)
+                intento += 1
+                continue
+            raise ErrorPAC(f"Error en {descripcion}: {respuesta.status_code}",
+                           respuesta.status_code, respuesta.text)
+
+    async def cerrar(self):
+        self.sesion.close()
+        await super().cerrar()
+
+
+def factura_desde_xml(documento, credenciales):
+    """
+    Convierte un comprobante CFDI 4.0 en el Invoice "por valores" de FiscalAPI.
+
+    FiscalAPI no recibe el XML: arma y sella el comprobante con el CSD del
+    emisor a partir de sus valores, así que el Sello local se descarta. Se
+    traducen los atributos del Comprobante, Emisor, Receptor y Conceptos con
+    sus traslados y retenciones; los complementos (Pagos, ...) no.
+
+    Parámetros:
+        documento: XML (bytes) o elemento raíz de lxml.
+        credenciales (tuple): (certificado_b64, key_b64, password) del CSD del emisor.
+
+    Retorna:
+        Invoice: Factura del SDK de FiscalAPI.
+    """
+    from lxml import etree
+    from fiscalapi.models.fiscalapi_models import (Invoice, InvoiceIssuer, InvoiceItem, InvoiceRecipient,
+                                                    ItemTax, TaxCredential)
+
+    raiz = etree.fromstring(documento) if isinstance(documento, (bytes, bytearray)) else documento
+    cfdi = "{http://www.sat.gob.mx/cfd/4}"
+    if raiz.find(f"{cfdi}Complemento") is not None:
+        raise ValueError("FiscalAPI por valores no admite los complementos del comprobante.")
+    emisor, receptor = raiz.find(f"{cfdi}Emisor"), raiz.find(f"{cfdi}Receptor")
+    certificado_b64, key_b64, password = credenciales
+
+    def decimal(nodo, atributo):
+        valor = nodo.get(atributo)
+        return Decimal(valor) if valor is not None else None
+
+    conceptos = []
+    for concepto in raiz.iterfind(f"{cfdi}Conceptos/{cfdi}Concepto"):
+        impuestos = [ItemTax(tax_code=impuesto.get("Impuesto"), tax_type_code=impuesto.get("TipoFactor"),
+                             tax_rate=decimal(impuesto, "TasaOCuota"), tax_flag_code=bandera)
+                     for grupo, nombre, bandera in (("Traslados", "Traslado", "T"), ("Retenciones", "Retencion", "R"))
+                     for impuesto in concepto.iterfind(f"{cfdi}Impuestos/{cfdi}{grupo}/{cfdi}{nombre}")]
+        conceptos.append(InvoiceItem(
+            item_code=concepto.get("ClaveProdServ"), item_sku=concepto.get("NoIdentificacion"),
+            quantity=decimal(concepto, "Cantidad"), unit_of_measurement_code=concepto.get("ClaveUnidad"),
+            description=concepto.get("Descripcion"), unit_price=decimal(concepto, "ValorUnitario"),
+            discount=decimal(concepto, "Descuento"), tax_object_code=concepto.get("ObjetoImp"),
+            item_taxes=impuestos or None))
+    return Invoice(
+        version_code=raiz.get("Version"), series=raiz.get("Serie"), number=raiz.get("Folio"),
+        date=raiz.get("Fecha"), payment_form_code=raiz.get("FormaPago"),
+        payment_conditions=raiz.get("CondicionesDePago"), currency_code=raiz.get("Moneda"),
+        type_code=raiz.get("TipoDeComprobante"), expedition_zip_code=raiz.get("LugarExpedicion"),
+        payment_method_code=raiz.get("MetodoPago"), exchange_rate=decimal(raiz, "TipoCambio"),
+        export_code=raiz.get("Exportacion"),
+        issuer=InvoiceIssuer(
+            tin=emisor.get("Rfc"), legal_name=emisor.get("Nombre"), tax_regime_code=emisor.get("RegimenFiscal"),
+            tax_credentials=[TaxCredential(base64_file=certificado_b64, file_type=0, password=password),
+                             TaxCredential(base64_file=key_b64, file_type=1, password=password)]),
+        recipient=InvoiceRecipient(
+            tin=receptor.get("Rfc"), legal_name=receptor.get("Nombre"),
+            zip_code=receptor.get("DomicilioFiscalReceptor"), tax_regime_code=receptor.get("RegimenFiscalReceptor"),
+            cfdi_use_code=receptor.get("UsoCFDI")),
+        items=conceptos)
+
+
+class ClienteFiscalAPI(ProveedorPAC):
+    """
+    Adaptador del SDK de FiscalAPI (flujo de timbrado.py) a la interfaz asíncrona.
+
+    Recibe el mismo XML que ClienteSW (así ColaTimbrado lo usa igual) y lo
+    envía "por valores" con factura_desde_xml; FiscalAPI lo sella con el CSD
+    de `credenciales`. El SDK es síncrono: cada llamada corre en el pool de
+    hilos del proveedor, el semáforo limita las solicitudes simultáneas, y las
+    fallas de red, 429 y 5xx se reintentan con la espera de ProveedorPAC. Los
+    rechazos del PAC se marcan como tales (ErrorPAC.rechazado).
+    """
+
+    def __init__(self, api_url, api_key, tenant, credenciales=None, max_concurrencia=8,
+                 solicitudes_por_segundo=None, reintentos=4, espera_base=0.5, paginas_consulta=2):
+        """
+        Parámetros:
+            credenciales: (certificado_b64, key_b64, password) del CSD del emisor, o una
+                función RFC -> esa tupla cuando se timbra para varios emisores.
+            paginas_consulta (int): Páginas recientes de facturas (50 por página) en que
+                consultar_timbre busca la Serie+Folio.
+        """
+        super().__init__(max_concurrencia, solicitudes_por_segundo, reintentos, espera_base)
+        import requests
+        from fiscalapi.models.common_models import FiscalApiSettings
+        from fiscalapi.services.fiscalapi_client import FiscalApiClient
+
+        settings = FiscalApiSettings(api_url=api_url, api_key=api_key, tenant=tenant)
+        self.client = FiscalApiClient(settings=settings)
+        self.credenciales = credenciales
+        self.paginas_consulta = paginas_consulta
+        self._error_red = requests.RequestException
+
+    def _credenciales(self, rfc):
+        if callable(self.credenciales):
+            return self.credenciales(rfc)
+        if self.credenciales is None:
+            raise ValueError(f"Sin credenciales del CSD para {rfc}")
+        return self.credenciales
+
+    async def timbrar(self, documento):
+        """
+        Timbra un XML firmado (bytes o ruta) o un Invoice ya armado.
+
+        Retorna:
+            dict: "uuid" y "cfdi" (XML timbrado), como ClienteSW.
+        """
+        from lxml import etree
+
+        if isinstance(documento, str):
+            with open(documento, "rb") as xml_file:
+                documento = xml_file.read()
+        if isinstance(documento, (bytes, bytearray)):
+            raiz = etree.fromstring(bytes(documento))
+            emisor = raiz.find("{http://www.sat.gob.mx/cfd/4}Emisor")
+            documento = factura_desde_xml(raiz, self._credenciales(emisor.get("Rfc") if emisor is not None else None))
+        datos = await self._llamar(self.client.invoices.create, documento, "timbrado", "timbrado_http")
+        return self._timbre(datos)
+
+    async def consultar_timbre(self, documento):
+        """
+        Busca la Serie+Folio del documento entre las facturas recientes de la cuenta.
+
+        El SDK no consulta por Serie+Folio: se revisan las primeras
+        `paginas_consulta` páginas del listado y se pide el detalle de la que
+        coincida.
+
+        Retorna:
+            dict: "uuid" y "cfdi" del timbre previo, o None si no está entre las recientes.
+        """
+        from lxml import etree
+
+        if isinstance(documento, str):
+            with open(documento, "rb") as xml_file:
+                documento = xml_file.read()
+        raiz = etree.fromstring(bytes(documento))
+        serie, folio = raiz.get("Serie"), raiz.get("Folio")
+        for pagina in range(1, self.paginas_consulta + 1):
+            listado = await self._llamar(self.client.invoices.get_list, (pagina, 50), "consulta", "consulta_http")
+            for factura in listado.items:
+                if factura.series == serie and factura.number == folio and factura.uuid:
+                    detalle = await self._llamar(self.client.invoices.get_by_id, (factura.id, True), "consulta",
+                                                 "consulta_http")
+                    return self._timbre(detalle)
+            if not listado.has_next_page:
+                break
+        return None
+
+    @staticmethod
+    def _timbre(datos):
+        xml = None
+        for respuesta_sat in datos.responses or []:
+            if respuesta_sat.invoice_base64:
+                xml = base64.b64decode(respuesta_sat.invoice_base64).decode("utf-8")
+        return {"uuid": datos.uuid, "cfdi": xml}
+
+    async def cancelar(self, uuid, rfc_emisor, motivo, folio_sustitucion=None, credenciales=None):
+        """Cancela un CFDI por valores, con el CSD del emisor (ver ProveedorPAC.cancelar)."""
+        from fiscalapi.models.fiscalapi_models import CancelInvoiceRequest, TaxCredential
+
+        certificado_b64, key_b64, password = credenciales or self._credenciales(rfc_emisor)
+        solicitud = CancelInvoiceRequest(
+            invoice_uuid=uuid, tin=rfc_emisor, cancellation_reason_code=motivo,
+            replacement_uuid=folio_sustitucion,
+            tax_credentials=[TaxCredential(base64_file=certificado_b64, file_type=0, password=password),
+                             TaxCredential(base64_file=key_b64, file_type=1, password=password)])
+        datos = await self._llamar(self.client.invoices.cancel, solicitud, "cancelación", "cancelacion_http")
+        codigos = datos.invoice_uuids or {}
+        codigo = codigos.get(uuid) or codigos.get(uuid.upper()) or next(iter(codigos.values()), None)
+        return {"uuid": uuid, "codigo": codigo, "acuse": datos.base64_cancellation_acknowledgement}
+
+    async def consultar_estado(self, uuid, rfc_emisor, rfc_receptor, total):
+        """Consulta el estado de un CFDI en el SAT (ver ProveedorPAC.consultar_estado)."""
+        from fiscalapi.models.fiscalapi_models import InvoiceStatusRequest
+
+        solicitud = InvoiceStatusRequest(invoice_uuid=uuid, issuer_tin=rfc_emisor, recipient_tin=rfc_receptor,
+                                         invoice_total=Decimal(str(total)))
+        datos = await self._llamar(self.client.invoices.get_status, solicitud, "consulta de estado",
+                                   "estado_http")
+        return {"uuid": uuid, "estado": datos.status, "codigo_estatus": datos.status_code,
+                "es_cancelable": datos.cancelable_status, "estatus_cancelacion": datos.cancellation_status}
+
+    async def _llamar(self, metodo, solicitud, descripcion, nombre_etapa):
+        """Llama al SDK con reintentos; `solicitud` es el argumento del método, o una tupla de argumentos."""
+        argumentos = solicitud if isinstance(solicitud, tuple) else (solicitud,)
+        intento = 0
+        while True:
+            api_response = status_code = None
+            async with self._semaforo:
+                await self._turno()
+                try:
+                    with instrumentacion.etapa(nombre_etapa, intento=intento):
+                        api_response = await self._en_hilo(metodo, *argumentos)
+                except self._error_red as e:
+                    if intento >= self.reintentos:
+                        raise ErrorPAC(f"Falla de comunicación con el PAC: {e}") from e
+            if api_response is not None:
+                status_code = getattr(api_response, "http_status_code", None)
+                instrumentacion.contar(instrumentacion.RESPUESTAS_PAC, nombre_etapa, str(status_code))
+                if api_response.succeeded:
+                    return api_response.data
+                if status_code not in ESTADOS_REINTENTABLES or intento >= self.reintentos:
+                    cuerpo = json.dumps({"message": api_response.message, "details": api_response.details},
+                                        ensure_ascii=False)
+                    raise ErrorPAC(f"Error en {descripcion}: {api_response.message}", status_code, cuerpo,
+                                   rechazado=status_code not in ESTADOS_REINTENTABLES)
+            await self._esperar_reintento(intento, status_code=status_code)
+            intento += 1
+
+
+if __name__ == "__main__":
+    import sys
+
+    async def principal(rutas):
+        async with ClienteSW("usuario@pruebas.com", "contraseña1234") as cliente:
+            resultados = await cliente.timbrar_lote(rutas)
+        for ruta, resultado in zip(rutas, resultados):
+            if isinstance(resultado, Exception):
+                print(f"❌ {ruta}: {resultado}")
+            else:
+                print(f"✅ {ruta}: UUID {resultado.get('uuid')}")
+
+    asyncio.run(principal(sys.argv[1:] or ["cfdi_firmado.xml"]))
@@ -0,0 +1,404 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import sqlite3
+import time
+from lxml import etree
+
+from . import cadena, firma
+from .cliente_pac import ErrorPAC, es_reintentable, es_timbre_previo
+
+# Estados de un comprobante en la cola:
+#   pendiente -> firmado -> timbrando -> timbrado
+#                   ^           |
+#                   +-----------+-> fallido (tras agotar los intentos o ante un rechazo)
+PENDIENTE = "pendiente"
+FIRMADO = "firmado"
+TIMBRANDO = "timbrando"
+TIMBRADO = "timbrado"
+FALLIDO = "fallido"
+ESTADOS = (PENDIENTE, FIRMADO, TIMBRANDO, TIMBRADO, FALLIDO)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS comprobantes (
+    id INTEGER PRIMARY KEY,
+    serie TEXT NOT NULL,
+    folio TEXT NOT NULL,
+    hash_cadena TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    xml BLOB NOT NULL,
+    uuid TEXT,
+    xml_timbrado BLOB,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    creado REAL NOT NULL,
+    actualizado REAL NOT NULL,
+    disponible REAL NOT NULL,
+    UNIQUE (serie, folio)
+);
+CREATE INDEX IF NOT EXISTS comprobantes_estado ON comprobantes (estado, disponible);
+CREATE INDEX IF NOT EXISTS comprobantes_hash ON comprobantes (hash_cadena);
+"""
+
+
+class FolioDuplicado(ValueError):
+    """La Serie+Folio ya está en la cola con una cadena original distinta."""
+
+
+def _hash_cadena(raiz):
+    return hashlib.sha256(cadena.generar_cadena_original(raiz).encode("utf-8")).hexdigest()
+
+
+class ColaTimbrado:
+    """
+    Cola persistente de timbrado sobre SQLite en modo WAL.
+
+    Cada comprobante se identifica por Serie+Folio y el SHA-256 de su cadena
+    original, de modo que volver a encolar el mismo documento no lo duplica.
+    El estado se guarda en disco antes de enviar al PAC (timbrando) y el TFD
+    en la misma transacción que lo marca como timbrado; si el proceso termina
+    en medio, recuperar() consulta al PAC por un UUID existente antes de
+    reenviar, para no timbrar dos veces el mismo folio.
+
+    La emisión (agregar) no espera al PAC: los documentos se acumulan en la
+    cola y procesar() los drena con N trabajadores concurrentes. Se asume un
+    solo proceso drenando cada base de datos. Con un Almacen, cada CFDI
+    timbrado se archiva además en él (ver cfdi.almacen).
+
+    Uso:
+        with ColaTimbrado("cola_timbrado.db") as cola:
+            cola.agregar(xml_firmado)
+            async with ClienteSW(usuario, password) as cliente:
+                await cola.procesar(cliente, trabajadores=8)
+    """
+
+    def __init__(self, ruta="cola_timbrado.db", max_intentos=5, espera_base=2.0, espera_maxima=300.0,
+                 almacen=None):
+        self.ruta = ruta
+        self.almacen = almacen
+        self.max_intentos = max_intentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        # Las transacciones se abren explícitamente (BEGIN IMMEDIATE)
+        self.conexion = sqlite3.connect(ruta, timeout=30, isolation_level=None)
+        self.conexion.row_factory = sqlite3.Row
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        # El TFD no se puede regenerar: cada commit llega a disco
+        self.conexion.execute("PRAGMA synchronous=FULL")
+        self.conexion.executescript(_ESQUEMA)
+
+    def cerrar(self):
+        self.conexion.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+    @contextlib.contextmanager
+    def _transaccion(self):
+        self.conexion.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conexion
+        except BaseException:
+            self.conexion.execute("ROLLBACK")
+            raise
+        self.conexion.execute("COMMIT")
+
+    def agregar(self, documento):
+        """
+        Encola un comprobante para timbrar.
+
+        Parámetros:
+            documento (bytes | str): XML del comprobante, o la ruta del archivo. Si
+                no tiene Sello queda pendiente de firmar (ver firmar_pendientes).
+
+        Retorna:
+            int: Id del comprobante en la cola (el existente si ya estaba encolado).
+        """
+        if isinstance(documento, str):
+            with open(documento, "rb") as xml_file:
+                documento = xml_file.read()
+        raiz = etree.fromstring(documento)
+        serie, folio = raiz.get("Serie", ""), raiz.get("Folio")
+        if not folio:
+            raise ValueError("El comprobante no tiene Folio.")
+        hash_cadena = _hash_cadena(raiz)
+        estado = FIRMADO if raiz.get("Sello") else PENDIENTE
+        ahora = time.time()
+
+        with self._transaccion() as conexion:
+            existente = conexion.execute(
+                "SELECT id, hash_cadena FROM comprobantes WHERE serie = ? AND folio = ?",
+                (serie, folio)).fetchone()
+            if existente is not None:
+                if existente["hash_cadena"] != hash_cadena:
+                    raise FolioDuplicado(f"La Serie+Folio {serie}{folio} ya está en la cola con otro contenido.")
+                return existente["id"]
+            cursor = conexion.execute(
+                "INSERT INTO comprobantes (serie, folio, hash_cadena, estado, xml, creado, actualizado, disponible)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (serie, folio, hash_cadena, estado, documento, ahora, ahora, ahora))
+            return cursor.lastrowid
+
+    def firmar_pendientes(self, llave_privada, no_certificado=None, certificado_b64=None, metodo="xslt"):
+        """
+        Sella los comprobantes pendientes y los deja listos para timbrar.
+
+        El sellado agrega NoCertificado y cambia la cadena original, así que el
+        hash se recalcula: volver a encolar el documento firmado no es un duplicado.
+
+        Retorna:
+            int: Número de comprobantes firmados (sin contar los que fallaron).
+        """
+        pendientes = self.conexion.execute(
+            "SELECT id, xml FROM comprobantes WHERE estado = ? ORDER BY id", (PENDIENTE,)).fetchall()
+        firmados = 0
+        for fila in pendientes:
+            try:
+                firmado = firma.sellar_cfdi(fila["xml"], llave_privada, no_certificado, certificado_b64, metodo)
+                hash_cadena = _hash_cadena(etree.fromstring(firmado))
+            except Exception as e:
+                self._actualizar(fila["id"], estado=FALLIDO, error=f"Error al firmar: {e}")
+                continue
+            self._actualizar(fila["id"], estado=FIRMADO, xml=firmado, hash_cadena=hash_cadena, error=None)
+            firmados += 1
+        return firmados
+
+    def _actualizar(self, id_comprobante, **campos):
+        campos["actualizado"] = time.time()
+        asignaciones = ", ".join(f"{campo} = ?" for campo in campos)
+        with self._transaccion() as conexion:
+            conexion.execute(f"UPDATE comprobantes SET {asignaciones} WHERE id = ?",
+                             (*campos.values(), id_comprobante))
+
+    def _reclamar(self):
+        """Toma el siguiente comprobante listo y lo marca como timbrando antes de enviarlo."""
+        ahora = time.time()
+        with self._transaccion() as conexion:
+            fila = conexion.execute(
+                "SELECT id, xml, intentos FROM comprobantes WHERE estado = ? AND disponible <= ?"
+                " ORDER BY disponible, id LIMIT 1", (FIRMADO, ahora)).fetchone()
+            if fila is None:
+                return None
+            conexion.execute(
+                "UPDATE comprobantes SET estado = ?, intentos = intentos + 1, actualizado = ? WHERE id = ?",
+                (TIMBRANDO, ahora, fila["id"]))
+        return fila["id"], fila["xml"], fila["intentos"] + 1
+
+    def _proxima_espera(self):
+        """Segundos hasta que haya un comprobante listo, o None si no queda ninguno por timbrar."""
+        disponible = self.conexion.execute(
+            "SELECT MIN(disponible) FROM comprobantes WHERE estado = ?", (FIRMADO,)).fetchone()[0]
+        if disponible is None:
+            return None
+        return max(0.0, disponible - time.time())
+
+    def _marcar_timbrado(self, id_comprobante, datos):
+        xml_timbrado = (datos.get("cfdi") or "").encode("utf-8")
+        self._actualizar(id_comprobante, estado=TIMBRADO, uuid=datos.get("uuid"),
+                         xml_timbrado=xml_timbrado, error=None)
+        if self.almacen is not None and xml_timbrado:
+            # El TFD ya está a salvo en la cola; una falla del almacén solo se anota
+            try:
+                self.almacen.agregar(xml_timbrado)
+            except (OSError, ValueError, etree.XMLSyntaxError) as e:
+                self._actualizar(id_comprobante, error=f"No se archivó: {e}")
+
+    def _registrar_falla(self, id_comprobante, intentos, error):
+        reintentable = es_reintentable(error)
+        mensaje = f"{error}: {error.cuerpo}" if isinstance(error, ErrorPAC) and error.cuerpo else str(error)
+        if reintentable and intentos < self.max_intentos:
+            espera = min(self.espera_maxima, self.espera_base * 2 ** (intentos - 1))
+            self._actualizar(id_comprobante, estado=FIRMADO, disponible=time.time() + espera, error=mensaje)
+        else:
+            self._actualizar(id_comprobante, estado=FALLIDO, error=mensaje)
+
+    async def _timbrar(self, cliente, id_comprobante, xml, intentos):
+        try:
+            datos = await cliente.timbrar(xml)
+        except Exception as e:
+            if es_timbre_previo(e):
+                # El PAC ya lo timbró (por ejemplo, la respuesta se perdió): se recupera su TFD
+                try:
+                    datos = await cliente.consultar_timbre(xml)
+                except Exception as consulta:
+                    e = consulta
+                else:
+                    if datos:
+                        self._marcar_timbrado(id_comprobante, datos)
+                        return
+            self._registrar_falla(id_comprobante, intentos, e)
+            return
+        self._marcar_timbrado(id_comprobante, datos)
+
+    async def _trabajador(self, cliente, continuo, intervalo):
+        while True:
+            reclamado = self._reclamar()
+            if reclamado is not None:
+                await self._timbrar(cliente, *reclamado)
+                continue
+            espera = self._proxima_espera()
+            if espera is None:
+                if not continuo:
+                    return
+                espera = intervalo
+            await asyncio.sleep(min(espera, intervalo))
+
+    async def recuperar(self, cliente):
+        """
+        Resuelve los comprobantes que quedaron en timbrando tras una caída.
+
+        Por cada uno se consulta al PAC: si ya tiene UUID se guarda su TFD, y
+        si no, vuelve a la cola para reenviarse. Los que no se pudieron
+        consultar se quedan en timbrando hasta el siguiente intento.
+
+        Retorna:
+            dict: Conteo de recuperados, reencolados y sin respuesta.
+        """
+        en_vuelo = self.conexion.execute(
+            "SELECT id, xml FROM comprobantes WHERE estado = ? ORDER BY id", (TIMBRANDO,)).fetchall()
+        consultas = await asyncio.gather(*(cliente.consultar_timbre(fila["xml"]) for fila in en_vuelo),
+                                         return_exceptions=True)
+        conteo = {"recuperados": 0, "reencolados": 0, "sin_respuesta": 0}
+        for fila, datos in zip(en_vuelo, consultas):
+            if isinstance(datos, Exception):
+                conteo["sin_respuesta"] += 1
+            elif datos:
+                self._marcar_timbrado(fila["id"], datos)
+                conteo["recuperados"] += 1
+            else:
+                self._actualizar(fila["id"], estado=FIRMADO, disponible=time.time())
+                conteo["reencolados"] += 1
+        return conteo
+
+    async def procesar(self, cliente, trabajadores=4, continuo=False, intervalo=1.0):
+        """
+        Drena la cola timbrando con varios trabajadores concurrentes.
+
+        Parámetros:
+            cliente: Proveedor PAC (por ejemplo ClienteSW); su semáforo limita
+                además las solicitudes en vuelo.
+            trabajadores (int): Comprobantes que se timbran al mismo tiempo.
+            continuo (bool): Seguir esperando comprobantes nuevos en lugar de
+                terminar cuando la cola quede vacía.
+            intervalo (float): Segundos entre revisiones de la cola sin trabajo.
+
+        Retorna:
+            dict: Métricas de la cola al terminar (ver metricas).
+        """
+        await self.recuperar(cliente)
+        await asyncio.gather(*(self._trabajador(cliente, continuo, intervalo) for _ in range(trabajadores)))
+        # Los que no se pudieron consultar al inicio se intentan una vez más
+        if self.metricas()["por_estado"][TIMBRANDO] and (await self.recuperar(cliente))["reencolados"]:
+            await asyncio.gather(*(self._trabajador(cliente, continuo, intervalo) for _ in range(trabajadores)))
+        return self.metricas()
+
+    def metricas(self):
+        """
+        Profundidad y antigüedad de la cola.
+
+        Retorna:
+            dict: Comprobantes por estado, profundidad (aún sin timbrar ni
+            fallar) y antigüedad máxima/promedio en segundos de esos comprobantes.
+        """
+        ahora = time.time()
+        por_estado = dict.fromkeys(ESTADOS, 0)
+        for estado, total in self.conexion.execute(
+                "SELECT estado, COUNT(*) FROM comprobantes GROUP BY estado"):
+            por_estado[estado] = total
+        profundidad, creado_min, creado_promedio = self.conexion.execute(
+            "SELECT COUNT(*), MIN(creado), AVG(creado) FROM comprobantes WHERE estado IN (?, ?, ?)",
+            (PENDIENTE, FIRMADO, TIMBRANDO)).fetchone()
+        return {
+            "por_estado": por_estado,
+            "profundidad": profundidad,
+            "antiguedad_max_s": ahora - creado_min if creado_min is not None else 0.0,
+            "antiguedad_promedio_s": ahora - creado_promedio if creado_promedio is not None else 0.0,
+        }
+
+    def obtener(self, serie, folio):
+        """Devuelve el registro de un comprobante (dict) o None si no está en la cola."""
+        fila = self.conexion.execute(
+            "SELECT * FROM comprobantes WHERE serie = ? AND folio = ?", (serie, folio)).fetchone()
+        return dict(fila) if fila is not None else None
+
+
+if __name__ == "__main__":
+    from .cliente_pac import ClienteSW
+
+    parser = argparse.ArgumentParser(description="Cola persistente de timbrado de CFDI.")
+    parser.add_argument("--db", default="cola_timbrado.db", help="Base de datos SQLite de la cola")
+    acciones = parser.add_subparsers(dest="accion", required=True)
+    agregar = acciones.add_parser("agregar", help="Encola comprobantes")
+    agregar.add_argument("archivos", nargs="+", help="XML a encolar")
+    procesar = acciones.add_parser("procesar", help="Firma los pendientes y timbra la cola")
+    procesar.add_argument("--trabajadores", type=int, default=4)
+    procesar.add_argument("--continuo", action="store_true", help="Seguir esperando comprobantes nuevos")
+    procesar.add_argument("--usuario", default="usuario@pruebas.com")
+    procesar.add_argument("--password", default="contraseña1234")
+    procesar.add_argument("--url", default=None, help="URL del PAC (por omisión, pruebas de SW)")
+    procesar.add_argument("--simulado", action="store_true", help="Timbrar contra un PACSimulado local")
+    procesar.add_argument("--key", default="mi_llave.key", help="Llave para los comprobantes sin sello")
+    procesar.add_argument("--cer", default="mi_certificado.cer")
+    procesar.add_argument("--password-key", default="12345678a")
+    procesar.add_argument("--almacen", default=None, help="Directorio del almacén donde archivar los timbrados")
+    procesar.add_argument("--metricas", type=int, default=None, metavar="PUERTO",
+                          help="Medir las etapas y exponer /metrics (Prometheus) en ese puerto")
+    acciones.add_parser("metricas", help="Profundidad y antigüedad de la cola")
+    exportar = acciones.add_parser("exportar", help="Escribe el XML timbrado de un folio")
+    exportar.add_argument("serie")
+    exportar.add_argument("folio")
+    exportar.add_argument("salida", nargs="?", default="factura_timbrada.xml")
+    args = parser.parse_args()
+
+    async def drenar(cola, url):
+        async with ClienteSW(args.usuario, args.password, **({"url_base": url} if url else {})) as cliente:
+            return await cola.procesar(cliente, args.trabajadores, args.continuo)
+
+    with ColaTimbrado(args.db) as cola:
+        if args.accion == "agregar":
+            for archivo in args.archivos:
+                try:
+                    print(f"✅ {archivo}: id {cola.agregar(archivo)}")
+                except (OSError, ValueError, etree.XMLSyntaxError) as e:
+                    print(f"❌ {archivo}: {e}")
+        elif args.accion == "procesar":
+            if args.metricas:
+                from . import instrumentacion
+
+                instrumentacion.activar()
+                instrumentacion.servir(args.metricas)
+                print(f"📈 Métricas en http://127.0.0.1:{args.metricas}/metrics")
+            if args.almacen:
+                from .almacen import Almacen
+
+                cola.almacen = Almacen(args.almacen)
+            if cola.metricas()["por_estado"][PENDIENTE]:
+                llave = firma.cargar_llave_privada(args.key, args.password_key.encode())
+                no_certificado, certificado_b64 = firma.cargar_certificado(args.cer)
+                print(f"✍️ Firmados: {cola.firmar_pendientes(llave, no_certificado, certificado_b64)}")
+            if args.simulado:
+                from .pac_simulado import PACSimulado
+
+                with PACSimulado(args.usuario, args.password) as pac:
+                    resultado = asyncio.run(drenar(cola, pac.url))
+            else:
+                resultado = asyncio.run(drenar(cola, args.url))
+            if cola.almacen is not None:
+                cola.almacen.cerrar()
+            print(json.dumps(resultado, indent=2))
+        elif args.accion == "metricas":
+            print(json.dumps(cola.metricas(), indent=2))
+        else:
+            registro = cola.obtener(args.serie, args.folio)
+            if registro is None or registro["estado"] != TIMBRADO:
+                print(f"❌ {args.serie}{args.folio} no está timbrado"
+                      + (f" ({registro['estado']}: {registro['error']})" if registro else ""))
+                exit(1)
+            with open(args.salida, "wb") as f:
+                f.write(registro["xml_timbrado"])
+            print(f"✅ UUID {registro['uuid']} guardado en {args.salida}")
@@ -0,0 +1,260 @@
+import argparse
+import base64
+import datetime
+import glob
+import os
+import threading
+from lxml import etree
+
+from . import firma
+from .firmante import Firmante
+
+CFDI = "{http://www.sat.gob.mx/cfd/4}"
+
+# El SAT guarda "RFC / CURP" del titular en x500UniqueIdentifier
+OID_RFC = "2.5.4.45"
+
+# Fecha del comprobante en hora del centro de México (sin horario de verano desde 2022)
+ZONA_CFDI = datetime.timezone(datetime.timedelta(hours=-6))
+
+
+class CSDNoEncontrado(LookupError):
+    """No hay un CSD cargado para ese RFC vigente en la fecha."""
+
+
+def _fecha_cfdi(fecha):
+    if fecha is None:
+        return datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(fecha, str):
+        fecha = datetime.datetime.fromisoformat(fecha)
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=ZONA_CFDI)
+    return fecha
+
+
+class Certificado:
+    """
+    Certificado de un CSD ya parseado, con los datos que lleva el CFDI.
+
+    Atributos:
+        rfc (str): RFC del titular.
+        no_certificado (str): NoCertificado de 20 dígitos (del número de serie).
+        certificado_b64 (str): DER en Base64 para el atributo Certificado.
+        inicio, fin (datetime): Vigencia en UTC.
+        formato (str): "DER" o "PEM", según venía el archivo.
+    """
+
+    def __init__(self, contenido):
+        from cryptography import x509
+        from cryptography.hazmat.primitives.serialization import Encoding
+
+        try:
+            self.x509 = x509.load_der_x509_certificate(contenido)
+            self.formato = "DER"
+        except ValueError:
+            self.x509 = x509.load_pem_x509_certificate(contenido)
+            self.formato = "PEM"
+        self.no_certificado = firma.numero_certificado(self.x509)
+        self.certificado_b64 = base64.b64encode(self.x509.public_bytes(Encoding.DER)).decode("ascii")
+        self.inicio = self.x509.not_valid_before_utc
+        self.fin = self.x509.not_valid_after_utc
+        identificadores = [a.value for a in self.x509.subject if a.oid.dotted_string == OID_RFC]
+        self.rfc = identificadores[0].split("/")[0].strip().upper() if identificadores else None
+        self.llave_publica = self.x509.public_key()
+
+    def vigente(self, fecha=None):
+        return self.inicio <= _fecha_cfdi(fecha) <= self.fin
+
+
+# Certificados parseados del proceso, por (ruta, mtime, tamaño)
+_certificados = {}
+_candado_certificados = threading.Lock()
+
+
+def leer_certificado(cer):
+    """
+    Certificado parseado desde una ruta (con cache por proceso) o desde bytes.
+
+    Un archivo ya leído no se vuelve a abrir ni a parsear mientras no cambie en disco.
+    """
+    if not isinstance(cer, str):
+        return Certificado(cer)
+    estado = os.stat(cer)
+    llave = (os.path.abspath(cer), estado.st_mtime_ns, estado.st_size)
+    certificado = _certificados.get(llave)
+    if certificado is None:
+        with open(cer, "rb") as cer_file:
+            certificado = Certificado(cer_file.read())
+        with _candado_certificados:
+            _certificados[llave] = certificado
+    return certificado
+
+
+class CSD:
+    """
+    Par .cer/.key de un emisor. La llave se descifra en el primer uso y se
+    comprueba que corresponda al certificado.
+    """
+
+    def __init__(self, certificado, llave, password):
+        self.certificado = certificado
+        self.key_b64 = base64.b64encode(llave).decode("ascii")  # para FiscalAPI
+        self._llave = llave
+        self._password = password
+        self._firmante = None
+        self._candado = threading.Lock()
+
+    rfc = property(lambda self: self.certificado.rfc)
+    no_certificado = property(lambda self: self.certificado.no_certificado)
+    certificado_b64 = property(lambda self: self.certificado.certificado_b64)
+
+    @property
+    def firmante(self):
+        if self._firmante is None:
+            with self._candado:
+                if self._firmante is None:
+                    firmante = Firmante.desde_bytes(self._llave, self._password)
+                    publica = firmante.llave_privada.public_key().public_numbers()
+                    if publica != self.certificado.llave_publica.public_numbers():
+                        raise ValueError(f"La llave no corresponde al certificado {self.no_certificado}")
+                    self._firmante = firmante
+        return self._firmante
+
+    def credenciales(self):
+        """(certificado_b64, key_b64, password) para los servicios del PAC que piden el CSD (cancelación)."""
+        password = self._password
+        if isinstance(password, bytes):
+            password = password.decode("utf-8")
+        return self.certificado_b64, self.key_b64, password
+
+    def __repr__(self):
+        return (f"CSD({self.rfc}, {self.no_certificado}, "
+                f"{self.certificado.inicio:%Y-%m-%d} a {self.certificado.fin:%Y-%m-%d})")
+
+
+class GestorCSD:
+    """
+    CSD de muchos emisores en memoria, seleccionados por RFC y fecha.
+
+    Cada .cer se parsea y cada .key se lee una sola vez (la llave se descifra
+    al firmar el primer comprobante de ese emisor). sellar() toma el RFC del
+    Emisor y la Fecha del comprobante, elige el CSD vigente en esa fecha e
+    inserta NoCertificado y Certificado antes de calcular la cadena original,
+    sin tocar el disco por factura.
+
+    Uso:
+        gestor = GestorCSD()
+        gestor.cargar_directorio("csd/", passwords={"EKU9003173C9": "12345678a"})
+        xml_sellado = gestor.sellar(xml)
+    """
+
+    def __init__(self):
+        self._por_rfc = {}  # RFC -> [CSD] ordenados por inicio de vigencia
+        self._candado = threading.Lock()
+
+    def agregar(self, cer, key, password):
+        """
+        Carga un par .cer/.key.
+
+        Parámetros:
+            cer, key: Rutas de los archivos o su contenido en bytes.
+            password (bytes | str): Contraseña de la llave privada.
+
+        Retorna:
+            CSD: El CSD cargado.
+        """
+        certificado = leer_certificado(cer)
+        if certificado.rfc is None:
+            raise ValueError(f"El certificado {certificado.no_certificado} no trae el RFC del titular")
+        if isinstance(key, str):
+            with open(key, "rb") as key_file:
+                key = key_file.read()
+        csd = CSD(certificado, key, password)
+        with self._candado:
+            lista = [c for c in self._por_rfc.get(csd.rfc, []) if c.no_certificado != csd.no_certificado]
+            lista.append(csd)
+            lista.sort(key=lambda c: c.certificado.inicio)
+            self._por_rfc[csd.rfc] = lista
+        return csd
+
+    def cargar_directorio(self, directorio, passwords=None, password=None):
+        """
+        Carga todos los pares <nombre>.cer / <nombre>.key de un directorio.
+
+        Parámetros:
+            passwords (dict): Contraseña por RFC o por nombre de archivo.
+            password: Contraseña para los pares que no estén en `passwords`.
+
+        Retorna:
+            list: CSD cargados.
+        """
+        passwords = passwords or {}
+        cargados = []
+        for ruta_cer in sorted(glob.glob(os.path.join(directorio, "*.cer"))):
+            nombre = os.path.splitext(ruta_cer)[0]
+            ruta_key = next((nombre + e for e in (".key", ".pem") if os.path.exists(nombre + e)), None)
+            if ruta_key is None:
+                continue
+            rfc = leer_certificado(ruta_cer).rfc
+            clave = passwords.get(rfc, passwords.get(os.path.basename(nombre), password))
+            cargados.append(self.agregar(ruta_cer, ruta_key, clave))
+        return cargados
+
+    def rfcs(self):
+        return sorted(self._por_rfc)
+
+    def csds(self, rfc):
+        return list(self._por_rfc.get(rfc.upper(), ()))
+
+    def seleccionar(self, rfc, fecha=None):
+        """
+        CSD del RFC vigente en la fecha; si hay varios, el emitido más recientemente.
+
+        Parámetros:
+            fecha: datetime o texto ISO (la Fecha del CFDI, en hora del centro
+                de México si no trae zona); por omisión, ahora.
+        """
+        momento = _fecha_cfdi(fecha)
+        for csd in reversed(self._por_rfc.get((rfc or "").upper(), ())):
+            if csd.certificado.vigente(momento):
+                return csd
+        raise CSDNoEncontrado(f"No hay un CSD vigente para {rfc} en {momento:%Y-%m-%d %H:%M}")
+
+    def sellar(self, documento, metodo="xslt", serializar=True, cache=None, validar=False):
+        """
+        Sella un CFDI con el CSD de su emisor (ver firma.sellar_cfdi).
+
+        Parámetros:
+            documento: Bytes del XML, o un árbol/elemento de lxml.
+
+        Retorna:
+            bytes: XML sellado (o el elemento raíz si serializar=False).
+        """
+        if isinstance(documento, (bytes, bytearray)):
+            documento = etree.fromstring(bytes(documento))
+        raiz = documento.getroot() if isinstance(documento, etree._ElementTree) else documento
+        emisor = raiz.find(CFDI + "Emisor")
+        csd = self.seleccionar(emisor.get("Rfc") if emisor is not None else None, raiz.get("Fecha"))
+        return firma.sellar_cfdi(raiz, csd.firmante, csd.no_certificado, csd.certificado_b64,
+                                 metodo=metodo, serializar=serializar, cache=cache, validar=validar)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CSD cargados de un directorio.")
+    parser.add_argument("directorio", help="Directorio con pares <nombre>.cer / <nombre>.key")
+    parser.add_argument("--password", default="12345678a", help="Contraseña de las llaves")
+    parser.add_argument("--probar", action="store_true", help="Descifrar cada llave y comprobar que corresponda")
+    args = parser.parse_args()
+
+    gestor = GestorCSD()
+    gestor.cargar_directorio(args.directorio, password=args.password)
+    for rfc in gestor.rfcs():
+        for csd in gestor.csds(rfc):
+            estado = "vigente" if csd.certificado.vigente() else "vencido"
+            if args.probar:
+                try:
+                    csd.firmante
+                except ValueError as e:
+                    estado = f"❌ {e}"
+            print(f"{rfc}\t{csd.no_certificado}\t{csd.certificado.inicio:%Y-%m-%d}\t"
+                  f"{csd.certificado.fin:%Y-%m-%d}\t{estado}")
@@ -0,0 +1,526 @@
+import argparse
+import collections
+import csv
+import glob
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+
+from .almacen import _entero_a_total, _fecha_a_entero, _total_a_entero
+
+# numpy (tablas) se importa al extraer o leer; pyarrow (Parquet) solo si está instalado
+
+CFDI = "{http://www.sat.gob.mx/cfd/4}"
+TFD = "{http://www.sat.gob.mx/TimbreFiscalDigital}"
+
+# Columnas de cada tabla y su tipo: "texto", "entero" o "importe" (entero en millonésimas,
+# como los Totales del almacén). Fechas en AAAAMMDDhhmmss y periodo en AAAAMM, enteros.
+TABLAS = {
+    "comprobantes": (
+        ("uuid", "texto"), ("archivo", "texto"), ("serie", "texto"), ("folio", "texto"), ("fecha", "entero"),
+        ("periodo", "entero"), ("tipo", "texto"), ("moneda", "texto"), ("tipo_cambio", "importe"),
+        ("subtotal", "importe"), ("descuento", "importe"), ("total", "importe"),
+        ("total_trasladados", "importe"), ("total_retenidos", "importe"), ("forma_pago", "texto"),
+        ("metodo_pago", "texto"), ("lugar_expedicion", "texto"), ("emisor_rfc", "texto"),
+        ("emisor_nombre", "texto"), ("emisor_regimen", "texto"), ("receptor_rfc", "texto"),
+        ("receptor_nombre", "texto"), ("receptor_regimen", "texto"), ("uso_cfdi", "texto"),
+        ("fecha_timbrado", "entero"), ("rfc_prov_certif", "texto"), ("no_certificado_sat", "texto"),
+        ("conceptos", "entero"),
+    ),
+    "conceptos": (
+        ("uuid", "texto"), ("numero", "entero"), ("clave_prod_serv", "texto"), ("no_identificacion", "texto"),
+        ("cantidad", "importe"), ("clave_unidad", "texto"), ("descripcion", "texto"),
+        ("valor_unitario", "importe"), ("importe", "importe"), ("descuento", "importe"), ("objeto_imp", "texto"),
+    ),
+    # Impuestos del comprobante (no los de cada concepto), con lo necesario para resumir sin cruces
+    "impuestos": (
+        ("uuid", "texto"), ("periodo", "entero"), ("tipo", "texto"), ("moneda", "texto"),
+        ("emisor_rfc", "texto"), ("receptor_rfc", "texto"), ("clase", "texto"), ("impuesto", "texto"),
+        ("tipo_factor", "texto"), ("tasa", "texto"), ("base", "importe"), ("importe", "importe"),
+    ),
+}
+
+# Columnas de agrupación de resumir(), además del RFC: el del emisor (lo facturado y, en lo
+# recibido, el proveedor de la DIOT) o el del receptor
+CLAVES_RESUMEN = ("periodo", "tipo", "moneda", "clase", "impuesto", "tipo_factor", "tasa")
+ResumenImpuesto = collections.namedtuple(
+    "ResumenImpuesto", "rfc periodo tipo moneda clase impuesto tipo_factor tasa base importe comprobantes")
+
+# Etiquetas que interesan a iterparse; todo lo demás (Addenda, otros complementos) solo se recorre
+_ETIQUETAS = tuple(CFDI + nombre for nombre in ("Comprobante", "Emisor", "Receptor", "Concepto", "Impuestos",
+                                                  "Traslado", "Retencion")) + (TFD + "TimbreFiscalDigital",)
+
+
+def _importe(valor, omision=0):
+    return _total_a_entero(valor) if valor else omision
+
+
+def extraer_documento(fuente, archivo=""):
+    """
+    Extrae las filas de un CFDI timbrado con etree.iterparse, sin construir el árbol completo.
+
+    Cada Concepto se libera (junto con sus hermanos anteriores) al terminar de leerlo,
+    así que la memoria no crece con el número de conceptos.
+
+    Parámetros:
+        fuente: Ruta del XML o archivo binario.
+        archivo (str): Nombre a registrar en la columna `archivo`.
+
+    Retorna:
+        dict: Tabla -> lista de filas (tuplas en el orden de TABLAS).
+    """
+    comprobante = emisor = receptor = timbre = None
+    totales = {}
+    conceptos, impuestos = [], []
+    raiz = None
+    impuestos_raiz = False  # dentro de cfdi:Impuestos del comprobante (no de un concepto)
+    for evento, elemento in etree.iterparse(fuente, events=("start", "end"), tag=_ETIQUETAS,
+                                            remove_comments=True):
+        etiqueta = elemento.tag
+        if evento == "start":
+            if etiqueta == _ETIQUETAS[0]:
+                raiz, comprobante = elemento, dict(elemento.attrib)
+            elif etiqueta == _ETIQUETAS[1]:
+                emisor = dict(elemento.attrib)
+            elif etiqueta == _ETIQUETAS[2]:
+                receptor = dict(elemento.attrib)
+            elif etiqueta == _ETIQUETAS[4] and elemento.getparent() is raiz:
+                impuestos_raiz = True
+                totales = dict(elemento.attrib)
+            elif impuestos_raiz and (etiqueta == _ETIQUETAS[5] or etiqueta == _ETIQUETAS[6]):
+                impuestos.append(("traslado" if etiqueta == _ETIQUETAS[5] else "retencion", dict(elemento.attrib)))
+            elif etiqueta == _ETIQUETAS[7]:
+                timbre = dict(elemento.attrib)
+        elif etiqueta == _ETIQUETAS[3]:
+            conceptos.append(dict(elemento.attrib))
+            elemento.clear()
+            while elemento.getprevious() is not None:
+                del elemento.getparent()[0]
+        elif etiqueta == _ETIQUETAS[4] and elemento.getparent() is raiz:
+            impuestos_raiz = False
+
+    if comprobante is None:
+        raise ValueError("No es un CFDI 4.0 (falta cfdi:Comprobante)")
+    if timbre is None or not timbre.get("UUID"):
+        raise ValueError("El CFDI no tiene Timbre Fiscal Digital")
+    emisor, receptor = emisor or {}, receptor or {}
+    uuid = timbre["UUID"].upper()
+    fecha = _fecha_a_entero(comprobante.get("Fecha", ""))
+    periodo = fecha // 10 ** 8
+    tipo, moneda = comprobante.get("TipoDeComprobante", ""), comprobante.get("Moneda", "")
+    filas = {
+        "comprobantes": [(
+            uuid, archivo, comprobante.get("Serie", ""), comprobante.get("Folio", ""), fecha, periodo, tipo, moneda,
+            _importe(comprobante.get("TipoCambio"), 10 ** 6), _importe(comprobante.get("SubTotal")),
+            _importe(comprobante.get("Descuento")), _importe(comprobante.get("Total")),
+            _importe(totales.get("TotalImpuestosTrasladados")), _importe(totales.get("TotalImpuestosRetenidos")),
+            comprobante.get("FormaPago", ""), comprobante.get("MetodoPago", ""),
+            comprobante.get("LugarExpedicion", ""), emisor.get("Rfc", ""), emisor.get("Nombre", ""),
+            emisor.get("RegimenFiscal", ""), receptor.get("Rfc", ""), receptor.get("Nombre", ""),
+            receptor.get("RegimenFiscalReceptor", ""), receptor.get("UsoCFDI", ""),
+            _fecha_a_entero(timbre.get("FechaTimbrado", "")), timbre.get("RfcProvCertif", ""),
+            timbre.get("NoCertificadoSAT", ""), len(conceptos),
+        )],
+        "conceptos": [(
+            uuid, numero, c.get("ClaveProdServ", ""), c.get("NoIdentificacion", ""), _importe(c.get("Cantidad")),
+            c.get("ClaveUnidad", ""), c.get("Descripcion", ""), _importe(c.get("ValorUnitario")),
+            _importe(c.get("Importe")), _importe(c.get("Descuento")), c.get("ObjetoImp", ""),
+        ) for numero, c in enumerate(conceptos, 1)],
+        "impuestos": [(
+            uuid, periodo, tipo, moneda, emisor.get("Rfc", ""), receptor.get("Rfc", ""), clase,
+            i.get("Impuesto", ""), i.get("TipoFactor", ""), i.get("TasaOCuota", ""), _importe(i.get("Base")),
+            _importe(i.get("Importe")),
+        ) for clase, i in impuestos],
+    }
+    return filas
+
+
+def _columnas(nombre, filas):
+    """Filas de una tabla -> columnas de numpy (texto '<U', enteros e importes int64)."""
+    import numpy as np
+
+    esquema = TABLAS[nombre]
+    valores = list(zip(*filas)) if filas else [()] * len(esquema)
+    return {columna: np.array(datos, dtype=str if tipo == "texto" else np.int64)
+            for (columna, tipo), datos in zip(esquema, valores)}
+
+
+def _extraer_lote(documentos):
+    """
+    Extrae un lote de documentos (rutas, o (nombre, bytes) del almacén) en un proceso trabajador.
+
+    Retorna:
+        tuple: (tablas como columnas de numpy, [(documento, error), ...]).
+    """
+    filas = {nombre: [] for nombre in TABLAS}
+    errores = []
+    for documento in documentos:
+        if isinstance(documento, str):
+            nombre, fuente = documento, documento
+        else:
+            nombre, fuente = documento[0], io.BytesIO(documento[1])
+        try:
+            extraidas = extraer_documento(fuente, nombre)
+        except (OSError, ValueError, etree.XMLSyntaxError) as e:
+            errores.append((nombre, f"{type(e).__name__}: {e}"))
+            continue
+        for tabla, nuevas in extraidas.items():
+            filas[tabla].extend(nuevas)
+    return {nombre: _columnas(nombre, filas[nombre]) for nombre in TABLAS}, errores
+
+
+def _concatenar(partes):
+    import numpy as np
+
+    return {columna: np.concatenate([parte[columna] for parte in partes]) for columna in partes[0]}
+
+
+class Extractor:
+    """
+    Extrae CFDI timbrados a tablas columnares (comprobantes, conceptos e impuestos) para análisis.
+
+    Cada documento se lee con etree.iterparse (ver extraer_documento) en un
+    ProcessPoolExecutor por lotes, con a lo sumo `ventana` lotes en vuelo. Las
+    filas se guardan por partes en `destino`/<tabla>/parte-NNNNNN.npz (o
+    .parquet si pyarrow está instalado): texto como '<U', fechas y periodos
+    como enteros e importes como enteros en millonésimas, así que las sumas
+    son exactas.
+
+    El manifiesto (destino/extraccion.json) guarda una marca de agua por
+    origen: para un directorio o patrón, la última (fecha de modificación,
+    ruta) procesada; para un Almacen, el número del último registro. Cada
+    ejecución solo procesa lo nuevo desde la marca y la avanza después de
+    escribir cada parte, así que una interrupción se retoma sin duplicar.
+    Los documentos que fallaron (a medio escribir, ilegibles o aún sin
+    timbrar) quedan en el manifiesto y se reintentan en la siguiente
+    ejecución aunque la marca ya los haya pasado.
+
+    Uso:
+        extractor = Extractor("tablas")
+        extractor.extraer("timbrados/")
+        for fila in resumir("tablas", por="emisor", desde=202403, hasta=202403):
+            print(fila)
+    """
+
+    def __init__(self, destino, procesos=None, lote=256, por_parte=100_000, ventana=None, formato=None):
+        """
+        Parámetros:
+            destino (str): Directorio de las tablas.
+            procesos (int): Procesos trabajadores (por omisión, núcleos).
+            lote (int): Documentos por tarea.
+            por_parte (int): Documentos por parte escrita (y por avance de la marca de agua).
+            ventana (int): Lotes en vuelo como máximo (por omisión, procesos * 4).
+            formato (str): "npz" o "parquet"; por omisión parquet si pyarrow está instalado.
+                Un destino existente conserva el suyo.
+        """
+        self.destino = destino
+        self.procesos = procesos or os.cpu_count() or 1
+        self.lote = lote
+        self.por_parte = por_parte
+        self.ventana = ventana or self.procesos * 4
+        self._ruta_manifiesto = os.path.join(destino, "extraccion.json")
+        if os.path.exists(self._ruta_manifiesto):
+            with open(self._ruta_manifiesto, encoding="utf-8") as f:
+                self.manifiesto = json.load(f)
+        else:
+            self.manifiesto = {"version": 1, "formato": formato or self._formato_disponible(), "partes": 0,
+                               "documentos": 0, "marcas": {}}
+        self.manifiesto.setdefault("reintentos", {})  # origen -> documentos que fallaron
+        self.formato = self.manifiesto["formato"]
+        self.documentos = 0
+        self.errores = 0
+        self.segundos = 0.0
+
+    @staticmethod
+    def _formato_disponible():
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return "npz"
+        return "parquet"
+
+    @property
+    def por_segundo(self):
+        """Documentos por segundo de la última ejecución."""
+        return self.documentos / self.segundos if self.segundos else 0.0
+
+    def _guardar_manifiesto(self):
+        temporal = self._ruta_manifiesto + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(self.manifiesto, f, indent=2)
+        os.replace(temporal, self._ruta_manifiesto)
+
+    def _pendientes(self, origen):
+        """
+        Documentos por procesar del origen: primero los que fallaron antes, luego los nuevos desde la marca de agua.
+
+        Los reintentos llevan la marca vigente, así que no la mueven.
+
+        Retorna:
+            tuple: (clave del origen en el manifiesto, generador de (documento, marca)).
+        """
+        if os.path.isfile(os.path.join(origen, "manifiesto.json")) and os.path.isfile(
+                os.path.join(origen, "registros.bin")):
+            from .almacen import Almacen
+
+            clave = "almacen:" + os.path.abspath(origen)
+            marca = self.manifiesto["marcas"].get(clave, -1)
+            reintentos = sorted(int(nombre.rpartition("#")[2])
+                                for nombre in self.manifiesto["reintentos"].get(clave, ()))
+
+            def del_almacen():
+                with Almacen(origen) as almacen:
+                    for numero in reintentos:
+                        yield (f"{origen}#{numero}", bytes(almacen.xml(numero))), marca
+                    for numero in range(marca + 1, len(almacen)):
+                        yield (f"{origen}#{numero}", bytes(almacen.xml(numero))), numero
+            return clave, del_almacen()
+
+        # Rutas absolutas: la marca vale sin importar desde dónde se ejecute
+        clave = os.path.abspath(origen)
+        rutas = glob.glob(os.path.join(clave, "*.xml") if os.path.isdir(origen) else clave)
+        marca = tuple(self.manifiesto["marcas"].get(clave, (-1, "")))
+        nuevos = []
+        for ruta in rutas:
+            try:
+                llave = (os.stat(ruta).st_mtime_ns, ruta)
+            except FileNotFoundError:
+                continue
+            if llave > marca:
+                nuevos.append(llave)
+        nuevos.sort()
+        # Un reintento que además cambió desde la marca se procesa una sola vez, entre los nuevos
+        en_nuevos = {ruta for _, ruta in nuevos}
+        reintentos = [ruta for ruta in self.manifiesto["reintentos"].get(clave, ())
+                      if ruta not in en_nuevos and os.path.exists(ruta)]
+        vigente = list(marca) if marca[0] >= 0 else None
+        return clave, itertools.chain(((ruta, vigente) for ruta in reintentos),
+                                      ((ruta, [mtime, ruta]) for mtime, ruta in nuevos))
+
+    def _escribir_parte(self, tablas):
+        numero = self.manifiesto["partes"] + 1
+        for nombre, columnas in tablas.items():
+            directorio = os.path.join(self.destino, nombre)
+            os.makedirs(directorio, exist_ok=True)
+            ruta = os.path.join(directorio, f"parte-{numero:06d}.{self.formato}")
+            temporal = ruta + ".tmp"
+            if self.formato == "parquet":
+                import pyarrow
+                import pyarrow.parquet
+
+                pyarrow.parquet.write_table(pyarrow.table(columnas), temporal)
+            else:
+                import numpy as np
+
+                with open(temporal, "wb") as f:
+                    np.savez(f, **columnas)
+            os.replace(temporal, ruta)
+        self.manifiesto["partes"] = numero
+
+    def extraer(self, origen):
+        """
+        Extrae los documentos del origen que no se habían procesado.
+
+        Parámetros:
+            origen (str): Directorio de XML timbrados, patrón glob, o directorio de un Almacen.
+
+        Retorna:
+            list: (documento, error) de los que no se pudieron leer (no detienen la extracción;
+                se reintentan en la siguiente ejecución).
+        """
+        os.makedirs(self.destino, exist_ok=True)
+        clave, documentos = self._pendientes(origen)
+        self.documentos = self.errores = 0
+        fallidos = []
+        # Lo que falta por leer bien: los reintentos previos salen al procesarse y entran los nuevos fallos
+        reintentar = set(self.manifiesto["reintentos"].get(clave, ()))
+        inicio = time.perf_counter()
+
+        def lotes():
+            lote, marca = [], None
+            for documento, marca in documentos:
+                lote.append(documento)
+                if len(lote) == self.lote:
+                    yield lote, marca
+                    lote = []
+            if lote:
+                yield lote, marca
+
+        acumuladas, en_parte = [], 0
+
+        def terminar(resultado, marca, nombres):
+            nonlocal en_parte
+            tablas, errores = resultado
+            acumuladas.append(tablas)
+            fallidos.extend(errores)
+            reintentar.difference_update(nombres)
+            reintentar.update(documento for documento, _ in errores)
+            leidos = len(tablas["comprobantes"]["uuid"])
+            self.documentos += leidos
+            self.errores += len(errores)
+            en_parte += leidos + len(errores)
+            if en_parte >= self.por_parte:
+                guardar(marca)
+
+        def guardar(marca):
+            nonlocal acumuladas, en_parte
+            if acumuladas:
+                self._escribir_parte({nombre: _concatenar([t[nombre] for t in acumuladas]) for nombre in TABLAS})
+            self.manifiesto["documentos"] += sum(len(t["comprobantes"]["uuid"]) for t in acumuladas)
+            if marca is not None:
+                self.manifiesto["marcas"][clave] = marca
+            if reintentar:
+                self.manifiesto["reintentos"][clave] = sorted(reintentar)
+            else:
+                self.manifiesto["reintentos"].pop(clave, None)
+            self._guardar_manifiesto()
+            acumuladas, en_parte = [], 0
+
+        ultima = None
+        with ProcessPoolExecutor(self.procesos) as executor:
+            pendientes = collections.deque()
+            for lote, marca in lotes():
+                nombres = [d if isinstance(d, str) else d[0] for d in lote]
+                pendientes.append((executor.submit(_extraer_lote, lote), marca, nombres))
+                if len(pendientes) >= self.ventana:
+                    futuro, ultima, enviado = pendientes.popleft()
+                    terminar(futuro.result(), ultima, enviado)
+            while pendientes:
+                futuro, ultima, enviado = pendientes.popleft()
+                terminar(futuro.result(), ultima, enviado)
+        if acumuladas or en_parte:
+            guardar(ultima)
+        self.segundos = time.perf_counter() - inicio
+        return fallidos
+
+
+def leer_tabla(destino, nombre, columnas=None):
+    """
+    Lee todas las partes de una tabla.
+
+    Parámetros:
+        destino (str): Directorio de las tablas (el de Extractor).
+        nombre (str): "comprobantes", "conceptos" o "impuestos".
+        columnas (tuple): Columnas a leer (por omisión, todas).
+
+    Retorna:
+        dict: Columna -> arreglo de numpy con las filas de todas las partes.
+    """
+    import numpy as np
+
+    columnas = tuple(columnas or (columna for columna, _ in TABLAS[nombre]))
+    tipos = dict(TABLAS[nombre])
+    partes = []
+    for ruta in sorted(glob.glob(os.path.join(destino, nombre, "parte-*"))):
+        if ruta.endswith(".npz"):
+            with np.load(ruta) as datos:
+                partes.append({columna: datos[columna] for columna in columnas})
+        elif ruta.endswith(".parquet"):
+            import pyarrow.parquet
+
+            tabla = pyarrow.parquet.read_table(ruta, columns=list(columnas))
+            # El texto llega como objetos; '<U' como en .npz (resumir agrupa con arreglos estructurados)
+            partes.append({columna: np.asarray(tabla.column(columna).to_numpy(),
+                                               dtype=str if tipos[columna] == "texto" else np.int64)
+                           for columna in columnas})
+    if not partes:
+        return {columna: np.array([], dtype=str if tipos[columna] == "texto" else np.int64) for columna in columnas}
+    return _concatenar(partes)
+
+
+def resumir(destino, por="emisor", desde=None, hasta=None, rfc=None):
+    """
+    Totales de impuestos del comprobante por RFC y periodo, con sumas enteras exactas.
+
+    Agrupa por RFC, periodo (AAAAMM), TipoDeComprobante, Moneda, clase
+    (traslado o retención), Impuesto, TipoFactor y TasaOCuota; los importes
+    quedan en la moneda de cada comprobante.
+
+    Parámetros:
+        destino (str): Directorio de las tablas.
+        por (str): "emisor" o "receptor": el RFC por el que se agrupa.
+        desde, hasta (int): Periodos AAAAMM inclusivos.
+        rfc (str): Solo ese RFC.
+
+    Retorna:
+        list: ResumenImpuesto ordenados por RFC, periodo y el resto de la clave.
+    """
+    import numpy as np
+
+    if por not in ("emisor", "receptor"):
+        raise ValueError("por debe ser 'emisor' o 'receptor'")
+    columna_rfc = f"{por}_rfc"
+    datos = leer_tabla(destino, "impuestos", (columna_rfc,) + CLAVES_RESUMEN + ("base", "importe"))
+    filtro = np.ones(len(datos["periodo"]), dtype=bool)
+    if desde is not None:
+        filtro &= datos["periodo"] >= int(desde)
+    if hasta is not None:
+        filtro &= datos["periodo"] <= int(hasta)
+    if rfc is not None:
+        filtro &= datos[columna_rfc] == rfc
+    datos = {columna: valores[filtro] for columna, valores in datos.items()}
+    if not len(datos["periodo"]):
+        return []
+
+    nombres = (columna_rfc,) + CLAVES_RESUMEN
+    claves = np.empty(len(datos["periodo"]), dtype=[(n, datos[n].dtype) for n in nombres])
+    for nombre in nombres:
+        claves[nombre] = datos[nombre]
+    grupos, inverso = np.unique(claves, return_inverse=True)
+    inverso = inverso.ravel()
+    base = np.zeros(len(grupos), dtype=np.int64)
+    importe = np.zeros(len(grupos), dtype=np.int64)
+    np.add.at(base, inverso, datos["base"])
+    np.add.at(importe, inverso, datos["importe"])
+    cuenta = np.bincount(inverso, minlength=len(grupos))
+    return [ResumenImpuesto(str(g[0]), int(g[1]), *(str(v) for v in tuple(g)[2:]),
+                            _entero_a_total(b), _entero_a_total(i), int(c))
+            for g, b, i, c in zip(grupos, base, importe, cuenta)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extracción de CFDI timbrados a tablas columnares.")
+    parser.add_argument("--destino", default="tablas_cfdi", help="Directorio de las tablas")
+    acciones = parser.add_subparsers(dest="accion", required=True)
+    extraer = acciones.add_parser("extraer", help="Extrae lo nuevo desde la última marca de agua")
+    extraer.add_argument("origen", help="Directorio o patrón glob de XML timbrados, o un Almacen")
+    extraer.add_argument("--procesos", type=int, default=None, help="Procesos (por omisión, núcleos)")
+    extraer.add_argument("--formato", default=None, choices=("npz", "parquet"))
+    resumen = acciones.add_parser("resumen", help="Impuestos por RFC y periodo")
+    resumen.add_argument("--por", default="emisor", choices=("emisor", "receptor"))
+    resumen.add_argument("--desde", type=int, default=None, help="Periodo AAAAMM inicial")
+    resumen.add_argument("--hasta", type=int, default=None, help="Periodo AAAAMM final")
+    resumen.add_argument("--rfc", default=None)
+    resumen.add_argument("--salida", default=None, help="CSV de salida (por omisión, la consola)")
+    args = parser.parse_args()
+
+    if args.accion == "extraer":
+        extractor = Extractor(args.destino, args.procesos, formato=args.formato)
+        for documento, error in extractor.extraer(args.origen):
+            print(f"❌ {documento}: {error}")
+        print(f"✅ {extractor.documentos} CFDI extraídos a {args.destino} ({extractor.formato}) en "
+              f"{extractor.segundos:.2f} s ({extractor.por_segundo:.0f} documentos/s); "
+              f"{extractor.manifiesto['documentos']} en total")
+    else:
+        filas = resumir(args.destino, args.por, args.desde, args.hasta, args.rfc)
+        salida = open(args.salida, "w", newline="", encoding="utf-8") if args.salida else None
+        try:
+            escritor = csv.writer(salida) if salida else None
+            if escritor:
+                escritor.writerow(ResumenImpuesto._fields)
+            for fila in filas:
+                if escritor:
+                    escritor.writerow(fila)
+                else:
+                    print(f"{fila.rfc} {fila.periodo} {fila.tipo} {fila.moneda} {fila.clase} {fila.impuesto} "
+                          f"{fila.tipo_factor} {fila.tasa}: base {fila.base}, importe {fila.importe} "
+                          f"({fila.comprobantes} CFDI)")
+        finally:
+            if salida:
+                salida.close()
+        if args.salida:
+            print(f"✅ {len(filas)} renglones en {args.salida}")
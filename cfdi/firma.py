@@ -0,0 +1,190 @@
+import base64
+import logging
+from lxml import etree
+
+from . import cache_resultados, cadena, instrumentacion
+
+# cryptography se importa dentro de cada función: importar el paquete (por
+# ejemplo, en un proceso trabajador recién creado) no debe pagar su carga.
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorFirma(ValueError):
+    """Falla al cargar el CSD o al calcular el sello de un CFDI."""
+
+
+class LlaveInvalida(ErrorFirma):
+    """La llave privada no se pudo descifrar (contraseña incorrecta o formato no soportado)."""
+
+
+class FirmaFallida(ErrorFirma):
+    """La llave no pudo firmar la cadena original."""
+
+
+def convertir_a_base64(ruta_archivo):
+    """
+    Convierte un archivo en Base64.
+
+    Parámetros:
+        ruta_archivo (str): Ruta del archivo a convertir.
+
+    Retorna:
+        str: Contenido del archivo en formato Base64. Si el archivo no existe se
+            lanza FileNotFoundError.
+    """
+    with open(ruta_archivo, "rb") as file:
+        return base64.b64encode(file.read()).decode()
+
+
+def cargar_llave_privada(ruta_key, password=b'12345678a'):
+    """
+    Carga la llave privada desde un archivo .key en formato DER.
+
+    Lanza FileNotFoundError si el archivo no existe y LlaveInvalida si no se
+    puede descifrar con la contraseña.
+    """
+    from cryptography.hazmat.primitives.serialization import load_der_private_key
+
+    with instrumentacion.etapa("llave"):
+        with open(ruta_key, 'rb') as key_file:
+            contenido = key_file.read()
+        try:
+            return load_der_private_key(contenido, password=password)
+        except (ValueError, TypeError) as e:
+            raise LlaveInvalida(f"No se pudo cargar la llave privada {ruta_key}: {e}") from e
+
+
+def firmar_cadena(cadena_original, llave_privada):
+    """Firma la cadena original con la llave privada usando SHA256 y PKCS1 v1.5 (FirmaFallida si no puede)."""
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    try:
+        firma = llave_privada.sign(
+            cadena_original.encode('utf-8'),
+            padding.PKCS1v15(),
+            hashes.SHA256()
+        )
+    except (ValueError, TypeError, AttributeError) as e:
+        raise FirmaFallida(f"Error al firmar la cadena original: {e}") from e
+    # Convertir la firma a Base64 para su uso en XML
+    return base64.b64encode(firma).decode('utf-8')
+
+
+def insertar_sello_en_xml(xml_path, sello, output_path):
+    """Inserta el sello digital en el XML CFDI dentro del atributo 'Sello'."""
+    xml_doc = etree.parse(xml_path)  # Cargar el XML CFDI
+    root = xml_doc.getroot()
+    root.set("Sello", sello)  # Insertar el sello digital generado
+    xml_doc.write(output_path, xml_declaration=True, encoding='UTF-8', pretty_print=True)
+    logger.info("✅ XML firmado correctamente: %s", output_path, extra={"salida": output_path})
+
+
+def numero_certificado(certificado):
+    """
+    Obtiene el NoCertificado (20 dígitos) a partir del número de serie del CSD.
+
+    El SAT codifica cada dígito del número de certificado como un byte ASCII
+    dentro del número de serie X.509.
+    """
+    serie = certificado.serial_number
+    return serie.to_bytes((serie.bit_length() + 7) // 8, "big").decode("ascii")
+
+
+def cargar_certificado(cer):
+    """
+    Carga un certificado CSD (.cer) en DER o PEM.
+
+    Parámetros:
+        cer: Ruta del archivo .cer o su contenido en bytes.
+
+    Retorna:
+        tuple: (NoCertificado, Certificado en Base64 del DER) listos para el XML.
+    """
+    from .csd import leer_certificado
+
+    # Una ruta ya leída se toma de la cache de certificados del proceso
+    certificado = leer_certificado(cer)
+    return certificado.no_certificado, certificado.certificado_b64
+
+
+def sellar_cfdi(documento, llave_privada, no_certificado=None, certificado_b64=None,
+                metodo="xslt", serializar=True, cache=None, validar=False):
+    """
+    Sella un CFDI en memoria con un solo parseo y una sola serialización.
+
+    Parámetros:
+        documento: Bytes del XML, o un árbol/elemento de lxml (por ejemplo el de
+            generacion.construir_comprobante); los árboles se modifican en sitio.
+        llave_privada: Llave privada ya cargada (ver cargar_llave_privada) o un Firmante.
+        no_certificado (str): NoCertificado a fijar antes de calcular la cadena.
+        certificado_b64 (str): Certificado en Base64 a fijar en el atributo Certificado.
+        metodo (str): Generación de la cadena original ("xslt", "nativo" o "auto").
+        serializar (bool): Si es False se devuelve el elemento raíz sellado.
+        cache: Cache de resultados (ver cache_resultados); si el mismo documento ya
+            se firmó con ese certificado se reutiliza su Sello sin transformar ni firmar.
+        validar (bool): Validar antes de firmar (ver cfdi.validacion); un documento
+            inválido lanza ComprobanteInvalido con todos sus errores.
+
+    Retorna:
+        bytes: XML sellado (o el elemento raíz si serializar=False). Nada se escribe a disco.
+    """
+    # "sellado" mide el total; parseo, cadena, firma y serialización son sus tramos hijos
+    with instrumentacion.etapa("sellado"):
+        digesto = None
+        if isinstance(documento, (bytes, bytearray)):
+            if cache is not None:
+                # Sobre los bytes recibidos es más barato que sobre el C14N
+                digesto = cache_resultados.digesto_bytes(bytes(documento), no_certificado)
+            with instrumentacion.etapa("parseo"):
+                raiz = etree.fromstring(bytes(documento))
+        elif isinstance(documento, etree._ElementTree):
+            raiz = documento.getroot()
+        else:
+            raiz = documento
+        with instrumentacion.comprobante_de(raiz):
+            return _sellar_raiz(raiz, llave_privada, no_certificado, certificado_b64, metodo, serializar, cache,
+                                validar, digesto)
+
+
+def _sellar_raiz(raiz, llave_privada, no_certificado, certificado_b64, metodo, serializar, cache, validar,
+                 digesto):
+    if validar:
+        from .validacion import exigir_valido
+
+        with instrumentacion.etapa("validacion"):
+            exigir_valido(raiz)
+
+    # NoCertificado forma parte de la cadena original; Certificado y Sello no
+    if no_certificado is not None:
+        raiz.set("NoCertificado", no_certificado)
+    if certificado_b64 is not None:
+        raiz.set("Certificado", certificado_b64)
+
+    sello = None
+    if cache is not None:
+        digesto = digesto or cache_resultados.digesto_documento(raiz)
+        sello = cache_resultados.buscar_sello(cache, digesto, raiz.get("NoCertificado"))
+    if sello is None:
+        with instrumentacion.etapa("cadena", metodo=metodo):
+            cadena_original = cadena.generar_cadena_original(raiz, metodo=metodo)
+        with instrumentacion.etapa("firma"):
+            if hasattr(llave_privada, "firmar"):
+                sello = llave_privada.firmar(cadena_original)  # un Firmante (ver cfdi.firmante)
+            else:
+                sello = firmar_cadena(cadena_original, llave_privada)
+        if cache is not None:
+            cache_resultados.guardar_sello(cache, digesto, raiz.get("NoCertificado"), cadena_original, sello)
+    raiz.set("Sello", sello)
+
+    if not serializar:
+        return raiz
+    with instrumentacion.etapa("serializacion"):
+        return etree.tostring(raiz.getroottree(), xml_declaration=True, encoding="UTF-8", pretty_print=True)
+
+
+def guardar(contenido, output_path):
+    """Escribe a disco un XML sellado por sellar_cfdi."""
+    with open(output_path, "wb") as f:
+        f.write(contenido)
@@ -0,0 +1,179 @@
+import argparse
+import collections
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+
+from . import cache_resultados, firma
+from .csd import GestorCSD
+from .firmante import Firmante
+
+# Resultado por documento; `error` es None cuando la firma fue exitosa
+ResultadoFirma = collections.namedtuple("ResultadoFirma", "documento sello salida error")
+
+# Estado de cada proceso trabajador: la llave se descifra una sola vez en el inicializador (Firmante),
+# o, con varios emisores, cada llave del GestorCSD en su primer documento
+_firmante = None
+_gestor = None
+_opciones = {}
+
+
+def _inicializar_trabajador(ruta_key, password, ruta_cer, directorio_salida, metodo, ruta_cache=None,
+                            validar=False, directorio_csd=None, passwords=None):
+    """Descifra la llave privada (y carga el certificado) del CSD una vez por proceso."""
+    global _firmante, _gestor
+    no_certificado = certificado_b64 = None
+    if directorio_csd:
+        _gestor = GestorCSD()
+        _gestor.cargar_directorio(directorio_csd, passwords, password)
+    else:
+        _firmante = Firmante.desde_archivo(ruta_key, password)
+        if ruta_cer:
+            no_certificado, certificado_b64 = firma.cargar_certificado(ruta_cer)
+    # La cache en disco se comparte entre procesos; cada uno tiene su nivel en memoria
+    cache = cache_resultados.CacheResultados(ruta_cache) if ruta_cache else None
+    _opciones.update(directorio_salida=directorio_salida, metodo=metodo, cache=cache, validar=validar,
+                     no_certificado=no_certificado, certificado_b64=certificado_b64)
+
+
+def _firmar_documento(documento):
+    """Cadena original, sello e inserción para un documento (ruta o bytes)."""
+    nombre = documento if isinstance(documento, str) else None
+    try:
+        if nombre is not None:
+            with open(nombre, "rb") as f:
+                documento = f.read()
+        if _gestor is not None:
+            raiz = _gestor.sellar(documento, _opciones["metodo"], serializar=False, cache=_opciones["cache"],
+                                  validar=_opciones["validar"])
+        else:
+            raiz = firma.sellar_cfdi(documento, _firmante, _opciones["no_certificado"],
+                                     _opciones["certificado_b64"], _opciones["metodo"], serializar=False,
+                                     cache=_opciones["cache"], validar=_opciones["validar"])
+        sello = raiz.get("Sello")
+        contenido = etree.tostring(raiz.getroottree(), xml_declaration=True, encoding="UTF-8",
+                                   pretty_print=True)
+        directorio_salida = _opciones["directorio_salida"]
+        if nombre is not None and directorio_salida:
+            salida = os.path.join(directorio_salida, os.path.basename(nombre))
+            with open(salida, "wb") as f:
+                f.write(contenido)
+        else:
+            salida = contenido
+        return ResultadoFirma(nombre, sello, salida, None)
+    except Exception as e:
+        return ResultadoFirma(nombre, None, None, f"{type(e).__name__}: {e}")
+
+
+def expandir_documentos(origen):
+    """
+    Normaliza el origen de documentos a un iterable.
+
+    Parámetros:
+        origen: Directorio (todos sus .xml), patrón glob, o iterable de rutas/bytes.
+
+    Retorna:
+        iterable: Rutas de archivo o contenidos en bytes, en orden.
+    """
+    if isinstance(origen, str):
+        if os.path.isdir(origen):
+            return sorted(glob.glob(os.path.join(origen, "*.xml")))
+        return sorted(glob.glob(origen))
+    return origen
+
+
+class FirmadorLote:
+    """
+    Firma lotes de CFDI repartiéndolos en un ProcessPoolExecutor.
+
+    Cada proceso descifra la llave .key una sola vez. Con `directorio_csd`
+    cada proceso carga los CSD de varios emisores (ver csd.GestorCSD) y sella
+    cada documento con el de su Emisor y Fecha; `passwords` da la contraseña
+    por RFC o nombre de archivo y `password` la de los demás. Los resultados
+    (y los errores por documento) se entregan en el mismo orden de entrada,
+    con a lo sumo `ventana` documentos en vuelo para mantener acotada la memoria.
+    """
+
+    def __init__(self, ruta_key, password, directorio_salida=None, procesos=None,
+                 metodo="xslt", ventana=None, ruta_cer=None, ruta_cache=None, validar=False,
+                 directorio_csd=None, passwords=None):
+        self.ruta_key = ruta_key
+        self.password = password
+        self.ruta_cer = ruta_cer
+        self.directorio_csd = directorio_csd
+        self.passwords = passwords
+        self.ruta_cache = ruta_cache
+        self.validar = validar
+        self.directorio_salida = directorio_salida
+        self.procesos = procesos or os.cpu_count() or 1
+        self.metodo = metodo
+        self.ventana = ventana or self.procesos * 64
+        self.procesados = 0
+        self.errores = 0
+        self.segundos = 0.0
+
+    @property
+    def por_segundo(self):
+        """Throughput de la última ejecución en facturas por segundo."""
+        return self.procesados / self.segundos if self.segundos else 0.0
+
+    def firmar(self, origen):
+        """Generador de ResultadoFirma, en orden, para todos los documentos del origen."""
+        if self.directorio_salida:
+            os.makedirs(self.directorio_salida, exist_ok=True)
+        self.procesados = self.errores = 0
+        inicio = time.perf_counter()
+        argumentos = (self.ruta_key, self.password, self.ruta_cer, self.directorio_salida, self.metodo,
+                      self.ruta_cache, self.validar, self.directorio_csd, self.passwords)
+        with ProcessPoolExecutor(self.procesos, initializer=_inicializar_trabajador,
+                                 initargs=argumentos) as executor:
+            pendientes = collections.deque()
+            for documento in expandir_documentos(origen):
+                pendientes.append(executor.submit(_firmar_documento, documento))
+                if len(pendientes) >= self.ventana:
+                    yield self._contar(pendientes.popleft().result(), inicio)
+            while pendientes:
+                yield self._contar(pendientes.popleft().result(), inicio)
+
+    def _contar(self, resultado, inicio):
+        self.procesados += 1
+        if resultado.error is not None:
+            self.errores += 1
+        self.segundos = time.perf_counter() - inicio
+        return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Firma masiva de CFDI con un pool de procesos.")
+    parser.add_argument("origen", help="Directorio o patrón glob de XML a firmar")
+    parser.add_argument("--salida", default="firmados", help="Directorio de los XML firmados")
+    parser.add_argument("--key", default="mi_llave.key", help="Llave privada del CSD (.key)")
+    parser.add_argument("--cer", default="mi_certificado.cer",
+                        help="Certificado del CSD para NoCertificado/Certificado ('' para omitir)")
+    parser.add_argument("--password", default="12345678a", help="Contraseña de la llave privada")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos (por omisión, núcleos)")
+    parser.add_argument("--metodo", default="xslt", choices=("xslt", "nativo", "auto"),
+                        help="Generación de la cadena original")
+    parser.add_argument("--cache", default=None, help="Cache de sellos en disco (SQLite) para documentos repetidos")
+    parser.add_argument("--validar", action="store_true", help="Validar cada documento antes de firmarlo")
+    parser.add_argument("--csd", default=None,
+                        help="Directorio con pares .cer/.key de varios emisores (ignora --key y --cer)")
+    parser.add_argument("--passwords", default=None, help="JSON con la contraseña de cada RFC para --csd")
+    args = parser.parse_args()
+
+    passwords = None
+    if args.passwords:
+        with open(args.passwords, encoding="utf-8") as f:
+            passwords = json.load(f)
+    firmador = FirmadorLote(args.key, args.password.encode("utf-8"), args.salida,
+                            args.procesos, args.metodo, ruta_cer=args.cer or None, ruta_cache=args.cache,
+                            validar=args.validar, directorio_csd=args.csd, passwords=passwords)
+    for resultado in firmador.firmar(args.origen):
+        if resultado.error is not None:
+            print(f"❌ {resultado.documento}: {resultado.error}")
+    print(f"✅ {firmador.procesados - firmador.errores}/{firmador.procesados} firmados "
+          f"en {firmador.segundos:.2f} s ({firmador.por_segundo:.1f} facturas/s, "
+          f"{firmador.procesos} procesos)")
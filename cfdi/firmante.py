@@ -0,0 +1,191 @@
+import argparse
+import binascii
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import instrumentacion
+
+# Tamaño de los grupos de cadenas que recibe cada hilo en firmar_concurrente
+TAMANO_GRUPO = 64
+
+
+class Firmante:
+    """
+    Firmante de larga vida para un CSD: la llave se descifra una sola vez.
+
+    Guarda los objetos de relleno (PKCS1v15) y de algoritmo (SHA-256
+    prehasheado) en lugar de crearlos en cada firma, calcula el SHA-256 con
+    hashlib (que libera el GIL con entradas grandes y admite la cadena por
+    partes) y entrega los sellos con binascii, sin pasar por base64.b64encode.
+    La llave de cryptography es inmutable, así que firmar() puede llamarse
+    desde varios hilos a la vez; firmar_concurrente() reparte un lote en un
+    pool de hilos sin el costo de crear procesos.
+
+    Uso:
+        firmante = Firmante.desde_archivo("mi_llave.key", b"12345678a")
+        sello = firmante.firmar(cadena_original)
+        sellos = firmante.firmar_lote(cadenas)
+    """
+
+    def __init__(self, llave_privada, hilos=None):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding, utils
+
+        self.llave_privada = llave_privada
+        self.hilos = hilos or os.cpu_count() or 1
+        self._relleno = padding.PKCS1v15()
+        self._algoritmo = utils.Prehashed(hashes.SHA256())
+        self._firmar = llave_privada.sign
+        self._pool = None
+        self._candado = threading.Lock()
+
+    @classmethod
+    def desde_bytes(cls, contenido, password=b"12345678a", **opciones):
+        """
+        Descifra una llave privada en DER (el .key del SAT, PKCS#8 cifrado) o PEM.
+
+        Parámetros:
+            contenido (bytes): Contenido del archivo de la llave.
+            password (bytes | str): Contraseña de la llave; None si no está cifrada.
+        """
+        from cryptography.hazmat.primitives.serialization import load_der_private_key, load_pem_private_key
+
+        if isinstance(password, str):
+            password = password.encode("utf-8")
+        with instrumentacion.etapa("llave"):
+            if contenido.lstrip().startswith(b"-----BEGIN"):
+                llave = load_pem_private_key(contenido, password=password)
+            else:
+                llave = load_der_private_key(contenido, password=password)
+        return cls(llave, **opciones)
+
+    @classmethod
+    def desde_archivo(cls, ruta_key, password=b"12345678a", **opciones):
+        """Lee y descifra la llave de un archivo .key (DER) o .pem."""
+        with open(ruta_key, "rb") as key_file:
+            return cls.desde_bytes(key_file.read(), password, **opciones)
+
+    def cerrar(self):
+        with self._candado:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+    @staticmethod
+    def digesto(cadena):
+        """
+        SHA-256 de la cadena original.
+
+        Parámetros:
+            cadena: bytes (UTF-8), str, o un iterable de partes en bytes para
+                calcularlo incrementalmente sin unir la cadena completa.
+        """
+        if isinstance(cadena, str):
+            cadena = cadena.encode("utf-8")
+        if isinstance(cadena, (bytes, bytearray, memoryview)):
+            return hashlib.sha256(cadena).digest()
+        digesto = hashlib.sha256()
+        for parte in cadena:
+            digesto.update(parte)
+        return digesto.digest()
+
+    def firmar_digesto(self, digesto):
+        """Firma PKCS#1 v1.5 de un SHA-256 ya calculado; retorna los bytes de la firma."""
+        return self._firmar(digesto, self._relleno, self._algoritmo)
+
+    def firmar(self, cadena):
+        """
+        Sello (Base64) de una cadena original; igual al de firma.firmar_cadena.
+        """
+        return binascii.b2a_base64(self.firmar_digesto(self.digesto(cadena)), newline=False).decode("ascii")
+
+    def firmar_lote(self, cadenas):
+        """Sellos de varias cadenas, en orden; primero todas las firmas y luego la codificación."""
+        firmar, relleno, algoritmo = self._firmar, self._relleno, self._algoritmo
+        sha256, codificar = hashlib.sha256, binascii.b2a_base64
+        firmas = [firmar(sha256(c.encode("utf-8") if isinstance(c, str) else c).digest(), relleno, algoritmo)
+                  for c in cadenas]
+        return [codificar(f, newline=False).decode("ascii") for f in firmas]
+
+    def firmar_concurrente(self, cadenas, hilos=None):
+        """
+        Como firmar_lote, repartiendo grupos de TAMANO_GRUPO cadenas en un pool de hilos.
+
+        El pool se crea en la primera llamada y se reutiliza hasta cerrar().
+        """
+        cadenas = list(cadenas)
+        if len(cadenas) <= TAMANO_GRUPO:
+            return self.firmar_lote(cadenas)
+        with self._candado:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(hilos or self.hilos, thread_name_prefix="firmante")
+            pool = self._pool
+        grupos = [cadenas[i:i + TAMANO_GRUPO] for i in range(0, len(cadenas), TAMANO_GRUPO)]
+        sellos = []
+        for parcial in pool.map(self.firmar_lote, grupos):
+            sellos.extend(parcial)
+        return sellos
+
+
+def comparar(ruta_key="mi_llave.key", password=b"12345678a", cadenas=2000, longitud=1500, hilos=None):
+    """
+    Micro-benchmark de firma.firmar_cadena contra Firmante con cadenas sintéticas.
+
+    Retorna:
+        dict: Sellos por segundo de cada variante (y si los sellos coinciden).
+    """
+    from . import firma
+
+    muestras = [("||4.0|A|%08d|2024-03-09T12:00:00|01|" % i + "X" * longitud + "||") for i in range(cadenas)]
+    llave = firma.cargar_llave_privada(ruta_key, password)
+    firmante = Firmante(llave, hilos=hilos)
+    resultados = {}
+
+    def medir(nombre, funcion, repeticiones=cadenas):
+        inicio = time.perf_counter()
+        salida = funcion()
+        resultados[nombre] = repeticiones / (time.perf_counter() - inicio)
+        return salida
+
+    # Lo que hacían los scripts: recargar y descifrar la llave en cada firma
+    recarga = max(1, cadenas // 20)
+    medir("firmar_cadena_recargando_llave", lambda: [
+        firma.firmar_cadena(c, firma.cargar_llave_privada(ruta_key, password)) for c in muestras[:recarga]],
+        recarga)
+    referencia = medir("firmar_cadena", lambda: [firma.firmar_cadena(c, llave) for c in muestras])
+    individual = medir("Firmante.firmar", lambda: [firmante.firmar(c) for c in muestras])
+    bytes_ = [c.encode("utf-8") for c in muestras]
+    lote = medir("Firmante.firmar_lote", lambda: firmante.firmar_lote(bytes_))
+    firmante.firmar_concurrente(bytes_[:TAMANO_GRUPO * 2])  # crea el pool fuera de la medición
+    concurrente = medir(f"Firmante.firmar_concurrente ({firmante.hilos} hilos)",
+                        lambda: firmante.firmar_concurrente(bytes_))
+    firmante.cerrar()
+    resultados["sellos_identicos"] = referencia == individual == lote == concurrente
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark del firmante contra firma.firmar_cadena.")
+    parser.add_argument("--key", default="mi_llave.key", help="Llave privada del CSD (.key o .pem)")
+    parser.add_argument("--password", default="12345678a", help="Contraseña de la llave privada")
+    parser.add_argument("--cadenas", type=int, default=2000, help="Cadenas por variante")
+    parser.add_argument("--longitud", type=int, default=1500, help="Caracteres aproximados de cada cadena")
+    parser.add_argument("--hilos", type=int, default=None, help="Hilos de firmar_concurrente (por omisión, núcleos)")
+    args = parser.parse_args()
+
+    resultados = comparar(args.key, args.password.encode("utf-8"), args.cadenas, args.longitud, args.hilos)
+    identicos = resultados.pop("sellos_identicos")
+    base = resultados["firmar_cadena"]
+    for nombre, por_segundo in resultados.items():
+        print(f"{nombre:45s} {por_segundo:10.0f} sellos/s  ({por_segundo / base:.2f}x)")
+    print("✅ Sellos idénticos a firmar_cadena" if identicos else "❌ Los sellos no coinciden")
+    exit(0 if identicos else 1)
@@ -0,0 +1,611 @@
+import argparse
+import collections
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# Un arriendo es un bloque [inicio, fin] de folios de una Serie reservado para un solo
+# proceso (titular) hasta `vence`. Estados:
+#   activo -> devuelto (el titular informa hasta dónde usó; el resto vuelve a asignarse)
+#          -> vencido  (nadie lo devolvió a tiempo; lo no informado queda como hueco)
+ACTIVO = "activo"
+DEVUELTO = "devuelto"
+VENCIDO = "vencido"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    serie TEXT PRIMARY KEY,
+    inicial INTEGER NOT NULL,
+    siguiente INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS arriendos (
+    id INTEGER PRIMARY KEY,
+    serie TEXT NOT NULL,
+    inicio INTEGER NOT NULL,
+    fin INTEGER NOT NULL,
+    titular TEXT NOT NULL,
+    creado REAL NOT NULL,
+    vence REAL NOT NULL,
+    estado TEXT NOT NULL,
+    usado_hasta INTEGER
+);
+CREATE INDEX IF NOT EXISTS arriendos_activos ON arriendos (vence) WHERE estado = 'activo';
+CREATE TABLE IF NOT EXISTS libres (
+    serie TEXT NOT NULL,
+    inicio INTEGER NOT NULL,
+    fin INTEGER NOT NULL,
+    PRIMARY KEY (serie, inicio)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS huecos (
+    serie TEXT NOT NULL,
+    inicio INTEGER NOT NULL,
+    fin INTEGER NOT NULL,
+    motivo TEXT NOT NULL,
+    arriendo INTEGER,
+    registrado REAL NOT NULL,
+    PRIMARY KEY (serie, inicio)
+) WITHOUT ROWID;
+"""
+
+Arriendo = collections.namedtuple("Arriendo", "id serie inicio fin titular vence")
+# Folios [inicio, fin] de una Serie que no llegaron a un comprobante
+Hueco = collections.namedtuple("Hueco", "serie inicio fin motivo")
+
+
+class ArriendoPerdido(RuntimeError):
+    """El arriendo ya no está activo (venció y se registró como hueco); no se puede renovar."""
+
+
+def titular_local():
+    """Identificador del proceso que arrienda: host:pid."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class AlmacenFolios:
+    """
+    Almacén de folios sobre SQLite (modo WAL), compartido por todos los procesos de un nodo.
+
+    Solo guarda el siguiente folio de cada Serie y los bloques arrendados:
+    cada proceso arrienda bloques completos (ver AsignadorFolios), así que hay
+    una transacción por bloque y no una por factura. Los folios devueltos sin
+    usar se reasignan antes de avanzar la Serie; los de un arriendo vencido se
+    registran como hueco y nunca se reasignan, porque su titular pudo haberlos
+    usado.
+
+    Otro almacén (uno remoto para varios nodos, o AlmacenFoliosMemoria en
+    pruebas) solo necesita los mismos métodos: arrendar, renovar, devolver,
+    recuperar_vencidos, huecos y estado.
+    """
+
+    def __init__(self, ruta="folios.db"):
+        self.ruta = ruta
+        # Las transacciones se abren explícitamente (BEGIN IMMEDIATE); la conexión se comparte entre hilos
+        self.conexion = sqlite3.connect(ruta, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conexion.row_factory = sqlite3.Row
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        # Un folio entregado no debe volver a entregarse tras un corte de luz
+        self.conexion.execute("PRAGMA synchronous=FULL")
+        self.conexion.executescript(_ESQUEMA)
+        self._candado = threading.Lock()
+
+    def cerrar(self):
+        self.conexion.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+    @contextlib.contextmanager
+    def _transaccion(self):
+        with self._candado:
+            self.conexion.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conexion
+            except BaseException:
+                self.conexion.execute("ROLLBACK")
+                raise
+            self.conexion.execute("COMMIT")
+
+    def iniciar_serie(self, serie, siguiente=1):
+        """
+        Fija el primer folio de una Serie (por ejemplo, para continuar la numeración existente).
+
+        Solo antes de arrendar el primer bloque: después, los folios ya pudieron entregarse.
+        Los folios anteriores no cuentan como huecos en reporte_huecos.
+        """
+        with self._transaccion() as conexion:
+            fila = conexion.execute("SELECT inicial, siguiente FROM series WHERE serie = ?", (serie,)).fetchone()
+            if fila is not None and fila["siguiente"] != fila["inicial"]:
+                raise ValueError(f"La Serie {serie} ya va en el folio {fila['siguiente']}")
+            conexion.execute("INSERT OR REPLACE INTO series (serie, inicial, siguiente) VALUES (?, ?, ?)",
+                             (serie, siguiente, siguiente))
+
+    def _vencer(self, conexion, ahora, serie=None):
+        filtro, parametros = ("AND serie = ?", (ahora, serie)) if serie is not None else ("", (ahora,))
+        vencidos = conexion.execute(
+            f"SELECT id, serie, inicio, fin FROM arriendos WHERE estado = 'activo' AND vence < ? {filtro}",
+            parametros).fetchall()
+        for fila in vencidos:
+            conexion.execute("INSERT OR REPLACE INTO huecos (serie, inicio, fin, motivo, arriendo, registrado) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (fila["serie"], fila["inicio"], fila["fin"], VENCIDO,
+                                                           fila["id"], ahora))
+            conexion.execute("UPDATE arriendos SET estado = 'vencido' WHERE id = ?", (fila["id"],))
+        return len(vencidos)
+
+    def arrendar(self, serie, cantidad, titular=None, duracion=3600.0):
+        """
+        Reserva un bloque de folios consecutivos para un solo titular.
+
+        Primero se entregan folios devueltos (el bloque puede ser menor que
+        `cantidad`); si no hay, se avanza la Serie.
+
+        Parámetros:
+            serie (str): Serie de los comprobantes ("" si no usan Serie).
+            cantidad (int): Folios que se quieren.
+            titular (str): Quién arrienda (por omisión, host:pid).
+            duracion (float): Segundos de vigencia; ver renovar().
+
+        Retorna:
+            Arriendo: El bloque reservado.
+        """
+        if cantidad < 1:
+            raise ValueError("La cantidad de folios debe ser positiva")
+        titular = titular or titular_local()
+        ahora = time.time()
+        with self._transaccion() as conexion:
+            self._vencer(conexion, ahora, serie)
+            libre = conexion.execute("SELECT inicio, fin FROM libres WHERE serie = ? ORDER BY inicio LIMIT 1",
+                                     (serie,)).fetchone()
+            if libre is not None:
+                inicio = libre["inicio"]
+                fin = min(libre["fin"], inicio + cantidad - 1)
+                conexion.execute("DELETE FROM libres WHERE serie = ? AND inicio = ?", (serie, inicio))
+                if fin < libre["fin"]:
+                    conexion.execute("INSERT INTO libres (serie, inicio, fin) VALUES (?, ?, ?)",
+                                     (serie, fin + 1, libre["fin"]))
+            else:
+                fila = conexion.execute("SELECT siguiente FROM series WHERE serie = ?", (serie,)).fetchone()
+                inicio = fila["siguiente"] if fila is not None else 1
+                fin = inicio + cantidad - 1
+                conexion.execute("INSERT INTO series (serie, inicial, siguiente) VALUES (?, 1, ?) "
+                                 "ON CONFLICT (serie) DO UPDATE SET siguiente = excluded.siguiente",
+                                 (serie, fin + 1))
+            cursor = conexion.execute(
+                "INSERT INTO arriendos (serie, inicio, fin, titular, creado, vence, estado)"
+                " VALUES (?, ?, ?, ?, ?, ?, 'activo')", (serie, inicio, fin, titular, ahora, ahora + duracion))
+            return Arriendo(cursor.lastrowid, serie, inicio, fin, titular, ahora + duracion)
+
+    def renovar(self, id_arriendo, duracion=3600.0):
+        """
+        Extiende la vigencia de un arriendo activo.
+
+        Retorna:
+            float: Nuevo vencimiento (epoch).
+        """
+        ahora = time.time()
+        with self._transaccion() as conexion:
+            self._vencer(conexion, ahora)
+            cursor = conexion.execute("UPDATE arriendos SET vence = ? WHERE id = ? AND estado = 'activo'",
+                                      (ahora + duracion, id_arriendo))
+            if not cursor.rowcount:
+                raise ArriendoPerdido(f"El arriendo {id_arriendo} ya no está activo")
+        return ahora + duracion
+
+    def devolver(self, id_arriendo, usado_hasta):
+        """
+        Cierra un arriendo: los folios después de `usado_hasta` vuelven a asignarse.
+
+        También vale para un arriendo ya vencido cuyo titular sigue vivo: su
+        hueco se reduce a lo que de verdad no se usó y eso se recupera.
+
+        Parámetros:
+            id_arriendo (int): Id del arriendo.
+            usado_hasta (int): Último folio entregado del bloque (inicio - 1 si ninguno).
+        """
+        with self._transaccion() as conexion:
+            fila = conexion.execute("SELECT serie, inicio, fin, estado FROM arriendos WHERE id = ?",
+                                    (id_arriendo,)).fetchone()
+            if fila is None or fila["estado"] == DEVUELTO:
+                return
+            if not fila["inicio"] - 1 <= usado_hasta <= fila["fin"]:
+                raise ValueError(f"usado_hasta {usado_hasta} fuera del arriendo {fila['inicio']}-{fila['fin']}")
+            if fila["estado"] == VENCIDO:
+                conexion.execute("DELETE FROM huecos WHERE arriendo = ?", (id_arriendo,))
+            if usado_hasta < fila["fin"]:
+                self._liberar(conexion, fila["serie"], usado_hasta + 1, fila["fin"])
+            conexion.execute("UPDATE arriendos SET estado = 'devuelto', usado_hasta = ? WHERE id = ?",
+                             (usado_hasta, id_arriendo))
+
+    def _liberar(self, conexion, serie, inicio, fin):
+        """Agrega [inicio, fin] a los libres uniéndolo con sus vecinos; si queda al final, la Serie retrocede."""
+        anterior = conexion.execute("SELECT inicio FROM libres WHERE serie = ? AND fin = ?",
+                                    (serie, inicio - 1)).fetchone()
+        if anterior is not None:
+            conexion.execute("DELETE FROM libres WHERE serie = ? AND inicio = ?", (serie, anterior["inicio"]))
+            inicio = anterior["inicio"]
+        posterior = conexion.execute("SELECT fin FROM libres WHERE serie = ? AND inicio = ?",
+                                     (serie, fin + 1)).fetchone()
+        if posterior is not None:
+            conexion.execute("DELETE FROM libres WHERE serie = ? AND inicio = ?", (serie, fin + 1))
+            fin = posterior["fin"]
+        cursor = conexion.execute("UPDATE series SET siguiente = ? WHERE serie = ? AND siguiente = ?",
+                                  (inicio, serie, fin + 1))
+        if not cursor.rowcount:
+            conexion.execute("INSERT INTO libres (serie, inicio, fin) VALUES (?, ?, ?)", (serie, inicio, fin))
+
+    def recuperar_vencidos(self):
+        """
+        Registra como huecos los arriendos vencidos de todas las Series.
+
+        Retorna:
+            int: Arriendos vencidos en esta llamada.
+        """
+        with self._transaccion() as conexion:
+            return self._vencer(conexion, time.time())
+
+    def huecos(self, serie):
+        """Huecos registrados de una Serie (arriendos vencidos sin devolver), en orden."""
+        filas = self.conexion.execute("SELECT serie, inicio, fin, motivo FROM huecos WHERE serie = ? ORDER BY inicio",
+                                      (serie,)).fetchall()
+        return [Hueco(*fila) for fila in filas]
+
+    def estado(self, serie):
+        """
+        Situación de una Serie para conciliar.
+
+        Retorna:
+            dict: inicial, siguiente, arriendos activos y rangos libres (listas de (inicio, fin)).
+        """
+        fila = self.conexion.execute("SELECT inicial, siguiente FROM series WHERE serie = ?", (serie,)).fetchone()
+        activos = self.conexion.execute(
+            "SELECT inicio, fin FROM arriendos WHERE serie = ? AND estado = 'activo' ORDER BY inicio",
+            (serie,)).fetchall()
+        libres = self.conexion.execute("SELECT inicio, fin FROM libres WHERE serie = ? ORDER BY inicio",
+                                       (serie,)).fetchall()
+        return {"inicial": fila["inicial"] if fila is not None else 1,
+                "siguiente": fila["siguiente"] if fila is not None else 1,
+                "activos": [tuple(a) for a in activos], "libres": [tuple(li) for li in libres]}
+
+    def series(self):
+        return [fila["serie"] for fila in self.conexion.execute("SELECT serie FROM series ORDER BY serie")]
+
+
+class AlmacenFoliosMemoria:
+    """
+    Almacén de folios en memoria con la misma interfaz que AlmacenFolios.
+
+    Sirve de sustituto local en pruebas o para un solo proceso: no sobrevive al
+    proceso, así que no debe usarse para folios que lleguen al PAC.
+    """
+
+    def __init__(self):
+        self._candado = threading.Lock()
+        self._inicial = {}
+        self._siguiente = {}
+        self._arriendos = {}  # id -> [serie, inicio, fin, titular, vence, estado]
+        self._libres = collections.defaultdict(list)
+        self._huecos = collections.defaultdict(dict)  # serie -> inicio -> (fin, arriendo)
+
+    def cerrar(self):
+        pass
+
+    def iniciar_serie(self, serie, siguiente=1):
+        with self._candado:
+            if self._siguiente.get(serie, 1) != self._inicial.get(serie, 1):
+                raise ValueError(f"La Serie {serie} ya va en el folio {self._siguiente[serie]}")
+            self._inicial[serie] = self._siguiente[serie] = siguiente
+
+    def _vencer(self, ahora):
+        vencidos = 0
+        for id_arriendo, arriendo in self._arriendos.items():
+            if arriendo[5] == ACTIVO and arriendo[4] < ahora:
+                arriendo[5] = VENCIDO
+                self._huecos[arriendo[0]][arriendo[1]] = (arriendo[2], id_arriendo)
+                vencidos += 1
+        return vencidos
+
+    def arrendar(self, serie, cantidad, titular=None, duracion=3600.0):
+        if cantidad < 1:
+            raise ValueError("La cantidad de folios debe ser positiva")
+        ahora = time.time()
+        with self._candado:
+            self._vencer(ahora)
+            libres = self._libres[serie]
+            if libres:
+                libres.sort()
+                inicio, fin_libre = libres.pop(0)
+                fin = min(fin_libre, inicio + cantidad - 1)
+                if fin < fin_libre:
+                    libres.append((fin + 1, fin_libre))
+            else:
+                inicio = self._siguiente.get(serie, 1)
+                fin = inicio + cantidad - 1
+                self._siguiente[serie] = fin + 1
+            id_arriendo = len(self._arriendos) + 1
+            titular = titular or titular_local()
+            self._arriendos[id_arriendo] = [serie, inicio, fin, titular, ahora + duracion, ACTIVO]
+            return Arriendo(id_arriendo, serie, inicio, fin, titular, ahora + duracion)
+
+    def renovar(self, id_arriendo, duracion=3600.0):
+        ahora = time.time()
+        with self._candado:
+            self._vencer(ahora)
+            arriendo = self._arriendos.get(id_arriendo)
+            if arriendo is None or arriendo[5] != ACTIVO:
+                raise ArriendoPerdido(f"El arriendo {id_arriendo} ya no está activo")
+            arriendo[4] = ahora + duracion
+        return ahora + duracion
+
+    def devolver(self, id_arriendo, usado_hasta):
+        with self._candado:
+            arriendo = self._arriendos.get(id_arriendo)
+            if arriendo is None or arriendo[5] == DEVUELTO:
+                return
+            serie, inicio, fin = arriendo[:3]
+            if not inicio - 1 <= usado_hasta <= fin:
+                raise ValueError(f"usado_hasta {usado_hasta} fuera del arriendo {inicio}-{fin}")
+            if arriendo[5] == VENCIDO:
+                self._huecos[serie].pop(inicio, None)
+            if usado_hasta < fin:
+                self._liberar(serie, usado_hasta + 1, fin)
+            arriendo[5] = DEVUELTO
+
+    def _liberar(self, serie, inicio, fin):
+        libres = self._libres[serie]
+        for vecino in [r for r in libres if r[1] == inicio - 1 or r[0] == fin + 1]:
+            libres.remove(vecino)
+            inicio, fin = min(inicio, vecino[0]), max(fin, vecino[1])
+        if fin + 1 == self._siguiente.get(serie, 1):
+            self._siguiente[serie] = inicio
+        else:
+            libres.append((inicio, fin))
+
+    def recuperar_vencidos(self):
+        with self._candado:
+            return self._vencer(time.time())
+
+    def huecos(self, serie):
+        with self._candado:
+            return [Hueco(serie, inicio, fin, VENCIDO) for inicio, (fin, _) in sorted(self._huecos[serie].items())]
+
+    def estado(self, serie):
+        with self._candado:
+            activos = sorted((a[1], a[2]) for a in self._arriendos.values() if a[0] == serie and a[5] == ACTIVO)
+            return {"inicial": self._inicial.get(serie, 1), "siguiente": self._siguiente.get(serie, 1),
+                    "activos": activos,
+                    "libres": sorted(self._libres[serie])}
+
+    def series(self):
+        return sorted(self._siguiente)
+
+
+class AsignadorFolios:
+    """
+    Entrega folios de una Serie a los hilos de un proceso sin ir al almacén por cada factura.
+
+    Arrienda bloques de `bloque` folios y los entrega con el iterador de un
+    range: en CPython next() sobre él es atómico, así que varios hilos toman
+    folios sin candado y sin repetirlos. Solo al agotarse el bloque (o al
+    acercarse su vencimiento) un hilo toma el candado y habla con el almacén.
+    Al cerrar, el resto del bloque se devuelve para reasignarse.
+
+    Varios procesos (o nodos, con un almacén compartido) pueden tener su propio
+    AsignadorFolios para la misma Serie: nunca reciben el mismo folio, aunque
+    los folios de cada uno no son consecutivos entre sí.
+
+    Uso:
+        with AlmacenFolios("folios.db") as almacen, AsignadorFolios(almacen, "A") as folios:
+            comprobante = construir_comprobante(serie="A", folio=folios.siguiente())
+    """
+
+    def __init__(self, almacen, serie, bloque=1000, duracion=3600.0, titular=None):
+        """
+        Parámetros:
+            almacen: AlmacenFolios o cualquier objeto con su misma interfaz.
+            serie (str): Serie de los folios.
+            bloque (int): Folios por arriendo.
+            duracion (float): Vigencia de cada arriendo en segundos; se renueva al pasar la mitad.
+            titular (str): Identificador del proceso (por omisión, host:pid).
+        """
+        self.almacen = almacen
+        self.serie = serie
+        self.bloque = bloque
+        self.duracion = duracion
+        self.titular = titular or titular_local()
+        self.arriendo = None
+        self._folios = iter(())
+        self._restantes = iter(())  # el range del bloque actual, para saber cuántos quedan
+        self._renovar_en = float("inf")
+        self._candado = threading.Lock()
+        self.arriendos = 0
+
+    def siguiente(self):
+        """
+        Retorna:
+            str: El siguiente folio del bloque arrendado.
+        """
+        try:
+            if time.monotonic() < self._renovar_en:
+                return next(self._folios)
+        except StopIteration:
+            pass
+        with self._candado:
+            # Otro hilo pudo haber renovado o arrendado mientras se esperaba el candado
+            if time.monotonic() >= self._renovar_en and self.arriendo is not None:
+                self._renovar()
+            try:
+                return next(self._folios)
+            except StopIteration:
+                self._nuevo_bloque()
+                return next(self._folios)
+
+    def _renovar(self):
+        try:
+            vence = self.almacen.renovar(self.arriendo.id, self.duracion)
+        except ArriendoPerdido:
+            # Venció y ya es hueco: se devuelve lo usado y se sigue con un bloque nuevo
+            self._devolver()
+            self._nuevo_bloque()
+            return
+        self._renovar_en = time.monotonic() + (vence - time.time()) / 2
+
+    def _nuevo_bloque(self):
+        self._devolver()
+        self.arriendo = self.almacen.arrendar(self.serie, self.bloque, self.titular, self.duracion)
+        self.arriendos += 1
+        self._restantes = iter(range(self.arriendo.inicio, self.arriendo.fin + 1))
+        self._folios = map(str, self._restantes)
+        self._renovar_en = time.monotonic() + (self.arriendo.vence - time.time()) / 2
+
+    def _devolver(self):
+        if self.arriendo is None:
+            return
+        # Vaciar el range es atómico: un hilo que aún tenga el iterador anterior recibe
+        # StopIteration y ningún folio queda a la vez entregado y devuelto
+        restantes = len(list(self._restantes))
+        self._folios = self._restantes = iter(())
+        arriendo, self.arriendo = self.arriendo, None
+        self._renovar_en = float("inf")
+        self.almacen.devolver(arriendo.id, arriendo.fin - restantes)
+
+    def cerrar(self):
+        """Devuelve los folios no usados del bloque actual."""
+        with self._candado:
+            self._devolver()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+
+def reporte_huecos(almacen, serie, emitidos=None):
+    """
+    Huecos de una Serie.
+
+    Sin `emitidos` son los registrados por el almacén (arriendos vencidos).
+    Con los folios que de verdad llegaron a un comprobante (por ejemplo, los
+    de la cola de timbrado o de las tablas de cfdi.extraccion) se concilia
+    todo lo asignado: del folio inicial al siguiente de la Serie, menos lo emitido,
+    lo libre y lo arrendado activo, queda lo que falta de verdad, incluidos
+    los folios entregados a facturas que fallaron antes de timbrarse.
+
+    Parámetros:
+        almacen: AlmacenFolios (o compatible).
+        serie (str): Serie a revisar.
+        emitidos (iterable): Folios emitidos (enteros o texto numérico).
+
+    Retorna:
+        list: Hueco por rango faltante, en orden.
+    """
+    if emitidos is None:
+        return almacen.huecos(serie)
+    import numpy as np
+
+    estado = almacen.estado(serie)
+    faltan = np.ones(estado["siguiente"], dtype=bool)  # índice = folio
+    faltan[:estado["inicial"]] = False
+    for inicio, fin in estado["libres"] + estado["activos"]:
+        faltan[inicio:fin + 1] = False
+    folios = np.fromiter((int(folio) for folio in emitidos if str(folio).isdigit()), dtype=np.int64)
+    folios = folios[(folios > 0) & (folios < len(faltan))]
+    faltan[folios] = False
+    # Cada folio faltante se etiqueta antes de agrupar: 1 sin comprobante, 2 + n dentro del
+    # n-ésimo arriendo vencido; así un rango no une huecos de motivos (o arriendos) distintos
+    etiquetas = faltan.astype(np.int64)
+    for n, hueco in enumerate(almacen.huecos(serie)):
+        tramo = etiquetas[hueco.inicio:hueco.fin + 1]
+        tramo[tramo == 1] = 2 + n
+    cambios = np.flatnonzero(np.diff(np.concatenate(([0], etiquetas, [0]))))
+    huecos = []
+    for inicio, despues in zip(cambios[:-1], cambios[1:]):
+        if etiquetas[inicio]:
+            motivo = VENCIDO if etiquetas[inicio] > 1 else "sin_comprobante"
+            huecos.append(Hueco(serie, int(inicio), int(despues) - 1, motivo))
+    return huecos
+
+
+def _emitidos_de(cola=None, tablas=None, serie=""):
+    """Folios emitidos de una Serie según la cola de timbrado (SQLite) o las tablas de cfdi.extraccion."""
+    if cola:
+        conexion = sqlite3.connect(cola)
+        try:
+            return [fila[0] for fila in conexion.execute("SELECT folio FROM comprobantes WHERE serie = ?", (serie,))]
+        finally:
+            conexion.close()
+    from .extraccion import leer_tabla
+
+    datos = leer_tabla(tablas, "comprobantes", ("serie", "folio"))
+    return datos["folio"][datos["serie"] == serie].tolist()
+
+
+def _trabajador_prueba(ruta, serie, hilos, folios, bloque):
+    """Toma `folios` folios con `hilos` hilos sobre un AsignadorFolios propio; corre en otro proceso."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    with AlmacenFolios(ruta) as almacen, AsignadorFolios(almacen, serie, bloque) as asignador:
+        def tomar(cantidad):
+            return [asignador.siguiente() for _ in range(cantidad)]
+
+        with ThreadPoolExecutor(hilos) as executor:
+            return [f for parte in executor.map(tomar, [folios // hilos] * hilos) for f in parte]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Asignación de Serie/Folio por bloques arrendados.")
+    parser.add_argument("--db", default="folios.db", help="Base de datos SQLite de los folios")
+    acciones = parser.add_subparsers(dest="accion", required=True)
+    iniciar = acciones.add_parser("iniciar", help="Fija el primer folio de una Serie")
+    iniciar.add_argument("serie")
+    iniciar.add_argument("siguiente", type=int)
+    estado = acciones.add_parser("estado", help="Siguiente folio, arriendos activos y libres por Serie")
+    estado.add_argument("serie", nargs="?", default=None)
+    huecos = acciones.add_parser("huecos", help="Reporte de huecos de una Serie")
+    huecos.add_argument("serie")
+    huecos.add_argument("--cola", default=None, help="Conciliar con los folios de esta cola de timbrado")
+    huecos.add_argument("--tablas", default=None, help="Conciliar con las tablas de cfdi.extraccion")
+    acciones.add_parser("vencer", help="Registra como huecos los arriendos vencidos")
+    prueba = acciones.add_parser("prueba", help="Varios procesos e hilos tomando folios a la vez")
+    prueba.add_argument("--serie", default="PRUEBA")
+    prueba.add_argument("--procesos", type=int, default=4)
+    prueba.add_argument("--hilos", type=int, default=4)
+    prueba.add_argument("--folios", type=int, default=100_000, help="Folios por proceso")
+    prueba.add_argument("--bloque", type=int, default=1000)
+    args = parser.parse_args()
+
+    with AlmacenFolios(args.db) as almacen:
+        if args.accion == "iniciar":
+            almacen.iniciar_serie(args.serie, args.siguiente)
+            print(f"✅ Serie {args.serie}: siguiente folio {args.siguiente}")
+        elif args.accion == "estado":
+            series = [args.serie] if args.serie is not None else almacen.series()
+            print(json.dumps({serie: almacen.estado(serie) for serie in series}, indent=2))
+        elif args.accion == "huecos":
+            emitidos = _emitidos_de(args.cola, args.tablas, args.serie) if args.cola or args.tablas else None
+            encontrados = reporte_huecos(almacen, args.serie, emitidos)
+            for hueco in encontrados:
+                print(f"⚠️ {hueco.serie} {hueco.inicio}-{hueco.fin} ({hueco.fin - hueco.inicio + 1} folios, "
+                      f"{hueco.motivo})")
+            print(f"{'✅' if not encontrados else '❌'} {len(encontrados)} huecos en la Serie {args.serie}")
+        elif args.accion == "vencer":
+            print(f"✅ {almacen.recuperar_vencidos()} arriendos vencidos registrados como huecos")
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            inicio = time.perf_counter()
+            with ProcessPoolExecutor(args.procesos) as executor:
+                futuros = [executor.submit(_trabajador_prueba, args.db, args.serie, args.hilos, args.folios,
+                                           args.bloque) for _ in range(args.procesos)]
+                entregados = [folio for futuro in futuros for folio in futuro.result()]
+            segundos = time.perf_counter() - inicio
+            repetidos = len(entregados) - len(set(entregados))
+            print(f"{'✅' if not repetidos else '❌'} {len(entregados)} folios en {segundos:.2f} s "
+                  f"({len(entregados) / segundos:,.0f} folios/s), {repetidos} repetidos; "
+                  f"{len(reporte_huecos(almacen, args.serie, entregados))} huecos")
@@ -0,0 +1,114 @@
+import logging
+
+from lxml import etree
+
+from .impuestos import ColumnaImpuesto, calcular, como_texto
+
+logger = logging.getLogger(__name__)
+
+
+def construir_comprobante(serie="A", folio="12345"):
+    """
+    Construye en memoria el árbol CFDI 4.0 con datos de emisor, receptor, conceptos e impuestos.
+
+    Parámetros:
+        serie (str): Serie del comprobante.
+        folio (str): Folio del comprobante (por ejemplo, de folios.AsignadorFolios.siguiente()).
+    """
+
+    # Calcular importes, impuestos y totales del concepto de ejemplo
+    calculo = calcular(["1"], ["1000.00"], traslados=[ColumnaImpuesto("002", "Tasa", "0.160000")])
+    importe = como_texto(calculo.importes)[0]
+    importe_iva = como_texto(calculo.traslados[0])[0]
+
+    # Definir espacio de nombres para el XML
+    NSMAP = {
+        "cfdi": "http://www.sat.gob.mx/cfd/4",
+        "xsi": "http://www.w3.org/2001/XMLSchema-instance"
+    }
+
+    # Crear la raíz del XML con los atributos obligatorios
+    cfdi = etree.Element("{http://www.sat.gob.mx/cfd/4}Comprobante",
+                         Version="4.0",
+                         Serie=serie,
+                         Folio=folio,
+                         Fecha="2024-03-09T12:00:00",
+                         FormaPago="01",
+                         CondicionesDePago="Contado",
+                         SubTotal=str(calculo.subtotal),
+                         Moneda="MXN",
+                         Total=str(calculo.total),
+                         TipoDeComprobante="I",
+                         MetodoPago="PUE",
+                         LugarExpedicion="64000",
+                         NoCertificado="30001000000400002434",
+                         nsmap=NSMAP
+                         )
+
+    # Agregar el nodo Emisor con su información fiscal
+    emisor = etree.SubElement(cfdi, "{http://www.sat.gob.mx/cfd/4}Emisor",
+                              Rfc="AAA010101AX5",
+                              Nombre="EMPRESA EMISORA S.A. DE C.V.",
+                              RegimenFiscal="601"
+                              )
+
+    # Agregar el nodo Receptor con su información fiscal
+    receptor = etree.SubElement(cfdi, "{http://www.sat.gob.mx/cfd/4}Receptor",
+                                Rfc="BBB020202BX6",
+                                Nombre="CLIENTE EJEMPLO",
+                                UsoCFDI="G03",
+                                DomicilioFiscalReceptor="64000",
+                                RegimenFiscalReceptor="601"
+                                )
+
+    # Crear el nodo Conceptos y agregar un concepto de ejemplo
+    conceptos = etree.SubElement(cfdi, "{http://www.sat.gob.mx/cfd/4}Conceptos")
+    concepto = etree.SubElement(conceptos, "{http://www.sat.gob.mx/cfd/4}Concepto",
+                                ClaveProdServ="01010101",
+                                Cantidad="1",
+                                ClaveUnidad="H87",
+                                Descripcion="Producto de prueba",
+                                ValorUnitario="1000.00",
+                                Importe=importe,
+                                ObjetoImp="02"
+                                )
+
+    # Crear el nodo de Impuestos y agregar impuestos trasladados
+    impuestos = etree.SubElement(cfdi, "{http://www.sat.gob.mx/cfd/4}Impuestos", TotalImpuestosTrasladados=str(calculo.total_impuestos_trasladados))
+    traslados = etree.SubElement(impuestos, "{http://www.sat.gob.mx/cfd/4}Traslados")
+    traslado = etree.SubElement(traslados, "{http://www.sat.gob.mx/cfd/4}Traslado",
+                                Base=como_texto(calculo.bases)[0],
+                                Impuesto="002",
+                                TipoFactor="Tasa",
+                                TasaOCuota="0.160000",
+                                Importe=importe_iva
+                                )
+
+    return cfdi
+
+
+def generar_xml_cfdi(output_path="cfdi_generado.xml", folios=None, serie="A"):
+    """
+    Genera un archivo XML CFDI 4.0 con datos de emisor, receptor, conceptos e impuestos.
+
+    Parámetros:
+        output_path (str): Ruta del XML a escribir.
+        folios (AsignadorFolios): Si se indica, el folio se toma de él (y la Serie, de su Serie);
+            si no, se usa el folio fijo de ejemplo.
+        serie (str): Serie del comprobante cuando no hay asignador.
+
+    Retorna:
+        str: Ruta del XML escrito.
+    """
+    if folios is not None:
+        cfdi = construir_comprobante(serie=folios.serie, folio=folios.siguiente())
+    else:
+        cfdi = construir_comprobante(serie=serie)
+
+    # Convertir el XML en una cadena y guardarlo en un archivo
+    xml_string = etree.tostring(cfdi, pretty_print=True, xml_declaration=True, encoding='UTF-8')
+    with open(output_path, "wb") as f:
+        f.write(xml_string)
+
+    logger.info("XML CFDI 4.0 generado: %s", output_path, extra={"salida": output_path})
+    return output_path
@@ -0,0 +1,240 @@
+import json
+import sys
+import tempfile
+from decimal import Decimal, ROUND_HALF_UP
+from lxml import etree
+
+CFDI = "http://www.sat.gob.mx/cfd/4"
+XSI = "http://www.w3.org/2001/XMLSchema-instance"
+NSMAP = {"cfdi": CFDI, "xsi": XSI}
+
+# Orden de atributos de cada nodo, igual al de generacion y del Anexo 20
+ATRIBUTOS_COMPROBANTE = (
+    "Version", "Serie", "Folio", "Fecha", "Sello", "FormaPago", "NoCertificado", "Certificado",
+    "CondicionesDePago", "SubTotal", "Descuento", "Moneda", "TipoCambio", "Total",
+    "TipoDeComprobante", "Exportacion", "MetodoPago", "LugarExpedicion", "Confirmacion",
+)
+ATRIBUTOS_EMISOR = ("Rfc", "Nombre", "RegimenFiscal", "FacAtrAdquirente")
+ATRIBUTOS_RECEPTOR = (
+    "Rfc", "Nombre", "DomicilioFiscalReceptor", "ResidenciaFiscal", "NumRegIdTrib",
+    "RegimenFiscalReceptor", "UsoCFDI",
+)
+ATRIBUTOS_CONCEPTO = (
+    "ClaveProdServ", "NoIdentificacion", "Cantidad", "ClaveUnidad", "Unidad", "Descripcion",
+    "ValorUnitario", "Importe", "Descuento", "ObjetoImp",
+)
+ATRIBUTOS_IMPUESTO = ("Base", "Impuesto", "TipoFactor", "TasaOCuota", "Importe")
+
+# Tamaño del búfer en memoria antes de pasar los conceptos procesados a disco
+LIMITE_MEMORIA = 8 * 1024 * 1024
+
+
+def _q(nombre):
+    return f"{{{CFDI}}}{nombre}"
+
+
+def _ordenar(datos, orden):
+    """Atributos presentes en el orden indicado, como texto."""
+    return {nombre: str(datos[nombre]) for nombre in orden if datos.get(nombre) not in (None, "")}
+
+
+def _redondear(valor, exponente):
+    return valor.quantize(exponente, rounding=ROUND_HALF_UP)
+
+
+class AcumuladorImpuestos:
+    """Suma en una sola pasada los traslados y retenciones de los conceptos."""
+
+    def __init__(self, exponente):
+        self.exponente = exponente
+        self.subtotal = Decimal(0)
+        self.descuento = Decimal(0)
+        self.traslados = {}  # (Impuesto, TipoFactor, TasaOCuota) -> [Base, Importe]
+        self.retenciones = {}  # Impuesto -> Importe
+
+    def procesar(self, concepto):
+        """Calcula importes del concepto (Importe, Base, Importe de impuestos) y los acumula."""
+        cantidad = Decimal(str(concepto["Cantidad"]))
+        valor_unitario = Decimal(str(concepto["ValorUnitario"]))
+        importe = _redondear(cantidad * valor_unitario, self.exponente)
+        # Igual que impuestos.calcular(): la Base parte del Descuento ya redondeado
+        descuento = _redondear(Decimal(str(concepto.get("Descuento") or 0)), self.exponente)
+        base = importe - descuento
+        self.subtotal += importe
+        self.descuento += descuento
+
+        salida = dict(concepto, Importe=importe)
+        if descuento:
+            salida["Descuento"] = descuento
+        salida["Traslados"] = []
+        for traslado in concepto.get("Traslados") or ():
+            calculado = dict(traslado, Base=base)
+            clave = (traslado["Impuesto"], traslado["TipoFactor"], traslado.get("TasaOCuota"))
+            acumulado = self.traslados.setdefault(clave, [Decimal(0), None])
+            acumulado[0] += base
+            if traslado["TipoFactor"] != "Exento":
+                importe_impuesto = _redondear(base * Decimal(str(traslado["TasaOCuota"])), self.exponente)
+                calculado["Importe"] = importe_impuesto
+                acumulado[1] = (acumulado[1] or Decimal(0)) + importe_impuesto
+            salida["Traslados"].append(calculado)
+        salida["Retenciones"] = []
+        for retencion in concepto.get("Retenciones") or ():
+            importe_impuesto = _redondear(base * Decimal(str(retencion["TasaOCuota"])), self.exponente)
+            salida["Retenciones"].append(dict(retencion, Base=base, Importe=importe_impuesto))
+            self.retenciones[retencion["Impuesto"]] = (
+                self.retenciones.get(retencion["Impuesto"], Decimal(0)) + importe_impuesto)
+        return salida
+
+    @property
+    def total_trasladados(self):
+        importes = [importe for _, importe in self.traslados.values() if importe is not None]
+        return sum(importes, Decimal(0)) if importes else None
+
+    @property
+    def total_retenidos(self):
+        return sum(self.retenciones.values(), Decimal(0)) if self.retenciones else None
+
+    @property
+    def total(self):
+        return (self.subtotal - self.descuento + (self.total_trasladados or 0)
+                - (self.total_retenidos or 0))
+
+
+def _escribir_impuestos(xf, traslados, retenciones, orden):
+    if not traslados and not retenciones:
+        return
+    with xf.element(_q("Impuestos")):
+        if traslados:
+            with xf.element(_q("Traslados")):
+                for traslado in traslados:
+                    with xf.element(_q("Traslado"), _ordenar(traslado, orden)):
+                        pass
+        if retenciones:
+            with xf.element(_q("Retenciones")):
+                for retencion in retenciones:
+                    with xf.element(_q("Retencion"), _ordenar(retencion, orden)):
+                        pass
+
+
+def generar_cfdi_streaming(comprobante, emisor, receptor, conceptos, destino, decimales=2):
+    """
+    Genera un CFDI 4.0 de forma incremental, con memoria acotada sin importar los conceptos.
+
+    La primera pasada calcula importes e impuestos de cada concepto y guarda el
+    resultado en un archivo temporal (en memoria hasta LIMITE_MEMORIA); la
+    segunda escribe el XML con etree.xmlfile, ya con SubTotal, Total e
+    Impuestos conocidos para la raíz.
+
+    Parámetros:
+        comprobante (dict): Atributos de cfdi:Comprobante (Serie, Folio, Fecha, ...).
+            SubTotal, Descuento y Total se calculan.
+        emisor (dict): Atributos de cfdi:Emisor.
+        receptor (dict): Atributos de cfdi:Receptor.
+        conceptos (iterable): Diccionarios con los atributos de cada concepto y,
+            opcionalmente, listas "Traslados"/"Retenciones" con Impuesto,
+            TipoFactor y TasaOCuota. Importe y Base se calculan.
+        destino: Ruta o archivo binario de salida.
+        decimales (int): Decimales de la moneda.
+
+    Retorna:
+        dict: SubTotal, Descuento, Total, impuestos y número de conceptos escritos.
+    """
+    exponente = Decimal(1).scaleb(-decimales)
+    acumulador = AcumuladorImpuestos(exponente)
+    numero_conceptos = 0
+
+    with tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA, mode="w+", encoding="utf-8") as temporal:
+        # Primera pasada: cálculo y acumulación; nada del XML se mantiene en memoria
+        for concepto in conceptos:
+            calculado = acumulador.procesar(concepto)
+            temporal.write(json.dumps(calculado, default=str, ensure_ascii=False))
+            temporal.write("\n")
+            numero_conceptos += 1
+        temporal.seek(0)
+
+        raiz = dict(comprobante)
+        raiz.setdefault("Version", "4.0")
+        raiz["SubTotal"] = _redondear(acumulador.subtotal, exponente)
+        raiz["Descuento"] = _redondear(acumulador.descuento, exponente) if acumulador.descuento else None
+        raiz["Total"] = _redondear(acumulador.total, exponente)
+        atributos_raiz = {f"{{{XSI}}}schemaLocation":
+                          f"{CFDI} http://www.sat.gob.mx/sitio_internet/cfd/4/cfdv40.xsd"}
+        atributos_raiz.update(_ordenar(raiz, ATRIBUTOS_COMPROBANTE))
+
+        # Segunda pasada: escritura incremental del XML
+        with etree.xmlfile(destino, encoding="UTF-8") as xf:
+            xf.write_declaration()
+            with xf.element(_q("Comprobante"), atributos_raiz, nsmap=NSMAP):
+                with xf.element(_q("Emisor"), _ordenar(emisor, ATRIBUTOS_EMISOR)):
+                    pass
+                with xf.element(_q("Receptor"), _ordenar(receptor, ATRIBUTOS_RECEPTOR)):
+                    pass
+                with xf.element(_q("Conceptos")):
+                    for numero, linea in enumerate(temporal):
+                        concepto = json.loads(linea)
+                        with xf.element(_q("Concepto"), _ordenar(concepto, ATRIBUTOS_CONCEPTO)):
+                            _escribir_impuestos(xf, concepto["Traslados"], concepto["Retenciones"],
+                                                ATRIBUTOS_IMPUESTO)
+                        if numero % 1024 == 1023:
+                            xf.flush()
+
+                traslados = [
+                    {"Base": _redondear(base, exponente), "Impuesto": impuesto, "TipoFactor": tipo_factor,
+                     "TasaOCuota": tasa, "Importe": importe}
+                    for (impuesto, tipo_factor, tasa), (base, importe) in acumulador.traslados.items()
+                ]
+                retenciones = [{"Impuesto": impuesto, "Importe": importe}
+                               for impuesto, importe in acumulador.retenciones.items()]
+                if traslados or retenciones:
+                    totales = {}
+                    if acumulador.total_retenidos is not None:
+                        totales["TotalImpuestosRetenidos"] = str(acumulador.total_retenidos)
+                    if acumulador.total_trasladados is not None:
+                        totales["TotalImpuestosTrasladados"] = str(acumulador.total_trasladados)
+                    with xf.element(_q("Impuestos"), totales):
+                        if retenciones:
+                            with xf.element(_q("Retenciones")):
+                                for retencion in retenciones:
+                                    with xf.element(_q("Retencion"), _ordenar(retencion, ("Impuesto", "Importe"))):
+                                        pass
+                        if traslados:
+                            with xf.element(_q("Traslados")):
+                                for traslado in traslados:
+                                    with xf.element(_q("Traslado"), _ordenar(traslado, ATRIBUTOS_IMPUESTO)):
+                                        pass
+
+    return {
+        "SubTotal": raiz["SubTotal"],
+        "Descuento": raiz["Descuento"],
+        "Total": raiz["Total"],
+        "TotalImpuestosTrasladados": acumulador.total_trasladados,
+        "TotalImpuestosRetenidos": acumulador.total_retenidos,
+        "Conceptos": numero_conceptos,
+    }
+
+
+def conceptos_de_ejemplo(cantidad):
+    """Genera conceptos sintéticos con IVA 16% (para pruebas de volumen)."""
+    for i in range(cantidad):
+        yield {
+            "ClaveProdServ": "01010101", "NoIdentificacion": f"SKU-{i:06d}", "Cantidad": "1",
+            "ClaveUnidad": "H87", "Descripcion": f"Producto de prueba {i}",
+            "ValorUnitario": "1000.00", "ObjetoImp": "02",
+            "Traslados": [{"Impuesto": "002", "TipoFactor": "Tasa", "TasaOCuota": "0.160000"}],
+        }
+
+
+if __name__ == "__main__":
+    numero = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    comprobante = {
+        "Serie": "A", "Folio": "12345", "Fecha": "2024-03-09T12:00:00", "FormaPago": "01",
+        "CondicionesDePago": "Contado", "Moneda": "MXN", "TipoDeComprobante": "I",
+        "Exportacion": "01", "MetodoPago": "PUE", "LugarExpedicion": "64000",
+    }
+    emisor = {"Rfc": "AAA010101AX5", "Nombre": "EMPRESA EMISORA S.A. DE C.V.", "RegimenFiscal": "601"}
+    receptor = {"Rfc": "BBB020202BX6", "Nombre": "CLIENTE EJEMPLO", "DomicilioFiscalReceptor": "64000",
+                "RegimenFiscalReceptor": "601", "UsoCFDI": "G03"}
+    totales = generar_cfdi_streaming(comprobante, emisor, receptor, conceptos_de_ejemplo(numero),
+                                     "cfdi_generado_grande.xml")
+    print(f"✅ XML CFDI 4.0 con {totales['Conceptos']} conceptos generado: cfdi_generado_grande.xml "
+          f"(Total {totales['Total']})")
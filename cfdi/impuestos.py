@@ -0,0 +1,389 @@
+import collections
+from decimal import Decimal, ROUND_HALF_UP
+
+# NumPy se importa en el primer uso del motor vectorizado (ver _cargar_numpy)
+np = None
+_numpy_disponible = None
+
+# Documentos con menos líneas se calculan con Decimal: el costo fijo de NumPy no se amortiza
+LINEAS_VECTORIZADO = 256
+
+# Límite de int64; los productos que podrían rebasarlo se calculan con Decimal
+_MAXIMO_INT64 = 2 ** 63 - 1
+
+# Columna de impuesto: `tasas` trae la TasaOCuota de cada línea (None si no aplica)
+# o un solo valor para todas; en TipoFactor "Exento" solo importa si aplica o no.
+ColumnaImpuesto = collections.namedtuple("ColumnaImpuesto", "impuesto tipo_factor tasas")
+
+# Resultado común de ambos motores. Por línea: importes, bases y, por columna,
+# los importes de cada traslado/retención. Agrupados: traslados por
+# (Impuesto, TipoFactor, TasaOCuota) -> (Base, Importe) y retenciones por Impuesto.
+ResultadoImpuestos = collections.namedtuple("ResultadoImpuestos", (
+    "decimales importes descuentos bases traslados retenciones grupos_traslados "
+    "grupos_retenciones subtotal descuento total_impuestos_trasladados "
+    "total_impuestos_retenidos total"))
+
+
+class DesbordamientoEntero(ArithmeticError):
+    """Los valores no caben en aritmética entera de 64 bits."""
+
+
+def _cargar_numpy():
+    """Importa NumPy una sola vez; devuelve None si no está instalado (el motor Decimal sigue disponible)."""
+    global np, _numpy_disponible
+    if _numpy_disponible is None:
+        try:
+            import numpy
+        except ImportError:
+            _numpy_disponible = False
+        else:
+            np = numpy
+            _numpy_disponible = True
+    return np if _numpy_disponible else None
+
+
+def _decimal(valor):
+    if isinstance(valor, Decimal):
+        return valor
+    return Decimal(str(valor))
+
+
+def _redondear(valor, exponente):
+    """Redondeo del SAT: mitad hacia arriba al número de decimales de la moneda."""
+    return valor.quantize(exponente, rounding=ROUND_HALF_UP)
+
+
+def _tasas_por_linea(columna, lineas):
+    tasas = columna.tasas
+    if tasas is None or isinstance(tasas, (str, int, float, Decimal)):
+        return [tasas] * lineas
+    return list(tasas)
+
+
+def _total(resultado_parcial, exponente):
+    subtotal, descuento, grupos_traslados, grupos_retenciones = resultado_parcial
+    importes_traslados = [importe for _, importe in grupos_traslados.values() if importe is not None]
+    trasladados = sum(importes_traslados, Decimal(0)) if importes_traslados else None
+    retenidos = sum(grupos_retenciones.values(), Decimal(0)) if grupos_retenciones else None
+    total = _redondear(subtotal - descuento + (trasladados or 0) - (retenidos or 0), exponente)
+    return trasladados, retenidos, total
+
+
+def calcular_decimal(cantidades, valores_unitarios, descuentos=None, traslados=(), retenciones=(),
+                     decimales=2):
+    """
+    Motor de referencia con Decimal, línea por línea.
+
+    Parámetros:
+        cantidades, valores_unitarios, descuentos: Columnas por línea (texto, int o Decimal).
+        traslados, retenciones: Listas de ColumnaImpuesto.
+        decimales (int): Decimales de la moneda.
+
+    Retorna:
+        ResultadoImpuestos: Valores por línea como listas de Decimal (None si no aplica).
+    """
+    exponente = Decimal(1).scaleb(-decimales)
+    lineas = len(cantidades)
+    descuentos = descuentos if descuentos is not None else [0] * lineas
+    importes, montos_descuento, bases = [], [], []
+    for cantidad, valor_unitario, descuento in zip(cantidades, valores_unitarios, descuentos):
+        importe = _redondear(_decimal(cantidad) * _decimal(valor_unitario), exponente)
+        descuento = _redondear(_decimal(descuento or 0), exponente)
+        importes.append(importe)
+        montos_descuento.append(descuento)
+        bases.append(importe - descuento)
+
+    grupos_traslados = {}
+    importes_traslados = []
+    for columna in traslados:
+        por_linea = []
+        for base, tasa in zip(bases, _tasas_por_linea(columna, lineas)):
+            if tasa is None and columna.tipo_factor != "Exento":
+                por_linea.append(None)
+                continue
+            if columna.tipo_factor == "Exento":
+                if tasa is None and columna.tasas is not None:
+                    por_linea.append(None)
+                    continue
+                clave = (columna.impuesto, columna.tipo_factor, None)
+                importe = None
+            else:
+                tasa = _decimal(tasa)
+                clave = (columna.impuesto, columna.tipo_factor, tasa)
+                importe = _redondear(base * tasa, exponente)
+            acumulado = grupos_traslados.setdefault(clave, [Decimal(0), None])
+            acumulado[0] += base
+            if importe is not None:
+                acumulado[1] = (acumulado[1] or Decimal(0)) + importe
+            por_linea.append(importe if importe is not None else base)
+        importes_traslados.append(por_linea)
+
+    grupos_retenciones = {}
+    importes_retenciones = []
+    for columna in retenciones:
+        por_linea = []
+        for base, tasa in zip(bases, _tasas_por_linea(columna, lineas)):
+            if tasa is None:
+                por_linea.append(None)
+                continue
+            importe = _redondear(base * _decimal(tasa), exponente)
+            grupos_retenciones[columna.impuesto] = grupos_retenciones.get(columna.impuesto, Decimal(0)) + importe
+            por_linea.append(importe)
+        importes_retenciones.append(por_linea)
+
+    grupos_traslados = {clave: (base, importe) for clave, (base, importe) in grupos_traslados.items()}
+    subtotal = sum(importes, Decimal(0))
+    descuento = sum(montos_descuento, Decimal(0))
+    trasladados, retenidos, total = _total((subtotal, descuento, grupos_traslados, grupos_retenciones),
+                                           exponente)
+    return ResultadoImpuestos(decimales, importes, montos_descuento, bases, importes_traslados,
+                              importes_retenciones, grupos_traslados, grupos_retenciones,
+                              _redondear(subtotal, exponente), _redondear(descuento, exponente),
+                              trasladados, retenidos, total)
+
+
+def _escalar_textos(textos):
+    if not textos.size:
+        return np.zeros(0, dtype=np.int64), 0
+    textos = np.char.strip(textos)
+    punto = np.char.find(textos, ".")
+    fracciones = np.where(punto >= 0, np.char.str_len(textos) - punto - 1, 0)
+    escala = int(fracciones.max(initial=0))
+    try:
+        # int() de Python convierte más rápido que astype(np.int64) desde texto
+        digitos = np.fromiter(map(int, np.char.replace(textos, ".", "").tolist()), np.int64, textos.size)
+    except OverflowError as e:
+        raise DesbordamientoEntero(str(e)) from e
+    if escala > 18:
+        raise DesbordamientoEntero("demasiados decimales para int64")
+    factores = 10 ** (escala - fracciones)
+    if not _cabe(np.abs(digitos).max(initial=0), factores.max(initial=1)):
+        raise DesbordamientoEntero("reescalado fuera de int64")
+    return digitos * factores, escala
+
+
+def _escalar(valores):
+    """
+    Convierte una columna a enteros exactos con una escala común.
+
+    El texto se interpreta con operaciones de cadena de NumPy (sin pasar por
+    float); la escala es el mayor número de decimales presente.
+
+    Retorna:
+        tuple: (arreglo int64, decimales de la escala)
+    """
+    if isinstance(valores, np.ndarray) and valores.dtype.kind in "iu":
+        # Columnas ya enteras (por ejemplo, cantidades de un ERP): sin pasar por texto
+        return valores.astype(np.int64), 0
+    try:
+        return _escalar_textos(np.asarray(valores, dtype=str))
+    except ValueError:
+        # Notación científica, Decimal con exponente, etc.: se normalizan con Decimal
+        return _escalar_textos(np.asarray([format(_decimal(v), "f") for v in valores], dtype=str))
+
+
+def _cabe(*maximos):
+    producto = 1
+    for maximo in maximos:
+        producto *= int(maximo)
+    return producto <= _MAXIMO_INT64
+
+
+def _reescalar(valores, escala, decimales):
+    """Lleva enteros de `escala` decimales a `decimales`, redondeando mitad hacia arriba."""
+    if escala == decimales:
+        return valores
+    if escala < decimales:
+        factor = 10 ** (decimales - escala)
+        if not _cabe(np.abs(valores).max(initial=0), factor):
+            raise DesbordamientoEntero("reescalado fuera de int64")
+        return valores * factor
+    divisor = 10 ** (escala - decimales)
+    mitad = divisor // 2
+    # Mitad hacia arriba sobre el valor absoluto, igual que ROUND_HALF_UP de Decimal
+    return np.sign(valores) * ((np.abs(valores) + mitad) // divisor)
+
+
+def _a_decimal(entero, decimales):
+    return Decimal(int(entero)).scaleb(-decimales)
+
+
+def calcular_vectorizado(cantidades, valores_unitarios, descuentos=None, traslados=(), retenciones=(),
+                         decimales=2):
+    """
+    Motor de punto fijo con enteros de NumPy para muchas líneas a la vez.
+
+    Cada columna se escala a enteros int64 con los decimales que trae; los
+    productos se calculan exactos y se redondean mitad hacia arriba. Si algún
+    producto pudiera rebasar int64 se lanza DesbordamientoEntero (ver calcular()).
+
+    Retorna:
+        ResultadoImpuestos: Valores por línea como arreglos int64 en centésimas
+        (o la escala de `decimales`); agrupados y totales como Decimal.
+    """
+    if _cargar_numpy() is None:
+        raise ImportError("El motor vectorizado requiere NumPy")
+    lineas = len(cantidades)
+    cantidad, escala_cantidad = _escalar(cantidades)
+    valor_unitario, escala_valor = _escalar(valores_unitarios)
+    if not _cabe(np.abs(cantidad).max(initial=0), np.abs(valor_unitario).max(initial=0)):
+        raise DesbordamientoEntero("Cantidad × ValorUnitario fuera de int64")
+    importes = _reescalar(cantidad * valor_unitario, escala_cantidad + escala_valor, decimales)
+    if descuentos is not None:
+        descuento, escala_descuento = _escalar([d or 0 for d in descuentos])
+        montos_descuento = _reescalar(descuento, escala_descuento, decimales)
+    else:
+        montos_descuento = np.zeros(lineas, dtype=np.int64)
+    bases = importes - montos_descuento
+    maximo_base = np.abs(bases).max(initial=0)
+
+    grupos_traslados = {}
+    importes_traslados = []
+    for columna in traslados:
+        tasas = _tasas_por_linea(columna, lineas)
+        aplica = np.array([t is not None for t in tasas], dtype=bool)
+        if columna.tipo_factor == "Exento":
+            if columna.tasas is None:
+                aplica[:] = True
+            if aplica.any():
+                clave = (columna.impuesto, columna.tipo_factor, None)
+                base_previa = grupos_traslados.get(clave, (Decimal(0), None))[0]
+                grupos_traslados[clave] = (base_previa + _a_decimal(bases[aplica].sum(), decimales), None)
+            importes_traslados.append(np.where(aplica, bases, 0))
+            continue
+        tasa, escala_tasa = _escalar([t if t is not None else 0 for t in tasas])
+        if not _cabe(maximo_base, np.abs(tasa).max(initial=0)):
+            raise DesbordamientoEntero("Base × TasaOCuota fuera de int64")
+        importe = np.where(aplica, _reescalar(bases * tasa, decimales + escala_tasa, decimales), 0)
+        importes_traslados.append(importe)
+        # Agrupación exacta por TasaOCuota: np.unique + np.add.at sobre int64
+        valores_tasa, indices = np.unique(tasa[aplica], return_inverse=True)
+        suma_bases = np.zeros(len(valores_tasa), dtype=np.int64)
+        suma_importes = np.zeros(len(valores_tasa), dtype=np.int64)
+        np.add.at(suma_bases, indices, bases[aplica])
+        np.add.at(suma_importes, indices, importe[aplica])
+        for valor, suma_base, suma_importe in zip(valores_tasa, suma_bases, suma_importes):
+            clave = (columna.impuesto, columna.tipo_factor, _a_decimal(valor, escala_tasa))
+            previo = grupos_traslados.get(clave, (Decimal(0), Decimal(0)))
+            grupos_traslados[clave] = (previo[0] + _a_decimal(suma_base, decimales),
+                                       previo[1] + _a_decimal(suma_importe, decimales))
+
+    grupos_retenciones = {}
+    importes_retenciones = []
+    for columna in retenciones:
+        tasas = _tasas_por_linea(columna, lineas)
+        aplica = np.array([t is not None for t in tasas], dtype=bool)
+        tasa, escala_tasa = _escalar([t if t is not None else 0 for t in tasas])
+        if not _cabe(maximo_base, np.abs(tasa).max(initial=0)):
+            raise DesbordamientoEntero("Base × TasaOCuota fuera de int64")
+        importe = np.where(aplica, _reescalar(bases * tasa, decimales + escala_tasa, decimales), 0)
+        importes_retenciones.append(importe)
+        if aplica.any():
+            grupos_retenciones[columna.impuesto] = (
+                grupos_retenciones.get(columna.impuesto, Decimal(0))
+                + _a_decimal(importe[aplica].sum(), decimales))
+
+    if not _cabe(lineas or 1, max(int(np.abs(importes).max(initial=0)), int(maximo_base))):
+        raise DesbordamientoEntero("Sumas fuera de int64")
+    exponente = Decimal(1).scaleb(-decimales)
+    subtotal = _a_decimal(importes.sum(), decimales)
+    descuento = _a_decimal(montos_descuento.sum(), decimales)
+    trasladados, retenidos, total = _total((subtotal, descuento, grupos_traslados, grupos_retenciones),
+                                           exponente)
+    return ResultadoImpuestos(decimales, importes, montos_descuento, bases, importes_traslados,
+                              importes_retenciones, grupos_traslados, grupos_retenciones,
+                              subtotal, descuento, trasladados, retenidos, total)
+
+
+def calcular(cantidades, valores_unitarios, descuentos=None, traslados=(), retenciones=(), decimales=2):
+    """
+    Calcula con el motor vectorizado y recurre a Decimal si no hay NumPy, si hay
+    desbordamiento o si el documento tiene menos de LINEAS_VECTORIZADO líneas.
+    """
+    if len(cantidades) >= LINEAS_VECTORIZADO and _cargar_numpy() is not None:
+        try:
+            return calcular_vectorizado(cantidades, valores_unitarios, descuentos, traslados,
+                                        retenciones, decimales)
+        except DesbordamientoEntero:
+            pass
+    return calcular_decimal(cantidades, valores_unitarios, descuentos, traslados, retenciones, decimales)
+
+
+def como_texto(valores, decimales=2):
+    """
+    Formatea una columna por línea como texto con los decimales de la moneda.
+
+    Acepta las listas de Decimal del motor de referencia y los arreglos de
+    enteros del vectorizado; los None se conservan.
+    """
+    if hasattr(valores, "dtype") and _cargar_numpy() is not None:
+        if not valores.size:
+            return []
+        signo = np.where(valores < 0, "-", "")
+        absolutos = np.abs(valores)
+        enteros = (absolutos // 10 ** decimales).astype(str)
+        if not decimales:
+            return np.char.add(signo, enteros).tolist()
+        fracciones = np.char.zfill((absolutos % 10 ** decimales).astype(str), decimales)
+        return np.char.add(np.char.add(signo, enteros), np.char.add(".", fracciones)).tolist()
+    exponente = Decimal(1).scaleb(-decimales)
+    # "+ 0" normaliza el -0.00 que deja redondear un negativo pequeño
+    return [None if v is None else str(_redondear(v, exponente) + 0) for v in valores]
+
+
+def comparar_motores(*args, **kwargs):
+    """
+    Calcula con ambos motores y devuelve las diferencias (lista vacía si coinciden).
+
+    Los argumentos son los mismos de calcular().
+    """
+    referencia = calcular_decimal(*args, **kwargs)
+    vectorizado = calcular_vectorizado(*args, **kwargs)
+    decimales = referencia.decimales
+    diferencias = []
+    for campo in ("importes", "descuentos", "bases"):
+        esperado = como_texto(getattr(referencia, campo), decimales)
+        obtenido = como_texto(getattr(vectorizado, campo), decimales)
+        diferencias.extend((campo, i, a, b) for i, (a, b) in enumerate(zip(esperado, obtenido)) if a != b)
+    for campo in ("traslados", "retenciones"):
+        for numero, (columna_ref, columna_vec) in enumerate(zip(getattr(referencia, campo),
+                                                                getattr(vectorizado, campo))):
+            esperado = como_texto(columna_ref, decimales)
+            obtenido = como_texto(columna_vec, decimales)
+            diferencias.extend((f"{campo}[{numero}]", i, a, b)
+                               for i, (a, b) in enumerate(zip(esperado, obtenido))
+                               if a is not None and a != b)
+    for campo in ("grupos_traslados", "grupos_retenciones", "subtotal", "descuento",
+                  "total_impuestos_trasladados", "total_impuestos_retenidos", "total"):
+        if getattr(referencia, campo) != getattr(vectorizado, campo):
+            diferencias.append((campo, None, getattr(referencia, campo), getattr(vectorizado, campo)))
+    return diferencias
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    # Comparación de ambos motores sobre conceptos sintéticos: python -m cfdi.impuestos [líneas]
+    lineas = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    aleatorio = random.Random(2024)
+    cantidades = [aleatorio.choice(["1", "2", "0.5", "1.333333", "12.125"]) for _ in range(lineas)]
+    valores_unitarios = [f"{aleatorio.randint(1, 10 ** 8) / 100:.2f}" for _ in range(lineas)]
+    descuentos = [aleatorio.choice([None, "0.00", "1.50", "10.005"]) for _ in range(lineas)]
+    traslados = [ColumnaImpuesto("002", "Tasa", [aleatorio.choice(["0.160000", "0.080000", None])
+                                                 for _ in range(lineas)])]
+    retenciones = [ColumnaImpuesto("001", "Tasa", [aleatorio.choice(["0.100000", None])
+                                                   for _ in range(lineas)])]
+    argumentos = (cantidades, valores_unitarios, descuentos, traslados, retenciones)
+    _cargar_numpy()  # la importación de NumPy no cuenta en la medición
+
+    for motor in (calcular_decimal, calcular_vectorizado):
+        inicio = time.perf_counter()
+        resultado = motor(*argumentos)
+        print(f"{motor.__name__}: {time.perf_counter() - inicio:.3f} s (Total {resultado.total})")
+    diferencias = comparar_motores(*argumentos)
+    for diferencia in diferencias[:20]:
+        print(f"❌ {diferencia}")
+    print("✅ Ambos motores coinciden" if not diferencias else f"❌ {len(diferencias)} diferencias")
+    exit(1 if diferencias else 0)
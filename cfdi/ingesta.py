@@ -0,0 +1,564 @@
+import argparse
+import collections
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from . import firma_lote, instrumentacion
+from .generacion_streaming import (ATRIBUTOS_COMPROBANTE, ATRIBUTOS_CONCEPTO, ATRIBUTOS_EMISOR, ATRIBUTOS_RECEPTOR,
+                                   generar_cfdi_streaming)
+
+# Columnas de entrada: las del Comprobante van tal cual (Serie, Folio, Fecha, FormaPago, ...);
+# las de los demás nodos llevan prefijo: Emisor.Rfc, Receptor.UsoCFDI, Concepto.Cantidad, ...
+# Los impuestos de cada concepto van en columnas con la tasa: Concepto.IVA ("0.160000",
+# "0.080000", "0.000000" o "Exento"), Concepto.RetencionIVA y Concepto.RetencionISR; un concepto
+# sin impuestos es ObjetoImp 01 salvo que la entrada diga otra cosa.
+COLUMNAS_IMPUESTOS = {"IVA": ("Traslados", "002"), "RetencionIVA": ("Retenciones", "002"),
+                      "RetencionISR": ("Retenciones", "001")}
+# Atributos que se calculan o los pone la firma; no se aceptan en la entrada
+CALCULADOS = frozenset({"SubTotal", "Descuento", "Total", "Sello", "NoCertificado", "Certificado"})
+
+REQUERIDOS_COMPROBANTE = ("Folio", "Fecha")
+REQUERIDOS_RECEPTOR = ("Rfc", "Nombre", "DomicilioFiscalReceptor", "RegimenFiscalReceptor", "UsoCFDI")
+REQUERIDOS_CONCEPTO = ("ClaveProdServ", "Cantidad", "ClaveUnidad", "Descripcion", "ValorUnitario")
+
+COLUMNAS_REPORTE = ("fila", "serie", "folio", "etapa", "error")
+
+# Bytes del inicio del archivo con los que se reconoce la entrada al reanudar
+BYTES_HUELLA = 64 * 1024
+
+# Factura agrupada a partir de filas consecutivas con la misma Serie+Folio;
+# `errores` son (fila, mensaje) y `fin` la posición en bytes tras su última fila
+Factura = collections.namedtuple("Factura", "serie folio primera ultima fin comprobante emisor receptor conceptos errores")
+# Resultado por factura, en el orden de la entrada; `error` es None si quedó firmada
+ResultadoIngesta = collections.namedtuple("ResultadoIngesta", "serie folio filas salida error")
+
+# Estado de cada proceso trabajador (ver _inicializar_trabajador)
+_emisor = {}
+_comprobante = {}
+
+
+def huella(ruta):
+    """SHA-256 del inicio del archivo, para no reanudar sobre otra entrada."""
+    with open(ruta, "rb") as f:
+        return hashlib.sha256(f.read(BYTES_HUELLA)).hexdigest()
+
+
+def _aplanar(registro, prefijo=""):
+    """Registro JSON anidado ({"Receptor": {"Rfc": ...}}) a columnas con prefijo (Receptor.Rfc)."""
+    plano = {}
+    for nombre, valor in registro.items():
+        if isinstance(valor, dict):
+            plano.update(_aplanar(valor, f"{prefijo}{nombre}."))
+        else:
+            plano[prefijo + nombre] = valor
+    return plano
+
+
+class LectorFilas:
+    """
+    Filas de un CSV o JSONL, una a la vez, con la posición en bytes al terminar cada una.
+
+    El archivo se lee en binario línea por línea, así que la posición de cada
+    fila se conoce sin contar caracteres y una lectura puede continuar desde
+    cualquier fin de fila (ver Ingesta.procesar con reanudar=True). Un CSV
+    puede tener campos entre comillas con saltos de línea.
+    """
+
+    def __init__(self, ruta, formato=None, posicion=0, encabezado=None, fila=0):
+        """
+        Parámetros:
+            ruta (str): Archivo de entrada.
+            formato (str): "csv" o "jsonl"; por omisión según la extensión.
+            posicion (int): Byte donde continuar (un fin de fila).
+            encabezado (list): Columnas del CSV cuando se continúa después del encabezado.
+            fila (int): Filas de datos ya leídas antes de `posicion`.
+        """
+        self.ruta = ruta
+        self.formato = formato or ("jsonl" if ruta.endswith((".jsonl", ".ndjson", ".json")) else "csv")
+        self.posicion = posicion
+        self.encabezado = encabezado
+        self.fila = fila
+
+    def _lineas(self, archivo):
+        for linea in iter(archivo.readline, b""):
+            self.posicion += len(linea)
+            yield linea.decode("utf-8-sig" if self.posicion == len(linea) else "utf-8")
+
+    def __iter__(self):
+        """Genera (número de fila, posición al terminarla, datos, error) por cada fila de datos."""
+        with open(self.ruta, "rb") as archivo:
+            archivo.seek(self.posicion)
+            lineas = self._lineas(archivo)
+            if self.formato == "jsonl":
+                for linea in lineas:
+                    if not linea.strip():
+                        continue
+                    self.fila += 1
+                    try:
+                        registro = json.loads(linea)
+                        if not isinstance(registro, dict):
+                            raise ValueError("la fila no es un objeto JSON")
+                    except ValueError as e:
+                        yield self.fila, self.posicion, None, f"JSON inválido: {e}"
+                        continue
+                    yield self.fila, self.posicion, _aplanar(registro), None
+                return
+
+            lector = csv.reader(lineas)
+            if self.encabezado is None:
+                self.encabezado = [columna.strip() for columna in next(lector, [])]
+            for valores in lector:
+                if not any(valores):
+                    continue
+                self.fila += 1
+                if len(valores) != len(self.encabezado):
+                    yield (self.fila, self.posicion, None,
+                           f"{len(valores)} columnas, se esperaban {len(self.encabezado)}")
+                    continue
+                yield self.fila, self.posicion, dict(zip(self.encabezado, valores)), None
+
+
+def _texto(valor):
+    return "" if valor is None else str(valor).strip()
+
+
+def _decimal(valor, nombre, positivo=False):
+    try:
+        numero = Decimal(_texto(valor))
+    except InvalidOperation:
+        raise ValueError(f"{nombre} no es un número: {valor!r}") from None
+    if not numero.is_finite() or numero < 0 or (positivo and numero == 0):
+        raise ValueError(f"{nombre} debe ser {'mayor que cero' if positivo else 'un número no negativo'}: {valor!r}")
+    return numero
+
+
+def _separar(datos):
+    """
+    Reparte las columnas de una fila entre Comprobante, Emisor, Receptor y Concepto.
+
+    Retorna:
+        tuple: (comprobante, emisor, receptor, concepto) como diccionarios de texto;
+            el concepto ya trae sus listas Traslados/Retenciones.
+    """
+    nodos = {"": {}, "Emisor": {}, "Receptor": {}, "Concepto": {}}
+    for columna, valor in datos.items():
+        nodo, _, nombre = columna.rpartition(".")
+        if nodo not in nodos:
+            raise ValueError(f"Columna desconocida: {columna}")
+        if isinstance(valor, list):  # Concepto.Traslados/Retenciones ya armados (JSONL)
+            nodos[nodo][nombre] = valor
+        elif _texto(valor):
+            nodos[nodo][nombre] = _texto(valor)
+    comprobante, emisor, receptor, concepto = nodos[""], nodos["Emisor"], nodos["Receptor"], nodos["Concepto"]
+
+    for nombre, conocidos in (("", ATRIBUTOS_COMPROBANTE), ("Emisor.", ATRIBUTOS_EMISOR),
+                              ("Receptor.", ATRIBUTOS_RECEPTOR)):
+        datos_nodo = nodos[nombre.rstrip(".")]
+        for atributo in datos_nodo:
+            if atributo not in conocidos or atributo in CALCULADOS:
+                raise ValueError(f"Columna no admitida: {nombre}{atributo}")
+
+    traslados = list(concepto.pop("Traslados", None) or ())
+    retenciones = list(concepto.pop("Retenciones", None) or ())
+    for columna, (lista, impuesto) in COLUMNAS_IMPUESTOS.items():
+        tasa = concepto.pop(columna, None)
+        if tasa is None:
+            continue
+        if columna == "IVA" and tasa.lower() == "exento":
+            traslados.append({"Impuesto": impuesto, "TipoFactor": "Exento"})
+            continue
+        _decimal(tasa, f"Concepto.{columna}")
+        destino = traslados if lista == "Traslados" else retenciones
+        destino.append({"Impuesto": impuesto, "TipoFactor": "Tasa", "TasaOCuota": tasa})
+    for atributo in concepto:
+        if atributo not in ATRIBUTOS_CONCEPTO or atributo == "Importe":
+            raise ValueError(f"Columna no admitida: Concepto.{atributo}")
+    concepto["Traslados"] = traslados
+    concepto["Retenciones"] = retenciones
+    return comprobante, emisor, receptor, concepto
+
+
+def _validar_concepto(concepto):
+    faltantes = [f"Concepto.{n}" for n in REQUERIDOS_CONCEPTO if n not in concepto]
+    if faltantes:
+        raise ValueError(f"Faltan columnas: {', '.join(faltantes)}")
+    _decimal(concepto["Cantidad"], "Concepto.Cantidad", positivo=True)
+    _decimal(concepto["ValorUnitario"], "Concepto.ValorUnitario")
+    if "Descuento" in concepto:
+        _decimal(concepto["Descuento"], "Concepto.Descuento")
+    objeto_imp = concepto.setdefault("ObjetoImp", "02" if concepto["Traslados"] or concepto["Retenciones"] else "01")
+    if objeto_imp == "01" and (concepto["Traslados"] or concepto["Retenciones"]):
+        raise ValueError("Concepto con ObjetoImp 01 (no objeto de impuesto) y con impuestos")
+
+
+def _combinar(factura, datos, fila, nombre):
+    """Agrega los datos de otra fila de la misma factura; las columnas vacías heredan los de la primera."""
+    for atributo, valor in datos.items():
+        actual = factura.setdefault(atributo, valor)
+        if actual != valor:
+            raise ValueError(f"{nombre}{atributo} difiere de la primera fila de la factura: {valor!r} != {actual!r}")
+
+
+def _cerrar(factura):
+    """Revisa los datos de la factura completa (pueden venir solo en su primera fila)."""
+    if not factura.errores:
+        faltantes = ([n for n in REQUERIDOS_COMPROBANTE if n not in factura.comprobante]
+                     + [f"Receptor.{n}" for n in REQUERIDOS_RECEPTOR if n not in factura.receptor])
+        if faltantes:
+            factura.errores.append((factura.primera, f"Faltan columnas: {', '.join(faltantes)}"))
+    return factura
+
+
+def agrupar(filas):
+    """
+    Agrupa filas consecutivas con la misma Serie+Folio en facturas, sin leer el archivo completo.
+
+    Las filas de una factura deben venir juntas (como las exporta un ERP
+    ordenado por folio); solo se guarda en memoria la factura en curso.
+
+    Parámetros:
+        filas (iterable): (fila, posición, datos, error), como las de LectorFilas.
+
+    Retorna:
+        generator: Factura por cada grupo; las filas con error quedan en `errores`
+            y la factura no se genera.
+    """
+    actual = None
+    for fila, posicion, datos, error in filas:
+        clave = None
+        if datos is not None:
+            clave = (_texto(datos.get("Serie")), _texto(datos.get("Folio")))
+        # Una fila ilegible no tiene clave: se queda con la factura en curso, que ya no se genera
+        if actual is not None and clave is not None and clave != (actual.serie, actual.folio):
+            yield _cerrar(actual)
+            actual = None
+        if actual is None:
+            serie, folio = clave or ("", "")
+            actual = Factura(serie, folio, fila, fila, posicion, {}, {}, {}, [], [])
+        actual = actual._replace(ultima=fila, fin=posicion)
+        if error is not None:
+            actual.errores.append((fila, error))
+            continue
+        try:
+            comprobante, emisor, receptor, concepto = _separar(datos)
+            _validar_concepto(concepto)
+            _combinar(actual.comprobante, comprobante, fila, "")
+            _combinar(actual.emisor, emisor, fila, "Emisor.")
+            _combinar(actual.receptor, receptor, fila, "Receptor.")
+        except ValueError as e:
+            actual.errores.append((fila, str(e)))
+            continue
+        actual.conceptos.append(concepto)
+    if actual is not None:
+        yield _cerrar(actual)
+
+
+def _inicializar_trabajador(emisor, comprobante, argumentos_firma):
+    """Fija el Emisor y los atributos constantes, y carga el CSD una vez por proceso (ver firma_lote)."""
+    _emisor.update(emisor)
+    _comprobante.update(comprobante)
+    firma_lote._inicializar_trabajador(*argumentos_firma)
+
+
+def _generar_y_firmar(factura):
+    """Genera el XML de una factura con generacion_streaming y lo sella; corre en un proceso trabajador."""
+    comprobante, emisor, receptor, conceptos = factura
+    try:
+        with instrumentacion.comprobante(serie=comprobante.get("Serie"), folio=comprobante["Folio"]):
+            with instrumentacion.etapa("generacion"):
+                destino = io.BytesIO()
+                generar_cfdi_streaming(dict(_comprobante, **comprobante), dict(_emisor, **emisor), receptor,
+                                       conceptos, destino)
+    except Exception as e:
+        return firma_lote.ResultadoFirma(None, None, None, f"generacion: {type(e).__name__}: {e}")
+    resultado = firma_lote._firmar_documento(destino.getvalue())
+    if resultado.error is not None:
+        return resultado._replace(error=f"firma: {resultado.error}")
+    return resultado
+
+
+def _nombre_archivo(serie, folio):
+    return re.sub(r"[^\w.-]", "_", f"{serie}{folio}") + ".xml"
+
+
+def _guardar(ruta, contenido):
+    """
+    Escribe el XML firmado de forma atómica. Si ya existe (una ejecución anterior
+    interrumpida) debe ser idéntico: la firma es determinista, así que otro contenido
+    significa una Serie+Folio repetida en la entrada.
+    """
+    if os.path.exists(ruta):
+        with open(ruta, "rb") as f:
+            if f.read() == contenido:
+                return
+        from .cola_timbrado import FolioDuplicado
+
+        raise FolioDuplicado(f"{os.path.basename(ruta)} ya existe con otro contenido")
+    temporal = ruta + ".tmp"
+    with open(temporal, "wb") as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+
+class Ingesta:
+    """
+    Convierte un archivo de ventas del ERP (CSV o JSONL, una fila por concepto)
+    en CFDI firmados, de punta a punta y con memoria acotada.
+
+    El proceso principal lee y agrupa las filas (ver LectorFilas y agrupar) y
+    reparte las facturas en un ProcessPoolExecutor; cada trabajador genera el
+    XML con generacion_streaming y lo sella con el CSD cargado una sola vez
+    (el mismo inicializador de firma_lote, también con varios emisores). Hay a
+    lo sumo `ventana` facturas en vuelo y los resultados vuelven en el orden de
+    la entrada, así que tras cada factura terminada se conoce el byte del
+    archivo hasta el que todo quedó procesado: cada `cada` facturas se guarda
+    ese punto de control y procesar(..., reanudar=True) continúa desde ahí.
+
+    Cada factura firmada se escribe en `directorio_salida` como <Serie><Folio>.xml
+    y, con `cola`, se encola para timbrar (ver cola_timbrado). Las filas con
+    error se escriben en el reporte CSV (fila, serie, folio, etapa, error) y su
+    factura se omite sin detener el lote.
+    """
+
+    def __init__(self, ruta_key, password, directorio_salida="facturas", emisor=None, comprobante=None,
+                 procesos=None, ventana=None, ruta_cer=None, metodo="xslt", validar=False, directorio_csd=None,
+                 passwords=None, cola=None, reporte=None, punto_control=None, cada=100, formato=None):
+        """
+        Parámetros:
+            ruta_key (str): Llave privada del CSD.
+            password (bytes): Contraseña de la llave.
+            directorio_salida (str): Directorio de los XML firmados.
+            emisor (dict): Atributos del Emisor; las columnas Emisor.* de la entrada los reemplazan.
+            comprobante (dict): Atributos constantes del Comprobante (Moneda, LugarExpedicion, ...).
+            procesos (int): Procesos trabajadores (por omisión, núcleos).
+            ventana (int): Facturas en vuelo como máximo (por omisión, procesos * 16).
+            ruta_cer (str): Certificado para NoCertificado/Certificado.
+            metodo (str): Generación de la cadena original ("xslt", "nativo" o "auto").
+            validar (bool): Validar cada comprobante antes de firmarlo (ver cfdi.validacion).
+            directorio_csd (str): Pares .cer/.key de varios emisores (ver csd.GestorCSD).
+            passwords (dict): Contraseña por RFC o nombre de archivo para `directorio_csd`.
+            cola: ColaTimbrado donde encolar cada factura firmada.
+            reporte (str): CSV de errores (por omisión, <salida>/errores.csv).
+            punto_control (str): JSON del punto de control (por omisión, <salida>/ingesta.json).
+            cada (int): Facturas entre puntos de control.
+            formato (str): "csv" o "jsonl"; por omisión según la extensión de la entrada.
+        """
+        self.emisor = dict(emisor or {})
+        self.comprobante = dict(comprobante or {})
+        self.directorio_salida = directorio_salida
+        self.procesos = procesos or os.cpu_count() or 1
+        self.ventana = ventana or self.procesos * 16
+        self.argumentos_firma = (ruta_key, password, ruta_cer, None, metodo, None, validar, directorio_csd,
+                                 passwords)
+        self.cola = cola
+        self.reporte = reporte or os.path.join(directorio_salida, "errores.csv")
+        self.punto_control = punto_control or os.path.join(directorio_salida, "ingesta.json")
+        self.cada = cada
+        self.formato = formato
+        self.facturas = 0
+        self.errores = 0
+        self.filas = 0
+        self.segundos = 0.0
+
+    @property
+    def por_segundo(self):
+        """Facturas por segundo de la última ejecución."""
+        return self.facturas / self.segundos if self.segundos else 0.0
+
+    def _leer_punto(self, ruta):
+        if not os.path.exists(self.punto_control):
+            return None
+        with open(self.punto_control, encoding="utf-8") as f:
+            punto = json.load(f)
+        if punto["huella"] != huella(ruta):
+            raise ValueError(f"El punto de control {self.punto_control} es de otro archivo de entrada")
+        return punto
+
+    def _guardar_punto(self, punto):
+        temporal = self.punto_control + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(punto, f, indent=2)
+        os.replace(temporal, self.punto_control)
+
+    def procesar(self, ruta, reanudar=False):
+        """
+        Generador de ResultadoIngesta, en orden, para todas las facturas de la entrada.
+
+        Parámetros:
+            ruta (str): CSV o JSONL del ERP.
+            reanudar (bool): Continuar desde el punto de control de una ejecución
+                anterior sobre el mismo archivo (si no hay, empieza desde el inicio).
+        """
+        os.makedirs(self.directorio_salida, exist_ok=True)
+        punto = self._leer_punto(ruta) if reanudar else None
+        if punto is None:
+            punto = {"archivo": os.path.abspath(ruta), "huella": huella(ruta), "posicion": 0, "fila": 0,
+                     "encabezado": None, "facturas": 0, "errores": 0, "reporte": 0, "terminado": False}
+        self.facturas, self.errores, self.filas = punto["facturas"], punto["errores"], punto["fila"]
+        lector = LectorFilas(ruta, self.formato, punto["posicion"], punto["encabezado"], punto["fila"])
+
+        # El reporte se recorta a lo que cubría el punto de control: nada se reporta dos veces
+        with open(self.reporte, "a+b") as f:
+            f.truncate(punto["reporte"])
+        reporte = open(self.reporte, "a", newline="", encoding="utf-8")
+        escritor = csv.writer(reporte)
+        if not punto["reporte"]:
+            escritor.writerow(COLUMNAS_REPORTE)
+
+        inicio = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(self.procesos, initializer=_inicializar_trabajador,
+                                     initargs=(self.emisor, self.comprobante, self.argumentos_firma)) as executor:
+                pendientes = collections.deque()
+                sin_guardar = 0
+                for factura in agrupar(lector):
+                    futuro = None
+                    if not factura.errores:
+                        futuro = executor.submit(_generar_y_firmar, (factura.comprobante, factura.emisor,
+                                                                     factura.receptor, factura.conceptos))
+                    pendientes.append((factura, futuro))
+                    while len(pendientes) >= self.ventana or (pendientes and (pendientes[0][1] is None
+                                                                              or pendientes[0][1].done())):
+                        factura_lista, futuro_listo = pendientes.popleft()
+                        yield self._terminar(factura_lista, futuro_listo, escritor)
+                        sin_guardar += 1
+                        if sin_guardar >= self.cada:
+                            self._punto(punto, factura_lista, lector, reporte)
+                            sin_guardar = 0
+                    self.segundos = time.perf_counter() - inicio
+                while pendientes:
+                    factura_lista, futuro_listo = pendientes.popleft()
+                    yield self._terminar(factura_lista, futuro_listo, escritor)
+            punto["terminado"] = True
+            self._punto(punto, None, lector, reporte)
+        finally:
+            reporte.close()
+            self.segundos = time.perf_counter() - inicio
+
+    def _terminar(self, factura, futuro, escritor):
+        """Escribe, encola o reporta una factura ya resuelta."""
+        self.facturas += 1
+        self.filas = factura.ultima
+        filas = f"{factura.primera}-{factura.ultima}" if factura.ultima != factura.primera else str(factura.primera)
+        error = salida = None
+        if factura.errores:
+            for fila, mensaje in factura.errores:
+                escritor.writerow((fila, factura.serie, factura.folio, "lectura", mensaje))
+            error = "; ".join(f"fila {fila}: {mensaje}" for fila, mensaje in factura.errores)
+        else:
+            resultado = futuro.result()
+            if resultado.error is None:
+                salida = os.path.join(self.directorio_salida, _nombre_archivo(factura.serie, factura.folio))
+                try:
+                    _guardar(salida, resultado.salida)
+                    if self.cola is not None:
+                        self.cola.agregar(resultado.salida)
+                except (OSError, ValueError) as e:
+                    error, salida = f"salida: {type(e).__name__}: {e}", None
+            else:
+                error = resultado.error
+            if error is not None:
+                etapa, _, mensaje = error.partition(": ")
+                escritor.writerow((filas, factura.serie, factura.folio, etapa, mensaje))
+        if error is not None:
+            self.errores += 1
+        return ResultadoIngesta(factura.serie, factura.folio, filas, salida, error)
+
+    def _punto(self, punto, factura, lector, reporte):
+        """Guarda el avance hasta el fin de `factura` (o del archivo, si es None)."""
+        reporte.flush()
+        punto.update(facturas=self.facturas, errores=self.errores, reporte=reporte.tell(),
+                     encabezado=lector.encabezado)
+        if factura is None:
+            punto.update(posicion=lector.posicion, fila=lector.fila)
+        else:
+            punto.update(posicion=factura.fin, fila=factura.ultima)
+        self._guardar_punto(punto)
+
+
+def escribir_ejemplo(ruta, facturas=1000, conceptos=5, semilla=0):
+    """CSV sintético de ventas (varias filas por factura) para pruebas de volumen."""
+    azar = random.Random(semilla)
+    columnas = ("Serie", "Folio", "Fecha", "FormaPago", "MetodoPago", "LugarExpedicion", "Receptor.Rfc",
+                "Receptor.Nombre", "Receptor.DomicilioFiscalReceptor", "Receptor.RegimenFiscalReceptor",
+                "Receptor.UsoCFDI", "Concepto.ClaveProdServ", "Concepto.NoIdentificacion", "Concepto.Cantidad",
+                "Concepto.ClaveUnidad", "Concepto.Unidad", "Concepto.Descripcion", "Concepto.ValorUnitario",
+                "Concepto.Descuento", "Concepto.IVA")
+    with open(ruta, "w", newline="", encoding="utf-8") as f:
+        escritor = csv.writer(f)
+        escritor.writerow(columnas)
+        for folio in range(1, facturas + 1):
+            cliente = f"CLIENTE {azar.randrange(1000)}"
+            for linea in range(azar.randint(1, conceptos * 2 - 1)):
+                escritor.writerow((
+                    "ERP", folio, "2024-03-09T12:00:00", "01", "PUE", "64000", "BBB020202BX6", cliente, "64000", "601", "G03", "01010101", f"SKU-{linea}",
+                    azar.randint(1, 10), "H87", "Pieza", f'Producto {linea}, "modelo" {azar.randrange(100)}',
+                    f"{azar.randint(100, 100000) / 100:.2f}", "1.00" if azar.random() < 0.1 else "",
+                    azar.choice(("0.160000", "0.160000", "0.080000", "Exento"))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingesta de ventas del ERP (CSV/JSONL) a CFDI firmados.")
+    parser.add_argument("entrada", help="CSV o JSONL con una fila por concepto")
+    parser.add_argument("--salida", default="facturas", help="Directorio de los XML firmados")
+    parser.add_argument("--emisor", default=None,
+                        help='JSON {"Emisor": {...}, "Comprobante": {...}} con los datos fijos')
+    parser.add_argument("--reanudar", action="store_true", help="Continuar desde el último punto de control")
+    parser.add_argument("--cada", type=int, default=100, help="Facturas entre puntos de control")
+    parser.add_argument("--formato", default=None, choices=("csv", "jsonl"))
+    parser.add_argument("--key", default="mi_llave.key", help="Llave privada del CSD (.key)")
+    parser.add_argument("--cer", default="mi_certificado.cer", help="Certificado del CSD")
+    parser.add_argument("--password", default="12345678a", help="Contraseña de la llave privada")
+    parser.add_argument("--csd", default=None, help="Directorio con pares .cer/.key de varios emisores")
+    parser.add_argument("--passwords", default=None, help="JSON con la contraseña de cada RFC para --csd")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos (por omisión, núcleos)")
+    parser.add_argument("--metodo", default="xslt", choices=("xslt", "nativo", "auto"))
+    parser.add_argument("--validar", action="store_true", help="Validar cada comprobante antes de firmarlo")
+    parser.add_argument("--cola", default=None, help="Encolar los firmados en esta cola de timbrado (SQLite)")
+    parser.add_argument("--ejemplo", type=int, default=None, metavar="FACTURAS",
+                        help="Escribir primero un CSV sintético con ese número de facturas en la entrada")
+    args = parser.parse_args()
+
+    if args.ejemplo:
+        escribir_ejemplo(args.entrada, args.ejemplo)
+        print(f"📝 {args.entrada}: {args.ejemplo} facturas de ejemplo")
+    datos = {"Emisor": {"Rfc": "AAA010101AX5", "Nombre": "EMPRESA EMISORA S.A. DE C.V.", "RegimenFiscal": "601"},
+             "Comprobante": {"Moneda": "MXN", "TipoDeComprobante": "I", "Exportacion": "01"}}
+    if args.emisor:
+        with open(args.emisor, encoding="utf-8") as f:
+            datos.update(json.load(f))
+    passwords = None
+    if args.passwords:
+        with open(args.passwords, encoding="utf-8") as f:
+            passwords = json.load(f)
+    cola = None
+    if args.cola:
+        from .cola_timbrado import ColaTimbrado
+
+        cola = ColaTimbrado(args.cola)
+
+    ingesta = Ingesta(args.key, args.password.encode("utf-8"), args.salida, datos["Emisor"], datos["Comprobante"],
+                      args.procesos, ruta_cer=args.cer or None, metodo=args.metodo, validar=args.validar,
+                      directorio_csd=args.csd, passwords=passwords, cola=cola, cada=args.cada,
+                      formato=args.formato)
+    try:
+        for resultado in ingesta.procesar(args.entrada, args.reanudar):
+            if resultado.error is not None:
+                print(f"❌ {resultado.serie}{resultado.folio} (filas {resultado.filas}): {resultado.error}")
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    finally:
+        if cola is not None:
+            cola.cerrar()
+    print(f"✅ {ingesta.facturas - ingesta.errores}/{ingesta.facturas} facturas firmadas en {args.salida} "
+          f"({ingesta.filas} filas, {ingesta.segundos:.2f} s, {ingesta.por_segundo:.1f} facturas/s); "
+          f"errores en {ingesta.reporte}")
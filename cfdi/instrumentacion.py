@@ -0,0 +1,515 @@
+import argparse
+import bisect
+import contextvars
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+# Métricas y trazas del flujo de CFDI (parseo, cadena, firma, serialización, HTTP del PAC).
+#
+# Desactivadas por omisión: etapa() devuelve entonces un objeto compartido que no
+# mide nada, así que el costo en el camino de firma es una llamada y una
+# comparación. Se activan con activar() o con la variable de entorno CFDI_METRICAS=1
+# (CFDI_TRAZAS=1 además emite un tramo por etapa). Cada proceso lleva sus propias
+# métricas; con un pool de procesos, cada trabajador tendría que exponer las suyas.
+#
+# Uso:
+#     instrumentacion.activar()
+#     instrumentacion.servir(9464)  # http://127.0.0.1:9464/metrics
+#     with instrumentacion.etapa("cadena"):
+#         ...
+
+# Límites (segundos) de los histogramas: de 0.1 ms a 10 s
+LIMITES_SEGUNDOS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0)
+
+PUERTO_PROMETHEUS = 9464
+
+activo = os.environ.get("CFDI_METRICAS", "") not in ("", "0")
+trazas = os.environ.get("CFDI_TRAZAS", "") not in ("", "0")
+
+logger_trazas = logging.getLogger("cfdi.trazas")
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ""
+    pares = []
+    for nombre, valor in zip(nombres, valores):
+        valor = str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pares.append(f'{nombre}="{valor}"')
+    return "{" + ",".join(pares) + "}"
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    """Contador monótono por combinación de etiquetas (tipo counter de Prometheus)."""
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._candado = threading.Lock()
+
+    def incrementar(self, *valores, cantidad=1):
+        with self._candado:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def valor(self, *valores):
+        return self._valores.get(valores, 0)
+
+    def limpiar(self):
+        with self._candado:
+            self._valores.clear()
+
+    def exportar(self):
+        with self._candado:
+            valores = sorted(self._valores.items())
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for clave, valor in valores:
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}")
+        return lineas
+
+
+class Histograma:
+    """
+    Histograma de cubetas fijas por combinación de etiquetas (tipo histogram de Prometheus).
+
+    Cada observación cuesta una búsqueda binaria y tres sumas bajo un candado.
+    """
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.limites = tuple(limites)
+        self._series = {}  # etiquetas -> [cuentas por cubeta (+Inf al final), suma]
+        self._candado = threading.Lock()
+
+    def observar(self, valor, *valores):
+        indice = bisect.bisect_left(self.limites, valor)
+        with self._candado:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * (len(self.limites) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def cuenta(self, *valores):
+        serie = self._series.get(valores)
+        return sum(serie[0]) if serie else 0
+
+    def suma(self, *valores):
+        serie = self._series.get(valores)
+        return serie[1] if serie else 0.0
+
+    def limpiar(self):
+        with self._candado:
+            self._series.clear()
+
+    def exportar(self):
+        with self._candado:
+            series = sorted((clave, (list(cuentas), suma)) for clave, (cuentas, suma) in self._series.items())
+        nombres = self.etiquetas + ("le",)
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for clave, (cuentas, suma) in series:
+            acumulado = 0
+            for limite, cuenta in zip(self.limites + ("+Inf",), cuentas):
+                acumulado += cuenta
+                le = limite if isinstance(limite, str) else _numero(float(limite))
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(nombres, clave + (le,))} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {acumulado}")
+        return lineas
+
+
+class Registro:
+    """Métricas del proceso, en el orden en que se registraron."""
+
+    def __init__(self):
+        self._metricas = {}
+        self._candado = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._candado:
+            return self._metricas.setdefault(metrica.nombre, metrica)
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Contador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), limites=LIMITES_SEGUNDOS):
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, limites))
+
+    def limpiar(self):
+        for metrica in list(self._metricas.values()):
+            metrica.limpiar()
+
+    def exportar(self):
+        """Texto en el formato de exposición de Prometheus (0.0.4)."""
+        lineas = []
+        for metrica in list(self._metricas.values()):
+            lineas.extend(metrica.exportar())
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+DURACION_ETAPA = registro.histograma(
+    "cfdi_etapa_segundos", "Duración de cada etapa del flujo de CFDI.", ("etapa",))
+FALLAS = registro.contador(
+    "cfdi_fallas_total", "Fallas por etapa y categoría (tipo de excepción).", ("etapa", "categoria"))
+RESPUESTAS_PAC = registro.contador(
+    "cfdi_pac_respuestas_total", "Respuestas HTTP del PAC por etapa y código de estado.", ("etapa", "codigo"))
+
+
+def activar(metricas=True, con_trazas=None):
+    """
+    Enciende (o apaga) la medición de etapas del proceso.
+
+    Parámetros:
+        metricas (bool): Medir duraciones y contar fallas.
+        con_trazas (bool): Emitir además un tramo por etapa; None deja el valor actual.
+    """
+    global activo, trazas
+    activo = bool(metricas)
+    if con_trazas is not None:
+        trazas = bool(con_trazas)
+
+
+def desactivar():
+    activar(False, False)
+
+
+def exportar_prometheus():
+    return registro.exportar()
+
+
+# Identificadores del comprobante en curso (uuid, serie, folio, rfc); viajan en los
+# tramos y en los logs JSON sin pasarlos por cada función
+_comprobante = contextvars.ContextVar("cfdi_comprobante", default=None)
+_tramo_actual = contextvars.ContextVar("cfdi_tramo", default=None)
+
+
+def identificadores():
+    """Identificadores del comprobante en curso (dict vacío si no hay ninguno)."""
+    return _comprobante.get() or {}
+
+
+class _Nula:
+    """Etapa y contexto que no hacen nada; se comparte cuando la instrumentación está apagada."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        return False
+
+    def atributo(self, nombre, valor):
+        pass
+
+
+_NULA = _Nula()
+
+
+class _Comprobante:
+    __slots__ = ("datos", "_ficha")
+
+    def __init__(self, datos):
+        self.datos = datos
+
+    def __enter__(self):
+        self._ficha = _comprobante.set({**identificadores(), **self.datos})
+        # El tramo en curso (por ejemplo "sellado", abierto antes del parseo) también los recibe
+        tramo = _tramo_actual.get()
+        if tramo is not None:
+            tramo.atributos.update(self.datos)
+        elif trazas and self.datos:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                return self
+            span = trace.get_current_span()
+            for clave, valor in self.datos.items():
+                span.set_attribute(f"cfdi.{clave}", str(valor))
+        return self
+
+    def __exit__(self, *excepcion):
+        _comprobante.reset(self._ficha)
+        return False
+
+
+def comprobante(**datos):
+    """
+    Fija los identificadores del comprobante en curso (uuid, serie, folio, rfc, ...).
+
+    Uso:
+        with instrumentacion.comprobante(serie="A", folio="12345"):
+            sellar_cfdi(...)
+    """
+    if not activo:
+        return _NULA
+    return _Comprobante({clave: valor for clave, valor in datos.items() if valor is not None})
+
+
+def comprobante_de(raiz, espacio="{http://www.sat.gob.mx/cfd/4}"):
+    """Como comprobante(), tomando Serie, Folio y el RFC del Emisor del elemento raíz de un CFDI."""
+    if not activo:
+        return _NULA
+    emisor = raiz.find(espacio + "Emisor")
+    return comprobante(serie=raiz.get("Serie"), folio=raiz.get("Folio"),
+                       rfc=emisor.get("Rfc") if emisor is not None else None)
+
+
+def categoria(excepcion):
+    """Categoría de falla de una excepción: su tipo, y el código de estado si es un ErrorPAC."""
+    nombre = type(excepcion).__name__
+    status_code = getattr(excepcion, "status_code", None)
+    return f"{nombre}_{status_code}" if status_code is not None else nombre
+
+
+class Tramo:
+    """
+    Tramo de una traza al estilo OpenTelemetry (mismos identificadores en hexadecimal).
+
+    Al terminar se emite en el logger "cfdi.trazas" con todos sus campos en `extra`,
+    así que FormatoJSON lo escribe como una línea JSON.
+    """
+
+    __slots__ = ("nombre", "traza_id", "tramo_id", "padre_id", "atributos", "inicio", "duracion",
+                 "estado", "_ficha")
+
+    def __init__(self, nombre, atributos):
+        padre = _tramo_actual.get()
+        self.nombre = nombre
+        self.traza_id = padre.traza_id if padre is not None else os.urandom(16).hex()
+        self.tramo_id = os.urandom(8).hex()
+        self.padre_id = padre.tramo_id if padre is not None else None
+        self.atributos = {**identificadores(), **atributos}
+        self.estado = "OK"
+        self.duracion = None
+
+    def iniciar(self):
+        self.inicio = time.time()
+        self._ficha = _tramo_actual.set(self)
+        return self
+
+    def terminar(self, duracion, excepcion=None):
+        _tramo_actual.reset(self._ficha)
+        self.duracion = duracion
+        if excepcion is not None:
+            self.estado = "ERROR"
+            self.atributos["error"] = categoria(excepcion)
+        logger_trazas.info("tramo %s", self.nombre, extra={"tramo": self.como_dict()})
+
+    def como_dict(self):
+        return {"nombre": self.nombre, "traza_id": self.traza_id, "tramo_id": self.tramo_id,
+                "padre_id": self.padre_id, "inicio": self.inicio,
+                "duracion_ms": round(self.duracion * 1000, 3) if self.duracion is not None else None,
+                "estado": self.estado, "atributos": self.atributos}
+
+
+def _tramo_otel(nombre, atributos):
+    """Tramo de OpenTelemetry si el paquete está instalado; None para usar Tramo."""
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    valores = {f"cfdi.{clave}": str(valor) for clave, valor in {**identificadores(), **atributos}.items()}
+    return trace.get_tracer("cfdi").start_as_current_span(nombre, attributes=valores)
+
+
+class _Etapa:
+    __slots__ = ("nombre", "atributos", "_inicio", "_tramo", "_otel")
+
+    def __init__(self, nombre, atributos):
+        self.nombre = nombre
+        self.atributos = atributos
+        self._tramo = self._otel = None
+
+    def atributo(self, nombre, valor):
+        """Agrega un atributo al tramo (por ejemplo el UUID una vez timbrado)."""
+        self.atributos[nombre] = valor
+        if self._tramo is not None:
+            self._tramo.atributos[nombre] = valor
+        elif self._otel is not None:
+            from opentelemetry import trace
+
+            trace.get_current_span().set_attribute(f"cfdi.{nombre}", str(valor))
+
+    def __enter__(self):
+        if trazas:
+            self._otel = _tramo_otel(self.nombre, self.atributos)
+            if self._otel is not None:
+                self._otel.__enter__()
+            else:
+                self._tramo = Tramo(self.nombre, self.atributos).iniciar()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, excepcion, rastreo):
+        duracion = time.perf_counter() - self._inicio
+        DURACION_ETAPA.observar(duracion, self.nombre)
+        if excepcion is not None:
+            FALLAS.incrementar(self.nombre, categoria(excepcion))
+        if self._tramo is not None:
+            self._tramo.terminar(duracion, excepcion)
+        elif self._otel is not None:
+            self._otel.__exit__(tipo, excepcion, rastreo)
+        return False
+
+
+def etapa(nombre, **atributos):
+    """
+    Mide una etapa del flujo: su duración va al histograma cfdi_etapa_segundos y,
+    si termina con una excepción, se cuenta en cfdi_fallas_total con su categoría.
+
+    Parámetros:
+        nombre (str): "parseo", "cadena", "firma", "serializacion", "llave", "timbrado_http", ...
+        atributos: Atributos del tramo (además de los identificadores del comprobante).
+
+    Uso:
+        with instrumentacion.etapa("firma"):
+            sello = firmante.firmar(cadena_original)
+    """
+    if not activo:
+        return _NULA
+    return _Etapa(nombre, atributos)
+
+
+def contar(contador, *valores):
+    """Incrementa un contador solo si la instrumentación está activa."""
+    if activo:
+        contador.incrementar(*valores)
+
+
+def servir(puerto=PUERTO_PROMETHEUS, direccion="127.0.0.1"):
+    """
+    Expone /metrics en formato Prometheus desde un hilo del proceso.
+
+    Retorna:
+        ThreadingHTTPServer: El servidor (server.shutdown() lo detiene).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            cuerpo = exportar_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, formato, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((direccion, puerto), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="cfdi-metricas", daemon=True).start()
+    return servidor
+
+
+# Atributos de todo LogRecord; lo demás llegó por `extra`
+_ATRIBUTOS_REGISTRO = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro, con los campos de `extra` y los identificadores del comprobante."""
+
+    def format(self, record):
+        datos = {
+            "momento": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+        }
+        datos.update(identificadores())
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_REGISTRO:
+                datos[clave] = valor
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+def configurar_logs(nivel=None, formato=None):
+    """
+    Configura el logger "cfdi" (y los scripts) para escribir a stderr.
+
+    Parámetros:
+        nivel (str): Nivel mínimo; por omisión CFDI_LOG_NIVEL o "INFO".
+        formato (str): "texto" (solo el mensaje, como los print de antes) o "json";
+            por omisión CFDI_LOGS o "texto".
+    """
+    nivel = nivel or os.environ.get("CFDI_LOG_NIVEL", "INFO")
+    formato = formato or os.environ.get("CFDI_LOGS", "texto")
+    manejador = logging.StreamHandler()
+    manejador.setFormatter(FormatoJSON() if formato == "json" else logging.Formatter("%(message)s"))
+    raiz = logging.getLogger()
+    for anterior in list(raiz.handlers):
+        raiz.removeHandler(anterior)
+    raiz.addHandler(manejador)
+    raiz.setLevel(nivel.upper())
+    # Los tramos son de nivel INFO pero solo interesan cuando se piden
+    logger_trazas.setLevel(logging.INFO if trazas else logging.WARNING)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mide las etapas de sellado de un CFDI y expone las métricas.")
+    parser.add_argument("xml", nargs="?", default="cfdi.xml", help="CFDI a sellar repetidamente")
+    parser.add_argument("--key", default="mi_llave.key")
+    parser.add_argument("--cer", default="mi_certificado.cer")
+    parser.add_argument("--password", default="12345678a")
+    parser.add_argument("--repeticiones", type=int, default=200)
+    parser.add_argument("--trazas", action="store_true", help="Emitir un tramo JSON por etapa")
+    parser.add_argument("--servir", type=int, default=None, metavar="PUERTO",
+                        help="Exponer /metrics en ese puerto hasta Ctrl+C")
+    args = parser.parse_args()
+
+    from . import firma
+    from .firmante import Firmante
+
+    # Ejecutado con -m, este archivo es __main__: el estado que leen firma y
+    # cliente_pac es el del módulo cfdi.instrumentacion
+    from . import instrumentacion
+
+    instrumentacion.configurar_logs(formato="json" if args.trazas else None)
+    with open(args.xml, "rb") as f:
+        contenido = f.read()
+    firmante = Firmante.desde_archivo(args.key, args.password)
+    no_certificado, certificado_b64 = firma.cargar_certificado(args.cer)
+
+    def sellar_todo():
+        inicio = time.perf_counter()
+        for _ in range(args.repeticiones):
+            firma.sellar_cfdi(contenido, firmante, no_certificado, certificado_b64)
+        return (time.perf_counter() - inicio) / args.repeticiones
+
+    apagado = sellar_todo()
+    instrumentacion.activar(True, args.trazas)
+    if args.trazas:
+        instrumentacion.logger_trazas.setLevel(logging.INFO)
+    encendido = sellar_todo()
+    print(instrumentacion.exportar_prometheus())
+    print(f"⏱️ {apagado * 1e3:.3f} ms por CFDI sin instrumentación, {encendido * 1e3:.3f} ms con ella "
+          f"({(encendido - apagado) * 1e6:+.1f} µs)")
+    if args.servir:
+        instrumentacion.servir(args.servir)
+        print(f"📈 Métricas en http://127.0.0.1:{args.servir}/metrics (Ctrl+C para terminar)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,281 @@
+import collections
+import email.parser
+import email.policy
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from lxml import etree
+
+TFD = "http://www.sat.gob.mx/TimbreFiscalDigital"
+CFDI = "http://www.sat.gob.mx/cfd/4"
+
+
+class PACSimulado:
+    """
+    PAC local para pruebas con la misma forma de API que SW.
+
+    Atiende /security/authenticate, /cfdi33/issue/v4, la consulta de timbres
+    previos, la cancelación y la consulta de estado en un hilo. Como el SAT,
+    rechaza con el error 307 un comprobante cuyo sello ya fue timbrado
+    (rechazar_duplicados=False lo desactiva para timbrar el mismo documento
+    repetidas veces). Permite inyectar respuestas de error (por ejemplo 429 o
+    503) y latencia, y cuenta las autenticaciones, solicitudes y conexiones
+    para verificar el cliente. Con `limite_por_segundo` responde 429 a las
+    solicitudes que excedan ese límite, como el de la cuenta de un PAC real.
+
+    Uso:
+        with PACSimulado() as pac:
+            cliente = ClienteSW("usuario", "contraseña", url_base=pac.url)
+    """
+
+    def __init__(self, user="usuario@pruebas.com", password="contraseña1234", vigencia_token=3600,
+                 latencia=0.0, host="127.0.0.1", puerto=0, rechazar_duplicados=True, limite_por_segundo=None):
+        self.user = user
+        self.password = password
+        self.vigencia_token = vigencia_token
+        self.latencia = latencia
+        self.rechazar_duplicados = rechazar_duplicados
+        self.limite_por_segundo = limite_por_segundo
+        self.excedidas = 0  # solicitudes rechazadas con 429 por exceder el límite
+        self._ventana = collections.deque()  # instantes de las solicitudes del último segundo
+        self.comprobantes = {}  # uuid -> {"emisor", "receptor", "total", "estado", "motivo"}
+        self.fallas = []  # códigos HTTP a devolver en las siguientes solicitudes de timbrado
+        self.tokens = {}  # token -> expiración
+        self.timbrados = {}  # uuid -> XML timbrado
+        self.por_sello = {}  # sello -> datos del timbre, para detectar duplicados
+        self.autenticaciones = 0
+        self.solicitudes = 0
+        self.conexiones = 0
+        self._candado = threading.Lock()
+        self._servidor = ThreadingHTTPServer((host, puerto), self._manejador())
+        self._servidor.daemon_threads = True
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, puerto = self._servidor.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *excepcion):
+        self.detener()
+
+    def inyectar_fallas(self, *codigos):
+        """Las siguientes solicitudes de timbrado responderán con estos códigos, en orden."""
+        with self._candado:
+            self.fallas.extend(codigos)
+
+    def revocar_tokens(self):
+        with self._candado:
+            self.tokens.clear()
+
+    def _autenticar(self, cuerpo):
+        datos = json.loads(cuerpo or b"{}")
+        if datos.get("user") != self.user or datos.get("password") != self.password:
+            return 401, {"status": "error", "message": "Usuario o contraseña inválidos"}
+        token = uuid.uuid4().hex
+        expira = int(time.time() + self.vigencia_token)
+        with self._candado:
+            self.tokens[token] = expira
+            self.autenticaciones += 1
+        return 200, {"status": "success", "data": {"token": token, "expires_in": expira}}
+
+    def token_valido(self, encabezado):
+        token = (encabezado or "").replace("Bearer ", "", 1)
+        with self._candado:
+            return self.tokens.get(token, 0) > time.time()
+
+    def _leer_comprobante(self, cuerpo, tipo_contenido):
+        """Extrae el XML del formulario multipart; retorna (raíz, None) o (None, respuesta de error)."""
+        mensaje = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: " + tipo_contenido.encode() + b"\r\n\r\n" + cuerpo)
+        xml = next((p.get_payload(decode=True) for p in mensaje.iter_parts()
+                    if p.get_param("name", header="content-disposition") == "xml"), None)
+        if not xml:
+            return None, (400, {"status": "error", "message": "No se recibió el XML"})
+        try:
+            raiz = etree.fromstring(xml)
+        except etree.XMLSyntaxError as e:
+            return None, (400, {"status": "error", "message": f"XML mal formado: {e}"})
+        if not raiz.get("Sello"):
+            return None, (400, {"status": "error", "message": "El comprobante no está sellado"})
+        return raiz, None
+
+    def _timbrar(self, cuerpo, tipo_contenido):
+        raiz, error = self._leer_comprobante(cuerpo, tipo_contenido)
+        if error:
+            return error
+        with self._candado:
+            previo = self.por_sello.get(raiz.get("Sello"))
+        if previo and self.rechazar_duplicados:
+            return 400, {"status": "error", "message": "307. El comprobante contiene un timbre previo.",
+                         "messageDetail": previo["uuid"]}
+
+        folio_fiscal = str(uuid.uuid4()).upper()
+        fecha = time.strftime("%Y-%m-%dT%H:%M:%S")
+        complemento = raiz.find(f"{{{CFDI}}}Complemento")
+        if complemento is None:
+            complemento = etree.SubElement(raiz, f"{{{CFDI}}}Complemento")
+        etree.SubElement(complemento, f"{{{TFD}}}TimbreFiscalDigital", nsmap={"tfd": TFD},
+                         Version="1.1", UUID=folio_fiscal, FechaTimbrado=fecha,
+                         RfcProvCertif="SPR190613I52", SelloCFD=raiz.get("Sello"),
+                         NoCertificadoSAT="30001000000500003456", SelloSAT="c2ltdWxhZG8=")
+        cfdi = etree.tostring(raiz, xml_declaration=True, encoding="UTF-8").decode("utf-8")
+        datos = {
+            "uuid": folio_fiscal, "fechaTimbrado": fecha, "cfdi": cfdi,
+            "noCertificadoCFDI": raiz.get("NoCertificado"), "selloCFDI": raiz.get("Sello"),
+        }
+        with self._candado:
+            self.timbrados[folio_fiscal] = cfdi
+            self.por_sello[raiz.get("Sello")] = datos
+        self.registrar(folio_fiscal, raiz.find(f"{{{CFDI}}}Emisor").get("Rfc"),
+                       raiz.find(f"{{{CFDI}}}Receptor").get("Rfc"), raiz.get("Total"))
+        return 200, {"status": "success", "data": datos}
+
+    def registrar(self, folio_fiscal, rfc_emisor, rfc_receptor, total):
+        """Da de alta un CFDI vigente sin timbrarlo (para probar cancelaciones y consultas en volumen)."""
+        with self._candado:
+            self.comprobantes[folio_fiscal.upper()] = {
+                "emisor": rfc_emisor, "receptor": rfc_receptor, "total": str(total), "estado": "Vigente",
+                "motivo": None}
+
+    def _cancelar(self, cuerpo, tipo_contenido):
+        datos = json.loads(cuerpo or b"{}")
+        folio_fiscal = (datos.get("uuid") or "").upper()
+        motivo = datos.get("motivo")
+        if motivo not in ("01", "02", "03", "04"):
+            return 400, {"status": "error", "message": f"Motivo de cancelación inválido: {motivo}"}
+        if (motivo == "01") != bool(datos.get("foliosustitucion")):
+            return 400, {"status": "error", "message": "El folio de sustitución solo aplica con el motivo 01"}
+        if not datos.get("b64Cer") or not datos.get("b64Key"):
+            return 400, {"status": "error", "message": "Faltan el certificado o la llave del CSD"}
+        with self._candado:
+            comprobante = self.comprobantes.get(folio_fiscal)
+            if comprobante is None:
+                codigo = "205"  # UUID no existe
+            elif comprobante["emisor"] != datos.get("rfc"):
+                codigo = "203"  # no corresponde al emisor
+            elif comprobante["estado"] == "Cancelado":
+                codigo = "202"  # previamente cancelado
+            else:
+                comprobante.update(estado="Cancelado", motivo=motivo)
+                codigo = "201"
+        acuse = f'<Acuse RfcEmisor="{datos.get("rfc")}"><Folios UUID="{folio_fiscal}" EstatusUUID="{codigo}"/></Acuse>'
+        return 200, {"status": "success", "data": {"acuse": acuse, "uuid": {folio_fiscal: codigo}}}
+
+    def _estado(self, cuerpo, tipo_contenido):
+        datos = json.loads(cuerpo or b"{}")
+        with self._candado:
+            comprobante = dict(self.comprobantes.get((datos.get("uuid") or "").upper()) or {})
+        if not comprobante or comprobante["emisor"] != datos.get("rfcEmisor"):
+            return 200, {"status": "success", "data": {
+                "codigoEstatus": "N - 602: Comprobante no encontrado.", "estado": "No Encontrado",
+                "esCancelable": "", "estatusCancelacion": ""}}
+        cancelado = comprobante["estado"] == "Cancelado"
+        return 200, {"status": "success", "data": {
+            "codigoEstatus": "S - Comprobante obtenido satisfactoriamente.", "estado": comprobante["estado"],
+            "esCancelable": "No cancelable" if cancelado else "Cancelable sin aceptación",
+            "estatusCancelacion": "Cancelado sin aceptación" if cancelado else ""}}
+
+    def _excede_limite(self):
+        """Ventana deslizante de un segundo; se llama con el candado tomado."""
+        if not self.limite_por_segundo:
+            return False
+        ahora = time.monotonic()
+        while self._ventana and ahora - self._ventana[0] >= 1.0:
+            self._ventana.popleft()
+        if len(self._ventana) >= self.limite_por_segundo:
+            self.excedidas += 1
+            return True
+        self._ventana.append(ahora)
+        return False
+
+    def _consultar(self, cuerpo, tipo_contenido):
+        raiz, error = self._leer_comprobante(cuerpo, tipo_contenido)
+        if error:
+            return error
+        with self._candado:
+            previo = self.por_sello.get(raiz.get("Sello"))
+        if previo is None:
+            return 404, {"status": "error", "message": "El comprobante no ha sido timbrado"}
+        return 200, {"status": "success", "data": previo}
+
+    def _manejador(self):
+        pac = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # conexiones keep-alive, como un PAC real
+            # Encabezados y cuerpo van en escrituras separadas; con Nagle cada
+            # respuesta esperaba el ACK retrasado del cliente (~40 ms)
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with pac._candado:
+                    pac.conexiones += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, estado, datos, encabezados=None):
+                cuerpo = json.dumps(datos).encode("utf-8")
+                self.send_response(estado)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                for nombre, valor in (encabezados or {}).items():
+                    self.send_header(nombre, valor)
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def do_POST(self):
+                cuerpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if pac.latencia:
+                    time.sleep(pac.latencia)
+                if self.path == "/security/authenticate":
+                    return self._responder(*pac._autenticar(cuerpo))
+                manejador = pac.rutas().get(self.path)
+                if manejador is None:
+                    return self._responder(404, {"status": "error", "message": "Ruta no encontrada"})
+                if not pac.token_valido(self.headers.get("Authorization")):
+                    return self._responder(401, {"status": "error", "message": "Token inválido"})
+                with pac._candado:
+                    pac.solicitudes += 1
+                    falla = pac.fallas.pop(0) if pac.fallas else None
+                    excedida = falla is None and pac._excede_limite()
+                if excedida:
+                    return self._responder(429, {"status": "error", "message": "Límite de solicitudes excedido"},
+                                           {"Retry-After": "1"})
+                if falla is not None:
+                    return self._responder(falla, {"status": "error", "message": "Falla simulada"},
+                                           {"Retry-After": "0"} if falla == 429 else None)
+                self._responder(*manejador(cuerpo, self.headers.get("Content-Type", "")))
+
+        return Manejador
+
+    def rutas(self):
+        """Rutas protegidas por token y su manejador (cuerpo, content-type) -> (estado, json)."""
+        return {"/cfdi33/issue/v4": self._timbrar, "/cfdi33/consulta/v4": self._consultar,
+                "/cfdi33/cancel/csd": self._cancelar, "/cfdi/status": self._estado}
+
+
+if __name__ == "__main__":
+    with PACSimulado(puerto=8089) as pac:
+        print(f"PAC simulado escuchando en {pac.url} (Ctrl+C para terminar)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,620 @@
+import argparse
+import collections
+import contextlib
+import json
+import os
+import sqlite3
+from decimal import Decimal, ROUND_HALF_UP
+from lxml import etree
+
+from .validacion import DECIMALES_MONEDA
+
+CFDI = "http://www.sat.gob.mx/cfd/4"
+PAGO20 = "http://www.sat.gob.mx/Pagos20"
+XSI = "http://www.w3.org/2001/XMLSchema-instance"
+TFD = "{http://www.sat.gob.mx/TimbreFiscalDigital}"
+NSMAP = {"cfdi": CFDI, "xsi": XSI, "pago20": PAGO20}
+UBICACION_ESQUEMAS = (f"{CFDI} http://www.sat.gob.mx/sitio_internet/cfd/4/cfdv40.xsd "
+                      f"{PAGO20} http://www.sat.gob.mx/sitio_internet/cfd/Pagos/Pagos20.xsd")
+
+# Decimales de BaseDR/ImporteDR y BaseP/ImporteP (t_Importe admite hasta 6)
+DECIMALES_IMPUESTOS = 6
+# Los nodos Totales van siempre en MXN
+DECIMALES_TOTALES = 2
+
+# Atributos de pago20:Totales por impuesto trasladado (Impuesto, TipoFactor, TasaOCuota)
+TOTALES_TRASLADOS = {
+    ("002", "Tasa", "0.160000"): ("TotalTrasladosBaseIVA16", "TotalTrasladosImpuestoIVA16"),
+    ("002", "Tasa", "0.080000"): ("TotalTrasladosBaseIVA8", "TotalTrasladosImpuestoIVA8"),
+    ("002", "Tasa", "0.000000"): ("TotalTrasladosBaseIVA0", "TotalTrasladosImpuestoIVA0"),
+    ("002", "Exento", None): ("TotalTrasladosBaseIVAExento", None),
+}
+TOTALES_RETENCIONES = {"001": "TotalRetencionesISR", "002": "TotalRetencionesIVA", "003": "TotalRetencionesIEPS"}
+
+# Orden de atributos de cada nodo, igual al de Pagos20.xsd
+ATRIBUTOS_PAGO = (
+    "FechaPago", "FormaDePagoP", "MonedaP", "TipoCambioP", "Monto", "NumOperacion", "RfcEmisorCtaOrd",
+    "NomBancoOrdExt", "CtaOrdenante", "RfcEmisorCtaBen", "CtaBeneficiario", "TipoCadPago", "CertPago",
+    "CadPago", "SelloPago",
+)
+ATRIBUTOS_TOTALES = (
+    "TotalRetencionesIVA", "TotalRetencionesISR", "TotalRetencionesIEPS", "TotalTrasladosBaseIVA16",
+    "TotalTrasladosImpuestoIVA16", "TotalTrasladosBaseIVA8", "TotalTrasladosImpuestoIVA8",
+    "TotalTrasladosBaseIVA0", "TotalTrasladosImpuestoIVA0", "TotalTrasladosBaseIVAExento", "MontoTotalPagos",
+)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS documentos (
+    uuid TEXT PRIMARY KEY,
+    rfc_emisor TEXT NOT NULL,
+    rfc_receptor TEXT NOT NULL,
+    serie TEXT,
+    folio TEXT,
+    moneda TEXT NOT NULL,
+    total TEXT NOT NULL,
+    saldo TEXT NOT NULL,
+    parcialidades INTEGER NOT NULL DEFAULT 0,
+    objeto_imp TEXT NOT NULL,
+    impuestos TEXT,
+    pendiente INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS documentos_pendientes ON documentos (rfc_emisor, rfc_receptor) WHERE pendiente = 1;
+CREATE TABLE IF NOT EXISTS aplicaciones (
+    uuid TEXT NOT NULL,
+    parcialidad INTEGER NOT NULL,
+    pago TEXT NOT NULL,
+    saldo_anterior TEXT NOT NULL,
+    pagado TEXT NOT NULL,
+    insoluto TEXT NOT NULL,
+    PRIMARY KEY (uuid, parcialidad)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS aplicaciones_pago ON aplicaciones (pago);
+"""
+
+# Documento relacionado en el libro; `impuestos` trae por tipo las filas
+# [Impuesto, TipoFactor, TasaOCuota, Base, Importe] del documento completo
+Saldo = collections.namedtuple(
+    "Saldo", "uuid rfc_emisor rfc_receptor serie folio moneda total saldo parcialidades objeto_imp impuestos")
+
+# Diferencia entre el saldo del libro y el que resulta de sus pagos aplicados
+Discrepancia = collections.namedtuple(
+    "Discrepancia", "uuid saldo saldo_calculado parcialidades parcialidades_calculadas")
+
+
+class PagoInvalido(ValueError):
+    """El pago no cuadra con el saldo de algún documento relacionado."""
+
+
+def _q(espacio, nombre):
+    return f"{{{espacio}}}{nombre}"
+
+
+def _exponente(decimales):
+    return Decimal(1).scaleb(-decimales)
+
+
+def _redondear(valor, decimales):
+    return valor.quantize(_exponente(decimales), rounding=ROUND_HALF_UP)
+
+
+def _decimales(moneda):
+    return DECIMALES_MONEDA.get(moneda, 2)
+
+
+def _texto(valor):
+    """Importe como texto sin notación científica ("0E-6" -> "0.000000")."""
+    return format(valor, "f")
+
+
+def _ordenar(datos, orden):
+    return {nombre: str(datos[nombre]) for nombre in orden if datos.get(nombre) not in (None, "")}
+
+
+def _impuestos_documento(raiz):
+    """
+    Traslados y retenciones del comprobante agrupados como en cfdi:Impuestos, pero con Base en ambos.
+
+    Se suman los de los conceptos; si los conceptos no traen impuestos se toman
+    los traslados de cfdi:Impuestos (las retenciones de ese nodo no traen Base).
+    """
+    grupos = {"traslados": {}, "retenciones": {}}
+    rutas = [(tipo, f"{{{CFDI}}}Conceptos/{{{CFDI}}}Concepto/{{{CFDI}}}Impuestos//{{{CFDI}}}{etiqueta}")
+             for tipo, etiqueta in (("traslados", "Traslado"), ("retenciones", "Retencion"))]
+    if raiz.find(f"{{{CFDI}}}Conceptos/{{{CFDI}}}Concepto/{{{CFDI}}}Impuestos") is None:
+        rutas = [("traslados", f"{{{CFDI}}}Impuestos/{{{CFDI}}}Traslados/{{{CFDI}}}Traslado")]
+    for tipo, ruta in rutas:
+        for nodo in raiz.iterfind(ruta):
+            clave = (nodo.get("Impuesto"), nodo.get("TipoFactor"), nodo.get("TasaOCuota"))
+            base, importe = grupos[tipo].get(clave, (Decimal(0), None))
+            if nodo.get("Importe") is not None:
+                importe = (importe or Decimal(0)) + Decimal(nodo.get("Importe"))
+            grupos[tipo][clave] = (base + Decimal(nodo.get("Base")), importe)
+    return {tipo: [[*clave, str(base), None if importe is None else str(importe)]
+                   for clave, (base, importe) in filas.items()]
+            for tipo, filas in grupos.items() if filas}
+
+
+def datos_documento(documento):
+    """
+    Datos de una factura para el libro de saldos.
+
+    Parámetros:
+        documento: CFDI de Ingreso timbrado con MetodoPago PPD (bytes, ruta o
+            elemento de lxml), o un dict con uuid, rfc_emisor, rfc_receptor,
+            serie, folio, moneda, total, objeto_imp e impuestos (opcional).
+
+    Retorna:
+        tuple: Fila para la tabla documentos, con el saldo igual al total.
+    """
+    if isinstance(documento, dict):
+        datos = documento
+    else:
+        if isinstance(documento, str):
+            raiz = etree.parse(documento).getroot()
+        elif isinstance(documento, (bytes, bytearray)):
+            raiz = etree.fromstring(bytes(documento))
+        else:
+            raiz = documento
+        timbre = raiz.find(f"{{{CFDI}}}Complemento/{TFD}TimbreFiscalDigital")
+        if timbre is None or not timbre.get("UUID"):
+            raise ValueError("El CFDI no tiene Timbre Fiscal Digital.")
+        if raiz.get("TipoDeComprobante") != "I" or raiz.get("MetodoPago") != "PPD":
+            raise ValueError(f"El CFDI {timbre.get('UUID')} no es un Ingreso con MetodoPago PPD.")
+        impuestos = _impuestos_documento(raiz)
+        datos = {
+            "uuid": timbre.get("UUID"),
+            "rfc_emisor": raiz.find(f"{{{CFDI}}}Emisor").get("Rfc"),
+            "rfc_receptor": raiz.find(f"{{{CFDI}}}Receptor").get("Rfc"),
+            "serie": raiz.get("Serie"),
+            "folio": raiz.get("Folio"),
+            "moneda": raiz.get("Moneda"),
+            "total": raiz.get("Total"),
+            "objeto_imp": "02" if impuestos else "01",
+            "impuestos": impuestos,
+        }
+    total = str(datos["total"])
+    return (datos["uuid"].upper(), datos["rfc_emisor"], datos["rfc_receptor"], datos.get("serie"),
+            datos.get("folio"), datos["moneda"], total, total, datos.get("objeto_imp", "01"),
+            json.dumps(datos.get("impuestos")) if datos.get("impuestos") else None,
+            1 if Decimal(total) > 0 else 0)
+
+
+class LibroSaldos:
+    """
+    Libro de saldos insolutos por UUID de factura PPD, sobre SQLite en modo WAL.
+
+    Cada factura se registra una vez con su total y sus impuestos; cada
+    complemento de pago consulta por llave primaria solo los documentos que
+    relaciona y, en la misma transacción, descuenta lo pagado y guarda la
+    aplicación (parcialidad, saldo anterior, pagado e insoluto). Así emitir
+    un REP no recorre las facturas históricas, y conciliar() puede recalcular
+    todos los saldos a partir de las aplicaciones.
+
+    Uso:
+        with LibroSaldos("saldos.db") as libro:
+            libro.registrar_lote(facturas_ppd)
+            raiz = construir_pago(comprobante, emisor, receptor, pagos, libro)
+    """
+
+    def __init__(self, ruta="saldos.db"):
+        self.ruta = ruta
+        # Las transacciones se abren explícitamente (BEGIN IMMEDIATE)
+        self.conexion = sqlite3.connect(ruta, timeout=30, isolation_level=None)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.executescript(_ESQUEMA)
+
+    def cerrar(self):
+        self.conexion.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+    @contextlib.contextmanager
+    def transaccion(self):
+        self.conexion.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conexion
+        except BaseException:
+            self.conexion.execute("ROLLBACK")
+            raise
+        self.conexion.execute("COMMIT")
+
+    def registrar(self, documento):
+        """Registra una factura (ver datos_documento); volver a registrarla no cambia su saldo."""
+        return self.registrar_lote([documento])
+
+    def registrar_lote(self, documentos, tamano=1000):
+        """
+        Registra facturas en transacciones de `tamano` filas.
+
+        Retorna:
+            int: Facturas nuevas en el libro.
+        """
+        nuevas = 0
+        filas = []
+        for documento in documentos:
+            filas.append(datos_documento(documento))
+            if len(filas) >= tamano:
+                nuevas += self._insertar(filas)
+                filas = []
+        if filas:
+            nuevas += self._insertar(filas)
+        return nuevas
+
+    def _insertar(self, filas):
+        with self.transaccion() as conexion:
+            antes = conexion.total_changes
+            conexion.executemany("INSERT OR IGNORE INTO documentos VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?)",
+                                 filas)
+            return conexion.total_changes - antes
+
+    def _saldo(self, fila):
+        return Saldo(*fila[:10], json.loads(fila[10]) if fila[10] else {})
+
+    def consultar(self, uuids):
+        """Saldos de varios UUID por llave primaria: {UUID: Saldo} (los que no existen se omiten)."""
+        uuids = [u.upper() for u in uuids]
+        saldos = {}
+        for inicio in range(0, len(uuids), 500):
+            grupo = uuids[inicio:inicio + 500]
+            consulta = ("SELECT uuid, rfc_emisor, rfc_receptor, serie, folio, moneda, total, saldo, parcialidades, "
+                        f"objeto_imp, impuestos FROM documentos WHERE uuid IN ({', '.join('?' * len(grupo))})")
+            for fila in self.conexion.execute(consulta, grupo):
+                saldos[fila[0]] = self._saldo(fila)
+        return saldos
+
+    def saldo(self, uuid):
+        return self.consultar([uuid]).get(uuid.upper())
+
+    def pendientes(self, rfc_emisor, rfc_receptor=None):
+        """Facturas con saldo insoluto del emisor (y receptor), por el índice parcial de pendientes."""
+        consulta = ("SELECT uuid, rfc_emisor, rfc_receptor, serie, folio, moneda, total, saldo, parcialidades, "
+                    "objeto_imp, impuestos FROM documentos WHERE pendiente = 1 AND rfc_emisor = ?")
+        parametros = [rfc_emisor]
+        if rfc_receptor is not None:
+            consulta += " AND rfc_receptor = ?"
+            parametros.append(rfc_receptor)
+        for fila in self.conexion.execute(consulta, parametros):
+            yield self._saldo(fila)
+
+    def aplicar(self, conexion, pago, aplicaciones):
+        """
+        Descuenta los pagos de un REP dentro de una transacción abierta.
+
+        Parámetros:
+            pago (str): Referencia del REP (Serie-Folio), para revertir().
+            aplicaciones: Tuplas (uuid, parcialidad, saldo_anterior, pagado, insoluto),
+                en orden; un UUID puede aparecer varias veces.
+        """
+        conexion.executemany(
+            "INSERT INTO aplicaciones (uuid, parcialidad, pago, saldo_anterior, pagado, insoluto) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(uuid, parcialidad, pago, str(anterior), str(pagado), str(insoluto))
+             for uuid, parcialidad, anterior, pagado, insoluto in aplicaciones])
+        finales = {}
+        for uuid, parcialidad, _, _, insoluto in aplicaciones:
+            finales[uuid] = (str(insoluto), parcialidad, 1 if insoluto > 0 else 0, uuid)
+        conexion.executemany("UPDATE documentos SET saldo = ?, parcialidades = ?, pendiente = ? WHERE uuid = ?",
+                             list(finales.values()))
+
+    def revertir(self, pago):
+        """
+        Devuelve a los documentos lo que pagó un REP (por ejemplo, si se canceló o no se timbró).
+
+        Solo se puede revertir la última parcialidad de cada documento.
+
+        Retorna:
+            int: Aplicaciones revertidas.
+        """
+        with self.transaccion() as conexion:
+            aplicaciones = conexion.execute(
+                "SELECT uuid, parcialidad, pagado FROM aplicaciones WHERE pago = ? ORDER BY parcialidad DESC",
+                (pago,)).fetchall()
+            for uuid, parcialidad, pagado in aplicaciones:
+                saldo, parcialidades = conexion.execute(
+                    "SELECT saldo, parcialidades FROM documentos WHERE uuid = ?", (uuid,)).fetchone()
+                if parcialidad != parcialidades:
+                    raise PagoInvalido(f"{uuid} tiene parcialidades posteriores a la {parcialidad} del pago {pago}")
+                conexion.execute("UPDATE documentos SET saldo = ?, parcialidades = ?, pendiente = 1 WHERE uuid = ?",
+                                 (str(Decimal(saldo) + Decimal(pagado)), parcialidad - 1, uuid))
+            conexion.execute("DELETE FROM aplicaciones WHERE pago = ?", (pago,))
+        return len(aplicaciones)
+
+    def conciliar(self):
+        """
+        Recalcula cada saldo como total menos lo aplicado y lo compara con el libro.
+
+        Retorna:
+            list: Discrepancia de cada documento que no cuadra (vacía si todo cuadra).
+        """
+        discrepancias = []
+        consulta = """
+            SELECT d.uuid, d.total, d.saldo, d.parcialidades, COUNT(a.uuid), group_concat(a.pagado, '|')
+            FROM documentos AS d LEFT JOIN aplicaciones AS a ON a.uuid = d.uuid
+            GROUP BY d.uuid
+        """
+        for uuid, total, saldo, parcialidades, aplicadas, pagados in self.conexion.execute(consulta):
+            pagado = sum((Decimal(p) for p in pagados.split("|")), Decimal(0)) if pagados else Decimal(0)
+            calculado = Decimal(total) - pagado
+            if calculado != Decimal(saldo) or aplicadas != parcialidades:
+                discrepancias.append(Discrepancia(uuid, saldo, str(calculado), parcialidades, aplicadas))
+        return discrepancias
+
+
+def _proporcionales(filas, proporcion):
+    """Base e Importe de cada impuesto del documento en la proporción pagada."""
+    for impuesto, tipo_factor, tasa, base, importe in filas:
+        base_dr = _redondear(Decimal(base) * proporcion, DECIMALES_IMPUESTOS)
+        importe_dr = None if importe is None else _redondear(Decimal(importe) * proporcion, DECIMALES_IMPUESTOS)
+        yield impuesto, tipo_factor, tasa, base_dr, importe_dr
+
+
+def construir_pago(comprobante, emisor, receptor, pagos, libro, referencia=None, aplicar=True):
+    """
+    Construye en memoria un CFDI de pago (tipo "P") con el complemento Pagos 2.0.
+
+    En una sola pasada por los pagos calcula NumParcialidad, ImpSaldoAnt,
+    ImpSaldoInsoluto, los impuestos de cada documento en proporción a lo
+    pagado, ImpuestosP y los Totales en MXN. Los saldos salen del libro por
+    llave primaria y, con aplicar=True, se descuentan en la misma transacción;
+    si algún pago no cuadra no se modifica nada.
+
+    Parámetros:
+        comprobante (dict): Atributos de cfdi:Comprobante (Serie, Folio, Fecha,
+            LugarExpedicion); los fijos de un pago se completan.
+        emisor, receptor (dict): Atributos de cfdi:Emisor y cfdi:Receptor.
+        pagos (list): Un dict por pago con FechaPago, FormaDePagoP, MonedaP,
+            TipoCambioP (si no es MXN), Monto opcional y los demás atributos de
+            pago20:Pago, más "Documentos": dicts con IdDocumento, ImpPagado y
+            EquivalenciaDR (si la moneda del documento es otra).
+        libro (LibroSaldos): Libro de saldos.
+        referencia (str): Referencia del REP en el libro; por omisión "Serie-Folio".
+        aplicar (bool): Si es False solo se calcula (vista previa).
+
+    Retorna:
+        Element: Raíz del comprobante, lista para firma.sellar_cfdi.
+    """
+    referencia = referencia or f"{comprobante.get('Serie', '')}-{comprobante.get('Folio', '')}"
+    uuids = {documento["IdDocumento"].upper() for pago in pagos for documento in pago["Documentos"]}
+
+    with libro.transaccion() as conexion:
+        saldos = libro.consultar(uuids)
+        faltantes = uuids - set(saldos)
+        if faltantes:
+            raise PagoInvalido("Documentos que no están en el libro: " + ", ".join(sorted(faltantes)))
+
+        aplicaciones = []
+        nodos_pago = []
+        totales = collections.defaultdict(Decimal)
+        for pago in pagos:
+            moneda_p = pago["MonedaP"]
+            decimales_p = _decimales(moneda_p)
+            tipo_cambio = Decimal(str(pago.get("TipoCambioP") or 1))
+            if moneda_p != "MXN" and "TipoCambioP" not in pago:
+                raise PagoInvalido(f"El pago del {pago['FechaPago']} en {moneda_p} requiere TipoCambioP")
+            suma = Decimal(0)
+            traslados_p = {}
+            retenciones_p = {}
+            documentos = []
+            for relacionado in pago["Documentos"]:
+                uuid = relacionado["IdDocumento"].upper()
+                saldo = saldos[uuid]
+                if saldo.rfc_emisor != emisor["Rfc"] or saldo.rfc_receptor != receptor["Rfc"]:
+                    raise PagoInvalido(f"{uuid} no es de {emisor['Rfc']} a {receptor['Rfc']}")
+                decimales_dr = _decimales(saldo.moneda)
+                anterior = Decimal(saldo.saldo)
+                pagado = _redondear(Decimal(str(relacionado["ImpPagado"])), decimales_dr)
+                if pagado <= 0 or pagado > anterior:
+                    raise PagoInvalido(f"ImpPagado {pagado} fuera del saldo {anterior} de {uuid}")
+                insoluto = anterior - pagado
+                parcialidad = saldo.parcialidades + 1
+                # El siguiente pago del mismo documento en este REP parte de aquí
+                saldos[uuid] = saldo._replace(saldo=str(insoluto), parcialidades=parcialidad)
+                aplicaciones.append((uuid, parcialidad, anterior, pagado, insoluto))
+
+                if saldo.moneda == moneda_p:
+                    equivalencia = Decimal(str(relacionado.get("EquivalenciaDR") or 1))
+                elif relacionado.get("EquivalenciaDR") is None:
+                    raise PagoInvalido(f"{uuid} está en {saldo.moneda} y el pago en {moneda_p}: falta EquivalenciaDR")
+                else:
+                    equivalencia = Decimal(str(relacionado["EquivalenciaDR"]))
+                suma += pagado / equivalencia
+
+                atributos = {"IdDocumento": uuid, "Serie": saldo.serie, "Folio": saldo.folio,
+                             "MonedaDR": saldo.moneda, "EquivalenciaDR": relacionado.get("EquivalenciaDR") or "1",
+                             "NumParcialidad": parcialidad, "ImpSaldoAnt": _texto(anterior),
+                             "ImpPagado": _texto(pagado), "ImpSaldoInsoluto": _texto(insoluto),
+                             "ObjetoImpDR": saldo.objeto_imp}
+                traslados_dr = retenciones_dr = ()
+                if saldo.objeto_imp == "02" and saldo.impuestos:
+                    proporcion = pagado / Decimal(saldo.total)
+                    traslados_dr = list(_proporcionales(saldo.impuestos.get("traslados", ()), proporcion))
+                    retenciones_dr = list(_proporcionales(saldo.impuestos.get("retenciones", ()), proporcion))
+                    for impuesto, tipo_factor, tasa, base, importe in traslados_dr:
+                        acumulado = traslados_p.setdefault((impuesto, tipo_factor, tasa), [Decimal(0), None])
+                        acumulado[0] += base / equivalencia
+                        if importe is not None:
+                            acumulado[1] = (acumulado[1] or Decimal(0)) + importe / equivalencia
+                    for impuesto, _, _, _, importe in retenciones_dr:
+                        retenciones_p[impuesto] = retenciones_p.get(impuesto, Decimal(0)) + importe / equivalencia
+                documentos.append((atributos, traslados_dr, retenciones_dr))
+
+            # Monto no puede ser menor que la suma de ImpPagado / EquivalenciaDR
+            minimo = _redondear(suma, decimales_p)
+            monto = _redondear(Decimal(str(pago["Monto"])), decimales_p) if pago.get("Monto") else minimo
+            if monto < minimo:
+                raise PagoInvalido(f"Monto {monto} menor que lo pagado a los documentos ({minimo})")
+            atributos_pago = dict(pago, Monto=_texto(monto), TipoCambioP=pago.get("TipoCambioP") or "1")
+
+            traslados_p = [(clave, _redondear(base, DECIMALES_IMPUESTOS),
+                            None if importe is None else _redondear(importe, DECIMALES_IMPUESTOS))
+                           for clave, (base, importe) in traslados_p.items()]
+            retenciones_p = [(impuesto, _redondear(importe, DECIMALES_IMPUESTOS))
+                             for impuesto, importe in retenciones_p.items()]
+            for clave, base, importe in traslados_p:
+                nombres = TOTALES_TRASLADOS.get(clave)
+                if nombres is not None:
+                    totales[nombres[0]] += base * tipo_cambio
+                    if nombres[1] is not None:
+                        totales[nombres[1]] += importe * tipo_cambio
+            for impuesto, importe in retenciones_p:
+                if impuesto in TOTALES_RETENCIONES:
+                    totales[TOTALES_RETENCIONES[impuesto]] += importe * tipo_cambio
+            totales["MontoTotalPagos"] += monto * tipo_cambio
+            nodos_pago.append((atributos_pago, documentos, traslados_p, retenciones_p))
+
+        if aplicar:
+            libro.aplicar(conexion, referencia, aplicaciones)
+
+    return _comprobante_pago(comprobante, emisor, receptor, nodos_pago, totales)
+
+
+def _impuestos_dr(padre, traslados, retenciones):
+    if not traslados and not retenciones:
+        return
+    nodo = etree.SubElement(padre, _q(PAGO20, "ImpuestosDR"))
+    if retenciones:
+        grupo = etree.SubElement(nodo, _q(PAGO20, "RetencionesDR"))
+        for impuesto, tipo_factor, tasa, base, importe in retenciones:
+            etree.SubElement(grupo, _q(PAGO20, "RetencionDR"), BaseDR=_texto(base), ImpuestoDR=impuesto,
+                             TipoFactorDR=tipo_factor, TasaOCuotaDR=tasa, ImporteDR=_texto(importe))
+    if traslados:
+        grupo = etree.SubElement(nodo, _q(PAGO20, "TrasladosDR"))
+        for impuesto, tipo_factor, tasa, base, importe in traslados:
+            atributos = {"BaseDR": _texto(base), "ImpuestoDR": impuesto, "TipoFactorDR": tipo_factor}
+            if tipo_factor != "Exento":
+                atributos.update(TasaOCuotaDR=tasa, ImporteDR=_texto(importe))
+            etree.SubElement(grupo, _q(PAGO20, "TrasladoDR"), atributos)
+
+
+def _comprobante_pago(comprobante, emisor, receptor, nodos_pago, totales):
+    atributos = {"Version": "4.0"}
+    atributos.update(comprobante)
+    atributos.update(SubTotal="0", Moneda="XXX", Total="0", TipoDeComprobante="P",
+                     Exportacion=comprobante.get("Exportacion", "01"))
+    for sobrante in ("FormaPago", "MetodoPago", "CondicionesDePago", "Descuento", "TipoCambio"):
+        atributos.pop(sobrante, None)
+    cfdi = etree.Element(_q(CFDI, "Comprobante"), {_q(XSI, "schemaLocation"): UBICACION_ESQUEMAS}, nsmap=NSMAP)
+    for nombre, valor in atributos.items():
+        cfdi.set(nombre, str(valor))
+
+    etree.SubElement(cfdi, _q(CFDI, "Emisor"), {k: str(v) for k, v in emisor.items()})
+    etree.SubElement(cfdi, _q(CFDI, "Receptor"), dict({k: str(v) for k, v in receptor.items()}, UsoCFDI="CP01"))
+    conceptos = etree.SubElement(cfdi, _q(CFDI, "Conceptos"))
+    etree.SubElement(conceptos, _q(CFDI, "Concepto"), ClaveProdServ="84111506", Cantidad="1",
+                     ClaveUnidad="ACT", Descripcion="Pago", ValorUnitario="0", Importe="0", ObjetoImp="01")
+
+    complemento = etree.SubElement(cfdi, _q(CFDI, "Complemento"))
+    nodo_pagos = etree.SubElement(complemento, _q(PAGO20, "Pagos"), Version="2.0")
+    etree.SubElement(nodo_pagos, _q(PAGO20, "Totales"), _ordenar(
+        {nombre: _texto(_redondear(valor, DECIMALES_TOTALES)) for nombre, valor in totales.items()},
+        ATRIBUTOS_TOTALES))
+    for atributos_pago, documentos, traslados_p, retenciones_p in nodos_pago:
+        nodo_pago = etree.SubElement(nodo_pagos, _q(PAGO20, "Pago"), _ordenar(atributos_pago, ATRIBUTOS_PAGO))
+        for atributos_dr, traslados_dr, retenciones_dr in documentos:
+            nodo_dr = etree.SubElement(nodo_pago, _q(PAGO20, "DoctoRelacionado"), _ordenar(atributos_dr, (
+                "IdDocumento", "Serie", "Folio", "MonedaDR", "EquivalenciaDR", "NumParcialidad", "ImpSaldoAnt",
+                "ImpPagado", "ImpSaldoInsoluto", "ObjetoImpDR")))
+            _impuestos_dr(nodo_dr, traslados_dr, retenciones_dr)
+        if traslados_p or retenciones_p:
+            impuestos_p = etree.SubElement(nodo_pago, _q(PAGO20, "ImpuestosP"))
+            if retenciones_p:
+                grupo = etree.SubElement(impuestos_p, _q(PAGO20, "RetencionesP"))
+                for impuesto, importe in retenciones_p:
+                    etree.SubElement(grupo, _q(PAGO20, "RetencionP"), ImpuestoP=impuesto, ImporteP=_texto(importe))
+            if traslados_p:
+                grupo = etree.SubElement(impuestos_p, _q(PAGO20, "TrasladosP"))
+                for (impuesto, tipo_factor, tasa), base, importe in traslados_p:
+                    atributos = {"BaseP": _texto(base), "ImpuestoP": impuesto, "TipoFactorP": tipo_factor}
+                    if tipo_factor != "Exento":
+                        atributos.update(TasaOCuotaP=tasa, ImporteP=_texto(importe))
+                    etree.SubElement(grupo, _q(PAGO20, "TrasladoP"), atributos)
+    return cfdi
+
+
+def _leer_jsonl(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            if linea.strip():
+                yield json.loads(linea)
+
+
+if __name__ == "__main__":
+    from . import firma
+    from .firma_lote import expandir_documentos
+
+    parser = argparse.ArgumentParser(description="Complementos de pago 2.0 y libro de saldos insolutos.")
+    parser.add_argument("--libro", default="saldos.db", help="Base de datos del libro de saldos")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    registrar = subcomandos.add_parser("registrar", help="Registrar facturas PPD timbradas")
+    registrar.add_argument("origen", help="Directorio o patrón glob de XML timbrados")
+    emitir = subcomandos.add_parser("emitir", help="Generar y sellar REP desde un JSONL")
+    emitir.add_argument("pagos", help="JSONL con comprobante, emisor, receptor y pagos de cada REP")
+    emitir.add_argument("--salida", default="pagos", help="Directorio de los XML sellados")
+    emitir.add_argument("--key", default="mi_llave.key", help="Llave privada del CSD (.key)")
+    emitir.add_argument("--cer", default="mi_certificado.cer", help="Certificado del CSD")
+    emitir.add_argument("--password", default="12345678a", help="Contraseña de la llave privada")
+    emitir.add_argument("--csd", default=None, help="Directorio con los CSD de varios emisores (ver cfdi.csd)")
+    revertir = subcomandos.add_parser("revertir", help="Devolver los saldos de un REP cancelado")
+    revertir.add_argument("referencia", help="Referencia del REP (Serie-Folio)")
+    pendientes = subcomandos.add_parser("pendientes", help="Facturas con saldo insoluto")
+    pendientes.add_argument("emisor", help="RFC del emisor")
+    pendientes.add_argument("--receptor", default=None, help="RFC del receptor")
+    subcomandos.add_parser("conciliar", help="Recalcular los saldos desde los pagos aplicados")
+    args = parser.parse_args()
+
+    with LibroSaldos(args.libro) as libro:
+        if args.comando == "registrar":
+            nuevas = libro.registrar_lote(expandir_documentos(args.origen))
+            print(f"✅ {nuevas} facturas nuevas en {args.libro}")
+        elif args.comando == "emitir":
+            os.makedirs(args.salida, exist_ok=True)
+            if args.csd:
+                from .csd import GestorCSD
+
+                gestor = GestorCSD()
+                gestor.cargar_directorio(args.csd, password=args.password)
+                sellar = gestor.sellar
+            else:
+                from .firmante import Firmante
+
+                firmante = Firmante.desde_archivo(args.key, args.password)
+                no_certificado, certificado_b64 = firma.cargar_certificado(args.cer)
+
+                def sellar(raiz):
+                    return firma.sellar_cfdi(raiz, firmante, no_certificado, certificado_b64)
+            emitidos = 0
+            for registro in _leer_jsonl(args.pagos):
+                comprobante = registro["comprobante"]
+                referencia = f"{comprobante.get('Serie', '')}-{comprobante.get('Folio', '')}"
+                try:
+                    raiz = construir_pago(comprobante, registro["emisor"], registro["receptor"],
+                                          registro["pagos"], libro, referencia)
+                    try:
+                        contenido = sellar(raiz)
+                    except Exception:
+                        libro.revertir(referencia)  # el libro solo avanza con REP sellados
+                        raise
+                except Exception as e:
+                    print(f"❌ {referencia}: {e}")
+                    continue
+                firma.guardar(contenido, os.path.join(args.salida, f"{referencia}.xml"))
+                emitidos += 1
+            print(f"✅ {emitidos} complementos de pago en {args.salida}")
+        elif args.comando == "revertir":
+            print(f"✅ {libro.revertir(args.referencia)} pagos revertidos de {args.referencia}")
+        elif args.comando == "pendientes":
+            for saldo in libro.pendientes(args.emisor, args.receptor):
+                print(f"{saldo.uuid}\t{saldo.serie or ''}{saldo.folio or ''}\t{saldo.moneda}\t"
+                      f"{saldo.saldo}/{saldo.total}\t{saldo.parcialidades} parcialidades")
+        else:
+            discrepancias = libro.conciliar()
+            for d in discrepancias:
+                print(f"❌ {d.uuid}: saldo {d.saldo} (calculado {d.saldo_calculado}), "
+                      f"{d.parcialidades} parcialidades (aplicadas {d.parcialidades_calculadas})")
+            print("✅ El libro cuadra con los pagos aplicados" if not discrepancias else
+                  f"❌ {len(discrepancias)} documentos no cuadran")
+            exit(1 if discrepancias else 0)
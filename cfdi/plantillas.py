@@ -0,0 +1,346 @@
+import argparse
+import random
+import re
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from lxml import etree
+
+from .generacion_streaming import (ATRIBUTOS_COMPROBANTE, ATRIBUTOS_CONCEPTO, ATRIBUTOS_EMISOR, ATRIBUTOS_IMPUESTO,
+                                   ATRIBUTOS_RECEPTOR, CFDI, NSMAP, XSI, AcumuladorImpuestos, _ordenar, _q,
+                                   _redondear)
+
+DECLARACION = "<?xml version='1.0' encoding='UTF-8'?>\n"
+ESQUEMA = f"{CFDI} http://www.sat.gob.mx/sitio_internet/cfd/4/cfdv40.xsd"
+
+IVA_16 = ({"Impuesto": "002", "TipoFactor": "Tasa", "TasaOCuota": "0.160000"},)
+
+# Receptor nacional (sin ResidenciaFiscal ni NumRegIdTrib)
+RECEPTOR_NACIONAL = ("Rfc", "Nombre", "DomicilioFiscalReceptor", "RegimenFiscalReceptor", "UsoCFDI")
+
+# Atributos calculados por la plantilla (no se toman de los datos)
+CALCULADOS_COMPROBANTE = frozenset({"SubTotal", "Descuento", "Total"})
+
+# Caracteres que libxml2 escapa en un atributo, y los que lxml rechaza
+_ENTIDADES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;",
+                            "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"})
+_ESPECIALES = re.compile('[&<>"\n\r\t\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff￾￿]')
+_INVALIDOS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff￾￿]")
+
+
+def escapar(valor):
+    """
+    Valor de un atributo escapado exactamente como lo serializa lxml.
+
+    Como lxml, rechaza con ValueError los caracteres de control que XML 1.0 no admite.
+    """
+    texto = valor if type(valor) is str else str(valor)
+    if _ESPECIALES.search(texto) is None:
+        return texto
+    if _INVALIDOS.search(texto) is not None:
+        raise ValueError(f"Carácter no permitido en XML: {texto!r}")
+    return texto.translate(_ENTIDADES)
+
+
+def _atributos(pares):
+    """Texto ' Nombre="valor"' de atributos fijos, con los % duplicados para el formato con %."""
+    return "".join(f' {nombre}="{escapar(valor)}"' for nombre, valor in pares).replace("%", "%%")
+
+
+def _formato(prefijo, nombres, sufijo):
+    """Formato de un elemento con atributos variables: prefijo, ' Nombre="%s"' por cada uno, sufijo."""
+    return prefijo + "".join(f' {nombre}="%s"' for nombre in nombres) + sufijo
+
+
+class Plantilla:
+    """
+    Forma de factura compilada una vez para serializar muchos comprobantes iguales.
+
+    La forma fija el emisor, los atributos constantes del Comprobante (FormaPago,
+    Moneda, LugarExpedicion, NoCertificado, ...), qué atributos trae cada
+    concepto y los traslados de todos los conceptos (por omisión IVA 16%).
+    Todo lo fijo se escapa y se ordena al compilar, así que generar() solo
+    calcula importes (con el mismo redondeo que generacion_streaming), escapa los
+    valores variables y los inserta en cadenas de formato precompiladas; el
+    resultado es byte por byte el mismo que el del camino con lxml (ver
+    referencia() y comparar()).
+
+    Uso:
+        plantilla = Plantilla(
+            {"FormaPago": "01", "Moneda": "MXN", "TipoDeComprobante": "I", "Exportacion": "01",
+             "MetodoPago": "PUE", "LugarExpedicion": "64000"},
+            {"Rfc": "AAA010101AX5", "Nombre": "EMPRESA EMISORA S.A. DE C.V.", "RegimenFiscal": "601"})
+        xml = plantilla.generar({"Serie": "A", "Folio": "1", "Fecha": "2024-03-09T12:00:00"},
+                                receptor, conceptos)
+    """
+
+    def __init__(self, comprobante, emisor, variables=("Serie", "Folio", "Fecha"), receptor=RECEPTOR_NACIONAL,
+                 concepto=("ClaveProdServ", "NoIdentificacion", "Cantidad", "ClaveUnidad", "Unidad",
+                           "Descripcion", "ValorUnitario"),
+                 traslados=IVA_16, objeto_imp="02", decimales=2):
+        """
+        Parámetros:
+            comprobante (dict): Atributos fijos del Comprobante.
+            emisor (dict): Atributos del Emisor.
+            variables (tuple): Atributos del Comprobante que cambian por factura.
+            receptor (tuple): Atributos del Receptor que trae cada factura.
+            concepto (tuple): Atributos de entrada de cada concepto; "Descuento" es
+                opcional por concepto. Importe se calcula y ObjetoImp es `objeto_imp`.
+            traslados (tuple): Traslados de cada concepto (Impuesto, TipoFactor, TasaOCuota).
+            decimales (int): Decimales de la moneda.
+        """
+        for traslado in traslados:
+            if traslado["TipoFactor"] not in ("Tasa", "Cuota"):
+                raise ValueError("Las plantillas solo admiten traslados con Tasa o Cuota")
+        desconocidos = (set(variables) | set(comprobante)) - set(ATRIBUTOS_COMPROBANTE)
+        if desconocidos or CALCULADOS_COMPROBANTE & (set(variables) | set(comprobante)):
+            raise ValueError(f"Atributos del Comprobante no válidos en la plantilla: {sorted(desconocidos) or ''}")
+
+        self.comprobante = dict(comprobante, Version=comprobante.get("Version", "4.0"))
+        self.emisor = dict(emisor)
+        self.variables = tuple(n for n in ATRIBUTOS_COMPROBANTE if n in variables)
+        self.atributos_receptor = tuple(n for n in ATRIBUTOS_RECEPTOR if n in receptor)
+        self.atributos_concepto = tuple(n for n in ATRIBUTOS_CONCEPTO if n in concepto and n != "Descuento")
+        self.traslados = tuple(dict(t) for t in traslados)
+        self.objeto_imp = objeto_imp
+        self.exponente = Decimal(1).scaleb(-decimales)
+        self._tasas = tuple(Decimal(t["TasaOCuota"]) for t in self.traslados)
+        self._compilar()
+
+    def _compilar(self):
+        # Comprobante: un formato con y otro sin Descuento, con los atributos fijos en su lugar
+        self._raiz = {}
+        self._campos_raiz = {}  # atributos variables y calculados, en el orden del formato
+        for con_descuento in (False, True):
+            partes = [f'<cfdi:Comprobante xmlns:cfdi="{CFDI}" xmlns:xsi="{XSI}" xsi:schemaLocation="{ESQUEMA}"']
+            campos = []
+            for nombre in ATRIBUTOS_COMPROBANTE:
+                if nombre in self.variables or nombre == "SubTotal" or nombre == "Total" or (
+                        nombre == "Descuento" and con_descuento):
+                    partes.append(f' {nombre}="%s"')
+                    campos.append(nombre)
+                elif self.comprobante.get(nombre) not in (None, "") and nombre not in CALCULADOS_COMPROBANTE:
+                    partes.append(_atributos([(nombre, self.comprobante[nombre])]))
+            partes.append(">\n")
+            partes.append("  <cfdi:Emisor" + _atributos(_ordenar(self.emisor, ATRIBUTOS_EMISOR).items()) + "/>\n")
+            self._raiz[con_descuento] = DECLARACION + "".join(partes)
+            self._campos_raiz[con_descuento] = tuple(campos)
+        self._receptor = _formato("  <cfdi:Receptor", self.atributos_receptor, "/>\n")
+
+        # Concepto: atributos de entrada, Importe (y Descuento), ObjetoImp fijo y sus traslados
+        traslados = "".join(
+            '          <cfdi:Traslado Base="%s"'
+            + _atributos([(n, t[n]) for n in ("Impuesto", "TipoFactor", "TasaOCuota")])
+            + ' Importe="%s"/>\n' for t in self.traslados)
+        impuestos = ("      <cfdi:Impuestos>\n        <cfdi:Traslados>\n" + traslados
+                     + "        </cfdi:Traslados>\n      </cfdi:Impuestos>\n") if self.traslados else ""
+        self._concepto = {}
+        for con_descuento in (False, True):
+            nombres = self.atributos_concepto + ("Importe",) + (("Descuento",) if con_descuento else ())
+            objeto = _atributos([("ObjetoImp", self.objeto_imp)])
+            if impuestos:
+                cierre = objeto + ">\n" + impuestos + "    </cfdi:Concepto>\n"
+            else:
+                cierre = objeto + "/>\n"
+            self._concepto[con_descuento] = _formato("    <cfdi:Concepto", nombres, cierre)
+
+        # Impuestos del comprobante
+        self._traslado_total = ['      <cfdi:Traslado Base="%s"' + _atributos(
+            [(n, t[n]) for n in ("Impuesto", "TipoFactor", "TasaOCuota")]) + ' Importe="%s"/>\n'
+            for t in self.traslados]
+
+    def generar(self, variables, receptor, conceptos):
+        """
+        Serializa un comprobante con la forma de la plantilla.
+
+        Parámetros:
+            variables (dict): Valores de los atributos variables del Comprobante.
+            receptor (dict): Atributos del Receptor.
+            conceptos (iterable): Diccionarios con los atributos de entrada de cada concepto.
+
+        Retorna:
+            bytes: XML en UTF-8, igual al de etree.tostring(..., pretty_print=True).
+        """
+        exponente = self.exponente
+        tasas = self._tasas
+        formatos = self._concepto
+        nombres = self.atributos_concepto
+        cero = Decimal(0)
+        subtotal = descuento_total = cero
+        bases = [cero] * len(tasas)
+        importes = [cero] * len(tasas)
+        partes = [None, None, "  <cfdi:Conceptos>\n"]  # raíz y receptor se llenan al final
+        agregar = partes.append
+        buscar = _ESPECIALES.search
+        for concepto in conceptos:
+            valores = [concepto[nombre] for nombre in nombres]
+            # Una sola búsqueda sobre todos los textos; solo si algo debe escaparse se va valor por valor
+            try:
+                especial = buscar("".join(valores))
+            except TypeError:  # algún valor no es str (p. ej. Cantidad numérica)
+                especial = True
+            if especial is not None:
+                valores = [escapar(valor) for valor in valores]
+            importe = (Decimal(str(concepto["Cantidad"])) * Decimal(str(concepto["ValorUnitario"]))).quantize(
+                exponente, ROUND_HALF_UP)
+            valores.append(importe)
+            subtotal += importe
+            descuento = concepto.get("Descuento")
+            if descuento:
+                # Como en generacion_streaming, un Descuento en cero se escribe tal como llegó
+                redondeado = Decimal(str(descuento)).quantize(exponente, ROUND_HALF_UP)
+                valores.append(redondeado if redondeado else escapar(descuento))
+                descuento_total += redondeado
+                base = importe - redondeado
+            else:
+                base = importe
+            for i, tasa in enumerate(tasas):
+                impuesto = (base * tasa).quantize(exponente, ROUND_HALF_UP)
+                bases[i] += base
+                importes[i] += impuesto
+                valores.append(base)
+                valores.append(impuesto)
+            agregar(formatos[bool(descuento)] % tuple(valores))
+        agregar("  </cfdi:Conceptos>\n")
+
+        trasladados = sum(importes, cero)
+        if tasas:
+            agregar(f'  <cfdi:Impuestos TotalImpuestosTrasladados="{trasladados}">\n    <cfdi:Traslados>\n')
+            for formato, base, importe in zip(self._traslado_total, bases, importes):
+                agregar(formato % (base.quantize(exponente, ROUND_HALF_UP), importe))
+            agregar("    </cfdi:Traslados>\n  </cfdi:Impuestos>\n")
+        agregar("</cfdi:Comprobante>\n")
+
+        con_descuento = bool(descuento_total)
+        calculados = {"SubTotal": subtotal.quantize(exponente, ROUND_HALF_UP),
+                      "Descuento": descuento_total.quantize(exponente, ROUND_HALF_UP),
+                      "Total": (subtotal - descuento_total + trasladados).quantize(exponente, ROUND_HALF_UP)}
+        partes[0] = self._raiz[con_descuento] % tuple([
+            calculados[nombre] if nombre in calculados else escapar(variables[nombre])
+            for nombre in self._campos_raiz[con_descuento]])
+        partes[1] = self._receptor % tuple([escapar(receptor[nombre]) for nombre in self.atributos_receptor])
+        return "".join(partes).encode("utf-8")
+
+    def referencia(self, variables, receptor, conceptos):
+        """
+        El mismo comprobante por el camino de lxml: importes con AcumuladorImpuestos de
+        generacion_streaming y el árbol con etree.Element/SubElement, como generacion.
+
+        Retorna:
+            bytes: etree.tostring(..., pretty_print=True, xml_declaration=True, encoding="UTF-8").
+        """
+        acumulador = AcumuladorImpuestos(self.exponente)
+        calculados = []
+        for concepto in conceptos:
+            datos = {n: concepto[n] for n in self.atributos_concepto}
+            if concepto.get("Descuento"):
+                datos["Descuento"] = concepto["Descuento"]
+            datos["ObjetoImp"] = self.objeto_imp
+            datos["Traslados"] = [dict(t) for t in self.traslados]
+            calculados.append(acumulador.procesar(datos))
+
+        datos_raiz = dict(self.comprobante, **{n: variables[n] for n in self.variables})
+        datos_raiz["SubTotal"] = _redondear(acumulador.subtotal, self.exponente)
+        datos_raiz["Descuento"] = _redondear(acumulador.descuento, self.exponente) if acumulador.descuento else None
+        datos_raiz["Total"] = _redondear(acumulador.total, self.exponente)
+        atributos_raiz = {f"{{{XSI}}}schemaLocation": ESQUEMA}
+        atributos_raiz.update(_ordenar(datos_raiz, ATRIBUTOS_COMPROBANTE))
+
+        raiz = etree.Element(_q("Comprobante"), atributos_raiz, nsmap=NSMAP)
+        etree.SubElement(raiz, _q("Emisor"), _ordenar(self.emisor, ATRIBUTOS_EMISOR))
+        etree.SubElement(raiz, _q("Receptor"), {n: str(receptor[n]) for n in self.atributos_receptor})
+        nodo_conceptos = etree.SubElement(raiz, _q("Conceptos"))
+        for concepto in calculados:
+            nodo = etree.SubElement(nodo_conceptos, _q("Concepto"), _ordenar(concepto, ATRIBUTOS_CONCEPTO))
+            if concepto["Traslados"]:
+                traslados = etree.SubElement(etree.SubElement(nodo, _q("Impuestos")), _q("Traslados"))
+                for traslado in concepto["Traslados"]:
+                    etree.SubElement(traslados, _q("Traslado"), _ordenar(traslado, ATRIBUTOS_IMPUESTO))
+        if acumulador.traslados:
+            impuestos = etree.SubElement(raiz, _q("Impuestos"),
+                                         TotalImpuestosTrasladados=str(acumulador.total_trasladados))
+            traslados = etree.SubElement(impuestos, _q("Traslados"))
+            for (impuesto, tipo_factor, tasa), (base, importe) in acumulador.traslados.items():
+                etree.SubElement(traslados, _q("Traslado"), _ordenar(
+                    {"Base": _redondear(base, self.exponente), "Impuesto": impuesto, "TipoFactor": tipo_factor,
+                     "TasaOCuota": tasa, "Importe": importe}, ATRIBUTOS_IMPUESTO))
+        return etree.tostring(raiz, pretty_print=True, xml_declaration=True, encoding="UTF-8")
+
+
+# Textos con todo lo que debe escaparse, para la comparación diferencial
+TEXTOS_DIFICILES = ('Tornillo 1/4" & tuerca', "<script>", "a > b", "Línea 1\nLínea 2", "tab\there", "\r",
+                    "Ñandú café ¿€?", "emoji 😀", "{llaves} y %s", "'apóstrofo'", "]]>", "\x7f\u0085")
+
+
+def _caso_aleatorio(azar, conceptos):
+    def texto():
+        return azar.choice(TEXTOS_DIFICILES) if azar.random() < 0.3 else f"Producto {azar.randrange(10 ** 6)}"
+
+    lineas = []
+    for i in range(conceptos):
+        concepto = {"ClaveProdServ": "01010101", "NoIdentificacion": f"SKU-{i}", "Cantidad": str(azar.randint(1, 40)),
+                    "ClaveUnidad": "H87", "Unidad": "Pieza", "Descripcion": texto(),
+                    "ValorUnitario": f"{azar.randint(1, 500000) / 100:.2f}"}
+        if azar.random() < 0.2:
+            concepto["Descuento"] = f"{azar.randint(0, 500) / 100:.2f}"
+        lineas.append(concepto)
+    variables = {"Serie": azar.choice(("A", "B&C", "R")), "Folio": str(azar.randrange(10 ** 7)),
+                 "Fecha": "2024-03-09T12:00:00"}
+    receptor = {"Rfc": "BBB020202BX6", "Nombre": texto(), "DomicilioFiscalReceptor": "64000",
+                "RegimenFiscalReceptor": "601", "UsoCFDI": "G03"}
+    return variables, receptor, lineas
+
+
+def comparar(plantilla, casos=1000, max_conceptos=20, semilla=0):
+    """
+    Prueba diferencial: genera comprobantes aleatorios (con textos que exigen escape,
+    descuentos y varios tamaños) por ambos caminos y compara los bytes.
+
+    Retorna:
+        list: (número de caso, bytes de la plantilla, bytes de lxml) de cada diferencia.
+    """
+    azar = random.Random(semilla)
+    diferencias = []
+    for numero in range(casos):
+        variables, receptor, conceptos = _caso_aleatorio(azar, azar.randint(1, max_conceptos))
+        rapido = plantilla.generar(variables, receptor, conceptos)
+        esperado = plantilla.referencia(variables, receptor, conceptos)
+        if rapido != esperado:
+            diferencias.append((numero, rapido, esperado))
+    return diferencias
+
+
+def plantilla_de_ejemplo():
+    """Plantilla del emisor de ejemplo con IVA 16% (la de los scripts de generación)."""
+    return Plantilla(
+        {"FormaPago": "01", "CondicionesDePago": "Contado", "Moneda": "MXN", "TipoDeComprobante": "I",
+         "Exportacion": "01", "MetodoPago": "PUE", "LugarExpedicion": "64000",
+         "NoCertificado": "30001000000500003282"},
+        {"Rfc": "AAA010101AX5", "Nombre": "EMPRESA EMISORA S.A. DE C.V.", "RegimenFiscal": "601"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plantillas precompiladas: prueba diferencial contra lxml y tiempos.")
+    parser.add_argument("--casos", type=int, default=2000, help="Comprobantes aleatorios a comparar")
+    parser.add_argument("--conceptos", type=int, default=5, help="Conceptos por comprobante en la medición")
+    parser.add_argument("--repeticiones", type=int, default=5000)
+    args = parser.parse_args()
+
+    plantilla = plantilla_de_ejemplo()
+    diferencias = comparar(plantilla, args.casos)
+    if diferencias:
+        numero, rapido, esperado = diferencias[0]
+        print(f"❌ {len(diferencias)}/{args.casos} comprobantes difieren; el primero es el caso {numero}:")
+        print(rapido.decode("utf-8"))
+        print(esperado.decode("utf-8"))
+        raise SystemExit(1)
+    print(f"✅ {args.casos} comprobantes aleatorios idénticos byte por byte a los de lxml")
+
+    variables, receptor, conceptos = _caso_aleatorio(random.Random(1), args.conceptos)
+    tiempos = {}
+    for nombre, funcion in (("plantilla", plantilla.generar), ("lxml", plantilla.referencia)):
+        inicio = time.perf_counter()
+        for _ in range(args.repeticiones):
+            funcion(variables, receptor, conceptos)
+        tiempos[nombre] = (time.perf_counter() - inicio) / args.repeticiones
+    print(f"⏱️ {args.conceptos} conceptos: plantilla {tiempos['plantilla'] * 1e6:.1f} µs, "
+          f"lxml {tiempos['lxml'] * 1e6:.1f} µs ({tiempos['lxml'] / tiempos['plantilla']:.1f}x)")
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import cadena, cadena_nativa, firma_lote, instrumentacion, verificacion_lote
+
+PUERTO = 8765
+
+FIRMAR = "firmar"
+VERIFICAR = "verificar"
+CADENA = "cadena"
+RUTAS = {"/firmar": FIRMAR, "/verificar": VERIFICAR, "/cadena": CADENA}
+
+# Documentos por tarea del pool: un lote grande se reparte entre los procesos
+TAMANO_TAREA = 16
+
+# Cuerpo máximo de una solicitud (un lote de XML)
+TAMANO_MAXIMO = 64 * 1024 * 1024
+
+MENSAJES_HTTP = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                 413: "Payload Too Large", 422: "Unprocessable Entity", 503: "Service Unavailable"}
+
+SOLICITUDES = instrumentacion.registro.contador(
+    "cfdi_servicio_solicitudes_total", "Solicitudes al servicio por operación y código HTTP.", ("operacion", "codigo"))
+DOCUMENTOS = instrumentacion.registro.contador(
+    "cfdi_servicio_documentos_total", "Documentos procesados por el servicio por operación.", ("operacion",))
+
+
+def _inicializar_trabajador(opciones):
+    """Deja listo un proceso del pool: llave(s) descifrada(s), cache de llaves y hojas XSLT compiladas."""
+    if opciones["ruta_key"] or opciones["directorio_csd"]:
+        firma_lote._inicializar_trabajador(
+            opciones["ruta_key"], opciones["password"], opciones["ruta_cer"], None, opciones["metodo"],
+            opciones["ruta_cache"], opciones["validar"], opciones["directorio_csd"], opciones["passwords"])
+    verificacion_lote._inicializar_trabajador(opciones["ruta_cache"])
+    if opciones["metodo"] != "nativo":
+        cadena.motor.transformacion()
+
+
+def _calentar(espera):
+    # Mantiene ocupado al proceso para que la siguiente tarea obligue a crear otro
+    time.sleep(espera)
+    return os.getpid()
+
+
+def _atender(operacion, documentos, metodo):
+    """Atiende un grupo de documentos (bytes) en un proceso del pool; nunca lanza por documento."""
+    resultados = []
+    for documento in documentos:
+        if operacion == FIRMAR:
+            if firma_lote._firmante is None and firma_lote._gestor is None:
+                resultados.append({"error": "El servicio no tiene un CSD para firmar"})
+                continue
+            resultado = firma_lote._firmar_documento(documento)
+            resultados.append({"sello": resultado.sello, "error": resultado.error,
+                               "xml": resultado.salida.decode("utf-8") if resultado.salida else None})
+        elif operacion == VERIFICAR:
+            resultado = verificacion_lote.verificar_cfdi(documento, metodo=metodo,
+                                                         resultados=verificacion_lote._resultados)
+            resultados.append({"estado": resultado.estado, "no_certificado": resultado.no_certificado,
+                               "detalle": resultado.detalle})
+        else:
+            try:
+                # La hoja XSLT no revisa la raíz: con otro XML devolvería "|||" en lugar de fallar
+                raiz = cadena_nativa.cargar_raiz(documento)
+                if raiz.tag != cadena_nativa.CFDI + "Comprobante":
+                    raise ValueError(f"La raíz no es cfdi:Comprobante: {raiz.tag}")
+                resultados.append({"cadena": cadena.generar_cadena_original(raiz, metodo=metodo),
+                                   "error": None})
+            except Exception as e:
+                resultados.append({"cadena": None, "error": f"{type(e).__name__}: {e}"})
+    return resultados
+
+
+class ServicioCFDI:
+    """
+    Servicio HTTP local de firma, verificación y cadena original.
+
+    Un pool de procesos se crea al iniciar y cada proceso descifra la llave (o
+    los CSD de un directorio, ver csd.GestorCSD) y compila las hojas XSLT una
+    sola vez, así que una solicitud paga solo el trabajo del documento. Atiende
+    en TCP o en un socket Unix, con conexiones keep-alive:
+
+        POST /firmar, /verificar, /cadena   un XML en el cuerpo, o un lote en JSON:
+                                            {"documentos": ["<cfdi:Comprobante ...>", ...]}
+        GET  /salud                         estado, procesos y documentos en vuelo
+        GET  /metrics                       métricas en formato Prometheus
+
+    Con más de `capacidad` documentos en vuelo responde 503 con Retry-After en
+    lugar de encolar sin límite, para que el cliente reintente o reparta la carga.
+
+    Uso:
+        servicio = ServicioCFDI("mi_llave.key", b"12345678a", "mi_certificado.cer")
+        asyncio.run(servicio.servir(puerto=8765))
+    """
+
+    def __init__(self, ruta_key=None, password=b"12345678a", ruta_cer=None, directorio_csd=None, passwords=None,
+                 procesos=None, metodo="xslt", validar=False, ruta_cache=None, capacidad=None,
+                 tamano_maximo=TAMANO_MAXIMO):
+        self.procesos = procesos or os.cpu_count() or 1
+        self.metodo = metodo
+        self.capacidad = capacidad or self.procesos * 64
+        self.tamano_maximo = tamano_maximo
+        self.en_vuelo = 0
+        self.rechazadas = 0
+        self._opciones = {"ruta_key": ruta_key, "password": password, "ruta_cer": ruta_cer,
+                          "directorio_csd": directorio_csd, "passwords": passwords, "metodo": metodo,
+                          "validar": validar, "ruta_cache": ruta_cache}
+        self._pool = None
+        self._servidor = None
+        self._socket = None
+        self._inicio = None
+
+    async def iniciar(self, host="127.0.0.1", puerto=PUERTO, socket=None):
+        """Crea y calienta el pool de procesos y empieza a aceptar conexiones."""
+        instrumentacion.activar()
+        self._pool = ProcessPoolExecutor(self.procesos, initializer=_inicializar_trabajador,
+                                         initargs=(self._opciones,))
+        loop = asyncio.get_running_loop()
+        # Una tarea por proceso, y todas a la vez: el pool crea (e inicializa) todos sus procesos
+        # antes de la primera solicitud
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _calentar, 0.05) for _ in range(self.procesos)))
+        if socket:
+            self._socket = socket
+            self._servidor = await asyncio.start_unix_server(self._conexion, path=socket)
+        else:
+            self._servidor = await asyncio.start_server(self._conexion, host, puerto)
+        self._inicio = time.monotonic()
+        return self
+
+    @property
+    def direccion(self):
+        return self._servidor.sockets[0].getsockname()
+
+    async def detener(self):
+        if self._servidor is not None:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+        if self._socket and os.path.exists(self._socket):
+            os.unlink(self._socket)
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    async def servir(self, host="127.0.0.1", puerto=PUERTO, socket=None):
+        """Inicia el servicio y atiende hasta SIGINT/SIGTERM."""
+        await self.iniciar(host, puerto, socket)
+        loop = asyncio.get_running_loop()
+        terminar = asyncio.Event()
+        for senal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(senal, terminar.set)
+        print(f"🚀 Servicio CFDI en {socket or f'http://{host}:{self.direccion[1]}'} "
+              f"({self.procesos} procesos, capacidad {self.capacidad} documentos)")
+        await terminar.wait()
+        await self.detener()
+
+    async def procesar(self, operacion, documentos):
+        """
+        Reparte documentos (bytes) entre los procesos del pool.
+
+        Retorna:
+            list: Un dict de resultado por documento, en el orden de entrada; None si
+                el servicio está saturado (más de `capacidad` documentos en vuelo).
+        """
+        if self.en_vuelo + len(documentos) > self.capacidad:
+            self.rechazadas += 1
+            return None
+        self.en_vuelo += len(documentos)
+        try:
+            loop = asyncio.get_running_loop()
+            grupos = [documentos[i:i + TAMANO_TAREA] for i in range(0, len(documentos), TAMANO_TAREA)]
+            parciales = await asyncio.gather(*(loop.run_in_executor(self._pool, _atender, operacion, grupo,
+                                                                    self.metodo) for grupo in grupos))
+        finally:
+            self.en_vuelo -= len(documentos)
+        if instrumentacion.activo:
+            DOCUMENTOS.incrementar(operacion, cantidad=len(documentos))
+        return [resultado for parcial in parciales for resultado in parcial]
+
+    async def _conexion(self, reader, writer):
+        try:
+            while True:
+                try:
+                    encabezado = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lineas = encabezado.decode("latin-1").split("\r\n")
+                try:
+                    metodo, ruta, version = lineas[0].split(" ", 2)
+                    encabezados = {}
+                    for linea in lineas[1:]:
+                        if linea:
+                            nombre, valor = linea.split(":", 1)
+                            encabezados[nombre.strip().lower()] = valor.strip()
+                    longitud = int(encabezados.get("content-length", 0))
+                except ValueError:
+                    await self._responder(writer, 400, {"error": "Solicitud HTTP inválida"}, cerrar=True)
+                    break
+                if longitud > self.tamano_maximo:
+                    await self._responder(writer, 413, {"error": f"El cuerpo excede {self.tamano_maximo} bytes"},
+                                          cerrar=True)
+                    break
+                cuerpo = await reader.readexactly(longitud) if longitud else b""
+                cerrar = encabezados.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+                codigo, contenido, extra = await self._atender_http(metodo, ruta.split("?")[0], encabezados,
+                                                                    cuerpo)
+                await self._responder(writer, codigo, contenido, extra, cerrar)
+                if cerrar:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _responder(self, writer, codigo, contenido, extra=None, cerrar=False):
+        if isinstance(contenido, (dict, list)):
+            tipo, cuerpo = "application/json", json.dumps(contenido, ensure_ascii=False).encode("utf-8")
+        elif isinstance(contenido, bytes):
+            tipo, cuerpo = "application/xml", contenido
+        else:
+            tipo, cuerpo = "text/plain; charset=utf-8", contenido.encode("utf-8")
+        encabezados = {"Content-Type": tipo, "Content-Length": str(len(cuerpo)),
+                       "Connection": "close" if cerrar else "keep-alive", **(extra or {})}
+        cabecera = f"HTTP/1.1 {codigo} {MENSAJES_HTTP.get(codigo, '')}\r\n" + "".join(
+            f"{nombre}: {valor}\r\n" for nombre, valor in encabezados.items()) + "\r\n"
+        writer.write(cabecera.encode("latin-1") + cuerpo)
+        await writer.drain()
+
+    async def _atender_http(self, metodo, ruta, encabezados, cuerpo):
+        """Retorna (código HTTP, contenido, encabezados extra)."""
+        if ruta == "/salud" and metodo == "GET":
+            return 200, self.salud(), None
+        if ruta == "/metrics" and metodo == "GET":
+            return 200, self.metricas(), None
+        operacion = RUTAS.get(ruta)
+        if operacion is None:
+            return 404, {"error": f"Ruta desconocida: {ruta}"}, None
+        if metodo != "POST":
+            return 405, {"error": "Use POST"}, {"Allow": "POST"}
+
+        lote = encabezados.get("content-type", "").startswith("application/json")
+        if lote:
+            try:
+                documentos = [d.encode("utf-8") if isinstance(d, str) else None
+                              for d in json.loads(cuerpo)["documentos"]]
+            except (ValueError, KeyError, TypeError) as e:
+                return self._contar(operacion, 400, {"error": f"Lote inválido: {e}"})
+            if None in documentos:
+                return self._contar(operacion, 400, {"error": "Cada documento debe ser el XML como texto"})
+            if len(documentos) > self.capacidad:
+                return self._contar(operacion, 413, {"error": f"El lote excede {self.capacidad} documentos"})
+        else:
+            documentos = [cuerpo]
+
+        with instrumentacion.etapa(f"servicio_{operacion}", documentos=len(documentos)):
+            resultados = await self.procesar(operacion, documentos)
+        if resultados is None:
+            return self._contar(operacion, 503, {"error": "Servicio saturado, reintente"}, {"Retry-After": "1"})
+        if lote:
+            return self._contar(operacion, 200, {"resultados": resultados})
+
+        resultado = resultados[0]
+        if operacion == VERIFICAR:
+            return self._contar(operacion, 200, resultado)
+        if resultado.get("error"):
+            return self._contar(operacion, 422, resultado)
+        if operacion == FIRMAR:
+            return self._contar(operacion, 200, resultado["xml"].encode("utf-8"))
+        return self._contar(operacion, 200, resultado["cadena"])
+
+    def _contar(self, operacion, codigo, contenido, extra=None):
+        instrumentacion.contar(SOLICITUDES, operacion, str(codigo))
+        return codigo, contenido, extra
+
+    def salud(self):
+        return {"estado": "ok", "procesos": self.procesos, "en_vuelo": self.en_vuelo, "capacidad": self.capacidad,
+                "rechazadas": self.rechazadas, "segundos_activo": round(time.monotonic() - self._inicio, 1)}
+
+    def metricas(self):
+        """Métricas del proceso principal (las etapas de cada trabajador se miden en su propio proceso)."""
+        return instrumentacion.exportar_prometheus() + (
+            "# HELP cfdi_servicio_en_vuelo Documentos en proceso.\n"
+            "# TYPE cfdi_servicio_en_vuelo gauge\n"
+            f"cfdi_servicio_en_vuelo {self.en_vuelo}\n"
+            "# HELP cfdi_servicio_capacidad Documentos en vuelo antes de responder 503.\n"
+            "# TYPE cfdi_servicio_capacidad gauge\n"
+            f"cfdi_servicio_capacidad {self.capacidad}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servicio HTTP local de firma, verificación y cadena original.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=PUERTO)
+    parser.add_argument("--socket", default=None, help="Atender en este socket Unix en lugar de TCP")
+    parser.add_argument("--key", default="mi_llave.key", help="Llave privada del CSD ('' para no firmar)")
+    parser.add_argument("--cer", default="mi_certificado.cer", help="Certificado del CSD")
+    parser.add_argument("--password", default="12345678a", help="Contraseña de la llave privada")
+    parser.add_argument("--csd", default=None, help="Directorio con pares .cer/.key de varios emisores")
+    parser.add_argument("--passwords", default=None, help="JSON con la contraseña de cada RFC para --csd")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos del pool (por omisión, núcleos)")
+    parser.add_argument("--metodo", default="xslt", choices=("xslt", "nativo", "auto"),
+                        help="Generación de la cadena original")
+    parser.add_argument("--capacidad", type=int, default=None, help="Documentos en vuelo antes de responder 503")
+    parser.add_argument("--validar", action="store_true", help="Validar cada documento antes de firmarlo")
+    parser.add_argument("--cache", default=None, help="Cache de sellos y veredictos en disco (SQLite)")
+    args = parser.parse_args()
+
+    passwords = None
+    if args.passwords:
+        with open(args.passwords, encoding="utf-8") as f:
+            passwords = json.load(f)
+    servicio = ServicioCFDI(args.key or None, args.password.encode("utf-8"), args.cer or None, args.csd, passwords,
+                            args.procesos, args.metodo, args.validar, args.cache, args.capacidad)
+    asyncio.run(servicio.servir(args.host, args.puerto, args.socket))
@@ -0,0 +1,108 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Cada módulo se importa en un intérprete nuevo, como un proceso trabajador recién
+# creado, y se compara la mediana contra su presupuesto. También se revisa que
+# ninguna dependencia pesada quede cargada solo por importarlo.
+# Uso: python -m cfdi.tiempo_importacion [--repeticiones N] [--factor F]
+# (tests/test_tiempo_importacion.py corre la misma revisión con pytest)
+
+# Milisegundos permitidos por módulo; lxml.etree por sí solo toma ~20 ms
+PRESUPUESTOS_MS = {
+    "cfdi": 5,
+    "cfdi.almacen": 60,
+    "cfdi.cache_resultados": 60,
+    "cfdi.cadena": 60,
+    "cfdi.cadena_nativa": 60,
+    "cfdi.catalogos": 60,
+    "cfdi.firma": 60,
+    "cfdi.firmante": 60,
+    "cfdi.csd": 60,
+    "cfdi.validacion": 60,
+    "cfdi.verificacion": 60,
+    "cfdi.generacion": 60,
+    "cfdi.generacion_streaming": 60,
+    "cfdi.plantillas": 60,
+    "cfdi.extraccion": 60,
+    "cfdi.folios": 60,
+    "cfdi.pagos": 60,
+    "cfdi.impuestos": 25,
+    "cfdi.instrumentacion": 25,
+    "cfdi.timbrado": 25,
+    "cfdi.firma_lote": 120,
+    "cfdi.verificacion_lote": 120,
+    "cfdi.ingesta": 120,
+    "cfdi.cliente_pac": 150,
+    "cfdi.pac_simulado": 150,
+    "cfdi.cola_timbrado": 150,
+    "cfdi.cancelacion": 150,
+    "cfdi.servicio": 150,
+}
+
+# Se cargan en el primer uso, nunca al importar
+DEPENDENCIAS_DIFERIDAS = ("cryptography", "requests", "fiscalapi", "numpy", "zstandard", "xlrd", "openpyxl")
+
+_MEDICION = """
+import sys, time, json
+inicio = time.perf_counter()
+import {modulo}
+transcurrido = time.perf_counter() - inicio
+print(json.dumps({{"ms": transcurrido * 1000,
+                  "cargadas": [d for d in {diferidas!r} if d in sys.modules]}}))
+"""
+
+
+def medir(modulo, repeticiones=5):
+    """
+    Mide la importación de un módulo en intérpretes nuevos.
+
+    Retorna:
+        tuple: (mediana en ms, dependencias diferidas que quedaron cargadas)
+    """
+    tiempos = []
+    cargadas = set()
+    codigo = _MEDICION.format(modulo=modulo, diferidas=DEPENDENCIAS_DIFERIDAS)
+    for _ in range(repeticiones):
+        proceso = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, check=True)
+        resultado = json.loads(proceso.stdout)
+        tiempos.append(resultado["ms"])
+        cargadas.update(resultado["cargadas"])
+    return statistics.median(tiempos), sorted(cargadas)
+
+
+def revisar(presupuestos=PRESUPUESTOS_MS, repeticiones=5, factor=1.0):
+    """
+    Mide todos los módulos contra su presupuesto.
+
+    Parámetros:
+        presupuestos (dict): Módulo -> milisegundos permitidos.
+        repeticiones (int): Intérpretes por módulo; se usa la mediana.
+        factor (float): Multiplicador de los presupuestos (equipos lentos o CI compartida).
+
+    Retorna:
+        list: Tuplas (módulo, ms, presupuesto, dependencias cargadas, cumple).
+    """
+    resultados = []
+    for modulo, presupuesto in presupuestos.items():
+        milisegundos, cargadas = medir(modulo, repeticiones)
+        limite = presupuesto * factor
+        resultados.append((modulo, milisegundos, limite, cargadas, milisegundos <= limite and not cargadas))
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Revisa el tiempo de importación de los módulos de cfdi.")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Intérpretes por módulo")
+    parser.add_argument("--factor", type=float, default=1.0, help="Multiplicador de los presupuestos")
+    args = parser.parse_args()
+
+    fallas = 0
+    for modulo, milisegundos, limite, cargadas, cumple in revisar(repeticiones=args.repeticiones,
+                                                                  factor=args.factor):
+        fallas += not cumple
+        extra = f" (cargó {', '.join(cargadas)})" if cargadas else ""
+        print(f"{'✅' if cumple else '❌'} {modulo}: {milisegundos:.1f} ms / {limite:.0f} ms{extra}")
+    exit(1 if fallas else 0)
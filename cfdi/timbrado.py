@@ -0,0 +1,156 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from . import instrumentacion
+
+# requests y fiscalapi se importan al timbrar, no al importar el paquete
+
+URL_SW_PRUEBAS = "https://services.test.sw.com.mx"
+URL_FISCALAPI_PRUEBAS = "https://test.fiscalapi.com"
+
+
+def obtener_token(user, password, url_base=URL_SW_PRUEBAS):
+    """
+    Realiza la autenticación para obtener el token.
+    Se envían los datos en formato JSON a la API de autenticación; si el PAC
+    rechaza las credenciales o no devuelve un token se lanza cliente_pac.ErrorPAC.
+    """
+    import requests
+
+    from .cliente_pac import ErrorPAC
+
+    url_auth = f"{url_base}/security/authenticate"
+    headers = {
+        "Content-Type": "application/json; charset=utf-8"
+    }
+    payload = {
+        "user": user,
+        "password": password
+    }
+
+    with instrumentacion.etapa("autenticacion_http"):
+        response = requests.post(url_auth, headers=headers, json=payload)  # Se envían los datos en el cuerpo JSON
+    if response.status_code != 200:
+        raise ErrorPAC(f"Error en autenticación: {response.status_code}", response.status_code, response.text)
+    try:
+        data = response.json()
+    except json.JSONDecodeError as e:
+        raise ErrorPAC("Error en la decodificación de la respuesta JSON", 200, response.text) from e
+    token = data.get("token") or (data.get("data") or {}).get("token")
+    if not token:
+        raise ErrorPAC("No se encontró el token en la respuesta", 200, response.text)
+    return token
+
+
+def timbrar_xml(token, xml_path, url_base=URL_SW_PRUEBAS):
+    """
+    Envía el archivo XML firmado a la API de timbrado usando multipart/form-data.
+
+    Retorna la respuesta de requests tal cual; si el archivo no existe se lanza FileNotFoundError.
+    """
+    import requests
+
+    url_timbrado = f"{url_base}/cfdi33/issue/v4"
+    headers = {
+        "Authorization": f"Bearer {token}"
+    }
+
+    with open(xml_path, "rb") as xml_file:
+        files = {"xml": (xml_path, xml_file, "application/xml")}
+        with instrumentacion.etapa("timbrado_http"):
+            response = requests.post(url_timbrado, headers=headers, files=files)
+    instrumentacion.contar(instrumentacion.RESPUESTAS_PAC, "timbrado_http", str(response.status_code))
+    return response
+
+
+def leer_archivo_base64(file_path):
+    """Lee un archivo (por ejemplo el .cer o .key del CSD) y lo devuelve en Base64."""
+    with open(file_path, "rb") as file:
+        file_content = file.read()
+        return base64.b64encode(file_content).decode('utf-8')
+
+
+def crear_cliente_fiscalapi(api_key, tenant, api_url=URL_FISCALAPI_PRUEBAS):
+    """Crea el cliente del SDK de FiscalAPI con las credenciales de la cuenta."""
+    from fiscalapi.models.common_models import FiscalApiSettings
+    from fiscalapi.services.fiscalapi_client import FiscalApiClient
+
+    settings = FiscalApiSettings(api_url=api_url, api_key=api_key, tenant=tenant)
+    return FiscalApiClient(settings=settings)
+
+
+def construir_factura(cer_base64, key_base64, password="12345678a", serie="A", folio="12345"):
+    """
+    Crea el objeto Invoice de FiscalAPI con los datos de la factura de ejemplo a timbrar.
+
+    Serie y folio deben venir de folios.AsignadorFolios cuando varios procesos timbran la misma Serie.
+    """
+    from fiscalapi.models.fiscalapi_models import (Invoice, InvoiceIssuer, InvoiceItem, InvoiceRecipient,
+                                                    ItemTax, TaxCredential)
+
+    return Invoice(
+        version_code="4.0",  # Versión del CFDI
+        series=serie,  # Serie del comprobante
+        number=folio,  # Número de folio
+        date=datetime.strptime("2024-03-05T12:00:00", "%Y-%m-%dT%H:%M:%S").strftime("%Y-%m-%dT%H:%M:%S"),
+        payment_form_code="01",  # Forma de pago
+        payment_conditions="Contado",  # Condiciones de pago
+        currency_code="MXN",  # Moneda
+        type_code="I",  # Tipo de comprobante (Ingreso)
+        expedition_zip_code="64000",  # Código postal de expedición
+        payment_method_code="PUE",  # Método de pago
+        exchange_rate=1,  # Tipo de cambio
+        export_code="01",  # Código de exportación
+
+        # Datos del Emisor (empresa que emite la factura)
+        issuer=InvoiceIssuer(
+            tin="AAA010101AX5",  # RFC del emisor
+            legal_name="EMPRESA EMISORA S.A. DE C.V.",  # Razón social del emisor
+            tax_regime_code="601",  # Régimen fiscal del emisor
+            tax_credentials=[  # Archivos de firma digital
+                TaxCredential(
+                    base64_file=cer_base64,
+                    file_type=0,  # Certificado
+                    password=password
+                ),
+                TaxCredential(
+                    base64_file=key_base64,
+                    file_type=1,  # Llave privada
+                    password=password
+                )
+            ]
+        ),
+
+        # Datos del Receptor (cliente que recibe la factura)
+        recipient=InvoiceRecipient(
+            tin="BBB020202BX6",  # RFC del receptor
+            legal_name="CLIENTE EJEMPLO",  # Nombre del receptor
+            zip_code="64000",  # Código postal del receptor
+            tax_regime_code="601",  # Régimen fiscal del receptor
+            cfdi_use_code="G03"  # Uso del CFDI
+        ),
+
+        # Detalles de los productos/servicios facturados
+        items=[
+            InvoiceItem(
+                item_code="01010101",  # Clave de producto/servicio
+                quantity=Decimal("1"),  # Cantidad de unidades
+                unit_of_measurement_code="H87",  # Clave de unidad de medida
+                description="Producto de prueba",  # Descripción del producto
+                unit_price=Decimal("1000.00"),  # Precio unitario
+                tax_object_code="02",  # Código de objeto de impuesto
+                discount=Decimal("0.00"),  # Descuento aplicado
+                item_sku="7501000101010",  # SKU del producto
+                item_taxes=[  # Impuestos aplicables
+                    ItemTax(
+                        tax_code="002",  # Código de impuesto (IVA)
+                        tax_type_code="Tasa",  # Tipo de impuesto
+                        tax_rate=Decimal("0.160000"),  # Tasa de impuesto (16%)
+                        tax_flag_code="T"  # Tipo de factor
+                    )
+                ]
+            )
+        ]
+    )
@@ -0,0 +1,590 @@
+import argparse
+import collections
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from decimal import Decimal, InvalidOperation, ROUND_DOWN, ROUND_HALF_UP, ROUND_UP
+from lxml import etree
+
+from .cadena import DIRECTORIO_BASE, ruta_en_paquete
+from .catalogos import FISICA, MORAL, PERSONA
+
+logger = logging.getLogger(__name__)
+
+CFDI = "http://www.sat.gob.mx/cfd/4"
+XS = "http://www.w3.org/2001/XMLSchema"
+
+# Paquete local de esquemas del SAT, con la misma estructura que
+# http://www.sat.gob.mx/sitio_internet/cfd/ (4/cfdv40.xsd, catalogos/catCFDI.xsd, ...)
+PAQUETE_XSD = os.path.join(DIRECTORIO_BASE, "xsd_sat")
+
+# Esquema de cada espacio de nombres dentro del paquete; los que no estén en
+# disco simplemente no se incluyen en la validación XSD
+ESQUEMAS = {
+    CFDI: "4/cfdv40.xsd",
+    "http://www.sat.gob.mx/TimbreFiscalDigital": "TimbreFiscalDigital/TimbreFiscalDigitalv11.xsd",
+    "http://www.sat.gob.mx/Pagos20": "Pagos/Pagos20.xsd",
+}
+
+# Catálogos pequeños del Anexo 20 como conjuntos en memoria. Los grandes
+# (c_ClaveProdServ, c_ClaveUnidad, c_CodigoPostal, c_Moneda) solo se revisan
+# si se pasan en `catalogos`.
+CATALOGOS = {
+    "c_TipoDeComprobante": frozenset({"I", "E", "T", "N", "P"}),
+    "c_Exportacion": frozenset({"01", "02", "03", "04"}),
+    "c_MetodoPago": frozenset({"PUE", "PPD"}),
+    "c_FormaPago": frozenset({
+        "01", "02", "03", "04", "05", "06", "08", "12", "13", "14", "15", "17", "23", "24", "25",
+        "26", "27", "28", "29", "30", "31", "99",
+    }),
+    "c_RegimenFiscal": frozenset({
+        "601", "603", "605", "606", "607", "608", "610", "611", "612", "614", "615", "616", "620",
+        "621", "622", "623", "624", "625", "626",
+    }),
+    "c_UsoCFDI": frozenset({
+        "G01", "G02", "G03", "I01", "I02", "I03", "I04", "I05", "I06", "I07", "I08", "D01", "D02",
+        "D03", "D04", "D05", "D06", "D07", "D08", "D09", "D10", "S01", "CP01", "CN01",
+    }),
+    "c_ObjetoImp": frozenset({"01", "02", "03", "04", "05", "06", "07", "08"}),
+    "c_Impuesto": frozenset({"001", "002", "003"}),
+    "c_TipoFactor": frozenset({"Tasa", "Cuota", "Exento"}),
+}
+
+# Decimales de las monedas más comunes; las demás se validan con 2
+DECIMALES_MONEDA = {"MXN": 2, "USD": 2, "EUR": 2, "CAD": 2, "GBP": 2, "JPY": 0, "XXX": 0}
+
+# Atributos obligatorios antes de firmar (Sello, NoCertificado y Certificado se agregan al sellar)
+REQUERIDOS = {
+    "Comprobante": ("Version", "Fecha", "SubTotal", "Moneda", "Total", "TipoDeComprobante",
+                    "Exportacion", "LugarExpedicion"),
+    "Emisor": ("Rfc", "Nombre", "RegimenFiscal"),
+    "Receptor": ("Rfc", "Nombre", "DomicilioFiscalReceptor", "RegimenFiscalReceptor", "UsoCFDI"),
+    "Concepto": ("ClaveProdServ", "Cantidad", "ClaveUnidad", "Descripcion", "ValorUnitario",
+                 "Importe", "ObjetoImp"),
+    "Traslado": ("Base", "Impuesto", "TipoFactor"),
+    "Retencion": ("Base", "Impuesto", "TipoFactor", "TasaOCuota", "Importe"),
+    # La retención del nodo Impuestos del Comprobante solo lleva el total por impuesto
+    "RetencionComprobante": ("Impuesto", "Importe"),
+}
+
+# Atributo -> catálogo, por nodo
+CATALOGO_DE = {
+    "Comprobante": (("FormaPago", "c_FormaPago"), ("MetodoPago", "c_MetodoPago"),
+                    ("TipoDeComprobante", "c_TipoDeComprobante"), ("Exportacion", "c_Exportacion"),
+                    ("Moneda", "c_Moneda"), ("LugarExpedicion", "c_CodigoPostal")),
+    "Emisor": (("RegimenFiscal", "c_RegimenFiscal"),),
+    "Receptor": (("RegimenFiscalReceptor", "c_RegimenFiscal"), ("UsoCFDI", "c_UsoCFDI"),
+                 ("DomicilioFiscalReceptor", "c_CodigoPostal")),
+    "Concepto": (("ClaveProdServ", "c_ClaveProdServ"), ("ClaveUnidad", "c_ClaveUnidad"),
+                 ("ObjetoImp", "c_ObjetoImp")),
+    "Traslado": (("Impuesto", "c_Impuesto"), ("TipoFactor", "c_TipoFactor")),
+    "Retencion": (("Impuesto", "c_Impuesto"), ("TipoFactor", "c_TipoFactor")),
+    "RetencionComprobante": (("Impuesto", "c_Impuesto"),),
+}
+
+# Patrones del Anexo 20 (simplificados a lo que se puede revisar sin catálogos)
+_RFC = re.compile(r"[A-ZÑ&]{3,4}[0-9]{2}(0[1-9]|1[012])(0[1-9]|[12][0-9]|3[01])[A-Z0-9]{2}[0-9A]\Z")
+_FECHA = re.compile(r"20[0-9]{2}-(0[1-9]|1[012])-(0[1-9]|[12][0-9]|3[01])T([01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9]\Z")
+_CODIGO_POSTAL = re.compile(r"[0-9]{5}\Z")
+_IMPORTE = re.compile(r"[0-9]{1,18}(\.[0-9]{1,6})?\Z")
+PATRONES = {
+    ("Comprobante", "Fecha"): _FECHA,
+    ("Comprobante", "LugarExpedicion"): _CODIGO_POSTAL,
+    ("Emisor", "Rfc"): _RFC,
+    ("Receptor", "Rfc"): _RFC,
+    ("Receptor", "DomicilioFiscalReceptor"): _CODIGO_POSTAL,
+}
+IMPORTES = {
+    "Comprobante": ("SubTotal", "Descuento", "TipoCambio", "Total"),
+    "Concepto": ("Cantidad", "ValorUnitario", "Importe", "Descuento"),
+    "Traslado": ("Base", "TasaOCuota", "Importe"),
+    "Retencion": ("Base", "TasaOCuota", "Importe"),
+    "RetencionComprobante": ("Importe",),
+}
+
+ErrorValidacion = collections.namedtuple("ErrorValidacion", "regla ruta mensaje")
+ResultadoValidacion = collections.namedtuple("ResultadoValidacion", "documento valido errores")
+
+
+class ComprobanteInvalido(ValueError):
+    """El comprobante no pasó la validación previa a la firma; `errores` trae todos los hallazgos."""
+
+    def __init__(self, errores):
+        super().__init__("; ".join(f"{e.ruta}: {e.mensaje}" for e in errores))
+        self.errores = errores
+
+
+class ResolvedorXSD(etree.Resolver):
+    """Resuelve los xs:import/xs:include del SAT contra el paquete local, sin acceso a red."""
+
+    def __init__(self, paquete=PAQUETE_XSD):
+        super().__init__()
+        self.paquete = paquete
+        self.faltantes = []
+
+    def resolve(self, url, pubid, context):
+        ruta = ruta_en_paquete(url, self.paquete)
+        if ruta is None:
+            return None
+        if os.path.exists(ruta):
+            return self.resolve_filename(ruta, context)
+        self.faltantes.append(url)
+        return None
+
+
+# Esquemas compilados del proceso, por paquete
+_esquemas = {}
+_candado = threading.Lock()
+
+
+def esquema(paquete=PAQUETE_XSD):
+    """
+    Esquema XSD del paquete local, compilado una sola vez por proceso.
+
+    Se arma un esquema que importa cfdv40.xsd y todos los complementos de
+    ESQUEMAS presentes en el paquete, de modo que un documento con sus
+    complementos se valida en una sola pasada.
+
+    Si el paquete no trae cfdv40.xsd se registra una advertencia (una vez por
+    proceso y paquete): quien pida esquemas=True debe saber que no se validaron.
+
+    Retorna:
+        etree.XMLSchema: Esquema compilado, o None si el paquete no trae cfdv40.xsd.
+    """
+    paquete = os.path.abspath(paquete)
+    if paquete in _esquemas:
+        return _esquemas[paquete]
+    with _candado:
+        if paquete not in _esquemas:
+            _esquemas[paquete] = _compilar_esquema(paquete)
+            if _esquemas[paquete] is None:
+                logger.warning("No se encontró %s en %s: se omite la validación XSD y solo se revisan "
+                               "las reglas del Anexo 20", ESQUEMAS[CFDI], paquete)
+        return _esquemas[paquete]
+
+
+def _compilar_esquema(paquete):
+    if not os.path.exists(os.path.join(paquete, ESQUEMAS[CFDI])):
+        return None
+    principal = etree.Element(f"{{{XS}}}schema", nsmap={"xs": XS})
+    for espacio, relativa in ESQUEMAS.items():
+        ruta = os.path.join(paquete, relativa)
+        if os.path.exists(ruta):
+            etree.SubElement(principal, f"{{{XS}}}import", namespace=espacio,
+                             schemaLocation="file://" + ruta.replace(os.sep, "/"))
+    resolvedor = ResolvedorXSD(paquete)
+    parser = etree.XMLParser(no_network=True)
+    parser.resolvers.add(resolvedor)
+    documento = etree.fromstring(etree.tostring(principal), parser, base_url=paquete + "/")
+    try:
+        return etree.XMLSchema(documento)
+    except etree.XMLSchemaParseError as e:
+        if resolvedor.faltantes:
+            raise etree.XMLSchemaParseError(
+                "Esquemas faltantes en el paquete local: " + ", ".join(resolvedor.faltantes)) from e
+        raise
+
+
+def limpiar_esquemas():
+    """Descarta los esquemas compilados (por ejemplo tras actualizar el paquete)."""
+    with _candado:
+        _esquemas.clear()
+
+
+def _decimal(texto):
+    try:
+        return Decimal(texto)
+    except (InvalidOperation, TypeError):
+        return None
+
+
+def _exponente(texto):
+    """Decimales con que viene escrito un número del XML."""
+    punto = texto.find(".")
+    return 0 if punto < 0 else len(texto) - punto - 1
+
+
+def _limites_producto(a_texto, b_texto, decimales, b_exacto=False):
+    """
+    Límites inferior y superior del producto de dos valores del XML (Anexo 20).
+
+    Cada factor se toma con su incertidumbre de redondeo (media unidad de su
+    último decimal); el inferior se trunca y el superior se redondea hacia
+    arriba a los decimales del resultado.
+    """
+    a, b = Decimal(a_texto), Decimal(b_texto)
+    margen_a = Decimal(1).scaleb(-_exponente(a_texto)) / 2
+    margen_b = 0 if b_exacto else Decimal(1).scaleb(-_exponente(b_texto)) / 2
+    cuanto = Decimal(1).scaleb(-decimales)
+    inferior = ((a - margen_a) * (b - margen_b)).quantize(cuanto, rounding=ROUND_DOWN)
+    superior = ((a + margen_a) * (b + margen_b)).quantize(cuanto, rounding=ROUND_UP)
+    return inferior, superior
+
+
+class _Revision:
+    """Acumula los errores de un documento en una sola pasada."""
+
+    def __init__(self, catalogos):
+        self.catalogos = catalogos
+        self.errores = []
+
+    def error(self, regla, ruta, mensaje):
+        self.errores.append(ErrorValidacion(regla, ruta, mensaje))
+
+    def nodo(self, elemento, nombre, ruta):
+        """Obligatorios, patrones, formato numérico y catálogos de un nodo."""
+        for atributo in REQUERIDOS.get(nombre, ()):
+            if not elemento.get(atributo):
+                self.error("requerido", f"{ruta}@{atributo}", f"Falta el atributo {atributo}")
+        for atributo in IMPORTES.get(nombre, ()):
+            valor = elemento.get(atributo)
+            if valor is not None and not _IMPORTE.match(valor):
+                self.error("formato", f"{ruta}@{atributo}", f"{atributo} no es un importe válido: {valor!r}")
+        for atributo, catalogo in CATALOGO_DE.get(nombre, ()):
+            valor = elemento.get(atributo)
+            claves = self.catalogos.get(catalogo)
+            if claves is None:
+                claves = CATALOGOS.get(catalogo)  # catálogo no importado: el conjunto integrado, si lo hay
+            if valor is not None and claves is not None and valor not in claves:
+                self.error("catalogo", f"{ruta}@{atributo}", f"{valor!r} no es una clave vigente de {catalogo}")
+
+    def patrones(self, elemento, nombre, ruta):
+        for (nodo, atributo), patron in PATRONES.items():
+            valor = elemento.get(atributo) if nodo == nombre else None
+            if valor and not patron.match(valor):
+                self.error("formato", f"{ruta}@{atributo}", f"{atributo} no cumple el patrón del Anexo 20: {valor!r}")
+
+
+def _suma_impuestos(impuestos, revision, ruta):
+    """
+    Revisa los traslados y retenciones de un concepto y los agrupa.
+
+    Retorna:
+        tuple: ({(Impuesto, TipoFactor, TasaOCuota): [Base, Importe]}, {Impuesto: Importe}).
+    """
+    traslados, retenciones = {}, {}
+    if impuestos is None:
+        return traslados, retenciones
+    for grupo, nombre in (("Traslados", "Traslado"), ("Retenciones", "Retencion")):
+        contenedor = impuestos.find(f"{{{CFDI}}}{grupo}")
+        for i, impuesto in enumerate(contenedor if contenedor is not None else (), 1):
+            ruta_impuesto = f"{ruta}/Impuestos/{grupo}/{nombre}[{i}]"
+            revision.nodo(impuesto, nombre, ruta_impuesto)
+            base, tasa, importe = (impuesto.get(a) for a in ("Base", "TasaOCuota", "Importe"))
+            clave = (impuesto.get("Impuesto"), impuesto.get("TipoFactor"), tasa)
+            if impuesto.get("TipoFactor") == "Exento":
+                if tasa is not None or importe is not None:
+                    revision.error("impuestos", ruta_impuesto, "Un impuesto Exento no lleva TasaOCuota ni Importe")
+                elif nombre == "Traslado" and _decimal(base) is not None:
+                    traslados.setdefault(clave, [Decimal(0), None])[0] += Decimal(base)
+                continue
+            if nombre == "Traslado" and (tasa is None or importe is None):
+                revision.error("requerido", ruta_impuesto, "El traslado requiere TasaOCuota e Importe")
+            if None in (_decimal(base), _decimal(tasa), _decimal(importe)):
+                continue
+            inferior, superior = _limites_producto(base, tasa, _exponente(importe), b_exacto=True)
+            if not inferior <= Decimal(importe) <= superior:
+                revision.error("importe", f"{ruta_impuesto}@Importe",
+                               f"Importe {importe} fuera de [{inferior}, {superior}] para Base×TasaOCuota")
+            if nombre == "Traslado":
+                acumulado = traslados.setdefault(clave, [Decimal(0), Decimal(0)])
+                acumulado[0] += Decimal(base)
+                acumulado[1] += Decimal(importe)
+            else:
+                retenciones[clave[0]] = retenciones.get(clave[0], Decimal(0)) + Decimal(importe)
+    return traslados, retenciones
+
+
+def _revisar_negocio(raiz, revision, decimales):
+    """Sumas de importes contra SubTotal, Descuento, impuestos y Total."""
+    cuanto = Decimal(1).scaleb(-decimales)
+
+    def redondear(valor):
+        return valor.quantize(cuanto, rounding=ROUND_HALF_UP)
+
+    for atributo in ("SubTotal", "Descuento", "Total"):
+        valor = raiz.get(atributo)
+        if valor and _IMPORTE.match(valor) and _exponente(valor) > decimales:
+            revision.error("decimales", f"Comprobante@{atributo}",
+                           f"{atributo} tiene más de {decimales} decimales para la moneda {raiz.get('Moneda')}")
+
+    subtotal = descuento = Decimal(0)
+    traslados, retenciones = {}, {}
+    conceptos = raiz.find(f"{{{CFDI}}}Conceptos")
+    if conceptos is None or not len(conceptos):
+        revision.error("requerido", "Comprobante/Conceptos", "El comprobante no tiene conceptos")
+        conceptos = ()
+    for i, concepto in enumerate(conceptos, 1):
+        ruta = f"Comprobante/Conceptos/Concepto[{i}]"
+        revision.nodo(concepto, "Concepto", ruta)
+        cantidad, valor_unitario, importe = (concepto.get(a) for a in ("Cantidad", "ValorUnitario", "Importe"))
+        if None not in (_decimal(cantidad), _decimal(valor_unitario), _decimal(importe)):
+            inferior, superior = _limites_producto(cantidad, valor_unitario, _exponente(importe))
+            if not inferior <= Decimal(importe) <= superior:
+                revision.error("importe", f"{ruta}@Importe",
+                               f"Importe {importe} fuera de [{inferior}, {superior}] para Cantidad×ValorUnitario")
+            subtotal += Decimal(importe)
+        descuento += _decimal(concepto.get("Descuento") or "0") or 0
+
+        impuestos = concepto.find(f"{{{CFDI}}}Impuestos")
+        objeto = concepto.get("ObjetoImp")
+        if objeto == "02" and impuestos is None:
+            revision.error("objeto_impuesto", ruta, "ObjetoImp 02 requiere el nodo Impuestos del concepto")
+        elif objeto in ("01", "03", "04") and impuestos is not None:
+            revision.error("objeto_impuesto", ruta, f"ObjetoImp {objeto} no admite el nodo Impuestos")
+        traslados_concepto, retenciones_concepto = _suma_impuestos(impuestos, revision, ruta)
+        for clave, (base, importe_impuesto) in traslados_concepto.items():
+            acumulado = traslados.setdefault(clave, [Decimal(0), None])
+            acumulado[0] += base
+            if importe_impuesto is not None:
+                acumulado[1] = (acumulado[1] or Decimal(0)) + importe_impuesto
+        for clave, importe_impuesto in retenciones_concepto.items():
+            retenciones[clave] = retenciones.get(clave, Decimal(0)) + importe_impuesto
+
+    valor = _decimal(raiz.get("SubTotal"))
+    if valor is not None and valor != redondear(subtotal):
+        revision.error("subtotal", "Comprobante@SubTotal",
+                       f"SubTotal {raiz.get('SubTotal')} no es la suma de los Importe ({redondear(subtotal)})")
+    valor = _decimal(raiz.get("Descuento") or "0")
+    if valor is not None and valor != redondear(descuento):
+        revision.error("descuento", "Comprobante@Descuento",
+                       f"Descuento {raiz.get('Descuento')} no es la suma de los descuentos ({redondear(descuento)})")
+
+    total_trasladados = total_retenidos = Decimal(0)
+    impuestos = raiz.find(f"{{{CFDI}}}Impuestos")
+    declarados_traslado, declarados_retencion = set(), set()
+    if impuestos is not None:
+        contenedor = impuestos.find(f"{{{CFDI}}}Traslados")
+        for i, traslado in enumerate(contenedor if contenedor is not None else (), 1):
+            ruta = f"Comprobante/Impuestos/Traslados/Traslado[{i}]"
+            revision.nodo(traslado, "Traslado", ruta)
+            clave = (traslado.get("Impuesto"), traslado.get("TipoFactor"), traslado.get("TasaOCuota"))
+            declarados_traslado.add(clave)
+            esperado = traslados.get(clave)
+            if esperado is None:
+                revision.error("impuestos", ruta, f"Traslado {clave} sin conceptos que lo trasladen")
+                continue
+            if _decimal(traslado.get("Base")) != redondear(esperado[0]):
+                revision.error("impuestos", f"{ruta}@Base",
+                               f"Base {traslado.get('Base')} no es la suma de los conceptos ({redondear(esperado[0])})")
+            if esperado[1] is not None:
+                if _decimal(traslado.get("Importe")) != redondear(esperado[1]):
+                    revision.error("impuestos", f"{ruta}@Importe",
+                                   f"Importe {traslado.get('Importe')} no es la suma de los conceptos "
+                                   f"({redondear(esperado[1])})")
+                total_trasladados += _decimal(traslado.get("Importe")) or 0
+        contenedor = impuestos.find(f"{{{CFDI}}}Retenciones")
+        for i, retencion in enumerate(contenedor if contenedor is not None else (), 1):
+            ruta = f"Comprobante/Impuestos/Retenciones/Retencion[{i}]"
+            revision.nodo(retencion, "RetencionComprobante", ruta)
+            clave = retencion.get("Impuesto")
+            declarados_retencion.add(clave)
+            esperado = retenciones.get(clave)
+            if esperado is None:
+                revision.error("impuestos", ruta, f"Retención {clave} sin conceptos que la retengan")
+            elif _decimal(retencion.get("Importe")) != redondear(esperado):
+                revision.error("impuestos", f"{ruta}@Importe",
+                               f"Importe {retencion.get('Importe')} no es la suma de los conceptos ({redondear(esperado)})")
+            total_retenidos += _decimal(retencion.get("Importe")) or 0
+
+        for atributo, suma in (("TotalImpuestosTrasladados", total_trasladados),
+                               ("TotalImpuestosRetenidos", total_retenidos)):
+            valor = impuestos.get(atributo)
+            if valor is not None and _decimal(valor) != redondear(suma):
+                revision.error("impuestos", f"Comprobante/Impuestos@{atributo}",
+                               f"{atributo} {valor} no es la suma de los impuestos ({redondear(suma)})")
+    for clave in traslados.keys() - declarados_traslado:
+        revision.error("impuestos", "Comprobante/Impuestos", f"Falta el traslado {clave} de los conceptos")
+    for clave in retenciones.keys() - declarados_retencion:
+        revision.error("impuestos", "Comprobante/Impuestos", f"Falta la retención {clave} de los conceptos")
+
+    total = _decimal(raiz.get("Total"))
+    subtotal_declarado = _decimal(raiz.get("SubTotal"))
+    descuento_declarado = _decimal(raiz.get("Descuento") or "0")
+    if None not in (total, subtotal_declarado, descuento_declarado):
+        esperado = redondear(subtotal_declarado - descuento_declarado + total_trasladados - total_retenidos)
+        if total != esperado:
+            revision.error("total", "Comprobante@Total",
+                           f"Total {raiz.get('Total')} no es SubTotal - Descuento + impuestos ({esperado})")
+
+
+def _revisar_relaciones(raiz, revision, compatibles):
+    """Régimen y UsoCFDI contra el tipo de persona del RFC, y UsoCFDI contra el régimen del receptor."""
+    emisor = raiz.find(f"{{{CFDI}}}Emisor")
+    receptor = raiz.find(f"{{{CFDI}}}Receptor")
+    revisiones = []
+    if emisor is not None and emisor.get("Rfc") and emisor.get("RegimenFiscal"):
+        persona = MORAL if len(emisor.get("Rfc")) == 12 else FISICA
+        revisiones.append(("Comprobante/Emisor@RegimenFiscal", "c_RegimenFiscal", emisor.get("RegimenFiscal"),
+                           PERSONA, persona, f"no aplica a persona {persona}"))
+    if receptor is not None and receptor.get("Rfc"):
+        persona = MORAL if len(receptor.get("Rfc")) == 12 else FISICA
+        regimen, uso = receptor.get("RegimenFiscalReceptor"), receptor.get("UsoCFDI")
+        if regimen:
+            revisiones.append(("Comprobante/Receptor@RegimenFiscalReceptor", "c_RegimenFiscal", regimen,
+                               PERSONA, persona, f"no aplica a persona {persona}"))
+        if uso:
+            revisiones.append(("Comprobante/Receptor@UsoCFDI", "c_UsoCFDI", uso,
+                               PERSONA, persona, f"no aplica a persona {persona}"))
+        if uso and regimen:
+            revisiones.append(("Comprobante/Receptor@UsoCFDI", "c_UsoCFDI", uso, "c_RegimenFiscal", regimen,
+                               f"no se permite con RegimenFiscalReceptor {regimen}"))
+    for ruta, catalogo, clave, relacionado, otra, motivo in revisiones:
+        if not compatibles(catalogo, clave, relacionado, otra):
+            revision.error("relacion", ruta, f"{clave} {motivo}")
+
+
+def validar(documento, esquemas=True, catalogos=None, paquete=PAQUETE_XSD):
+    """
+    Valida un CFDI 4.0 antes de firmarlo y devuelve todos sus errores a la vez.
+
+    Revisa, en una sola pasada por el árbol, los atributos obligatorios y los
+    patrones del Anexo 20, las claves de catálogo, los importes de cada
+    concepto (con la tolerancia de redondeo del Anexo 20), las sumas de
+    SubTotal, Descuento e impuestos, y el Total. Si el paquete local trae los
+    XSD, además valida contra cfdv40.xsd y los complementos.
+
+    Parámetros:
+        documento: Ruta del XML, sus bytes, o un árbol/elemento de lxml.
+        esquemas (bool): Validar también contra los XSD del paquete local.
+        catalogos (dict): Nombre de catálogo -> claves válidas (cualquier objeto
+            que admita `in`); por omisión, CATALOGOS. Con un cfdi.catalogos.Catalogos
+            se revisa además la vigencia de cada clave a la Fecha del comprobante
+            y las relaciones entre catálogos (UsoCFDI por régimen y tipo de persona).
+        paquete (str): Directorio del paquete local de XSD.
+
+    Retorna:
+        list: ErrorValidacion (regla, ruta, mensaje); vacía si el documento es válido.
+    """
+    if isinstance(documento, str):
+        raiz = etree.parse(documento).getroot()
+    elif isinstance(documento, (bytes, bytearray)):
+        raiz = etree.fromstring(bytes(documento))
+    elif isinstance(documento, etree._ElementTree):
+        raiz = documento.getroot()
+    else:
+        raiz = documento
+
+    catalogos = CATALOGOS if catalogos is None else catalogos
+    if hasattr(catalogos, "vigentes") and _FECHA.match(raiz.get("Fecha") or ""):
+        catalogos = catalogos.vigentes(raiz.get("Fecha"))
+    revision = _Revision(catalogos)
+    if raiz.tag != f"{{{CFDI}}}Comprobante":
+        revision.error("estructura", raiz.tag, "El documento no es un Comprobante CFDI 4.0")
+        return revision.errores
+
+    if esquemas:
+        compilado = esquema(paquete)
+        if compilado is not None and not compilado.validate(raiz):
+            for entrada in compilado.error_log:
+                revision.error("xsd", entrada.path or f"línea {entrada.line}", entrada.message)
+
+    revision.nodo(raiz, "Comprobante", "Comprobante")
+    revision.patrones(raiz, "Comprobante", "Comprobante")
+    if raiz.get("Version") not in (None, "4.0"):
+        revision.error("formato", "Comprobante@Version", f"Versión {raiz.get('Version')} distinta de 4.0")
+    for nombre in ("Emisor", "Receptor"):
+        nodo = raiz.find(f"{{{CFDI}}}{nombre}")
+        if nodo is None:
+            revision.error("requerido", f"Comprobante/{nombre}", f"Falta el nodo {nombre}")
+            continue
+        revision.nodo(nodo, nombre, f"Comprobante/{nombre}")
+        revision.patrones(nodo, nombre, f"Comprobante/{nombre}")
+    if hasattr(catalogos, "compatibles"):
+        _revisar_relaciones(raiz, revision, catalogos.compatibles)
+
+    if raiz.get("MetodoPago") == "PPD" and raiz.get("FormaPago") not in (None, "99"):
+        revision.error("forma_pago", "Comprobante@FormaPago", "Con MetodoPago PPD la FormaPago debe ser 99")
+    if raiz.get("TipoDeComprobante") == "P":
+        if raiz.get("Moneda") != "XXX" or raiz.get("SubTotal") != "0" or raiz.get("Total") != "0":
+            revision.error("pago", "Comprobante", "Un comprobante de pago lleva Moneda XXX, SubTotal 0 y Total 0")
+        return revision.errores
+
+    _revisar_negocio(raiz, revision, DECIMALES_MONEDA.get(raiz.get("Moneda"), 2))
+    return revision.errores
+
+
+def exigir_valido(documento, **opciones):
+    """Como validar(), pero lanza ComprobanteInvalido si hay errores."""
+    errores = validar(documento, **opciones)
+    if errores:
+        raise ComprobanteInvalido(errores)
+
+
+# Opciones del proceso trabajador (ver validar_lote)
+_opciones = {}
+
+
+def _inicializar_trabajador(esquemas, paquete, ruta_catalogos=None):
+    from .catalogos import Catalogos
+
+    # Cada proceso abre su propia conexión a los catálogos
+    _opciones.update(esquemas=esquemas, paquete=paquete,
+                     catalogos=Catalogos(ruta_catalogos) if ruta_catalogos else None)
+    if esquemas:
+        esquema(paquete)  # se compila una vez por proceso, antes del primer documento
+
+
+def _validar_en_trabajador(documento):
+    nombre = documento if isinstance(documento, str) else None
+    try:
+        errores = validar(documento, _opciones["esquemas"], _opciones["catalogos"], _opciones["paquete"])
+    except (OSError, etree.XMLSyntaxError) as e:
+        errores = [ErrorValidacion("xml", "", str(e))]
+    return ResultadoValidacion(nombre, not errores, [e._asdict() for e in errores])
+
+
+def validar_lote(origen, procesos=None, esquemas=True, paquete=PAQUETE_XSD, ventana=None, ruta_catalogos=None):
+    """
+    Valida muchos CFDI en paralelo con un ProcessPoolExecutor.
+
+    Parámetros:
+        origen: Directorio, patrón glob o iterable de rutas/bytes.
+        procesos (int): Procesos del pool; por omisión, los núcleos disponibles.
+        esquemas (bool): Validar también contra los XSD del paquete local.
+        paquete (str): Directorio del paquete local de XSD.
+        ventana (int): Documentos en vuelo como máximo.
+        ruta_catalogos (str): Base de catálogos del SAT (ver cfdi.catalogos).
+
+    Retorna:
+        generator: ResultadoValidacion por documento, en el orden de entrada.
+    """
+    # El pool solo se carga en lote; sellar_cfdi(validar=True) no lo necesita
+    from concurrent.futures import ProcessPoolExecutor
+
+    from .firma_lote import expandir_documentos
+
+    procesos = procesos or os.cpu_count() or 1
+    ventana = ventana or procesos * 64
+    with ProcessPoolExecutor(procesos, initializer=_inicializar_trabajador,
+                             initargs=(esquemas, paquete, ruta_catalogos)) as executor:
+        pendientes = collections.deque()
+        for documento in expandir_documentos(origen):
+            pendientes.append(executor.submit(_validar_en_trabajador, documento))
+            if len(pendientes) >= ventana:
+                yield pendientes.popleft().result()
+        while pendientes:
+            yield pendientes.popleft().result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validación previa a la firma de CFDI 4.0 (JSON lines).")
+    parser.add_argument("origen", help="Archivo, directorio o patrón glob de XML a validar")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos (por omisión, núcleos)")
+    parser.add_argument("--sin-xsd", action="store_true", help="Omitir la validación contra los XSD")
+    parser.add_argument("--paquete", default=PAQUETE_XSD, help="Directorio del paquete local de XSD")
+    parser.add_argument("--catalogos", default=None, help="Base de catálogos del SAT (python -m cfdi.catalogos importar)")
+    args = parser.parse_args()
+
+    if not args.sin_xsd and esquema(args.paquete) is None:
+        print(f"⚠️ No se encontró {ESQUEMAS[CFDI]} en {args.paquete}; solo se revisan las reglas del Anexo 20",
+              file=sys.stderr)
+    invalidos = 0
+    for resultado in validar_lote(args.origen, args.procesos, not args.sin_xsd, args.paquete,
+                                  ruta_catalogos=args.catalogos):
+        invalidos += not resultado.valido
+        sys.stdout.write(json.dumps(resultado._asdict(), ensure_ascii=False) + "\n")
+    exit(1 if invalidos else 0)
@@ -0,0 +1,122 @@
+import base64
+import logging
+import re
+from lxml import etree
+
+from . import cadena, instrumentacion
+
+logger = logging.getLogger(__name__)
+
+
+class CertificadoInvalido(ValueError):
+    """El archivo .cer no se pudo leer como certificado X.509 (DER o PEM)."""
+
+
+class SelloInvalido(ValueError):
+    """
+    El sello de un CFDI no se pudo verificar.
+
+    Atributos:
+        categoria (str): "sin_comprobante", "sin_sello", "base64_invalido", "cadena_invalida"
+            o "sello_invalido" (los mismos estados que verificacion_lote).
+    """
+
+    def __init__(self, mensaje, categoria):
+        super().__init__(mensaje)
+        self.categoria = categoria
+
+
+def validar_sello(xml_path, cer_path, xslt_path=None):
+    """
+    Valida el sello digital en un CFDI 4.0 verificando su autenticidad con la llave pública del CSD.
+
+    Cada paso se registra en el logger "cfdi.verificacion".
+
+    Retorna:
+        bool: True si el sello es válido. Si no, lanza SelloInvalido con la
+            categoría del problema (o CertificadoInvalido si el .cer no se pudo leer).
+    """
+    # Cargar el XML y extraer la raíz
+    with instrumentacion.etapa("parseo"):
+        xml_doc = etree.parse(xml_path)
+    root = xml_doc.getroot()
+
+    # Definir espacio de nombres CFDI 4.0
+    ns = {"cfdi": "http://www.sat.gob.mx/cfd/4"}
+
+    # Extraer el nodo Comprobante y su atributo 'Sello'
+    comprobante = root.xpath("//cfdi:Comprobante", namespaces=ns)
+    if not comprobante:
+        raise SelloInvalido("No se encontró el nodo 'Comprobante' en el XML.", "sin_comprobante")
+
+    sello = comprobante[0].get("Sello")
+    if not sello:
+        raise SelloInvalido("El XML no tiene un sello digital.", "sin_sello")
+    logger.info("✅ Sello encontrado en el XML: %s...", sello[:50])
+
+    # Validar formato Base64 del sello
+    if not validar_base64(sello):
+        raise SelloInvalido("El sello no es un Base64 válido.", "base64_invalido")
+    logger.info("✅ El sello tiene un formato Base64 válido.")
+
+    # Generar la cadena original del XML ya parseado
+    try:
+        with instrumentacion.etapa("cadena"):
+            cadena_original = cadena.generar_cadena_original(xml_doc, xslt_path).strip()
+    except etree.XSLTError as e:
+        raise SelloInvalido(f"No se pudo generar la cadena original: {e}", "cadena_invalida") from e
+    logger.info("✅ Cadena Original generada correctamente.")
+
+    # Extraer la llave pública del CSD
+    llave_publica = cargar_llave_publica(cer_path)
+    logger.info("✅ Llave pública del CSD cargada.")
+
+    # Verificar la validez del sello digital
+    if not verificar_sello(cadena_original, sello, llave_publica):
+        raise SelloInvalido("El sello no es válido o no coincide con la llave pública.", "sello_invalido")
+    logger.info("✅ El sello es válido y fue generado correctamente con el CSD.")
+    return True
+
+
+def validar_base64(cadena):
+    """Verifica si una cadena tiene un formato Base64 válido."""
+    patron = r'^[A-Za-z0-9+/]+={0,2}$'  # Base64 puede terminar en '=' o '=='
+    return bool(re.match(patron, cadena))
+
+
+def cargar_llave_publica(cer_path):
+    """
+    Carga la llave pública desde el certificado CSD (.cer), parseado una sola vez por proceso.
+
+    Lanza FileNotFoundError si el archivo no existe y CertificadoInvalido si no es un certificado.
+    """
+    from .csd import leer_certificado
+
+    try:
+        certificado = leer_certificado(cer_path)
+    except ValueError as e:
+        raise CertificadoInvalido(f"No se pudo cargar la llave pública de {cer_path}: {e}") from e
+    logger.debug("Certificado cargado en formato %s", certificado.formato,
+                 extra={"no_certificado": certificado.no_certificado})
+    return certificado.llave_publica
+
+
+def verificar_sello(cadena_original, sello, llave_publica):
+    """Verifica si el sello digital es válido utilizando la llave pública del CSD."""
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    with instrumentacion.etapa("verificacion"):
+        try:
+            firma = base64.b64decode(sello)
+            llave_publica.verify(
+                firma,
+                cadena_original.encode("utf-8"),
+                padding.PKCS1v15(),
+                hashes.SHA256()
+            )
+            return True  # La firma es válida si no se lanza una excepción
+        except (InvalidSignature, ValueError) as e:
+            logger.debug("Sello no verificado: %r", e)
+            return False
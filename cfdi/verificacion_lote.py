@@ -0,0 +1,209 @@
+import argparse
+import base64
+import binascii
+import collections
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+
+from . import cache_resultados, cadena, firma, firma_lote
+
+CFDI = "{http://www.sat.gob.mx/cfd/4}"
+
+# Estados posibles de una verificación
+VALIDO = "valido"
+SELLO_INVALIDO = "sello_invalido"
+BASE64_INVALIDO = "base64_invalido"
+SIN_COMPROBANTE = "sin_comprobante"
+SIN_SELLO = "sin_sello"
+SIN_CERTIFICADO = "sin_certificado"
+CERTIFICADO_INVALIDO = "certificado_invalido"
+NO_CERTIFICADO_DISCREPANTE = "no_certificado_discrepante"
+XML_INVALIDO = "xml_invalido"
+ERROR = "error"
+
+ResultadoVerificacion = collections.namedtuple(
+    "ResultadoVerificacion", "documento estado no_certificado detalle")
+
+
+class CacheLlavesPublicas:
+    """
+    Cache LRU de llaves públicas por NoCertificado.
+
+    Se guarda también el Certificado en Base64: si otro documento declara el
+    mismo NoCertificado con un certificado distinto, no se usa la llave en cache.
+    """
+
+    def __init__(self, capacidad=1024):
+        self.capacidad = capacidad
+        self._entradas = collections.OrderedDict()
+        self._candado = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, no_certificado, certificado_b64):
+        """Devuelve (llave pública, NoCertificado del certificado) parseando solo en un fallo."""
+        with self._candado:
+            entrada = self._entradas.get(no_certificado)
+            if entrada is not None and entrada[0] == certificado_b64:
+                self._entradas.move_to_end(no_certificado)
+                self.aciertos += 1
+                return entrada[1], entrada[2]
+            self.fallos += 1
+        from cryptography import x509
+
+        certificado = x509.load_der_x509_certificate(base64.b64decode(certificado_b64))
+        entrada = (certificado_b64, certificado.public_key(), firma.numero_certificado(certificado))
+        with self._candado:
+            self._entradas[no_certificado] = entrada
+            self._entradas.move_to_end(no_certificado)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+        return entrada[1], entrada[2]
+
+
+# Cache del proceso (cada trabajador del pool tiene la suya)
+cache_llaves = CacheLlavesPublicas()
+
+
+def verificar_cfdi(documento, cache=None, metodo="xslt", resultados=None):
+    """
+    Verifica el sello de un CFDI con el certificado que trae embebido.
+
+    Parámetros:
+        documento: Ruta del XML o sus bytes.
+        cache (CacheLlavesPublicas): Cache de llaves; por omisión la del proceso.
+        metodo (str): Generación de la cadena original ("xslt", "nativo" o "auto").
+        resultados: Cache de resultados (ver cache_resultados); un sello ya verificado
+            con el mismo certificado devuelve el veredicto guardado sin transformar ni verificar.
+
+    Retorna:
+        ResultadoVerificacion: Estado estructurado; nunca imprime ni lanza por documento.
+    """
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    cache = cache_llaves if cache is None else cache
+    nombre = documento if isinstance(documento, str) else None
+    no_certificado = digesto_archivo = None
+    try:
+        if resultados is not None:
+            # Los mismos bytes ya verificados se resuelven sin parsear
+            if nombre is not None:
+                with open(nombre, "rb") as xml_file:
+                    documento = xml_file.read()
+            digesto_archivo = cache_resultados.digesto_bytes(documento)
+            veredicto = cache_resultados.buscar_veredicto_archivo(resultados, digesto_archivo)
+            if veredicto is not None:
+                return ResultadoVerificacion(nombre, *veredicto, None)
+        try:
+            if isinstance(documento, str):
+                raiz = etree.parse(nombre).getroot()
+            else:
+                raiz = etree.fromstring(documento)
+        except etree.XMLSyntaxError as e:
+            return ResultadoVerificacion(nombre, XML_INVALIDO, None, str(e))
+        if raiz.tag != CFDI + "Comprobante":
+            return ResultadoVerificacion(nombre, SIN_COMPROBANTE, None, raiz.tag)
+
+        no_certificado = raiz.get("NoCertificado")
+        sello = raiz.get("Sello")
+        certificado_b64 = raiz.get("Certificado")
+        if not sello:
+            return ResultadoVerificacion(nombre, SIN_SELLO, no_certificado, None)
+        if not certificado_b64 or not no_certificado:
+            return ResultadoVerificacion(nombre, SIN_CERTIFICADO, no_certificado, None)
+        try:
+            firma_sello = base64.b64decode(sello, validate=True)
+        except binascii.Error as e:
+            return ResultadoVerificacion(nombre, BASE64_INVALIDO, no_certificado, str(e))
+        try:
+            llave_publica, no_certificado_real = cache.obtener(no_certificado, certificado_b64)
+        except (ValueError, binascii.Error) as e:
+            return ResultadoVerificacion(nombre, CERTIFICADO_INVALIDO, no_certificado, str(e))
+        if no_certificado_real != no_certificado:
+            return ResultadoVerificacion(nombre, NO_CERTIFICADO_DISCREPANTE, no_certificado,
+                                         f"el certificado corresponde a {no_certificado_real}")
+
+        if resultados is not None:
+            digesto = cache_resultados.digesto_documento(raiz)
+            estado = cache_resultados.buscar_veredicto(resultados, digesto, no_certificado, certificado_b64, sello)
+            if estado is not None:
+                cache_resultados.guardar_veredicto_archivo(resultados, digesto_archivo, estado, no_certificado)
+                return ResultadoVerificacion(nombre, estado, no_certificado, None)
+
+        cadena_original = cadena.generar_cadena_original(raiz, metodo=metodo)
+        try:
+            llave_publica.verify(firma_sello, cadena_original.encode("utf-8"), padding.PKCS1v15(),
+                                 hashes.SHA256())
+            estado = VALIDO
+        except InvalidSignature:
+            estado = SELLO_INVALIDO
+        if resultados is not None:
+            cache_resultados.guardar_veredicto(resultados, digesto, no_certificado, certificado_b64, sello,
+                                               cadena_original, estado)
+            cache_resultados.guardar_veredicto_archivo(resultados, digesto_archivo, estado, no_certificado)
+        return ResultadoVerificacion(nombre, estado, no_certificado, None)
+    except Exception as e:
+        return ResultadoVerificacion(nombre, ERROR, no_certificado, f"{type(e).__name__}: {e}")
+
+
+# Cache de resultados del proceso trabajador (ver verificar_lote)
+_resultados = None
+
+
+def _inicializar_trabajador(ruta_cache):
+    global _resultados
+    _resultados = cache_resultados.CacheResultados(ruta_cache) if ruta_cache else None
+
+
+def _verificar_en_trabajador(argumentos):
+    documento, metodo = argumentos
+    return verificar_cfdi(documento, metodo=metodo, resultados=_resultados)
+
+
+def verificar_lote(origen, procesos=None, metodo="xslt", ventana=None, ruta_cache=None):
+    """
+    Verifica muchos CFDI en paralelo con un ProcessPoolExecutor.
+
+    Parámetros:
+        origen: Directorio, patrón glob o iterable de rutas/bytes.
+        procesos (int): Procesos del pool; por omisión, los núcleos disponibles.
+        metodo (str): Generación de la cadena original.
+        ventana (int): Documentos en vuelo como máximo.
+        ruta_cache (str): Cache de veredictos en disco (SQLite), compartida entre los
+            procesos y entre ejecuciones.
+
+    Retorna:
+        generator: ResultadoVerificacion por documento, en el orden de entrada.
+    """
+    procesos = procesos or os.cpu_count() or 1
+    ventana = ventana or procesos * 64
+    with ProcessPoolExecutor(procesos, initializer=_inicializar_trabajador, initargs=(ruta_cache,)) as executor:
+        pendientes = collections.deque()
+        for documento in firma_lote.expandir_documentos(origen):
+            pendientes.append(executor.submit(_verificar_en_trabajador, (documento, metodo)))
+            if len(pendientes) >= ventana:
+                yield pendientes.popleft().result()
+        while pendientes:
+            yield pendientes.popleft().result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verificación masiva de sellos de CFDI (JSON lines).")
+    parser.add_argument("origen", help="Directorio o patrón glob de XML a verificar")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos (por omisión, núcleos)")
+    parser.add_argument("--metodo", default="xslt", choices=("xslt", "nativo", "auto"),
+                        help="Generación de la cadena original")
+    parser.add_argument("--cache", default=None, help="Cache de veredictos en disco (SQLite)")
+    args = parser.parse_args()
+
+    invalidos = 0
+    for resultado in verificar_lote(args.origen, args.procesos, args.metodo, ruta_cache=args.cache):
+        invalidos += resultado.estado != VALIDO
+        sys.stdout.write(json.dumps(resultado._asdict(), ensure_ascii=False) + "\n")
+    exit(1 if invalidos else 0)
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+from lxml import etree
+
+from cfdi import firma
+from cfdi.generacion import construir_comprobante
+
+DIRECTORIO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def csd():
+    """Llave privada, NoCertificado y certificado en Base64 del CSD de pruebas del repositorio."""
+    llave = firma.cargar_llave_privada(os.path.join(DIRECTORIO, "mi_llave.key"), b"12345678a")
+    no_certificado, certificado_b64 = firma.cargar_certificado(os.path.join(DIRECTORIO, "mi_certificado.cer"))
+    return llave, no_certificado, certificado_b64
+
+
+@pytest.fixture
+def sin_firmar():
+    def construir(folio, serie="A"):
+        return etree.tostring(construir_comprobante(serie=serie, folio=folio), xml_declaration=True,
+                              encoding="UTF-8")
+    return construir
+
+
+@pytest.fixture
+def firmado(csd, sin_firmar):
+    def sellar(folio, serie="A"):
+        return firma.sellar_cfdi(sin_firmar(folio, serie), *csd)
+    return sellar
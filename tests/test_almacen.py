@@ -0,0 +1,141 @@
+import os
+from decimal import Decimal
+
+import pytest
+from lxml import etree
+
+from cfdi.almacen import Almacen, xml_de_respuesta
+from cfdi.generacion import construir_comprobante
+
+pytest.importorskip("numpy")
+
+CFDI = "http://www.sat.gob.mx/cfd/4"
+TFD = "http://www.sat.gob.mx/TimbreFiscalDigital"
+
+# uuid, emisor, fecha, total, serie, folio
+DOCUMENTOS = [
+    ("5E0A0000-0000-4000-8000-000000000000", "AAA010101AX5", "2024-01-15T10:00:00", "100.00", "A", "1"),
+    ("5E0A0000-0000-4000-8000-000000000001", "AAA010101AX5", "2024-02-10T09:30:00", "250.50", "A", "2"),
+    ("5E0A0000-0000-4000-8000-000000000002", "CCC030303CX7", "2024-02-29T23:59:59", "1000.00", "B", "1"),
+    ("5E0A0000-0000-4000-8000-000000000003", "AAA010101AX5", "2024-03-01T00:00:00", "99.99", "B", "10"),
+    ("5E0A0000-0000-4000-8000-000000000004", "CCC030303CX7", "2024-03-15T18:00:00", "250.50", "A", "10"),
+]
+
+
+def _timbrado(uuid, emisor, fecha, total, serie, folio, nombre="CLIENTE EJEMPLO"):
+    raiz = construir_comprobante(serie=serie, folio=folio)
+    raiz.set("Fecha", fecha)
+    raiz.set("Total", total)
+    raiz.find(f"{{{CFDI}}}Emisor").set("Rfc", emisor)
+    raiz.find(f"{{{CFDI}}}Receptor").set("Nombre", nombre)
+    complemento = etree.SubElement(raiz, f"{{{CFDI}}}Complemento")
+    etree.SubElement(complemento, f"{{{TFD}}}TimbreFiscalDigital", nsmap={"tfd": TFD}, Version="1.1",
+                     UUID=uuid, FechaTimbrado=fecha, RfcProvCertif="SPR190613I52",
+                     NoCertificadoSAT="30001000000500003456")
+    return etree.tostring(raiz, xml_declaration=True, encoding="UTF-8")
+
+
+def _busquedas(almacen):
+    uuids = [d[0] for d in DOCUMENTOS]
+    numeros = {uuid: almacen.buscar(uuid=uuid).tolist() for uuid in uuids}
+    assert numeros == {uuid: [i] for i, uuid in enumerate(uuids)}
+    assert almacen.buscar(uuid=uuids[2].lower()).tolist() == [2]
+    assert almacen.buscar(uuid="5E0A0000-0000-4000-8000-999999999999").tolist() == []
+    assert almacen.buscar(emisor="AAA010101AX5").tolist() == [0, 1, 3]
+    assert almacen.buscar(desde="2024-02", hasta="2024-02").tolist() == [1, 2]
+    assert almacen.buscar(desde="2024-02-29T23:59:59").tolist() == [2, 3, 4]
+    assert almacen.buscar(total_min="250.50", total_max="250.50").tolist() == [1, 4]
+    assert almacen.buscar(total_max="100").tolist() == [0, 3]
+    assert almacen.buscar(serie="B", folio="1").tolist() == [2]
+    assert almacen.buscar(serie="A", folio="10").tolist() == [4]
+    assert almacen.buscar(serie="A", folio="1").tolist() == [0]
+    assert almacen.buscar(emisor="CCC030303CX7", desde="2024-03").tolist() == [4]
+    assert almacen.buscar(receptor="BBB020202BX6").tolist() == [0, 1, 2, 3, 4]
+    assert almacen.buscar().tolist() == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("codec", ["zstd", "zlib", "ninguno"])
+def test_agregar_reabrir_y_buscar(tmp_path, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    ruta = str(tmp_path / "almacen")
+    xmls = [_timbrado(*documento) for documento in DOCUMENTOS]
+    with Almacen(ruta, codec=codec) as almacen:
+        assert [almacen.agregar(xml) for xml in xmls[:3]] == [0, 1, 2]
+    with Almacen(ruta) as almacen:
+        assert [almacen.agregar(xml) for xml in xmls[3:]] == [3, 4]
+        _busquedas(almacen)  # sin índices: todo se revisa en la cola
+    with Almacen(ruta) as almacen:
+        almacen.indexar()
+    with Almacen(ruta) as almacen:
+        assert almacen.manifiesto["indexados"] == 5
+        _busquedas(almacen)
+        assert bytes(almacen.xml(DOCUMENTOS[3][0])) == xmls[3]
+        assert almacen.registro(1)[1:] == (DOCUMENTOS[1][0], "2024-02-10T09:30:00", Decimal("250.50"),
+                                           "AAA010101AX5", "BBB020202BX6", "A", "2")
+
+
+def test_indice_y_cola_se_combinan(tmp_path):
+    with Almacen(str(tmp_path / "almacen")) as almacen:
+        for documento in DOCUMENTOS[:2]:
+            almacen.agregar(_timbrado(*documento))
+        almacen.indexar()
+        for documento in DOCUMENTOS[2:]:
+            almacen.agregar(_timbrado(*documento))
+        # Dos registros en los índices y tres aún sin indexar
+        _busquedas(almacen)
+
+
+def test_uuid_repetido_devuelve_el_registro_existente(tmp_path):
+    ruta = str(tmp_path / "almacen")
+    xml = _timbrado(*DOCUMENTOS[0])
+    with Almacen(ruta) as almacen:
+        assert almacen.agregar(xml) == 0
+        assert almacen.agregar(_timbrado(*DOCUMENTOS[1])) == 1
+        assert almacen.agregar(xml) == 0
+        almacen.indexar()
+        assert almacen.agregar({"cfdi": xml.decode("utf-8")}) == 0
+    with Almacen(ruta) as almacen:
+        assert almacen.agregar(xml) == 0
+        assert len(almacen) == 2
+        assert DOCUMENTOS[0][0].lower() in almacen
+    with pytest.raises(ValueError):
+        xml_de_respuesta(object())
+
+
+def test_bloques_anteriores_al_diccionario(tmp_path):
+    pytest.importorskip("zstandard")
+    ruta = str(tmp_path / "almacen")
+    documentos = [(f"5E0A0000-0000-4000-8000-{i:012d}", "AAA010101AX5", "2024-03-01T12:00:00", f"{i}.00", "A",
+                   str(i), f"CLIENTE {i * 7919}") for i in range(30)]
+    xmls = [_timbrado(*documento) for documento in documentos]
+    with Almacen(ruta, codec="zstd", muestras_diccionario=20, tamano_diccionario=1024) as almacen:
+        lector = Almacen(ruta)  # abierto antes de que exista el diccionario
+        for xml in xmls:
+            almacen.agregar(xml)
+        assert almacen.manifiesto["diccionario"] == "diccionario.zstd"
+        # Los bloques con diccionario son más pequeños que los de antes
+        assert len(almacen.bloque(25)) < len(almacen.bloque(5))
+        assert [almacen.xml(n) for n in range(30)] == xmls
+        assert lector.xml(25) == xmls[25] and lector.xml(5) == xmls[5]
+        lector.cerrar()
+    with Almacen(ruta) as almacen:
+        assert [almacen.xml(n) for n in range(30)] == xmls
+
+
+def test_registro_a_medio_escribir_se_descarta(tmp_path):
+    ruta = str(tmp_path / "almacen")
+    with Almacen(ruta) as almacen:
+        for documento in DOCUMENTOS[:3]:
+            almacen.agregar(_timbrado(*documento))
+        tamano_registro = almacen.dtype.itemsize
+    registros = os.path.join(ruta, "registros.bin")
+    with open(registros, "ab") as f:
+        f.write(b"\x01" * (tamano_registro // 2))  # la caída interrumpió el cuarto registro
+
+    with Almacen(ruta) as almacen:
+        assert os.path.getsize(registros) == 3 * tamano_registro
+        assert len(almacen) == 3
+        assert almacen.agregar(_timbrado(*DOCUMENTOS[3])) == 3
+        assert almacen.buscar(serie="B", folio="10").tolist() == [3]
+        assert almacen.xml(DOCUMENTOS[2][0]) == _timbrado(*DOCUMENTOS[2])
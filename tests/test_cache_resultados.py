@@ -0,0 +1,130 @@
+import time
+
+from lxml import etree
+
+from cfdi import cache_resultados, firma
+from cfdi.cache_resultados import CacheResultados, digesto_documento
+from cfdi.verificacion_lote import verificar_cfdi
+
+
+class FirmanteContador:
+    """Firma con la llave del CSD y cuenta las operaciones RSA."""
+
+    def __init__(self, llave):
+        self.llave = llave
+        self.firmas = 0
+
+    def firmar(self, cadena_original):
+        self.firmas += 1
+        return firma.firmar_cadena(cadena_original, self.llave)
+
+
+def test_lru_en_memoria():
+    cache = CacheResultados(capacidad=2)
+    cache.guardar("a", "1")
+    cache.guardar("b", "2")
+    assert cache.obtener("a") == "1"  # "a" pasa a ser la más reciente
+    cache.guardar("c", "3")
+    assert cache.obtener("b") is None
+    assert cache.obtener("a") == "1" and cache.obtener("c") == "3"
+    estadisticas = cache.estadisticas()
+    assert {k: estadisticas[k] for k in ("aciertos_memoria", "aciertos_disco", "fallos", "desalojos_memoria",
+                                         "entradas_memoria")} == {
+        "aciertos_memoria": 3, "aciertos_disco": 0, "fallos": 1, "desalojos_memoria": 1, "entradas_memoria": 2}
+    assert estadisticas["tasa_aciertos"] == 0.75
+
+
+def test_nivel_en_disco_y_promocion(tmp_path):
+    ruta = str(tmp_path / "cache.db")
+    with CacheResultados(ruta, capacidad=1) as cache:
+        cache.guardar("a", "1")
+        cache.guardar("b", "2")
+        assert cache.obtener("a") == "1"  # desalojada de memoria, sigue en disco
+        assert cache.obtener("a") == "1"  # y ya se promovió
+        assert (cache.aciertos_disco, cache.aciertos_memoria) == (1, 1)
+    with CacheResultados(ruta) as cache:
+        assert cache.obtener("b") == "2" and cache.aciertos_disco == 1
+        assert cache.obtener("z") is None and cache.fallos == 1
+        assert cache.estadisticas()["entradas_disco"] == 2
+
+
+def test_desalojo_por_tamano_en_disco(tmp_path):
+    with CacheResultados(str(tmp_path / "cache.db"), capacidad=0, max_bytes_disco=1000, revisar_cada=1) as cache:
+        for i in range(8):
+            cache.guardar(f"clave{i:02d}", "x" * 93)  # 100 bytes por entrada
+            time.sleep(0.002)
+        assert cache.obtener("clave00") is not None  # la más antigua se acaba de usar
+        for i in range(8, 12):
+            cache.guardar(f"clave{i:02d}", "x" * 93)
+            time.sleep(0.002)
+        estadisticas = cache.estadisticas()
+        assert estadisticas["bytes_disco"] <= 1000
+        # Al pasar de 1000 bytes se borran las menos usadas hasta quedar al 90%
+        assert estadisticas["desalojos_disco"] == 2
+        assert cache.obtener("clave00") is not None
+        assert [cache.obtener(f"clave{i:02d}") for i in (1, 2, 3)] == [None, None, "x" * 93]
+        assert cache.obtener("clave11") is not None
+
+
+def test_digesto_ignora_sello_y_certificado(sin_firmar):
+    raiz = etree.fromstring(sin_firmar("1"))
+    original = digesto_documento(raiz)
+    raiz.set("Sello", "abc")
+    raiz.set("Certificado", "def")
+    assert digesto_documento(raiz) == original
+    raiz.set("NoCertificado", "30001000000400002435")
+    assert digesto_documento(raiz) != original
+
+
+def test_sellar_con_cache_de_bytes(csd, sin_firmar):
+    llave, no_certificado, certificado_b64 = csd
+    firmante = FirmanteContador(llave)
+    cache = CacheResultados()
+
+    primero = firma.sellar_cfdi(sin_firmar("1"), firmante, no_certificado, certificado_b64, cache=cache)
+    repetido = firma.sellar_cfdi(sin_firmar("1"), firmante, no_certificado, certificado_b64, cache=cache)
+    assert repetido == primero
+    assert firmante.firmas == 1 and cache.aciertos_memoria == 2  # documento y sello
+
+    # Otro Folio: otro documento y otro Sello, nunca el guardado
+    otro = firma.sellar_cfdi(sin_firmar("2"), firmante, no_certificado, certificado_b64, cache=cache)
+    assert firmante.firmas == 2
+    assert etree.fromstring(otro).get("Sello") != etree.fromstring(primero).get("Sello")
+
+    # Otro NoCertificado (forma parte de la cadena original): tampoco se reutiliza
+    firma.sellar_cfdi(sin_firmar("1"), firmante, "30001000000400002435", certificado_b64, cache=cache)
+    assert firmante.firmas == 3
+
+    for sellado in (primero, repetido, otro):
+        assert verificar_cfdi(sellado).estado == "valido"
+
+
+def test_sellar_con_cache_de_arbol(csd, sin_firmar):
+    llave, no_certificado, certificado_b64 = csd
+    firmante = FirmanteContador(llave)
+    cache = CacheResultados()
+
+    sellado = firma.sellar_cfdi(etree.fromstring(sin_firmar("1")), firmante, no_certificado, certificado_b64,
+                                serializar=False, cache=cache)
+    sello = sellado.get("Sello")
+    # El mismo árbol ya sellado tiene el mismo digesto (sin Sello ni Certificado): se reutiliza
+    assert firma.sellar_cfdi(sellado, firmante, no_certificado, certificado_b64, serializar=False,
+                             cache=cache).get("Sello") == sello
+    assert firmante.firmas == 1
+
+    cambiado = etree.fromstring(sin_firmar("1"))
+    cambiado.set("Total", "1.00")
+    resultado = firma.sellar_cfdi(cambiado, firmante, no_certificado, certificado_b64, cache=cache)
+    assert firmante.firmas == 2
+    assert etree.fromstring(resultado).get("Sello") != sello
+
+
+def test_veredictos(csd, firmado, tmp_path):
+    sellado = firmado("1")
+    with CacheResultados(str(tmp_path / "cache.db")) as cache:
+        assert verificar_cfdi(sellado, resultados=cache).estado == "valido"
+        digesto = cache_resultados.digesto_bytes(sellado)
+        assert cache_resultados.buscar_veredicto_archivo(cache, digesto)[0] == "valido"
+        # Un Sello alterado es otro archivo y otro veredicto
+        alterado = sellado.replace(b'Sello="', b'Sello="AAAA', 1)
+        assert verificar_cfdi(alterado, resultados=cache).estado != "valido"
@@ -0,0 +1,71 @@
+import io
+import os
+
+from lxml import etree
+
+from cfdi import firma
+from cfdi.cadena_nativa import comparar_con_xslt
+from cfdi.generacion import construir_comprobante
+from cfdi.generacion_streaming import conceptos_de_ejemplo, generar_cfdi_streaming
+from cfdi.pagos import LibroSaldos, construir_pago
+
+from .conftest import DIRECTORIO
+
+EMISOR = {"Rfc": "AAA010101AX5", "Nombre": "EMPRESA EMISORA S.A. DE C.V.", "RegimenFiscal": "601"}
+RECEPTOR = {"Rfc": "BBB020202BX6", "Nombre": "CLIENTE EJEMPLO", "DomicilioFiscalReceptor": "64000",
+            "RegimenFiscalReceptor": "601", "UsoCFDI": "G03"}
+
+
+def _streaming_con_texto_escapado():
+    comprobante = {"Serie": "A", "Folio": "7", "Fecha": "2024-03-09T12:00:00", "FormaPago": "99",
+                   "CondicionesDePago": "  Crédito   a 30 días  ", "Moneda": "MXN", "TipoDeComprobante": "I",
+                   "Exportacion": "01", "MetodoPago": "PPD", "LugarExpedicion": "64000"}
+    emisor = dict(EMISOR, Nombre="PEÑA & HIJOS <MAYOREO> S.A.")
+    conceptos = list(conceptos_de_ejemplo(3)) + [
+        {"ClaveProdServ": "01010101", "Cantidad": "2.5", "ClaveUnidad": "KGM",
+         "Descripcion": 'Tornillo 3/4" | acero  "inoxidable"\tcon\nsalto', "ValorUnitario": "12.345",
+         "Descuento": "1.005", "ObjetoImp": "02",
+         "Traslados": [{"Impuesto": "002", "TipoFactor": "Tasa", "TasaOCuota": "0.160000"},
+                       {"Impuesto": "003", "TipoFactor": "Cuota", "TasaOCuota": "0.298800"}],
+         "Retenciones": [{"Impuesto": "001", "TipoFactor": "Tasa", "TasaOCuota": "0.100000"},
+                         {"Impuesto": "002", "TipoFactor": "Tasa", "TasaOCuota": "0.106667"}]},
+        {"ClaveProdServ": "86121500", "Cantidad": "1", "ClaveUnidad": "E48", "Descripcion": "Colegiatura 'ñandú'",
+         "ValorUnitario": "3500.00", "ObjetoImp": "02",
+         "Traslados": [{"Impuesto": "002", "TipoFactor": "Exento"}]},
+    ]
+    salida = io.BytesIO()
+    generar_cfdi_streaming(comprobante, emisor, RECEPTOR, conceptos, salida)
+    return salida.getvalue()
+
+
+def _rep(ruta_libro):
+    uuid = "6F1E0C2A-0000-4000-8000-000000000001"
+    with LibroSaldos(ruta_libro) as libro:
+        libro.registrar({"uuid": uuid, "rfc_emisor": EMISOR["Rfc"], "rfc_receptor": RECEPTOR["Rfc"],
+                         "serie": "F", "folio": "1", "moneda": "MXN", "total": "1160.00", "objeto_imp": "02",
+                         "impuestos": {"traslados": [["002", "Tasa", "0.160000", "1000.00", "160.00"]],
+                                       "retenciones": [["001", "Tasa", "0.100000", "1000.00", "100.00"]]}})
+        receptor = {k: v for k, v in RECEPTOR.items() if k != "UsoCFDI"}
+        pagos = [{"FechaPago": "2024-03-10T12:00:00", "FormaDePagoP": "03", "MonedaP": "USD", "TipoCambioP": "17.50",
+                  "NumOperacion": "A&B <1>", "Documentos": [
+                      {"IdDocumento": uuid, "ImpPagado": "875.00", "EquivalenciaDR": "17.50"}]}]
+        raiz = construir_pago({"Serie": "P", "Folio": "1", "Fecha": "2024-03-10T12:00:00", "LugarExpedicion": "64000"},
+                              EMISOR, receptor, pagos, libro)
+    return etree.tostring(raiz, xml_declaration=True, encoding="UTF-8")
+
+
+def test_corpus_identico_a_xslt(csd, firmado, tmp_path):
+    corpus = [
+        os.path.join(DIRECTORIO, "cfdi.xml"),
+        etree.tostring(construir_comprobante(), xml_declaration=True, encoding="UTF-8"),
+        firmado("1"),
+        _streaming_con_texto_escapado(),
+        _rep(str(tmp_path / "saldos.db")),
+    ]
+    corpus.append(firma.sellar_cfdi(corpus[-1], *csd))
+    assert comparar_con_xslt(corpus) == []
+
+
+def test_reporta_discrepancias():
+    discrepancias = comparar_con_xslt([b"<x/>"])
+    assert len(discrepancias) == 1 and "cfdi:Comprobante" in discrepancias[0][2]
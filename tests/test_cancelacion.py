@@ -0,0 +1,156 @@
+import asyncio
+import uuid
+
+import pytest
+
+from cfdi.cancelacion import (CANCELAR, CONSULTAR, FALLIDO, PENDIENTE, TERMINADO, LoteCancelacion, Solicitud,
+                              validar_solicitud)
+from cfdi.cliente_pac import ClienteSW
+from cfdi.pac_simulado import PACSimulado
+
+EMISOR = "EKU9003173C9"
+CREDENCIALES = ("Y2Vy", "a2V5", "12345678a")
+
+
+class ClienteInterrumpido(ClienteSW):
+    """Cancela la tarea del lote al pedir la cancelación número `detener_en` (como un Ctrl+C)."""
+
+    def __init__(self, *args, detener_en, **opciones):
+        super().__init__(*args, **opciones)
+        self.detener_en = detener_en
+        self.llamadas = 0
+        self.tarea = None
+
+    async def cancelar(self, *args, **opciones):
+        self.llamadas += 1
+        if self.llamadas == self.detener_en:
+            self.tarea.cancel()
+            await asyncio.sleep(1)
+        return await super().cancelar(*args, **opciones)
+
+
+@pytest.fixture
+def pac():
+    with PACSimulado() as servidor:
+        yield servidor
+
+
+def _uuids(pac, cantidad):
+    uuids = [str(uuid.uuid4()).upper() for _ in range(cantidad)]
+    for folio_fiscal in uuids:
+        pac.registrar(folio_fiscal, EMISOR, "XAXX010101000", "116.00")
+    return uuids
+
+
+def _cancelaciones(uuids, motivo="02"):
+    return [Solicitud(folio_fiscal, EMISOR, motivo) for folio_fiscal in uuids]
+
+
+def _ejecutar(pac, lote, operacion=CANCELAR, cliente=ClienteSW, trabajadores=None, **opciones):
+    async def principal():
+        async with cliente(pac.user, pac.password, url_base=pac.url, reintentos=0, espera_base=0.001,
+                           **opciones) as instancia:
+            tarea = asyncio.create_task(lote.ejecutar(instancia, operacion, trabajadores,
+                                                      credenciales=lambda rfc: CREDENCIALES))
+            instancia.tarea = tarea
+            return await tarea
+    return asyncio.run(principal())
+
+
+@pytest.mark.parametrize("solicitud", [
+    Solicitud("U1", EMISOR, "01", "U2"), Solicitud("U1", EMISOR, "02"), Solicitud("U1", EMISOR, "03"),
+    Solicitud("U1", EMISOR, "04")])
+def test_motivos_validos(solicitud):
+    validar_solicitud(CANCELAR, solicitud)
+
+
+@pytest.mark.parametrize("operacion, solicitud", [
+    (CANCELAR, Solicitud("U1", EMISOR, "05")),
+    (CANCELAR, Solicitud("U1", EMISOR, None)),
+    (CANCELAR, Solicitud("U1", EMISOR, "01")),  # el motivo 01 requiere el folio que lo sustituye
+    (CANCELAR, Solicitud("U1", EMISOR, "02", "U2")),  # y solo el 01 lo admite
+    (CANCELAR, Solicitud(None, EMISOR, "02")),
+    (CONSULTAR, Solicitud("U1", EMISOR, rfc_receptor="XAXX010101000")),
+    ("anular", Solicitud("U1", EMISOR, "02"))])
+def test_solicitudes_invalidas(operacion, solicitud):
+    with pytest.raises(ValueError):
+        validar_solicitud(operacion, solicitud)
+
+
+def test_aceptadas_terminan_y_rechazadas_fallan(pac, tmp_path):
+    vigente, cancelado = _uuids(pac, 2)
+    pac.comprobantes[cancelado]["estado"] = "Cancelado"
+    inexistente = str(uuid.uuid4()).upper()
+    with LoteCancelacion(str(tmp_path / "lote.db"), espera_ronda=0) as lote:
+        assert lote.agregar(CANCELAR, _cancelaciones([vigente, cancelado, inexistente])) == 3
+        assert lote.agregar(CANCELAR, _cancelaciones([vigente])) == 0
+        resumen = _ejecutar(pac, lote)
+        resultados = {r.uuid: r for r in lote.resultados(CANCELAR)}
+
+    assert resumen == {TERMINADO: 2, FALLIDO: 1}
+    assert resultados[vigente].resultado["codigo"] == "201"
+    assert resultados[cancelado].resultado["codigo"] == "202"
+    assert resultados[inexistente].estado == FALLIDO and "205" in resultados[inexistente].error
+    assert all(r.intentos == 1 for r in resultados.values())
+    assert pac.comprobantes[vigente]["estado"] == "Cancelado"
+
+
+def test_consulta_de_estado(pac, tmp_path):
+    folio_fiscal, = _uuids(pac, 1)
+    with LoteCancelacion(str(tmp_path / "lote.db")) as lote:
+        lote.agregar(CONSULTAR, [Solicitud(folio_fiscal, EMISOR, rfc_receptor="XAXX010101000", total="116.00")])
+        assert _ejecutar(pac, lote, CONSULTAR) == {TERMINADO: 1}
+        resultado, = lote.resultados(CONSULTAR)
+    assert resultado.resultado["estado"] == "Vigente"
+
+
+def test_falla_transitoria_queda_pendiente_y_se_reintenta(pac, tmp_path):
+    folio_fiscal, = _uuids(pac, 1)
+    with LoteCancelacion(str(tmp_path / "lote.db"), max_intentos=3, espera_ronda=0) as lote:
+        lote.agregar(CANCELAR, _cancelaciones([folio_fiscal]))
+        pac.inyectar_fallas(503)
+
+        async def una_ronda():
+            async with ClienteSW(pac.user, pac.password, url_base=pac.url, reintentos=0) as cliente:
+                await lote._ronda(cliente, CANCELAR, 1, lambda rfc: CREDENCIALES)
+
+        asyncio.run(una_ronda())
+        pendiente, = lote.resultados(CANCELAR)
+        assert (pendiente.estado, pendiente.intentos) == (PENDIENTE, 1)
+
+        pac.inyectar_fallas(502)
+        assert _ejecutar(pac, lote) == {TERMINADO: 1}
+        terminado, = lote.resultados(CANCELAR)
+    assert terminado.intentos == 3
+
+
+def test_falla_transitoria_agota_max_intentos(pac, tmp_path):
+    folio_fiscal, = _uuids(pac, 1)
+    with LoteCancelacion(str(tmp_path / "lote.db"), max_intentos=3, espera_ronda=0) as lote:
+        lote.agregar(CANCELAR, _cancelaciones([folio_fiscal]))
+        pac.inyectar_fallas(503, 503, 503, 503)
+        assert _ejecutar(pac, lote) == {FALLIDO: 1}
+        fallido, = lote.resultados(CANCELAR)
+    assert fallido.intentos == 3
+    assert "503" in fallido.error
+    assert pac.fallas == [503]  # no hubo una cuarta solicitud
+
+
+def test_continua_desde_el_punto_de_control(pac, tmp_path):
+    uuids = _uuids(pac, 40)
+    ruta = str(tmp_path / "lote.db")
+    with LoteCancelacion(ruta, guardar_cada=5, intervalo_guardado=3600) as lote:
+        lote.agregar(CANCELAR, _cancelaciones(uuids))
+        with pytest.raises(asyncio.CancelledError):
+            _ejecutar(pac, lote, cliente=ClienteInterrumpido, trabajadores=1, detener_en=16)
+    enviadas = pac.solicitudes
+    assert enviadas == 15
+
+    with LoteCancelacion(ruta) as lote:
+        assert lote.resumen(CANCELAR) == {TERMINADO: 15, PENDIENTE: 25}
+        assert _ejecutar(pac, lote) == {TERMINADO: 40}
+        resultados = list(lote.resultados(CANCELAR))
+    # Solo se enviaron los pendientes, y ningún UUID se canceló dos veces (el PAC respondería 202)
+    assert pac.solicitudes - enviadas == 25
+    assert {r.resultado["codigo"] for r in resultados} == {"201"}
+    assert all(r.intentos == 1 for r in resultados)
@@ -0,0 +1,77 @@
+import asyncio
+import base64
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fiscalapi")
+
+from fiscalapi.models.common_models import ApiResponse, PagedList  # noqa: E402
+from fiscalapi.models.fiscalapi_models import Invoice, InvoiceResponse  # noqa: E402
+
+from cfdi.cliente_pac import ClienteFiscalAPI  # noqa: E402
+
+
+class FacturasSimuladas:
+    """Servicio `invoices` del SDK en memoria: guarda lo que recibe y lo lista como la API."""
+
+    def __init__(self):
+        self.facturas = []
+
+    def create(self, factura):
+        timbrada = factura.model_copy(update={"id": str(len(self.facturas)), "uuid": str(uuid.uuid4()).upper()})
+        timbrada.responses = [InvoiceResponse(invoice_base64=base64.b64encode(
+            f'<cfdi:Comprobante Serie="{factura.series}" Folio="{factura.number}"/>'.encode()).decode())]
+        self.facturas.append(timbrada)
+        return ApiResponse[Invoice](succeeded=True, data=timbrada, http_status_code=200)
+
+    def get_list(self, pagina, tamano):
+        inicio = (pagina - 1) * tamano
+        # El listado no trae el detalle (las respuestas del SAT); get_by_id sí
+        items = [f.model_copy(update={"responses": None}) for f in self.facturas[inicio:inicio + tamano]]
+        total_paginas = max(1, -(-len(self.facturas) // tamano))
+        return ApiResponse[PagedList[Invoice]](succeeded=True, http_status_code=200, data=PagedList[Invoice](
+            items=items, page_number=pagina, total_pages=total_paginas, total_count=len(self.facturas),
+            has_previous_page=pagina > 1, has_next_page=pagina < total_paginas))
+
+    def get_by_id(self, identificador, detalles=False):
+        return ApiResponse[Invoice](succeeded=True, data=self.facturas[int(identificador)], http_status_code=200)
+
+
+@pytest.fixture
+def cliente():
+    cliente = ClienteFiscalAPI("https://test.fiscalapi.com", "clave", "tenant", credenciales=("cer", "key", "12345678a"),
+                               espera_base=0.001)
+    cliente.client = SimpleNamespace(invoices=FacturasSimuladas())
+    return cliente
+
+
+def test_serie_y_folio_van_en_la_factura_y_se_encuentran_al_consultar(cliente, sin_firmar):
+    documento = sin_firmar("F7", "B")
+
+    async def principal():
+        for i in range(60):  # la factura queda en la segunda página del listado
+            await cliente.timbrar(sin_firmar(str(i), "Z"))
+        timbre = await cliente.timbrar(documento)
+        return timbre, await cliente.consultar_timbre(documento), await cliente.consultar_timbre(
+            sin_firmar("F8", "B"))
+
+    timbre, previo, ausente = asyncio.run(principal())
+    enviada = cliente.client.invoices.facturas[-1]
+    assert (enviada.series, enviada.number) == ("B", "F7")
+    assert 'Serie="B" Folio="F7"' in timbre["cfdi"]
+    assert previo == timbre
+    assert ausente is None
+
+
+def test_consultar_timbre_no_pasa_de_paginas_consulta(cliente, sin_firmar):
+    cliente.paginas_consulta = 1
+
+    async def principal():
+        for i in range(50):
+            await cliente.timbrar(sin_firmar(str(i), "Z"))
+        await cliente.timbrar(sin_firmar("F7", "B"))
+        return await cliente.consultar_timbre(sin_firmar("F7", "B"))
+
+    assert asyncio.run(principal()) is None
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cfdi.cliente_pac import ClienteSW, ErrorPAC
+from cfdi.cola_timbrado import TIMBRADO, ColaTimbrado
+from cfdi.pac_simulado import PACSimulado
+
+
+class PACContador(PACSimulado):
+    """PACSimulado que además registra cuántas solicitudes de timbrado atiende a la vez."""
+
+    def __init__(self, **opciones):
+        super().__init__(**opciones)
+        self.en_vuelo = 0
+        self.maximo_en_vuelo = 0
+        self._candado_vuelo = threading.Lock()
+
+    def _timbrar(self, cuerpo, tipo_contenido):
+        with self._candado_vuelo:
+            self.en_vuelo += 1
+            self.maximo_en_vuelo = max(self.maximo_en_vuelo, self.en_vuelo)
+        try:
+            time.sleep(0.05)
+            return super()._timbrar(cuerpo, tipo_contenido)
+        finally:
+            with self._candado_vuelo:
+                self.en_vuelo -= 1
+
+    def rutas(self):
+        return dict(super().rutas(), **{"/cfdi33/issue/v4": self._timbrar})
+
+
+@pytest.fixture
+def pac():
+    with PACContador() as servidor:
+        yield servidor
+
+
+def _cliente(pac, **opciones):
+    opciones.setdefault("espera_base", 0.001)
+    return ClienteSW(pac.user, pac.password, url_base=pac.url, **opciones)
+
+
+def test_token_una_sola_vez_y_renovado_bajo_el_candado(pac, firmado):
+    documentos = [firmado(f"T{i}") for i in range(12)]
+
+    async def principal():
+        async with _cliente(pac, max_concurrencia=6) as cliente:
+            resultados = await cliente.timbrar_lote(documentos[:6])
+            cliente._expira = 0.0  # el token vence: todas las corrutinas lo necesitan a la vez
+            resultados += await cliente.timbrar_lote(documentos[6:])
+            return resultados, cliente.autenticaciones
+
+    resultados, autenticaciones = asyncio.run(principal())
+    assert not [r for r in resultados if isinstance(r, Exception)]
+    assert autenticaciones == pac.autenticaciones == 2
+
+
+def test_semaforo_limita_las_solicitudes_en_vuelo(pac, firmado):
+    documentos = [firmado(f"S{i}") for i in range(12)]
+
+    async def principal():
+        async with _cliente(pac, max_concurrencia=3) as cliente:
+            return await cliente.timbrar_lote(documentos)
+
+    resultados = asyncio.run(principal())
+    assert not [r for r in resultados if isinstance(r, Exception)]
+    assert pac.maximo_en_vuelo == 3
+
+
+def test_reintenta_429_y_503(pac, firmado):
+    pac.inyectar_fallas(429, 503)
+
+    async def principal():
+        async with _cliente(pac) as cliente:
+            return await cliente.timbrar(firmado("R1"))
+
+    assert asyncio.run(principal())["uuid"]
+    assert pac.solicitudes == 3
+
+
+def test_respeta_retry_after(firmado):
+    documentos = [firmado("L1"), firmado("L2")]
+
+    async def principal(pac):
+        async with _cliente(pac) as cliente:
+            await cliente.timbrar(documentos[0])
+            inicio = time.monotonic()
+            await cliente.timbrar(documentos[1])  # excede el límite: 429 con Retry-After: 1
+            return time.monotonic() - inicio
+
+    with PACSimulado(limite_por_segundo=1) as pac:
+        espera = asyncio.run(principal(pac))
+    assert pac.excedidas == 1
+    assert espera >= 0.9  # espera_base es de 1 ms: solo Retry-After explica la pausa
+
+
+def test_agota_los_reintentos(pac, firmado):
+    pac.inyectar_fallas(503, 503, 503)
+
+    async def principal():
+        async with _cliente(pac, reintentos=2) as cliente:
+            await cliente.timbrar(firmado("R2"))
+
+    with pytest.raises(ErrorPAC) as error:
+        asyncio.run(principal())
+    assert error.value.status_code == 503 and not error.value.rechazado
+
+
+def test_duplicado_307_se_recupera_con_consultar_timbre(pac, firmado, tmp_path):
+    documento = firmado("D1")
+
+    async def principal():
+        async with _cliente(pac) as cliente:
+            previo = await cliente.timbrar(documento)
+            with ColaTimbrado(str(tmp_path / "cola.db")) as cola:
+                id_comprobante = cola.agregar(documento)
+                await cola.procesar(cliente, trabajadores=1)
+                fila = cola.conexion.execute("SELECT estado, uuid FROM comprobantes WHERE id = ?",
+                                             (id_comprobante,)).fetchone()
+            return previo, tuple(fila)
+
+    previo, (estado, uuid) = asyncio.run(principal())
+    assert (estado, uuid) == (TIMBRADO, previo["uuid"])
+    assert len(pac.timbrados) == 1
@@ -0,0 +1,17 @@
+from cfdi.cola_timbrado import FALLIDO, FIRMADO, ColaTimbrado
+
+
+def test_firmar_pendientes_actualiza_el_hash_y_cuenta_solo_los_firmados(tmp_path, csd, sin_firmar):
+    with ColaTimbrado(str(tmp_path / "cola.db")) as cola:
+        id_bueno = cola.agregar(sin_firmar("A77"))
+        id_roto = cola.agregar(sin_firmar("A78"))
+        cola.conexion.execute("UPDATE comprobantes SET xml = ? WHERE id = ?", (b"<roto", id_roto))
+
+        assert cola.firmar_pendientes(*csd) == 1
+
+        fila = cola.conexion.execute("SELECT estado, xml FROM comprobantes WHERE id = ?", (id_bueno,)).fetchone()
+        assert fila["estado"] == FIRMADO
+        # El mismo comprobante, ya firmado, no es un folio duplicado
+        assert cola.agregar(fila["xml"]) == id_bueno
+        estado = cola.conexion.execute("SELECT estado FROM comprobantes WHERE id = ?", (id_roto,)).fetchone()[0]
+        assert estado == FALLIDO
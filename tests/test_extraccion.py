@@ -0,0 +1,56 @@
+import json
+import os
+
+from lxml import etree
+
+from cfdi.extraccion import Extractor, leer_tabla
+from cfdi.generacion import construir_comprobante
+
+CFDI = "http://www.sat.gob.mx/cfd/4"
+TFD = "http://www.sat.gob.mx/TimbreFiscalDigital"
+
+
+def _timbrado(folio, uuid=None):
+    raiz = construir_comprobante(serie="A", folio=folio)
+    if uuid:
+        complemento = etree.SubElement(raiz, f"{{{CFDI}}}Complemento")
+        etree.SubElement(complemento, f"{{{TFD}}}TimbreFiscalDigital", nsmap={"tfd": TFD}, Version="1.1",
+                         UUID=uuid, FechaTimbrado="2024-03-09T12:05:00", RfcProvCertif="SPR190613I52",
+                         NoCertificadoSAT="30001000000500003456")
+    return etree.tostring(raiz, xml_declaration=True, encoding="UTF-8")
+
+
+def _escribir(ruta, contenido, mtime):
+    with open(ruta, "wb") as f:
+        f.write(contenido)
+    os.utime(ruta, ns=(mtime, mtime))
+
+
+def test_documentos_fallidos_se_reintentan(tmp_path):
+    origen, destino = tmp_path / "timbrados", str(tmp_path / "tablas")
+    origen.mkdir()
+    base = 1_700_000_000 * 10 ** 9
+    _escribir(origen / "a.xml", _timbrado("1", "UUID-A"), base)
+    _escribir(origen / "b.xml", _timbrado("2"), base + 10 ** 9)  # aún sin timbrar
+    _escribir(origen / "c.xml", b"<cfdi:Comprobante", base + 2 * 10 ** 9)  # a medio escribir
+    _escribir(origen / "d.xml", _timbrado("4", "UUID-D"), base + 3 * 10 ** 9)
+
+    extractor = Extractor(destino, procesos=1)
+    fallidos = extractor.extraer(str(origen))
+    assert (extractor.documentos, len(fallidos)) == (2, 2)
+
+    # Sin cambios: la marca ya pasó b.xml y c.xml, pero siguen pendientes
+    extractor = Extractor(destino, procesos=1)
+    assert len(extractor.extraer(str(origen))) == 2 and extractor.documentos == 0
+
+    # Se completan con su fecha de modificación anterior a la marca de agua
+    _escribir(origen / "b.xml", _timbrado("2", "UUID-B"), base + 10 ** 9)
+    _escribir(origen / "c.xml", _timbrado("3", "UUID-C"), base + 2 * 10 ** 9)
+    extractor = Extractor(destino, procesos=1)
+    assert extractor.extraer(str(origen)) == [] and extractor.documentos == 2
+
+    extractor = Extractor(destino, procesos=1)
+    assert extractor.extraer(str(origen)) == [] and extractor.documentos == 0
+    assert sorted(leer_tabla(destino, "comprobantes", ("uuid",))["uuid"]) == ["UUID-A", "UUID-B", "UUID-C", "UUID-D"]
+    with open(os.path.join(destino, "extraccion.json"), encoding="utf-8") as f:
+        assert json.load(f)["reintentos"] == {}
@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+from lxml import etree
+
+from cfdi.folios import (VENCIDO, AlmacenFolios, AlmacenFoliosMemoria, ArriendoPerdido, AsignadorFolios, Hueco,
+                         reporte_huecos)
+from cfdi.generacion import generar_xml_cfdi
+
+
+@pytest.fixture(params=["sqlite", "memoria"])
+def almacen(request, tmp_path):
+    almacen = AlmacenFolios(str(tmp_path / "folios.db")) if request.param == "sqlite" else AlmacenFoliosMemoria()
+    yield almacen
+    almacen.cerrar()
+
+
+def test_sin_folios_repetidos_entre_hilos_y_asignadores(almacen):
+    entregados = []
+    candado = threading.Lock()
+
+    def tomar(asignador):
+        propios = [asignador.siguiente() for _ in range(500)]
+        with candado:
+            entregados.extend(propios)
+
+    # Dos asignadores (como dos procesos) con cuatro hilos cada uno sobre el mismo almacén
+    asignadores = [AsignadorFolios(almacen, "A", bloque=37) for _ in range(2)]
+    hilos = [threading.Thread(target=tomar, args=(asignador,)) for asignador in asignadores for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    for asignador in asignadores:
+        asignador.cerrar()
+
+    assert len(entregados) == len(set(entregados)) == 4000
+    # Lo que no se usó de cada bloque quedó libre: nada falta
+    assert reporte_huecos(almacen, "A", entregados) == []
+
+
+def test_folios_devueltos_se_reasignan_en_orden(almacen):
+    with AsignadorFolios(almacen, "A", bloque=10) as asignador:
+        assert [asignador.siguiente() for _ in range(3)] == ["1", "2", "3"]
+    primero = almacen.arrendar("A", 5)
+    segundo = almacen.arrendar("A", 5)
+    assert (primero.inicio, primero.fin, segundo.inicio, segundo.fin) == (4, 8, 9, 13)
+
+    almacen.devolver(primero.id, 5)  # 6-8 vuelven
+    almacen.devolver(segundo.id, 10)  # 11-13 vuelven y la Serie retrocede
+    assert almacen.estado("A")["libres"] == [(6, 8)]
+    assert almacen.estado("A")["siguiente"] == 11
+    with AsignadorFolios(almacen, "A", bloque=4) as asignador:
+        assert [asignador.siguiente() for _ in range(6)] == ["6", "7", "8", "11", "12", "13"]
+
+
+def test_arriendo_vencido_queda_como_hueco(almacen):
+    arriendo = almacen.arrendar("A", 10, duracion=-1)
+    assert almacen.recuperar_vencidos() == 1
+    assert almacen.huecos("A") == [Hueco("A", 1, 10, VENCIDO)]
+    with pytest.raises(ArriendoPerdido):
+        almacen.renovar(arriendo.id)
+    # Los folios del arriendo vencido nunca se reasignan
+    assert almacen.arrendar("A", 5).inicio == 11
+
+
+def test_asignador_sigue_con_otro_bloque_si_pierde_el_arriendo(almacen):
+    with AsignadorFolios(almacen, "A", bloque=10, duracion=-1) as asignador:
+        assert asignador.siguiente() == "1"
+        # El arriendo ya venció: al renovarlo se pierde, se informa lo usado (el hueco se reduce
+        # a nada y 2-10 se liberan) y se arrienda otro bloque
+        assert asignador.siguiente() == "2"
+    assert almacen.huecos("A") == []
+
+
+def test_reporte_separa_huecos_de_motivos_distintos(tmp_path):
+    with AlmacenFolios(str(tmp_path / "folios.db")) as almacen:
+        entregado = almacen.arrendar("A", 14)
+        almacen.devolver(entregado.id, 14)  # el folio 14 se entregó pero su factura no se emitió
+        almacen.arrendar("A", 5, duracion=-1)  # 15-19: su titular murió
+        almacen.arrendar("A", 5, duracion=-1)  # 20-24: otro titular, otro arriendo vencido
+        siguiente = almacen.arrendar("A", 5)
+        almacen.devolver(siguiente.id, 27)  # 28-29 vuelven a los libres
+        emitidos = [str(folio) for folio in range(1, 14)] + ["16", "25", "26"]
+
+        assert reporte_huecos(almacen, "A") == [Hueco("A", 15, 19, VENCIDO), Hueco("A", 20, 24, VENCIDO)]
+        assert reporte_huecos(almacen, "A", emitidos) == [
+            Hueco("A", 14, 14, "sin_comprobante"), Hueco("A", 15, 15, VENCIDO), Hueco("A", 17, 19, VENCIDO),
+            Hueco("A", 20, 24, VENCIDO), Hueco("A", 27, 27, "sin_comprobante")]
+
+
+def test_reporte_ignora_los_folios_anteriores_a_la_serie(tmp_path):
+    with AlmacenFolios(str(tmp_path / "folios.db")) as almacen:
+        almacen.iniciar_serie("B", 100)
+        arriendo = almacen.arrendar("B", 10)
+        almacen.devolver(arriendo.id, 104)
+        assert reporte_huecos(almacen, "B", ["100", "101", "103", "104", "X"]) == [
+            Hueco("B", 102, 102, "sin_comprobante")]
+
+
+def test_generar_xml_toma_el_folio_del_asignador_sin_imprimir(almacen, tmp_path, capsys):
+    salida = str(tmp_path / "cfdi.xml")
+    with AsignadorFolios(almacen, "B", bloque=1) as folios:
+        assert generar_xml_cfdi(salida, folios=folios) == salida
+
+    raiz = etree.parse(salida).getroot()
+    assert (raiz.get("Serie"), raiz.get("Folio")) == ("B", "1")
+    # Es una función de biblioteca: el mensaje para el usuario lo imprime generador_cfdi.py
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,81 @@
+import random
+from decimal import Decimal
+
+import pytest
+
+from cfdi import impuestos
+from cfdi.impuestos import ColumnaImpuesto, calcular, calcular_decimal, comparar_motores
+
+pytest.importorskip("numpy")
+
+
+def _aleatorias(lineas, semilla):
+    aleatorio = random.Random(semilla)
+    cantidades = [aleatorio.choice(["1", "2", "0.5", "1.333333", "12.125", "3", "0.001"]) for _ in range(lineas)]
+    valores_unitarios = [f"{aleatorio.randint(1, 10 ** 7) / 100:.2f}" if aleatorio.random() < 0.8
+                         else f"{aleatorio.randint(1, 10 ** 8) / 10 ** 6:.6f}" for _ in range(lineas)]
+    descuentos = [aleatorio.choice([None, "0.00", "1.50", "10.005", "0.005"]) for _ in range(lineas)]
+    traslados = [ColumnaImpuesto("002", "Tasa", [aleatorio.choice(["0.160000", "0.080000", "0.000000", None])
+                                                 for _ in range(lineas)]),
+                 ColumnaImpuesto("003", "Tasa", [aleatorio.choice(["0.265000", "0.530000", None, None])
+                                                 for _ in range(lineas)])]
+    retenciones = [ColumnaImpuesto("001", "Tasa", [aleatorio.choice(["0.100000", "0.012500", None])
+                                                   for _ in range(lineas)]),
+                   ColumnaImpuesto("002", "Tasa", [aleatorio.choice(["0.106667", None]) for _ in range(lineas)])]
+    return cantidades, valores_unitarios, descuentos, traslados, retenciones
+
+
+@pytest.mark.parametrize("semilla", [1, 2, 2024])
+def test_columnas_aleatorias(semilla):
+    assert comparar_motores(*_aleatorias(2000, semilla)) == []
+
+
+def test_redondeo_mitad_hacia_arriba():
+    cantidades = ["1", "1", "3", "2", "1", "1", "1"]
+    valores_unitarios = ["0.005", "1.005", "0.335", "0.0025", "0.004999", "100.00", "0.50"]
+    descuentos = [None, "0.005", None, None, None, "10.005", None]
+    traslados = [ColumnaImpuesto("002", "Tasa", "0.160000")]
+    retenciones = [ColumnaImpuesto("001", "Tasa", [None, None, None, None, None, None, "0.010000"])]
+    argumentos = (cantidades, valores_unitarios, descuentos, traslados, retenciones)
+
+    referencia = calcular_decimal(*argumentos)
+    assert referencia.importes == [Decimal(v) for v in ("0.01", "1.01", "1.01", "0.01", "0.00", "100.00", "0.50")]
+    assert referencia.descuentos[5] == Decimal("10.01")
+    assert referencia.retenciones[0][6] == Decimal("0.01")  # 0.50 × 0.01 = 0.005
+    assert comparar_motores(*argumentos) == []
+
+
+def test_exento_cuota_y_tasas_de_seis_decimales():
+    lineas = 12
+    cantidades = [str(i + 1) for i in range(lineas)]
+    valores_unitarios = ["33.33", "19.99", "0.07", "1234.56", "5.005", "0.01"] * 2
+    traslados = [
+        ColumnaImpuesto("002", "Exento", ["0" if i % 3 == 0 else None for i in range(lineas)]),
+        ColumnaImpuesto("002", "Tasa", [None if i % 3 == 0 else "0.160000" for i in range(lineas)]),
+        ColumnaImpuesto("003", "Cuota", [None if i % 2 else "0.298800" for i in range(lineas)]),
+        ColumnaImpuesto("003", "Tasa", "0.080000"),
+    ]
+    retenciones = [ColumnaImpuesto("002", "Tasa", "0.106667"), ColumnaImpuesto("001", "Tasa", "0.012500")]
+    assert comparar_motores(cantidades, valores_unitarios, None, traslados, retenciones) == []
+    # Un Exento para todas las líneas (tasas=None) solo acumula la Base
+    exento = comparar_motores(cantidades, valores_unitarios, traslados=[ColumnaImpuesto("002", "Exento", None)])
+    assert exento == []
+
+
+def test_muchas_lineas_por_grupo():
+    lineas = 20000
+    cantidades = ["1.5"] * lineas
+    valores_unitarios = [f"{(i % 997) + 0.335:.3f}" for i in range(lineas)]
+    traslados = [ColumnaImpuesto("002", "Tasa", ["0.160000" if i % 2 else "0.080000" for i in range(lineas)])]
+    retenciones = [ColumnaImpuesto("002", "Tasa", "0.106667")]
+    assert comparar_motores(cantidades, valores_unitarios, None, traslados, retenciones) == []
+    resultado = calcular(cantidades, valores_unitarios, traslados=traslados, retenciones=retenciones)
+    assert len(resultado.grupos_traslados) == 2
+
+
+def test_desbordamiento_recurre_a_decimal():
+    lineas = impuestos.LINEAS_VECTORIZADO
+    argumentos = (["1000000000.123456"] * lineas, ["99999999999.999999"] * lineas)
+    with pytest.raises(impuestos.DesbordamientoEntero):
+        impuestos.calcular_vectorizado(*argumentos)
+    assert calcular(*argumentos).subtotal == calcular_decimal(*argumentos).subtotal
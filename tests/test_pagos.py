@@ -0,0 +1,144 @@
+from decimal import Decimal
+
+import pytest
+
+from cfdi import firma
+from cfdi.cadena_nativa import comparar_con_xslt
+from cfdi.pagos import PAGO20, LibroSaldos, PagoInvalido, construir_pago
+
+EMISOR = {"Rfc": "AAA010101AX5", "Nombre": "EMPRESA EMISORA S.A. DE C.V.", "RegimenFiscal": "601"}
+RECEPTOR = {"Rfc": "BBB020202BX6", "Nombre": "CLIENTE EJEMPLO", "DomicilioFiscalReceptor": "64000",
+            "RegimenFiscalReceptor": "601"}
+MXN = "6F1E0C2A-0000-4000-8000-000000000001"
+USD = "6F1E0C2A-0000-4000-8000-000000000002"
+SIN_IMPUESTOS = "6F1E0C2A-0000-4000-8000-000000000003"
+
+
+def _documento(uuid, moneda, total, base, importe, folio):
+    return {"uuid": uuid, "rfc_emisor": EMISOR["Rfc"], "rfc_receptor": RECEPTOR["Rfc"], "serie": "F",
+            "folio": folio, "moneda": moneda, "total": total, "objeto_imp": "02",
+            "impuestos": {"traslados": [["002", "Tasa", "0.160000", base, importe]]}}
+
+
+@pytest.fixture
+def libro(tmp_path):
+    with LibroSaldos(str(tmp_path / "saldos.db")) as libro:
+        libro.registrar_lote([
+            _documento(MXN, "MXN", "1160.00", "1000.00", "160.00", "1"),
+            _documento(USD, "USD", "116.00", "100.00", "16.00", "2"),
+            {"uuid": SIN_IMPUESTOS, "rfc_emisor": EMISOR["Rfc"], "rfc_receptor": RECEPTOR["Rfc"],
+             "moneda": "MXN", "total": "500.00"}])
+        yield libro
+
+
+def _pago(moneda="MXN", *documentos, **atributos):
+    return dict({"FechaPago": "2024-03-10T12:00:00", "FormaDePagoP": "03", "MonedaP": moneda,
+                 "Documentos": [dict(zip(("IdDocumento", "ImpPagado", "EquivalenciaDR"), d)) for d in documentos]},
+                **atributos)
+
+
+def _rep(libro, folio, pagos, **opciones):
+    comprobante = {"Serie": "P", "Folio": folio, "Fecha": "2024-03-10T12:00:00", "LugarExpedicion": "64000"}
+    return construir_pago(comprobante, EMISOR, RECEPTOR, pagos, libro, **opciones)
+
+
+def _nodos(raiz, nombre):
+    return raiz.findall(f".//{{{PAGO20}}}{nombre}")
+
+
+def test_dos_parcialidades_en_un_rep(libro):
+    raiz = _rep(libro, "1", [_pago("MXN", (MXN, "580.00")), _pago("MXN", (MXN, "290.00"))])
+
+    relacionados = [(d.get("NumParcialidad"), d.get("ImpSaldoAnt"), d.get("ImpPagado"), d.get("ImpSaldoInsoluto"))
+                    for d in _nodos(raiz, "DoctoRelacionado")]
+    assert relacionados == [("1", "1160.00", "580.00", "580.00"), ("2", "580.00", "290.00", "290.00")]
+    # Impuestos del documento en proporción a lo pagado (1/2 y 1/4)
+    assert [(t.get("BaseDR"), t.get("ImporteDR")) for t in _nodos(raiz, "TrasladoDR")] == [
+        ("500.000000", "80.000000"), ("250.000000", "40.000000")]
+    assert [(t.get("BaseP"), t.get("ImporteP")) for t in _nodos(raiz, "TrasladoP")] == [
+        ("500.000000", "80.000000"), ("250.000000", "40.000000")]
+    totales = _nodos(raiz, "Totales")[0]
+    assert dict(totales.attrib) == {"TotalTrasladosBaseIVA16": "750.00", "TotalTrasladosImpuestoIVA16": "120.00",
+                                    "MontoTotalPagos": "870.00"}
+    assert [p.get("Monto") for p in _nodos(raiz, "Pago")] == ["580.00", "290.00"]
+
+    saldo = libro.saldo(MXN)
+    assert (saldo.saldo, saldo.parcialidades) == ("290.00", 2)
+    assert libro.conciliar() == []
+
+
+def test_sobrepago_no_modifica_el_libro(libro):
+    with pytest.raises(PagoInvalido):
+        _rep(libro, "1", [_pago("MXN", (MXN, "1000.00"), (SIN_IMPUESTOS, "100.00")),
+                          _pago("MXN", (MXN, "160.01"))])
+    with pytest.raises(PagoInvalido):
+        _rep(libro, "1", [_pago("MXN", (SIN_IMPUESTOS, "0"))])
+    assert libro.saldo(MXN).saldo == "1160.00" and libro.saldo(MXN).parcialidades == 0
+    assert libro.saldo(SIN_IMPUESTOS).saldo == "500.00"
+    assert libro.conexion.execute("SELECT COUNT(*) FROM aplicaciones").fetchone() == (0,)
+
+
+def test_pago_en_dolares_de_un_documento_en_dolares(libro):
+    raiz = _rep(libro, "1", [_pago("USD", (USD, "58.00"), TipoCambioP="17.50")])
+
+    pago, = _nodos(raiz, "Pago")
+    assert (pago.get("MonedaP"), pago.get("TipoCambioP"), pago.get("Monto")) == ("USD", "17.50", "58.00")
+    relacionado, = _nodos(raiz, "DoctoRelacionado")
+    assert (relacionado.get("MonedaDR"), relacionado.get("EquivalenciaDR"), relacionado.get("ImpSaldoInsoluto")) == (
+        "USD", "1", "58.00")
+    assert [(t.get("BaseP"), t.get("ImporteP")) for t in _nodos(raiz, "TrasladoP")] == [("50.000000", "8.000000")]
+    # Totales siempre en MXN: lo de USD por TipoCambioP
+    assert dict(_nodos(raiz, "Totales")[0].attrib) == {
+        "TotalTrasladosBaseIVA16": "875.00", "TotalTrasladosImpuestoIVA16": "140.00", "MontoTotalPagos": "1015.00"}
+
+
+def test_pago_en_dolares_de_un_documento_en_pesos(libro):
+    with pytest.raises(PagoInvalido, match="EquivalenciaDR"):
+        _rep(libro, "1", [_pago("USD", (MXN, "875.00"), TipoCambioP="17.50")])
+    with pytest.raises(PagoInvalido, match="TipoCambioP"):
+        _rep(libro, "1", [_pago("USD", (MXN, "875.00", "17.50"))])
+
+    raiz = _rep(libro, "1", [_pago("USD", (MXN, "875.00", "17.50"), TipoCambioP="17.50")])
+    pago, = _nodos(raiz, "Pago")
+    assert pago.get("Monto") == "50.00"  # 875.00 MXN / EquivalenciaDR
+    traslado_dr, = _nodos(raiz, "TrasladoDR")
+    assert (traslado_dr.get("BaseDR"), traslado_dr.get("ImporteDR")) == ("754.310345", "120.689655")
+    traslado_p, = _nodos(raiz, "TrasladoP")
+    base_p, importe_p = Decimal(traslado_p.get("BaseP")), Decimal(traslado_p.get("ImporteP"))
+    assert (base_p, importe_p) == (Decimal("43.103448"), Decimal("6.896552"))
+    assert dict(_nodos(raiz, "Totales")[0].attrib) == {
+        "TotalTrasladosBaseIVA16": "754.31", "TotalTrasladosImpuestoIVA16": "120.69", "MontoTotalPagos": "875.00"}
+    assert libro.saldo(MXN).saldo == "285.00"
+
+
+def test_revertir_y_conciliar(libro):
+    _rep(libro, "1", [_pago("MXN", (MXN, "580.00"), (SIN_IMPUESTOS, "500.00"))])
+    _rep(libro, "2", [_pago("MXN", (MXN, "100.00"))])
+    assert {s.uuid for s in libro.pendientes(EMISOR["Rfc"])} == {MXN, USD}
+
+    # P-1 ya no es la última parcialidad de MXN
+    with pytest.raises(PagoInvalido):
+        libro.revertir("P-1")
+    assert libro.saldo(MXN).saldo == "480.00"
+
+    assert libro.revertir("P-2") == 1
+    assert libro.revertir("P-1") == 2
+    assert (libro.saldo(MXN).saldo, libro.saldo(MXN).parcialidades) == ("1160.00", 0)
+    assert libro.saldo(SIN_IMPUESTOS).saldo == "500.00"
+    assert libro.conciliar() == []
+
+    libro.conexion.execute("UPDATE documentos SET saldo = '1.00' WHERE uuid = ?", (MXN,))
+    discrepancia, = libro.conciliar()
+    assert (discrepancia.uuid, discrepancia.saldo_calculado) == (MXN, "1160.00")
+
+
+def test_vista_previa_no_aplica(libro):
+    _rep(libro, "1", [_pago("MXN", (MXN, "580.00"))], aplicar=False)
+    assert libro.saldo(MXN).saldo == "1160.00"
+
+
+def test_cadena_nativa_del_rep_igual_a_xslt(libro, csd):
+    raiz = _rep(libro, "1", [_pago("MXN", (MXN, "580.00"), (SIN_IMPUESTOS, "250.00")),
+                             _pago("USD", (USD, "58.00"), TipoCambioP="17.50")])
+    sellado = firma.sellar_cfdi(raiz, *csd)
+    assert comparar_con_xslt([sellado]) == []
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from cfdi.plantillas import Plantilla, _caso_aleatorio, comparar, plantilla_de_ejemplo
+
+IVA_8 = {"Impuesto": "002", "TipoFactor": "Tasa", "TasaOCuota": "0.080000"}
+IVA_16 = {"Impuesto": "002", "TipoFactor": "Tasa", "TasaOCuota": "0.160000"}
+IEPS = {"Impuesto": "003", "TipoFactor": "Tasa", "TasaOCuota": "0.265000"}
+
+# Lo que el escape de la plantilla debe reproducir igual que libxml2
+ESCAPABLES = ("&", "<", ">", '"', "a & b < c > d \"e\"", "\n", "\r\n", "\t", "%", "%s", "%%", "100% & %(x)s")
+# Caracteres de control que XML 1.0 no admite: ambos caminos los rechazan
+RECHAZADOS = ("\x00", "\x01", "\x08", "\x0b", "\x0c", "\x1f", "texto\x1bcon escape")
+
+
+def _plantilla_aleatoria(azar):
+    """Una forma de factura al azar: atributos fijos y variables, conceptos, traslados y decimales."""
+    variables = tuple(n for n in ("Serie", "Folio", "Fecha") if n == "Folio" or azar.random() < 0.7)
+    comprobante = {"Moneda": "MXN", "TipoDeComprobante": "I", "Exportacion": "01", "LugarExpedicion": "64000"}
+    comprobante.update({n: v for n, v in (("Serie", "F&G"), ("Fecha", "2024-03-09T12:00:00")) if n not in variables})
+    if azar.random() < 0.5:
+        comprobante.update(FormaPago="99", MetodoPago="PPD", CondicionesDePago='Neto 30 "días" & 5%')
+    concepto = tuple(n for n in ("ClaveProdServ", "NoIdentificacion", "Cantidad", "ClaveUnidad", "Unidad",
+                                 "Descripcion", "ValorUnitario")
+                     if n not in ("NoIdentificacion", "Unidad") or azar.random() < 0.5)
+    traslados = azar.choice(((IVA_16,), (IVA_8,), (IVA_16, IEPS), ()))
+    return Plantilla(comprobante, {"Rfc": "AAA010101AX5", "Nombre": "A&B <Servicios> 100%", "RegimenFiscal": "601"},
+                     variables=variables, concepto=concepto, traslados=traslados,
+                     objeto_imp="02" if traslados else "01", decimales=azar.choice((2, 2, 0)))
+
+
+def test_ejemplo_identico_a_lxml():
+    assert comparar(plantilla_de_ejemplo(), casos=1000, max_conceptos=20, semilla=0) == []
+
+
+@pytest.mark.parametrize("semilla", range(12))
+def test_formas_aleatorias_identicas_a_lxml(semilla):
+    azar = random.Random(semilla)
+    assert comparar(_plantilla_aleatoria(azar), casos=150, max_conceptos=12, semilla=semilla) == []
+
+
+def _caso_con(texto):
+    variables, receptor, conceptos = _caso_aleatorio(random.Random(0), 3)
+    variables["Serie"] = texto
+    receptor["Nombre"] = texto
+    conceptos[1]["Descripcion"] = texto
+    return variables, receptor, conceptos
+
+
+@pytest.mark.parametrize("texto", ESCAPABLES)
+def test_escape_identico_a_lxml(texto):
+    plantilla = plantilla_de_ejemplo()
+    caso = _caso_con(texto)
+    assert plantilla.generar(*caso) == plantilla.referencia(*caso)
+
+
+@pytest.mark.parametrize("texto", ESCAPABLES)
+def test_escape_de_atributos_fijos(texto):
+    plantilla = Plantilla({"Moneda": "MXN", "TipoDeComprobante": "I", "Exportacion": "01", "LugarExpedicion": "64000",
+                           "CondicionesDePago": texto},
+                          {"Rfc": "AAA010101AX5", "Nombre": texto, "RegimenFiscal": "601"})
+    caso = _caso_aleatorio(random.Random(1), 2)
+    assert plantilla.generar(*caso) == plantilla.referencia(*caso)
+
+
+@pytest.mark.parametrize("texto", RECHAZADOS)
+def test_caracteres_de_control_rechazados(texto):
+    plantilla = plantilla_de_ejemplo()
+    caso = _caso_con(texto)
+    with pytest.raises(ValueError):
+        plantilla.generar(*caso)
+    with pytest.raises(ValueError):
+        plantilla.referencia(*caso)
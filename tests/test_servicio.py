@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from cfdi import cadena
+from cfdi.servicio import ServicioCFDI
+
+
+async def _post(puerto, ruta, cuerpo):
+    reader, writer = await asyncio.open_connection("127.0.0.1", puerto)
+    writer.write(f"POST {ruta} HTTP/1.1\r\nContent-Type: application/xml\r\nContent-Length: {len(cuerpo)}\r\n"
+                 f"Connection: close\r\n\r\n".encode("latin-1") + cuerpo)
+    await writer.drain()
+    respuesta = await reader.read()
+    writer.close()
+    cabecera, _, contenido = respuesta.partition(b"\r\n\r\n")
+    return int(cabecera.split(b" ")[1]), contenido
+
+
+def _cadenas(documentos, metodo):
+    async def correr():
+        servicio = await ServicioCFDI(ruta_key=None, procesos=1, metodo=metodo).iniciar(puerto=0)
+        try:
+            return [await _post(servicio.direccion[1], "/cadena", d) for d in documentos]
+        finally:
+            await servicio.detener()
+    return asyncio.run(correr())
+
+
+@pytest.mark.parametrize("metodo", ["xslt", "nativo"])
+def test_cadena_rechaza_raiz_que_no_es_comprobante(metodo, sin_firmar):
+    documento = sin_firmar("1")
+    (codigo, contenido), (codigo_ajeno, contenido_ajeno) = _cadenas([documento, b"<x/>"], metodo)
+    assert codigo == 200
+    assert contenido.decode("utf-8") == cadena.generar_cadena_original(documento)
+    assert codigo_ajeno == 422
+    assert b"cfdi:Comprobante" in contenido_ajeno
@@ -0,0 +1,16 @@
+import os
+
+import pytest
+
+from cfdi.tiempo_importacion import PRESUPUESTOS_MS, revisar
+
+# En CI compartida o equipos lentos: CFDI_FACTOR_IMPORTACION=2 duplica los presupuestos
+FACTOR = float(os.environ.get("CFDI_FACTOR_IMPORTACION", "1.0"))
+
+
+@pytest.mark.parametrize("modulo", sorted(PRESUPUESTOS_MS))
+def test_importacion_dentro_del_presupuesto(modulo):
+    [(_, milisegundos, limite, cargadas, cumple)] = revisar({modulo: PRESUPUESTOS_MS[modulo]}, repeticiones=3,
+                                                            factor=FACTOR)
+    assert not cargadas, f"{modulo} carga al importarse: {', '.join(cargadas)}"
+    assert cumple, f"{modulo}: {milisegundos:.1f} ms > {limite:.0f} ms"
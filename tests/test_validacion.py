@@ -0,0 +1,38 @@
+import io
+import logging
+
+from cfdi import validacion
+from cfdi.generacion_streaming import generar_cfdi_streaming
+
+COMPROBANTE = {"Serie": "A", "Folio": "1", "Fecha": "2024-03-09T12:00:00", "FormaPago": "01", "Moneda": "MXN",
+               "TipoDeComprobante": "I", "Exportacion": "01", "MetodoPago": "PUE", "LugarExpedicion": "64000"}
+EMISOR = {"Rfc": "AAA010101AX5", "Nombre": "EMPRESA EMISORA S.A. DE C.V.", "RegimenFiscal": "601"}
+RECEPTOR = {"Rfc": "BBB020202BX6", "Nombre": "CLIENTE EJEMPLO", "DomicilioFiscalReceptor": "64000",
+            "RegimenFiscalReceptor": "601", "UsoCFDI": "G03"}
+
+
+def _documento(**comprobante):
+    concepto = {"ClaveProdServ": "01010101", "Cantidad": "1", "ClaveUnidad": "H87", "Descripcion": "Servicio",
+                "ValorUnitario": "1000.00", "ObjetoImp": "02",
+                "Traslados": [{"Impuesto": "002", "TipoFactor": "Tasa", "TasaOCuota": "0.160000"}],
+                "Retenciones": [{"Impuesto": "001", "TipoFactor": "Tasa", "TasaOCuota": "0.100000"}]}
+    salida = io.BytesIO()
+    generar_cfdi_streaming(dict(COMPROBANTE, **comprobante), EMISOR, RECEPTOR, [concepto], salida)
+    return salida.getvalue()
+
+
+def test_retencion_del_comprobante_solo_requiere_impuesto_e_importe():
+    assert validacion.validar(_documento(), esquemas=False) == []
+
+
+def test_catalogo_faltante_usa_el_integrado():
+    errores = validacion.validar(_documento(FormaPago="77"), esquemas=False, catalogos={"c_Impuesto": {"001", "002"}})
+    assert [(e.regla, e.ruta) for e in errores] == [("catalogo", "Comprobante@FormaPago")]
+
+
+def test_advierte_si_el_paquete_no_trae_esquemas(tmp_path, caplog):
+    with caplog.at_level(logging.WARNING, logger="cfdi.validacion"):
+        assert validacion.validar(_documento(), paquete=str(tmp_path)) == []
+        validacion.validar(_documento(), paquete=str(tmp_path))
+    advertencias = [r for r in caplog.records if "validación XSD" in r.getMessage()]
+    assert len(advertencias) == 1